@@ -0,0 +1,29 @@
+"""Indice (data_pagamento, id) per la lista costi paginata a cursore
+
+Revision ID: a9c1e3f5b7d9
+Revises: f8b0d2e4a6c8
+Create Date: 2026-10-18 20:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a9c1e3f5b7d9'
+down_revision: Union[str, Sequence[str], None] = 'f8b0d2e4a6c8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # GET /costs?limit=&after=<data>:<id> senza filtro per anno: seek sulla chiave del cursore
+    op.create_index('ix_costo_data_pagamento_id', 'costo', ['data_pagamento', 'id'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_costo_data_pagamento_id', table_name='costo')
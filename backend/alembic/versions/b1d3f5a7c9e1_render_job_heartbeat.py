@@ -0,0 +1,28 @@
+"""Heartbeat dei job di generazione documenti (render_job.heartbeat_at)
+
+Revision ID: b1d3f5a7c9e1
+Revises: a9c1e3f5b7d9
+Create Date: 2026-10-18 21:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b1d3f5a7c9e1'
+down_revision: Union[str, Sequence[str], None] = 'a9c1e3f5b7d9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('render_job', sa.Column('heartbeat_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('render_job', 'heartbeat_at')
@@ -0,0 +1,70 @@
+"""Tabelle di riepilogo per le statistiche (fatture per mese/cliente, costi)
+
+Revision ID: b4d6f8a0c2e4
+Revises: a3c5e7f9b1d2
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b4d6f8a0c2e4'
+down_revision: Union[str, Sequence[str], None] = 'a3c5e7f9b1d2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'fattura_stats_mese',
+        sa.Column('anno', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('mese', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('conteggio', sa.Integer(), nullable=False),
+        sa.Column('totale', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('anno', 'mese')
+    )
+    op.create_table(
+        'fattura_stats_cliente',
+        sa.Column('anno', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('cliente_id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('conteggio', sa.Integer(), nullable=False),
+        sa.Column('totale', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('anno', 'cliente_id')
+    )
+    op.create_table(
+        'costo_stats',
+        sa.Column('anno_riferimento', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('mese', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('descrizione', sa.String(length=255), nullable=False),
+        sa.Column('conteggio', sa.Integer(), nullable=False),
+        sa.Column('totale', sa.Float(), nullable=False),
+        sa.PrimaryKeyConstraint('anno_riferimento', 'mese', 'descrizione')
+    )
+
+    # Popolamento iniziale dai dati esistenti (stesse GROUP BY di `flask stats rebuild`)
+    op.execute(
+        "INSERT INTO fattura_stats_mese (anno, mese, conteggio, totale) "
+        "SELECT anno, CAST(EXTRACT(month FROM data_fattura) AS INTEGER), COUNT(*), SUM(totale) "
+        "FROM fattura GROUP BY 1, 2"
+    )
+    op.execute(
+        "INSERT INTO fattura_stats_cliente (anno, cliente_id, conteggio, totale) "
+        "SELECT anno, cliente_id, COUNT(*), SUM(totale) FROM fattura GROUP BY 1, 2"
+    )
+    op.execute(
+        "INSERT INTO costo_stats (anno_riferimento, mese, descrizione, conteggio, totale) "
+        "SELECT anno_riferimento, CAST(EXTRACT(month FROM data_pagamento) AS INTEGER), descrizione, "
+        "COUNT(*), SUM(totale) FROM costo GROUP BY 1, 2, 3"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('costo_stats')
+    op.drop_table('fattura_stats_cliente')
+    op.drop_table('fattura_stats_mese')
@@ -0,0 +1,28 @@
+"""Reinvio forzato delle righe della coda STS (sts_outbox.forza)
+
+Revision ID: c2e4a6b8d0f2
+Revises: b1d3f5a7c9e1
+Create Date: 2026-10-18 22:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c2e4a6b8d0f2'
+down_revision: Union[str, Sequence[str], None] = 'b1d3f5a7c9e1'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('sts_outbox', sa.Column('forza', sa.Boolean(), nullable=False, server_default=sa.false()))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('sts_outbox', 'forza')
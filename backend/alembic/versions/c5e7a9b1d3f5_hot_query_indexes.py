@@ -0,0 +1,50 @@
+"""Indici per le query calde (join cliente, liste STS/non pagate, costi)
+
+Revision ID: c5e7a9b1d3f5
+Revises: b4d6f8a0c2e4
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5e7a9b1d3f5'
+down_revision: Union[str, Sequence[str], None] = 'b4d6f8a0c2e4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Join fattura -> cliente e controllo "cliente con fatture" prima dell'eliminazione
+    op.create_index('ix_fattura_cliente_id', 'fattura', ['cliente_id'])
+    # GET /sts/invoices/unsent e invio STS per anno, ordinati per anno/progressivo
+    op.create_index(
+        'ix_fattura_sts_da_inviare', 'fattura', ['anno', 'progressivo'],
+        postgresql_where=sa.text('inviata_sts = false AND data_pagamento IS NOT NULL'),
+    )
+    # GET /invoices/unpaid
+    op.create_index(
+        'ix_fattura_non_pagate', 'fattura', ['anno', 'progressivo'],
+        postgresql_where=sa.text('data_pagamento IS NULL'),
+    )
+    # Costi di un anno di competenza ordinati per data di pagamento
+    op.create_index('ix_costo_anno_riferimento_data_pagamento', 'costo', ['anno_riferimento', 'data_pagamento'])
+    # GET /costs/unpaid, ordinati per data di pagamento
+    op.create_index(
+        'ix_costo_non_pagati', 'costo', ['data_pagamento'],
+        postgresql_where=sa.text('pagato = false'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_costo_non_pagati', table_name='costo')
+    op.drop_index('ix_costo_anno_riferimento_data_pagamento', table_name='costo')
+    op.drop_index('ix_fattura_non_pagate', table_name='fattura')
+    op.drop_index('ix_fattura_sts_da_inviare', table_name='fattura')
+    op.drop_index('ix_fattura_cliente_id', table_name='fattura')
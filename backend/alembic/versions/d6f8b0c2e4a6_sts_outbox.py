@@ -0,0 +1,50 @@
+"""Coda persistente delle operazioni STS (sts_outbox)
+
+Revision ID: d6f8b0c2e4a6
+Revises: c5e7a9b1d3f5
+Create Date: 2026-10-18 17:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd6f8b0c2e4a6'
+down_revision: Union[str, Sequence[str], None] = 'c5e7a9b1d3f5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'sts_outbox',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('batch_id', sa.String(length=32), nullable=False),
+        sa.Column('fattura_id', sa.Integer(), nullable=False),
+        sa.Column('operazione', sa.String(length=20), nullable=False),
+        sa.Column('stato', sa.String(length=20), nullable=False),
+        sa.Column('tentativi', sa.Integer(), nullable=False),
+        sa.Column('ultimo_errore', sa.Text(), nullable=True),
+        sa.Column('protocollo', sa.String(length=100), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['fattura_id'], ['fattura.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_sts_outbox_batch_id', 'sts_outbox', ['batch_id'])
+    # Al più un'operazione in coda o in corso per fattura
+    op.create_index(
+        'uq_sts_outbox_fattura_attiva', 'sts_outbox', ['fattura_id'], unique=True,
+        postgresql_where=sa.text("stato IN ('pending', 'in_progress')"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('uq_sts_outbox_fattura_attiva', table_name='sts_outbox')
+    op.drop_index('ix_sts_outbox_batch_id', table_name='sts_outbox')
+    op.drop_table('sts_outbox')
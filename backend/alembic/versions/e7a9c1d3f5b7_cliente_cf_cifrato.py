@@ -0,0 +1,31 @@
+"""CF cifrato per STS sul cliente (codice_fiscale_cifrato, codice_fiscale_cifrato_cert)
+
+Revision ID: e7a9c1d3f5b7
+Revises: d6f8b0c2e4a6
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e7a9c1d3f5b7'
+down_revision: Union[str, Sequence[str], None] = 'd6f8b0c2e4a6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Vuote: il cifrato viene calcolato al primo invio STS di ogni cliente
+    op.add_column('cliente', sa.Column('codice_fiscale_cifrato', sa.Text(), nullable=True))
+    op.add_column('cliente', sa.Column('codice_fiscale_cifrato_cert', sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('cliente', 'codice_fiscale_cifrato_cert')
+    op.drop_column('cliente', 'codice_fiscale_cifrato')
@@ -0,0 +1,52 @@
+"""Unique (anno, progressivo) on fattura
+
+Revision ID: f2a4c6e8b0d1
+Revises: d9e1f3a5b7c9
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2a4c6e8b0d1'
+down_revision: Union[str, Sequence[str], None] = 'd9e1f3a5b7c9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Make invoice numbers unique per year and align the per-year counter
+    with the numbers already issued."""
+    conn = op.get_bind()
+    duplicates = conn.execute(sa.text(
+        "SELECT anno, progressivo FROM fattura "
+        "GROUP BY anno, progressivo HAVING COUNT(*) > 1"
+    )).fetchall()
+    if duplicates:
+        elenco = ', '.join(f"{p}/{a}" for a, p in duplicates)
+        raise RuntimeError(
+            f"Numeri fattura duplicati da correggere prima della migration: {elenco}"
+        )
+
+    op.create_unique_constraint(
+        'uq_fattura_anno_progressivo',
+        'fattura',
+        ['anno', 'progressivo']
+    )
+
+    # Il contatore non deve mai essere indietro rispetto ai numeri già emessi
+    op.execute(
+        "INSERT INTO fattura_progressivo (anno, last_progressivo) "
+        "SELECT anno, MAX(progressivo) FROM fattura GROUP BY anno "
+        "ON CONFLICT (anno) DO UPDATE SET last_progressivo = GREATEST("
+        "COALESCE(fattura_progressivo.last_progressivo, 0), EXCLUDED.last_progressivo)"
+    )
+
+
+def downgrade() -> None:
+    """Drop the unique constraint on invoice numbers."""
+    op.drop_constraint('uq_fattura_anno_progressivo', 'fattura', type_='unique')
@@ -0,0 +1,37 @@
+"""Segnaposto della generazione dei costi ricorrenti (costo_ricorrente.ultimo_periodo_generato)
+
+Revision ID: f8b0d2e4a6c8
+Revises: e7a9c1d3f5b7
+Create Date: 2026-10-18 19:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f8b0d2e4a6c8'
+down_revision: Union[str, Sequence[str], None] = 'e7a9c1d3f5b7'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('costo_ricorrente', sa.Column('ultimo_periodo_generato', sa.String(length=7), nullable=True))
+    # Finora ogni lettura generava tutti i periodi scaduti: il segnaposto è l'ultimo presente
+    op.execute(
+        """
+        UPDATE costo_ricorrente
+        SET ultimo_periodo_generato = (
+            SELECT MAX(costo.periodo_riferimento) FROM costo WHERE costo.ricorrenza_id = costo_ricorrente.id
+        )
+        """
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('costo_ricorrente', 'ultimo_periodo_generato')
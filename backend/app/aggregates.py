@@ -0,0 +1,249 @@
+"""Tabelle di riepilogo per le statistiche della dashboard, aggiornate in modo incrementale.
+
+GET /api/invoices/stats e GET /api/costs/stats rileggevano a ogni richiesta
+tutte le fatture e tutti i costi. Ora leggono solo tre tabelle piccole:
+
+- `fattura_stats_mese`: (anno, mese di data_fattura) -> conteggio, totale;
+- `fattura_stats_cliente`: (anno, cliente_id) -> conteggio, totale;
+- `costo_stats`: (anno_riferimento, mese di data_pagamento, descrizione) -> conteggio, totale.
+
+Le tabelle si aggiornano nella stessa transazione di ogni scrittura, con due
+listener sulla sessione: prima del flush si leggono dal DB i valori vecchi
+delle righe modificate o eliminate, dopo il flush si applicano i delta
+(+1/+totale sulla chiave nuova, -1/-totale su quella vecchia) con un upsert
+per chiave. Le chiavi sono ordinate, così due transazioni concorrenti
+prendono i lock di riga sempre nello stesso ordine; le righe che arrivano a
+conteggio zero si eliminano. Un rollback annulla insieme scrittura e delta.
+
+Gli INSERT core (`db.session.execute(insert(Fattura), righe)`) non passano dal
+flush: chi li usa deve chiamare `record_invoices(righe)` (o `record_costs`) nella
+stessa transazione, altrimenti il commit fallisce.
+
+I listener si registrano esplicitamente con `register(db.session)` (app/main.py,
+fixture dei test, script che creano un'app Flask).
+
+`rebuild()` ricalcola le tabelle da zero, `check()` le confronta con le
+aggregazioni calcolate sulle tabelle vive (`flask stats rebuild|check`).
+"""
+from collections import defaultdict
+
+from sqlalchemy import Integer, cast, delete, event, extract, func, insert, inspect, select, text
+
+from app.models import db, Fattura, Costo, FatturaStatsMese, FatturaStatsCliente, CostoStats
+
+# Colonne di fattura/costo da cui dipendono chiavi e importi delle tabelle di riepilogo
+_CAMPI = {
+    Fattura: ('anno', 'data_fattura', 'cliente_id', 'totale'),
+    Costo: ('anno_riferimento', 'data_pagamento', 'descrizione', 'totale'),
+}
+
+# Colonne da restituire (RETURNING) per gli INSERT core di costi passati a record_costs
+CAMPI_COSTO = _CAMPI[Costo]
+
+_CHIAVI = {
+    FatturaStatsMese: ('anno', 'mese'),
+    FatturaStatsCliente: ('anno', 'cliente_id'),
+    CostoStats: ('anno_riferimento', 'mese', 'descrizione'),
+}
+
+_SESSION_INFO_KEY = 'aggregates_pending'
+# Tabelle con INSERT core eseguiti nella transazione e non ancora passati a record_*
+_CORE_INFO_KEY = 'aggregates_core_insert'
+
+
+def _upsert_sql(tabella, chiavi):
+    colonne = ', '.join(chiavi)
+    parametri = ', '.join(f':{c}' for c in chiavi)
+    return text(
+        f"""
+        INSERT INTO {tabella} ({colonne}, conteggio, totale)
+        VALUES ({parametri}, :conteggio, :totale)
+        ON CONFLICT ({colonne}) DO UPDATE
+            SET conteggio = {tabella}.conteggio + excluded.conteggio,
+                totale = {tabella}.totale + excluded.totale
+        """
+    )
+
+
+def _cleanup_sql(tabella, chiavi):
+    condizioni = ' AND '.join(f'{c} = :{c}' for c in chiavi)
+    return text(f"DELETE FROM {tabella} WHERE {condizioni} AND conteggio <= 0")
+
+
+_UPSERT = {modello: _upsert_sql(modello.__tablename__, chiavi) for modello, chiavi in _CHIAVI.items()}
+_CLEANUP = {modello: _cleanup_sql(modello.__tablename__, chiavi) for modello, chiavi in _CHIAVI.items()}
+
+
+def _voci(modello, valori):
+    """(tabella di riepilogo, chiave, importo) toccate da una riga di fattura o di costo."""
+    if modello is Fattura:
+        anno, data_fattura, cliente_id, totale = valori
+        return ((FatturaStatsMese, (anno, data_fattura.month), totale),
+                (FatturaStatsCliente, (anno, cliente_id), totale))
+    anno_riferimento, data_pagamento, descrizione, totale = valori
+    return ((CostoStats, (anno_riferimento, data_pagamento.month, descrizione), totale),)
+
+
+def _accumula(delta, modello, valori, segno):
+    for tabella, chiave, totale in _voci(modello, valori):
+        voce = delta[tabella, chiave]
+        voce[0] += segno
+        voce[1] += segno * totale
+
+
+def _applica(connection, delta):
+    upsert = defaultdict(list)
+    cleanup = defaultdict(list)
+    for (tabella, chiave), (conteggio, totale) in sorted(delta.items(), key=lambda v: (v[0][0].__tablename__, v[0][1])):
+        if conteggio == 0 and totale == 0:
+            continue  # la riga ha cambiato solo campi che non entrano nelle statistiche
+        parametri = dict(zip(_CHIAVI[tabella], chiave))
+        upsert[tabella].append({**parametri, 'conteggio': conteggio, 'totale': totale})
+        if conteggio < 0:
+            cleanup[tabella].append(parametri)
+    for tabella, righe in upsert.items():
+        connection.execute(_UPSERT[tabella], righe)
+    for tabella, righe in cleanup.items():
+        connection.execute(_CLEANUP[tabella], righe)
+
+
+def _campi_modificati(obj):
+    stato = inspect(obj)
+    return any(stato.attrs[campo].history.has_changes() for campo in _CAMPI[type(obj)])
+
+
+def _before_flush(session, flush_context, instances):
+    nuove = [obj for obj in session.new if type(obj) in _CAMPI]
+    modificate = [obj for obj in session.dirty if type(obj) in _CAMPI and _campi_modificati(obj)]
+    eliminate = [obj for obj in session.deleted if type(obj) in _CAMPI]
+
+    # Valori vecchi letti dal DB (non dall'oggetto, che potrebbe non averli caricati)
+    vecchie = []
+    ids = defaultdict(list)
+    for obj in modificate + eliminate:
+        ids[type(obj)].append(inspect(obj).identity[0])
+    for modello, id_list in ids.items():
+        colonne = [getattr(modello, campo) for campo in _CAMPI[modello]]
+        righe = session.connection().execute(select(*colonne).where(modello.id.in_(id_list)))
+        vecchie.extend((modello, tuple(riga)) for riga in righe)
+
+    session.info[_SESSION_INFO_KEY] = (nuove + modificate, vecchie) if nuove or vecchie else None
+
+
+def _after_flush(session, flush_context):
+    pending = session.info.pop(_SESSION_INFO_KEY, None)
+    if not pending:
+        return
+    oggetti, vecchie = pending
+    delta = defaultdict(lambda: [0, 0.0])
+    for modello, valori in vecchie:
+        _accumula(delta, modello, valori, -1)
+    for obj in oggetti:
+        modello = type(obj)
+        _accumula(delta, modello, tuple(getattr(obj, campo) for campo in _CAMPI[modello]), +1)
+    _applica(session.connection(), delta)
+
+
+def _do_orm_execute(orm_execute_state):
+    tabella = getattr(orm_execute_state.statement, 'table', None)
+    if orm_execute_state.is_insert and tabella is not None and tabella.name in ('fattura', 'costo'):
+        orm_execute_state.session.info.setdefault(_CORE_INFO_KEY, set()).add(tabella.name)
+
+
+def _before_commit(session):
+    mancanti = session.info.pop(_CORE_INFO_KEY, None)
+    if mancanti:
+        raise RuntimeError(
+            f"INSERT core su {', '.join(sorted(mancanti))} senza record_invoices/record_costs: "
+            "le tabelle di riepilogo resterebbero disallineate"
+        )
+
+
+def _after_transaction_end(session, transaction):
+    if transaction.parent is None:  # fine della transazione esterna (commit o rollback)
+        session.info.pop(_CORE_INFO_KEY, None)
+
+
+_LISTENERS = (
+    ('before_flush', _before_flush),
+    ('after_flush', _after_flush),
+    ('do_orm_execute', _do_orm_execute),
+    ('before_commit', _before_commit),
+    ('after_transaction_end', _after_transaction_end),
+)
+
+
+def register(session):
+    """Registra sulla sessione i listener che tengono allineate le tabelle di riepilogo (idempotente)."""
+    for nome, listener in _LISTENERS:
+        if not event.contains(session, nome, listener):
+            event.listen(session, nome, listener)
+
+
+def _registrato(session, tabella):
+    session.info.get(_CORE_INFO_KEY, set()).discard(tabella)
+
+
+def record_invoices(righe):
+    """Aggiorna le tabelle di riepilogo per fatture inserite con un INSERT core (dict di colonne)."""
+    _registrato(db.session, 'fattura')
+    delta = defaultdict(lambda: [0, 0.0])
+    for riga in righe:
+        _accumula(delta, Fattura, tuple(riga[campo] for campo in _CAMPI[Fattura]), +1)
+    _applica(db.session.connection(), delta)
+
+
+def record_costs(righe):
+    """Aggiorna le tabelle di riepilogo per costi inseriti con un INSERT core (dict di colonne)."""
+    _registrato(db.session, 'costo')
+    delta = defaultdict(lambda: [0, 0.0])
+    for riga in righe:
+        _accumula(delta, Costo, tuple(riga[campo] for campo in _CAMPI[Costo]), +1)
+    _applica(db.session.connection(), delta)
+
+
+def _live_queries():
+    """Per ogni tabella di riepilogo, la GROUP BY equivalente sulle tabelle vive."""
+    mese_fattura = cast(extract('month', Fattura.data_fattura), Integer)
+    mese_costo = cast(extract('month', Costo.data_pagamento), Integer)
+    return {
+        FatturaStatsMese: select(
+            Fattura.anno, mese_fattura, func.count(Fattura.id), func.sum(Fattura.totale)
+        ).group_by(Fattura.anno, mese_fattura),
+        FatturaStatsCliente: select(
+            Fattura.anno, Fattura.cliente_id, func.count(Fattura.id), func.sum(Fattura.totale)
+        ).group_by(Fattura.anno, Fattura.cliente_id),
+        CostoStats: select(
+            Costo.anno_riferimento, mese_costo, Costo.descrizione, func.count(Costo.id), func.sum(Costo.totale)
+        ).group_by(Costo.anno_riferimento, mese_costo, Costo.descrizione),
+    }
+
+
+def rebuild():
+    """Ricalcola da zero le tabelle di riepilogo nella transazione corrente; ritorna le righe per tabella."""
+    righe = {}
+    for modello, live in _live_queries().items():
+        db.session.execute(delete(modello))
+        db.session.execute(insert(modello).from_select([*_CHIAVI[modello], 'conteggio', 'totale'], live))
+        righe[modello.__tablename__] = db.session.query(modello).count()
+    return righe
+
+
+def check(tolleranza=0.005):
+    """
+    Confronta le tabelle di riepilogo con le aggregazioni vive.
+
+    Ritorna la lista delle differenze come (tabella, chiave, atteso, trovato),
+    dove atteso/trovato sono (conteggio, totale) oppure None se la riga manca.
+    """
+    differenze = []
+    for modello, live in _live_queries().items():
+        colonne = [getattr(modello, c) for c in _CHIAVI[modello]]
+        atteso = {tuple(r[:-2]): (r[-2], r[-1]) for r in db.session.execute(live)}
+        trovato = {tuple(r[:-2]): (r[-2], r[-1])
+                   for r in db.session.execute(select(*colonne, modello.conteggio, modello.totale))}
+        for chiave in sorted(atteso.keys() | trovato.keys()):
+            a, t = atteso.get(chiave), trovato.get(chiave)
+            if a is None or t is None or a[0] != t[0] or abs(a[1] - t[1]) > tolleranza:
+                differenze.append((modello.__tablename__, chiave, a, t))
+    return differenze
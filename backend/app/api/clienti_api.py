@@ -1,17 +1,18 @@
 from flask import Blueprint, request, jsonify, send_file, current_app
 from app.models import db, Cliente
-from app.utils import decode_codice_fiscale
 from codicefiscale import isvalid
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.exc import NoResultFound
 from datetime import datetime, timedelta
 from app.timezone import now_local
-from docxtpl import DocxTemplate
-import requests
+from app.documents import (
+    GIUSTIFICATIVO_TEMPLATE, ConversionError, resolve_template, build_giustificativo_context,
+    giustificativo_basename, build_document, parse_document_format, MIMETYPES,
+)
+from app.jobs import submit_render_job, accepted_response
 import os
 import re
 import tempfile
-import zipfile
 
 clients_bp = Blueprint('clients_bp', __name__)
 
@@ -309,16 +310,40 @@ def client_api_detail(client_id):
         return jsonify({"message": "Si è verificato un errore imprevisto."}), 500
 
 
-PUNTINI = '…' * 8  # linea di puntini per i campi da compilare a mano
+def parse_giustificativo_args(args, adesso=None):
+    """
+    Valida i query param del giustificativo applicando i default.
 
+    Ritorna ((data_prestazione, ora_inizio, ora_fine), None) oppure (None, messaggio).
+    Di default la seduta è oggi e si è appena conclusa (dalle = un'ora fa,
+    alle = ora corrente).
+    """
+    if adesso is None:
+        adesso = now_local()
 
-def _build_residenza(client):
-    """Compone la residenza (es. 'Firenze (50100), Via Roma 123') saltando i campi vuoti."""
-    luogo = client.citta or ''
-    if client.cap:
-        luogo = f"{luogo} ({client.cap})" if luogo else f"CAP {client.cap}"
-    parti = [p for p in (luogo, client.indirizzo) if p]
-    return ', '.join(parti) if parti else PUNTINI
+    # Data della prestazione: parametro opzionale, default oggi
+    data_param = args.get('data')
+    if data_param:
+        try:
+            data_prestazione = datetime.strptime(data_param, '%Y-%m-%d').date()
+        except ValueError:
+            return None, "Il parametro 'data' deve essere in formato YYYY-MM-DD."
+    else:
+        data_prestazione = adesso.date()
+
+    orari = {}
+    for nome_param, default_value in (('ora_inizio', (adesso - timedelta(hours=1)).strftime('%H:%M')),
+                                      ('ora_fine', adesso.strftime('%H:%M'))):
+        valore = args.get(nome_param)
+        if not valore:
+            orari[nome_param] = default_value
+            continue
+        try:
+            orari[nome_param] = datetime.strptime(valore, '%H:%M').strftime('%H:%M')
+        except ValueError:
+            return None, f"Il parametro '{nome_param}' deve essere in formato HH:MM."
+
+    return (data_prestazione, orari['ora_inizio'], orari['ora_fine']), None
 
 
 @clients_bp.route('/clients/<int:client_id>/giustificativo', methods=['GET'])
@@ -328,123 +353,64 @@ def download_giustificativo(client_id):
     precompilata con data e ora correnti, e la restituisce come ZIP
     contenente DOCX e PDF (stesso flusso delle fatture via Gotenberg).
 
-    Query params opzionali: data (YYYY-MM-DD), ora_inizio (HH:MM), ora_fine (HH:MM).
+    Query params opzionali: data (YYYY-MM-DD), ora_inizio (HH:MM), ora_fine (HH:MM),
+    format (zip di default, pdf per il solo PDF, docx per il solo DOCX senza Gotenberg).
     """
     try:
         client = Cliente.query.get(client_id)
         if not client:
             return jsonify({"message": "Cliente non trovato."}), 404
 
-        app_root = current_app.root_path
-        custom_template_path = os.path.join(app_root, 'templates', 'custom', 'giustificativo_template.docx')
-        builtin_template_path = os.path.join(app_root, 'templates', 'giustificativo_template.docx')
-        template_path = custom_template_path if os.path.exists(custom_template_path) else builtin_template_path
-        if not os.path.exists(template_path):
+        template_path = resolve_template(current_app.root_path, GIUSTIFICATIVO_TEMPLATE)
+        if not template_path:
             return jsonify({"error": "Template file not found"}), 404
 
-        adesso = now_local()
-
-        # Data della prestazione: parametro opzionale, default oggi
-        data_param = request.args.get('data')
-        if data_param:
-            try:
-                data_prestazione = datetime.strptime(data_param, '%Y-%m-%d').date()
-            except ValueError:
-                return jsonify({"message": "Il parametro 'data' deve essere in formato YYYY-MM-DD."}), 400
-        else:
-            data_prestazione = adesso.date()
-
-        # Orari: parametri opzionali; di default la seduta si è appena conclusa
-        # (dalle = un'ora fa, alle = ora corrente)
-        def parse_ora(nome_param, default_value):
-            valore = request.args.get(nome_param)
-            if not valore:
-                return default_value, None
-            try:
-                return datetime.strptime(valore, '%H:%M').strftime('%H:%M'), None
-            except ValueError:
-                return None, jsonify({"message": f"Il parametro '{nome_param}' deve essere in formato HH:MM."})
-
-        ora_inizio, err = parse_ora('ora_inizio', (adesso - timedelta(hours=1)).strftime('%H:%M'))
-        if err:
-            return err, 400
-        ora_fine, err = parse_ora('ora_fine', adesso.strftime('%H:%M'))
-        if err:
-            return err, 400
+        parametri, errore = parse_giustificativo_args(request.args)
+        if errore:
+            return jsonify({"message": errore}), 400
+        fmt, errore = parse_document_format(request.args)
+        if errore:
+            return jsonify({"message": errore}), 400
 
-        # Sesso ricavato dal codice fiscale; data di nascita dal campo
-        # anagrafico se presente, altrimenti decodificata dal CF
-        dati_cf = decode_codice_fiscale(client.codice_fiscale)
-        sesso = dati_cf['sesso'] if dati_cf else None
-        if client.data_nascita:
-            data_nascita = client.data_nascita.strftime('%d/%m/%Y')
-        elif dati_cf:
-            data_nascita = dati_cf['data_nascita'].strftime('%d/%m/%Y')
-        else:
-            data_nascita = PUNTINI
-
-        genere = {
-            'M': {'articolo_titolo': 'Il Sig.', 'nato_nata': 'nato', 'presentato_presentata': 'presentato', 'interessato_interessata': 'interessato'},
-            'F': {'articolo_titolo': 'La Sig.ra', 'nato_nata': 'nata', 'presentato_presentata': 'presentata', 'interessato_interessata': 'interessata'},
-        }.get(sesso, {'articolo_titolo': 'Il/La Sig./Sig.ra', 'nato_nata': 'nato/a', 'presentato_presentata': 'presentato/a', 'interessato_interessata': 'interessato/a'})
-
-        context = {
-            'cliente_nome': client.nome,
-            'cliente_cognome': client.cognome,
-            'cliente_codice_fiscale': client.codice_fiscale,
-            'cliente_data_nascita': data_nascita,
-            'cliente_luogo_nascita': client.luogo_nascita or PUNTINI,
-            'cliente_residenza': _build_residenza(client),
-            'data_prestazione': data_prestazione.strftime('%d/%m/%Y'),
-            'ora_inizio': ora_inizio,
-            'ora_fine': ora_fine,
-            **genere,
-            # Dati intestatario (professionista) da env vars, come per la fattura
-            'intestatario_titolo': os.getenv('INVOICE_INTESTATARIO_TITOLO', ''),
-            'intestatario_professione': os.getenv('INVOICE_INTESTATARIO_PROFESSIONE', ''),
-            'intestatario_indirizzo': os.getenv('INVOICE_INTESTATARIO_INDIRIZZO', ''),
-            'intestatario_cap_citta': os.getenv('INVOICE_INTESTATARIO_CAP_CITTA', ''),
-            'intestatario_cf': os.getenv('INVOICE_INTESTATARIO_CF', ''),
-            'intestatario_piva': os.getenv('INVOICE_INTESTATARIO_PIVA', ''),
-            'intestatario_email': os.getenv('INVOICE_INTESTATARIO_EMAIL', ''),
-            'intestatario_pec': os.getenv('INVOICE_INTESTATARIO_PEC', ''),
-            'intestatario_nome': os.getenv('INVOICE_INTESTATARIO_NOME', ''),
-        }
-
-        # Riga "luogo, data": città dell'intestatario senza CAP iniziale, se disponibile
-        luogo_rilascio = re.sub(r'^\d{5}\s*', '', os.getenv('INVOICE_INTESTATARIO_CAP_CITTA', '')).strip()
-        data_rilascio = data_prestazione.strftime('%d/%m/%Y')
-        context['luogo_data_rilascio'] = f"{luogo_rilascio}, {data_rilascio}" if luogo_rilascio else data_rilascio
-
-        nome_base = re.sub(r'[^A-Za-z0-9_-]+', '_', f"giustificativo_{client.cognome}_{client.nome}_{data_prestazione.strftime('%Y%m%d')}")
+        context = build_giustificativo_context(client, *parametri)
+        nome_base = giustificativo_basename(client, parametri[0])
 
         with tempfile.TemporaryDirectory() as tmpdir:
-            docx_path = os.path.join(tmpdir, f"{nome_base}.docx")
-            doc = DocxTemplate(template_path)
-            doc.render(context)
-            doc.save(docx_path)
-
-            gotenberg_url = os.getenv('GOTENBERG_URL', 'http://localhost:3000')
-            gotenberg_libreoffice_endpoint = f'{gotenberg_url}/forms/libreoffice/convert'
-
+            out_path = os.path.join(tmpdir, f"out.{fmt}")
             try:
-                with open(docx_path, 'rb') as docx_file:
-                    response = requests.post(gotenberg_libreoffice_endpoint, files={'files': docx_file}, timeout=60)
-                response.raise_for_status()
-                pdf_path = os.path.join(tmpdir, f"{nome_base}.pdf")
-                with open(pdf_path, 'wb') as pdf_file:
-                    pdf_file.write(response.content)
-            except requests.exceptions.RequestException as e:
+                build_document(template_path, context, nome_base, fmt, out_path, tmpdir)
+            except ConversionError as e:
                 print(f"Errore nella comunicazione con Gotenberg: {e}")
                 return jsonify({"error": "Errore nella conversione a PDF (problema con il servizio Gotenberg)"}), 500
 
-            zip_path = os.path.join(tmpdir, f"{nome_base}.zip")
-            with zipfile.ZipFile(zip_path, 'w') as zipf:
-                zipf.write(docx_path, os.path.basename(docx_path))
-                zipf.write(pdf_path, os.path.basename(pdf_path))
-
-            return send_file(zip_path, as_attachment=True, download_name=f"{nome_base}.zip")
+            return send_file(out_path, mimetype=MIMETYPES[fmt], as_attachment=True,
+                             download_name=f"{nome_base}.{fmt}")
 
     except Exception as e:
         print(f"Errore durante la generazione del giustificativo per il cliente {client_id}: {str(e)}")
-        return jsonify({"error": str(e)}), 500
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
+
+
+@clients_bp.route('/clients/<int:client_id>/giustificativo/render', methods=['POST'])
+def render_giustificativo_job(client_id):
+    """
+    Accoda la generazione del giustificativo; il risultato si legge da /api/jobs/<id>.
+
+    Stessi parametri di GET /clients/<id>/giustificativo (query string o body
+    JSON). I default di data e orari si fissano adesso, non quando il job parte.
+    """
+    client = db.session.get(Cliente, client_id)
+    if not client:
+        return jsonify({"message": "Cliente non trovato."}), 404
+
+    parametri, errore = parse_giustificativo_args(request.get_json(silent=True) or request.args)
+    if errore:
+        return jsonify({"message": errore}), 400
+
+    data_prestazione, ora_inizio, ora_fine = parametri
+    job = submit_render_job('giustificativo', client_id, {
+        'data': data_prestazione.isoformat(),
+        'ora_inizio': ora_inizio,
+        'ora_fine': ora_fine,
+    })
+    return accepted_response(job)
@@ -1,21 +1,17 @@
-from flask import Blueprint, request, jsonify
-from app.models import db, Costo, CostoRicorrente
-from datetime import date, datetime
-from sqlalchemy import extract, func
-from sqlalchemy.exc import IntegrityError
-import calendar
+from flask import Blueprint, request, jsonify, Response
+from app.models import db, Costo, CostoRicorrente, CostoStats
+from collections import defaultdict
+from datetime import datetime
+import json
+from sqlalchemy import func, inspect, tuple_
 
-from app.timezone import today_local
+from app.pagination import parse_limit, parse_cost_cursor, format_cost_cursor
+from app.queries import cost_stats
+from app.recurring import FREQUENZE_RICORRENZA, MESI_PREVISIONE_MAX, forecast_costs, generate_recurring_costs
 
 # Crea un Blueprint per le rotte API dei costi
 costi_bp = Blueprint('costi_bp', __name__)
 
-FREQUENZE_RICORRENZA = {
-    'mensile': 1,
-    'trimestrale': 3,
-    'annuale': 12,
-}
-
 
 def parse_date(value, field_name):
     if not value:
@@ -35,19 +31,6 @@ def bool_from_payload(data, key, default=False):
     return bool(value)
 
 
-def add_months(source_date, months):
-    month_index = source_date.month - 1 + months
-    year = source_date.year + month_index // 12
-    month = month_index % 12 + 1
-    day = min(source_date.day, calendar.monthrange(year, month)[1])
-    return date(year, month, day)
-
-
-def due_date_for_period(year, month, day):
-    last_day = calendar.monthrange(year, month)[1]
-    return date(year, month, min(day, last_day))
-
-
 def serialize_cost(costo):
     return {
         "id": costo.id,
@@ -71,7 +54,8 @@ def serialize_recurring_cost(ricorrenza):
         "data_inizio": ricorrenza.data_inizio.strftime('%Y-%m-%d'),
         "data_fine": ricorrenza.data_fine.strftime('%Y-%m-%d') if ricorrenza.data_fine else None,
         "pagato_default": ricorrenza.pagato_default,
-        "attivo": ricorrenza.attivo
+        "attivo": ricorrenza.attivo,
+        "ultimo_periodo_generato": ricorrenza.ultimo_periodo_generato
     }
 
 
@@ -108,62 +92,6 @@ def build_recurring_cost(data):
     )
 
 
-def generate_recurring_costs(until_date=None, commit=True):
-    until_date = until_date or today_local()
-    created = 0
-    ricorrenze = CostoRicorrente.query.filter_by(attivo=True).all()
-
-    for ricorrenza in ricorrenze:
-        step_months = FREQUENZE_RICORRENZA[ricorrenza.frequenza]
-        current = date(ricorrenza.data_inizio.year, ricorrenza.data_inizio.month, 1)
-        end_date = min(ricorrenza.data_fine or until_date, until_date)
-        periods_to_generate = []
-
-        while current <= end_date:
-            due_date = due_date_for_period(current.year, current.month, ricorrenza.giorno_scadenza)
-            if due_date >= ricorrenza.data_inizio and due_date <= end_date:
-                periodo = f"{current.year:04d}-{current.month:02d}"
-                periods_to_generate.append((periodo, due_date, current.year))
-            current = add_months(current, step_months)
-
-        if not periods_to_generate:
-            continue
-
-        existing_periods = {
-            row[0] for row in db.session.query(Costo.periodo_riferimento)
-            .filter(
-                Costo.ricorrenza_id == ricorrenza.id,
-                Costo.periodo_riferimento.in_([period for period, _, _ in periods_to_generate])
-            )
-            .all()
-        }
-
-        for periodo, due_date, anno_riferimento in periods_to_generate:
-            if periodo in existing_periods:
-                continue
-            try:
-                with db.session.begin_nested():
-                    db.session.add(Costo(
-                        descrizione=f"{ricorrenza.descrizione} - {periodo}",
-                        anno_riferimento=anno_riferimento,
-                        data_pagamento=due_date,
-                        totale=ricorrenza.totale,
-                        pagato=ricorrenza.pagato_default,
-                        ricorrenza_id=ricorrenza.id,
-                        periodo_riferimento=periodo
-                    ))
-                    db.session.flush()
-                created += 1
-                existing_periods.add(periodo)
-            except IntegrityError:
-                # Un altro worker ha generato lo stesso periodo tra lookup e insert.
-                existing_periods.add(periodo)
-
-    if created and commit:
-        db.session.commit()
-    return created
-
-
 @costi_bp.route('/costs', methods=['POST'])
 def add_costo():
     """Endpoint per l'aggiunta di un nuovo costo."""
@@ -183,77 +111,130 @@ def add_costo():
         db.session.rollback()
         return jsonify({"message": f"Errore durante l'aggiunta del costo: {str(e)}"}), 500
 
+def _filtered_costs_query():
+    """
+    Costo.query con i filtri della lista: year (anno di competenza), pagato
+    (true/false), ricorrenza_id e q (sottostringa della descrizione, senza
+    distinzione di maiuscole).
+    """
+    query = Costo.query
+    year = request.args.get('year', type=int)
+    if year:
+        query = query.filter(Costo.anno_riferimento == year)
+    if request.args.get('pagato', '') != '':
+        query = query.filter(Costo.pagato == bool_from_payload(request.args, 'pagato'))
+    ricorrenza_id = request.args.get('ricorrenza_id', type=int)
+    if ricorrenza_id:
+        query = query.filter(Costo.ricorrenza_id == ricorrenza_id)
+    testo = request.args.get('q', '').strip()
+    if testo:
+        testo = testo.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        query = query.filter(Costo.descrizione.ilike(f"%{testo}%", escape='\\'))
+    return query
+
+
+def _costs_order(query):
+    return query.order_by(Costo.data_pagamento.desc(), Costo.id.desc())
+
+
 @costi_bp.route('/costs', methods=['GET'])
 def get_costs():
-    """Endpoint per ottenere tutti i costi."""
+    """
+    Endpoint per ottenere i costi, dal pagamento più recente.
+
+    Filtri opzionali: year, pagato, ricorrenza_id, q. Con limit/after risponde
+    una pagina a cursore, con group=year un oggetto {anno: [costi]} per anno di
+    competenza decrescente; altrimenti la lista completa, come prima.
+    """
+    if 'limit' in request.args or 'after' in request.args:
+        return _costs_page()
     try:
-        generate_recurring_costs(commit=False)
-        costs = Costo.query.order_by(Costo.data_pagamento.desc()).all()
-        costs_data = [serialize_cost(c) for c in costs]
-        db.session.commit()
-        return jsonify(costs_data), 200
+        costs = _costs_order(_filtered_costs_query()).all()
+        if request.args.get('group') == 'year':
+            grouped_costs = defaultdict(list)
+            for c in costs:
+                grouped_costs[c.anno_riferimento].append(serialize_cost(c))
+            # json.dumps mantiene l'ordine degli anni (jsonify ordinerebbe le chiavi come stringhe)
+            sorted_grouped_costs = {year: grouped_costs[year] for year in sorted(grouped_costs, reverse=True)}
+            return Response(json.dumps(sorted_grouped_costs), mimetype='application/json')
+        return jsonify([serialize_cost(c) for c in costs]), 200
     except Exception as e:
-        db.session.rollback()
         return jsonify({"message": f"Errore durante il recupero dei costi: {str(e)}"}), 500
 
 
+def _costs_page():
+    """
+    Lista costi paginata a cursore (keyset su data_pagamento, id, decrescente).
+
+    Query params: limit (default 50, max 200), after (<YYYY-MM-DD>:<id>
+    dell'ultimo costo ricevuto) e gli stessi filtri della lista completa.
+    """
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        cursor = parse_cost_cursor(request.args.get('after'))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    query = _filtered_costs_query()
+    if cursor:
+        query = query.filter(tuple_(Costo.data_pagamento, Costo.id) < cursor)
+
+    # Una riga in più per sapere se esiste una pagina successiva
+    rows = _costs_order(query).limit(limit + 1).all()
+    page = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = format_cost_cursor(page[-1].data_pagamento, page[-1].id)
+
+    return jsonify({
+        'items': [serialize_cost(c) for c in page],
+        'next_cursor': next_cursor,
+        'limit': limit,
+    })
+
+
+@costi_bp.route('/costs/years', methods=['GET'])
+def get_cost_years():
+    """Anni di competenza con almeno un costo (dal più recente), letti da costo_stats."""
+    try:
+        righe = db.session.execute(
+            db.select(CostoStats.anno_riferimento, func.sum(CostoStats.conteggio), func.sum(CostoStats.totale))
+            .group_by(CostoStats.anno_riferimento)
+            .order_by(CostoStats.anno_riferimento.desc())
+        ).all()
+        return jsonify([{"anno": anno, "conteggio": conteggio, "totale": round(totale, 2)}
+                        for anno, conteggio, totale in righe]), 200
+    except Exception as e:
+        return jsonify({"message": f"Errore durante il recupero degli anni dei costi: {str(e)}"}), 500
+
+
 @costi_bp.route('/costs/stats', methods=['GET'])
 def get_costs_stats():
     """Endpoint per ottenere le statistiche dei costi."""
     try:
-        generate_recurring_costs(commit=False)
         year = request.args.get('year', type=int)
-        query = Costo.query
-
-        if year:
-            query = query.filter(Costo.anno_riferimento == year)
-
-        totale_annuo = query.with_entities(func.coalesce(func.sum(Costo.totale), 0)).scalar() or 0
+        stats = cost_stats(year)
 
         if year:
-            mese_expr = extract('month', Costo.data_pagamento)
-            per_mese_rows = (
-                db.session.query(
-                    mese_expr.label('mese'),
-                    func.coalesce(func.sum(Costo.totale), 0).label('totale')
-                )
-                .filter(Costo.anno_riferimento == year)
-                .group_by(mese_expr)
-                .order_by(mese_expr)
-                .all()
-            )
             data = {
                 "anno_selezionato": year,
-                "totale_annuo": float(totale_annuo),
+                "totale_annuo": float(stats['totale']),
                 "per_mese": [
-                    {"mese": int(row.mese), "totale": float(row.totale)}
-                    for row in per_mese_rows
+                    {"mese": row['periodo'], "totale": float(row['totale'])}
+                    for row in stats['per_periodo']
+                ]
+            }
+        else:
+            data = {
+                "anno_selezionato": None,
+                "totale_annuo": float(stats['totale']),
+                "per_anno": [
+                    {"anno": row['periodo'], "totale": float(row['totale'])}
+                    for row in stats['per_periodo']
                 ]
             }
-            db.session.commit()
-            return jsonify(data), 200
-
-        per_anno_rows = (
-            db.session.query(
-                Costo.anno_riferimento.label('anno'),
-                func.coalesce(func.sum(Costo.totale), 0).label('totale')
-            )
-            .group_by(Costo.anno_riferimento)
-            .order_by(Costo.anno_riferimento)
-            .all()
-        )
-        data = {
-            "anno_selezionato": None,
-            "totale_annuo": float(totale_annuo),
-            "per_anno": [
-                {"anno": int(row.anno), "totale": float(row.totale)}
-                for row in per_anno_rows
-            ]
-        }
-        db.session.commit()
         return jsonify(data), 200
     except Exception as e:
-        db.session.rollback()
         return jsonify({"message": f"Errore durante il recupero delle statistiche dei costi: {str(e)}"}), 500
 
 
@@ -261,20 +242,27 @@ def get_costs_stats():
 def get_unpaid_costs():
     """Endpoint per ottenere i costi non pagati."""
     try:
-        generate_recurring_costs(commit=False)
         costs = (
             Costo.query
             .filter(Costo.pagato == False)
             .order_by(Costo.data_pagamento.asc())
             .all()
         )
-        costs_data = [serialize_cost(c) for c in costs]
-        db.session.commit()
-        return jsonify(costs_data), 200
+        return jsonify([serialize_cost(c) for c in costs]), 200
     except Exception as e:
-        db.session.rollback()
         return jsonify({"message": f"Errore durante il recupero dei costi non pagati: {str(e)}"}), 500
 
+@costi_bp.route('/costs/forecast', methods=['GET'])
+def get_costs_forecast():
+    """Endpoint per la previsione mensile delle uscite (costi non pagati + ricorrenze future)."""
+    months = request.args.get('months', 12, type=int)
+    if months < 1 or months > MESI_PREVISIONE_MAX:
+        return jsonify({"message": f"months deve essere tra 1 e {MESI_PREVISIONE_MAX}"}), 400
+    try:
+        return jsonify(forecast_costs(months)), 200
+    except Exception as e:
+        return jsonify({"message": f"Errore durante il calcolo della previsione dei costi: {str(e)}"}), 500
+
 @costi_bp.route('/costs/<int:costo_id>', methods=['GET'])
 def get_single_cost(costo_id):
     """Endpoint per ottenere un singolo costo."""
@@ -330,7 +318,7 @@ def add_recurring_cost():
         ricorrenza = build_recurring_cost(data)
         db.session.add(ricorrenza)
         db.session.flush()
-        generate_recurring_costs(commit=False)
+        generate_recurring_costs(commit=False, ricorrenze=[ricorrenza])
         db.session.commit()
         return jsonify({
             "message": "Costo ricorrente aggiunto con successo!",
@@ -380,9 +368,13 @@ def update_recurring_cost(ricorrenza_id):
             ricorrenza.pagato_default = bool_from_payload(data, 'pagato_default', False)
         if 'attivo' in data:
             ricorrenza.attivo = bool_from_payload(data, 'attivo', True)
+        # Periodi calcolati da inizio e frequenza: se cambiano la regola va ripercorsa dall'inizio
+        stato = inspect(ricorrenza)
+        if stato.attrs.data_inizio.history.has_changes() or stato.attrs.frequenza.history.has_changes():
+            ricorrenza.ultimo_periodo_generato = None
 
         db.session.flush()
-        generate_recurring_costs(commit=False)
+        generate_recurring_costs(commit=False, ricorrenze=[ricorrenza])
         db.session.commit()
         return jsonify({"message": "Costo ricorrente aggiornato con successo!"}), 200
     except Exception as e:
@@ -1,128 +1,278 @@
 from flask import Blueprint, request, jsonify, send_file, Response, current_app
-from app.models import db, Fattura, FatturaProgressivo, Cliente, Costo
+from app.models import db, Fattura, Cliente
 from datetime import datetime
-from sqlalchemy import text, func, extract
+from sqlalchemy import text, tuple_, insert
 from collections import defaultdict
-from docxtpl import DocxTemplate
-import requests
+from concurrent.futures import ThreadPoolExecutor
 import os
 import json
-import tempfile
-import zipfile
-import shutil
 from app.utils import calculate_invoice_totals, calculate_prezzo_base_da_totale, format_numero_sedute, PRESTAZIONE_BASE, CONTRIBUTO_PERCENTUALE, BOLLO_COSTO, BOLLO_SOGLIA
 from app.timezone import now_local
+from app.pagination import parse_limit, parse_invoice_cursor, format_invoice_cursor
+from app.queries import invoice_list_query, cliente_display_name, invoice_stats, cost_stats
+from app.progressivo import reserve_progressivi
+from app.aggregates import record_invoices
+from app.documents import (
+    INVOICE_TEMPLATE, ConversionError, resolve_template, build_invoice_context,
+    invoice_basename, cached_invoice_bundle, cached_invoice_document, read_bundle_pdf, publish_bundle,
+    document_cache, parse_document_format, MIMETYPES,
+)
+from app.archive import stream_zip, ordered_results
+from app.jobs import submit_render_job, accepted_response
 
 invoices_bp = Blueprint('invoices_bp', __name__)
 
 
-def _build_pagamento_descrizione(fattura):
-    """Costruisce la descrizione del pagamento per il template della fattura."""
-    metodo = fattura.metodo_pagamento or ''
-    if fattura.data_pagamento:
-        return f"Pagato con {metodo} in data {fattura.data_pagamento.strftime('%d/%m/%Y')}"
-    elif metodo.lower() == 'bonifico':
-        iban = os.getenv('INVOICE_IBAN', '')
-        intestatario = os.getenv('INVOICE_INTESTATARIO', '')
-        if iban and intestatario:
-            return f"Il pagamento dovrà essere effettuato a mezzo bonifico bancario sull'IBAN {iban} intestato a {intestatario}"
-        elif iban:
-            return f"Il pagamento dovrà essere effettuato a mezzo bonifico bancario sull'IBAN {iban}"
-        else:
-            return "Il pagamento dovrà essere effettuato a mezzo bonifico bancario"
-    else:
-        return f"Pagato con {metodo} in data Non pagato"
-
-
 @invoices_bp.route('/invoices', methods=['GET', 'POST'])
 def invoices_api():
     if request.method == 'POST':
         data = request.get_json()
         current_year = now_local().year
-        
-        # VALIDAZIONE E CONVERSIONE NUMERO_SEDUTE
-        try:
-            numero_sedute = float(data.get('numero_sedute', 1))
-            if numero_sedute <= 0:
-                return jsonify({'message': 'Il numero di sedute deve essere maggiore di 0'}), 400
-            if numero_sedute > 100:
-                return jsonify({'message': 'Il numero di sedute non può superare 100'}), 400
-        except (ValueError, TypeError):
-            return jsonify({'message': 'Il numero di sedute deve essere un numero valido (es: 1, 1.5, 2.5)'}), 400
-        
-        # GESTIONE PREZZO TOTALE UNITARIO (conversione in prezzo base)
-        prezzo_totale_unitario = data.get('prezzo_totale_unitario', 60.00)  # Default 60€
-        try:
-            prezzo_totale_unitario = float(prezzo_totale_unitario)
-            if prezzo_totale_unitario <= 0:
-                return jsonify({'message': 'Il prezzo deve essere maggiore di 0'}), 400
-            if prezzo_totale_unitario > 1000:
-                return jsonify({'message': 'Il prezzo non può superare 1000€'}), 400
-            # Converte il prezzo totale in prezzo base
-            prezzo_base = calculate_prezzo_base_da_totale(prezzo_totale_unitario)
-        except (ValueError, TypeError):
-            return jsonify({'message': 'Il prezzo deve essere un numero valido'}), 400
-        
-        progressivo_entry = FatturaProgressivo.query.filter_by(anno=current_year).first()
-        if not progressivo_entry:
-            progressivo_entry = FatturaProgressivo(anno=current_year, last_progressivo=0)
-            db.session.add(progressivo_entry)
-            db.session.commit()
-        
-        progressivo = progressivo_entry.last_progressivo + 1
-        
-        # Calcola i totali usando il prezzo base personalizzato
-        calcoli = calculate_invoice_totals(numero_sedute, prezzo_base)
 
-        numero_sedute_formattato = format_numero_sedute(numero_sedute)
-        descrizione = f"n. {numero_sedute_formattato} di Sedut{'e' if numero_sedute > 1 else 'a'} di consulenza psicologica"
+        valori, errore = _parse_invoice_payload(data)
+        if errore:
+            return jsonify({'message': errore}), 400
 
-        inviata_sts_bool = data.get('inviata_sts', False)
+        # Riserva atomica del numero: nessun doppione anche con più worker concorrenti
+        progressivo = reserve_progressivi(current_year)
 
-        nuova_fattura = Fattura(
-            anno=current_year,
-            progressivo=progressivo,
-            data_fattura=datetime.strptime(data['data_fattura'], '%Y-%m-%d').date(),
-            data_pagamento=datetime.strptime(data['data_pagamento'], '%Y-%m-%d').date() if data.get('data_pagamento') else None,
-            metodo_pagamento=data.get('metodo_pagamento'),
-            cliente_id=data['cliente_id'],
-            importo_prestazione=prezzo_base,  # Salva il prezzo base
-            bollo=calcoli['bollo_flag'],
-            descrizione=descrizione,
-            totale=calcoli['totale'],
-            numero_sedute=numero_sedute,
-            inviata_sts=inviata_sts_bool
-        )
-        
+        nuova_fattura = Fattura(**_new_invoice_columns(valori, current_year, progressivo))
         db.session.add(nuova_fattura)
-        progressivo_entry.last_progressivo = progressivo
         db.session.commit()
         
         return jsonify({'message': 'Fattura aggiunta con successo!', 'id': nuova_fattura.id}), 201
-    else:  
-        invoices = Fattura.query.order_by(Fattura.anno.desc(), Fattura.progressivo.desc()).all()
+    else:
+        # Modalità a cursore (?limit=&after=<anno>:<progressivo>): pagina piatta con next_cursor
+        if 'limit' in request.args or 'after' in request.args:
+            return _invoices_page()
+
+        year = request.args.get('year', type=int)
+        query = invoice_list_query()
+        if year:
+            query = query.filter(Fattura.anno == year)
+        invoices = query.order_by(Fattura.anno.desc(), Fattura.progressivo.desc()).all()
         
         grouped_invoices = defaultdict(list)
         for i in invoices:
-            grouped_invoices[i.anno].append({
-                'id': i.id,
-                'numero_fattura': f"{i.progressivo}/{i.anno}",
-                'data_fattura': i.data_fattura.strftime('%Y-%m-%d'),
-                'data_pagamento': i.data_pagamento.strftime('%Y-%m-%d') if i.data_pagamento else None,
-                'metodo_pagamento': i.metodo_pagamento,
-                'cliente': f"{i.cliente.nome} {i.cliente.cognome}" if i.cliente else None,
-                'descrizione': i.descrizione,
-                'totale': f"{i.totale:.2f}",
-                'inviata_sts': i.inviata_sts or False,
-                'protocollo_sts': i.protocollo_sts,
-                'data_invio_sts': i.data_invio_sts.isoformat() if i.data_invio_sts else None,
-            })
+            grouped_invoices[i.anno].append(_serialize_invoice_list_item(i))
 
         sorted_years = sorted(grouped_invoices.keys(), reverse=True)
         sorted_grouped_invoices = {year: grouped_invoices[year] for year in sorted_years}
         json_output = json.dumps(sorted_grouped_invoices)
         return Response(json_output, mimetype='application/json')
 
+
+def _serialize_invoice_list_item(i):
+    """Serializza una riga di invoice_list_query() per l'elenco fatture."""
+    return {
+        'id': i.id,
+        'numero_fattura': f"{i.progressivo}/{i.anno}",
+        'data_fattura': i.data_fattura.strftime('%Y-%m-%d'),
+        'data_pagamento': i.data_pagamento.strftime('%Y-%m-%d') if i.data_pagamento else None,
+        'metodo_pagamento': i.metodo_pagamento,
+        'cliente': cliente_display_name(i),
+        'descrizione': i.descrizione,
+        'totale': f"{i.totale:.2f}",
+        'inviata_sts': i.inviata_sts or False,
+        'protocollo_sts': i.protocollo_sts,
+        'data_invio_sts': i.data_invio_sts.isoformat() if i.data_invio_sts else None,
+    }
+
+
+def _invoices_page():
+    """
+    Lista fatture paginata a cursore (keyset su anno, progressivo, decrescente).
+
+    Query params: limit (default 50, max 200), after (<anno>:<progressivo>
+    dell'ultima fattura ricevuta), year (opzionale). La seek sulla coppia
+    (anno, progressivo) legge solo le righe della pagina, quindi latenza e
+    memoria non crescono con gli anni di storico.
+    """
+    try:
+        limit = parse_limit(request.args.get('limit'))
+        cursor = parse_invoice_cursor(request.args.get('after'))
+    except ValueError as e:
+        return jsonify({'message': str(e)}), 400
+
+    query = invoice_list_query()
+    year = request.args.get('year', type=int)
+    if year:
+        query = query.filter(Fattura.anno == year)
+    if cursor:
+        query = query.filter(tuple_(Fattura.anno, Fattura.progressivo) < cursor)
+
+    # Una riga in più per sapere se esiste una pagina successiva
+    rows = query.order_by(Fattura.anno.desc(), Fattura.progressivo.desc()).limit(limit + 1).all()
+    page = rows[:limit]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = format_invoice_cursor(page[-1].anno, page[-1].progressivo)
+
+    return jsonify({
+        'items': [_serialize_invoice_list_item(i) for i in page],
+        'next_cursor': next_cursor,
+        'limit': limit,
+    })
+
+def _parse_invoice_payload(data):
+    """
+    Valida il payload di creazione fattura.
+
+    Ritorna (valori, None) con i campi già convertiti, oppure (None, messaggio)
+    con il primo errore di validazione. Non tocca il DB.
+    """
+    if not isinstance(data, dict):
+        return None, 'Dati fattura non validi'
+
+    # VALIDAZIONE E CONVERSIONE NUMERO_SEDUTE
+    try:
+        numero_sedute = float(data.get('numero_sedute', 1))
+        if numero_sedute <= 0:
+            return None, 'Il numero di sedute deve essere maggiore di 0'
+        if numero_sedute > 100:
+            return None, 'Il numero di sedute non può superare 100'
+    except (ValueError, TypeError):
+        return None, 'Il numero di sedute deve essere un numero valido (es: 1, 1.5, 2.5)'
+
+    # GESTIONE PREZZO TOTALE UNITARIO (conversione in prezzo base)
+    prezzo_totale_unitario = data.get('prezzo_totale_unitario', 60.00)  # Default 60€
+    try:
+        prezzo_totale_unitario = float(prezzo_totale_unitario)
+        if prezzo_totale_unitario <= 0:
+            return None, 'Il prezzo deve essere maggiore di 0'
+        if prezzo_totale_unitario > 1000:
+            return None, 'Il prezzo non può superare 1000€'
+        # Converte il prezzo totale in prezzo base
+        prezzo_base = calculate_prezzo_base_da_totale(prezzo_totale_unitario)
+    except (ValueError, TypeError):
+        return None, 'Il prezzo deve essere un numero valido'
+
+    try:
+        data_fattura = datetime.strptime(data['data_fattura'], '%Y-%m-%d').date()
+        data_pagamento = datetime.strptime(data['data_pagamento'], '%Y-%m-%d').date() if data.get('data_pagamento') else None
+    except KeyError:
+        return None, 'La data fattura è obbligatoria'
+    except (ValueError, TypeError):
+        return None, 'Le date devono avere formato YYYY-MM-DD'
+
+    try:
+        cliente_id = int(data['cliente_id'])
+    except KeyError:
+        return None, 'Il cliente è obbligatorio'
+    except (ValueError, TypeError):
+        return None, 'Cliente non valido'
+
+    return {
+        'numero_sedute': numero_sedute,
+        'prezzo_base': prezzo_base,
+        'data_fattura': data_fattura,
+        'data_pagamento': data_pagamento,
+        'metodo_pagamento': data.get('metodo_pagamento'),
+        'cliente_id': cliente_id,
+        'inviata_sts': data.get('inviata_sts', False),
+    }, None
+
+
+def _new_invoice_columns(valori, anno, progressivo):
+    """Colonne di una nuova Fattura a partire dai valori validati da _parse_invoice_payload."""
+    numero_sedute = valori['numero_sedute']
+    # Calcola i totali usando il prezzo base personalizzato
+    calcoli = calculate_invoice_totals(numero_sedute, valori['prezzo_base'])
+    numero_sedute_formattato = format_numero_sedute(numero_sedute)
+    descrizione = f"n. {numero_sedute_formattato} di Sedut{'e' if numero_sedute > 1 else 'a'} di consulenza psicologica"
+
+    return {
+        'anno': anno,
+        'progressivo': progressivo,
+        'data_fattura': valori['data_fattura'],
+        'data_pagamento': valori['data_pagamento'],
+        'metodo_pagamento': valori['metodo_pagamento'],
+        'cliente_id': valori['cliente_id'],
+        'importo_prestazione': valori['prezzo_base'],  # Salva il prezzo base
+        'bollo': calcoli['bollo_flag'],
+        'descrizione': descrizione,
+        'totale': calcoli['totale'],
+        'numero_sedute': numero_sedute,
+        'inviata_sts': valori['inviata_sts'],
+    }
+
+
+BULK_MAX_FATTURE = 500
+
+
+@invoices_bp.route('/invoices/bulk', methods=['POST'])
+def invoices_bulk_api():
+    """
+    Crea più fatture in una sola richiesta (es. emissione di fine mese).
+
+    Body: array di oggetti con lo stesso formato di POST /invoices. Tutti gli
+    elementi vengono validati prima di toccare il DB (clienti compresi, con
+    una sola query); per quelli validi si riserva un blocco contiguo di
+    progressivi con un'unica istruzione e si inseriscono tutte le righe con
+    un INSERT multi-riga nella stessa transazione. Gli elementi non validi
+    non consumano numeri.
+
+    Ritorna {created, failed, results: [{index, id, numero_fattura} | {index, error}]}
+    nell'ordine di input.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, list) or not data:
+        return jsonify({'message': 'Il body deve essere un array non vuoto di fatture'}), 400
+    if len(data) > BULK_MAX_FATTURE:
+        return jsonify({'message': f'Al massimo {BULK_MAX_FATTURE} fatture per richiesta'}), 400
+
+    results = [None] * len(data)
+    validi = []
+    for index, item in enumerate(data):
+        valori, errore = _parse_invoice_payload(item)
+        if errore:
+            results[index] = {'index': index, 'error': errore}
+        else:
+            validi.append((index, valori))
+
+    # Clienti inesistenti: scartati prima dell'INSERT (una FK violata annullerebbe tutto il blocco)
+    clienti_richiesti = {valori['cliente_id'] for _, valori in validi}
+    clienti_esistenti = {
+        row.id for row in db.session.query(Cliente.id).filter(Cliente.id.in_(clienti_richiesti))
+    } if clienti_richiesti else set()
+    da_inserire = []
+    for index, valori in validi:
+        if valori['cliente_id'] in clienti_esistenti:
+            da_inserire.append((index, valori))
+        else:
+            results[index] = {'index': index, 'error': 'Cliente non trovato'}
+
+    if da_inserire:
+        current_year = now_local().year
+        primo = reserve_progressivi(current_year, count=len(da_inserire))
+        righe = [
+            _new_invoice_columns(valori, current_year, primo + offset)
+            for offset, (_, valori) in enumerate(da_inserire)
+        ]
+        # RETURNING non garantisce l'ordine delle righe: gli id si associano per progressivo
+        id_per_progressivo = dict(db.session.execute(
+            insert(Fattura).returning(Fattura.progressivo, Fattura.id),
+            righe,
+        ).all())
+        # INSERT core: niente flush ORM, le tabelle di riepilogo si aggiornano qui
+        record_invoices(righe)
+        db.session.commit()
+
+        for (index, _), riga in zip(da_inserire, righe):
+            results[index] = {
+                'index': index,
+                'id': id_per_progressivo[riga['progressivo']],
+                'numero_fattura': f"{riga['progressivo']}/{riga['anno']}",
+            }
+
+    created = len(da_inserire)
+    return jsonify({
+        'created': created,
+        'failed': len(data) - created,
+        'results': results,
+    }), 201 if created else 400
+
+
 @invoices_bp.route('/invoices/<int:invoice_id>', methods=['GET', 'PUT'])
 def invoice_api_detail(invoice_id):
     fattura = Fattura.query.get_or_404(invoice_id)
@@ -204,105 +354,138 @@ def invoice_api_detail(invoice_id):
 
 @invoices_bp.route('/invoices/<int:invoice_id>/download', methods=['GET'])
 def download_invoice_zip(invoice_id):
+    """
+    Scarica la fattura. Query param `format`:
+    - zip (default): ZIP con DOCX e PDF, copiato anche in invoices/;
+    - pdf: solo il PDF, senza ZIP;
+    - docx: solo il DOCX, senza conversione Gotenberg.
+    """
     try:
         fattura = Fattura.query.get_or_404(invoice_id)
         cliente = Cliente.query.get_or_404(fattura.cliente_id)
         app_root = current_app.root_path
-        
+
+        fmt, errore = parse_document_format(request.args)
+        if errore:
+            return jsonify({"error": errore}), 400
+
         SAVE_DIR = os.path.join(app_root, 'invoices')
         os.makedirs(SAVE_DIR, exist_ok=True)
-        # Cerca prima un template custom (montato via volume), altrimenti usa quello built-in
-        custom_template_path = os.path.join(app_root, 'templates', 'custom', 'invoice_template.docx')
-        builtin_template_path = os.path.join(app_root, 'templates', 'invoice_template.docx')
-        template_path = custom_template_path if os.path.exists(custom_template_path) else builtin_template_path
-        if not os.path.exists(template_path):
+        template_path = resolve_template(app_root, INVOICE_TEMPLATE)
+        if not template_path:
             return jsonify({"error": "Template file not found"}), 404
 
-        # Usa importo_prestazione (prezzo base salvato nel database)
-        prezzo_base = fattura.importo_prestazione
-        calcoli = calculate_invoice_totals(fattura.numero_sedute, prezzo_base)
-        numero_sedute_formattato = format_numero_sedute(calcoli['numero_sedute'])
-        descrizione_prestazione = f"n. {numero_sedute_formattato} di Sedut{'e' if calcoli['numero_sedute'] > 1 else 'a'} di consulenza psicologica"
-
-        bollo_descrizione_estesa = ""
-        bollo_descrizione_semplice = ""
-        bollo_importo_formattato = ""
-        if calcoli['bollo_flag']:
-            bollo_descrizione_estesa = "Imposta di bollo da 2 euro assolta sull'originale per importi maggiori di 77,47 euro"
-            bollo_descrizione_semplice = "Imposta di Bollo - Esc. Art. 15"
-            bollo_importo_formattato = f"€{calcoli['bollo_importo']:.2f}".replace('.', ',')
-
-        context = {
-            'numero_fattura': f"{fattura.progressivo}",
-            'data_fattura': fattura.data_fattura.strftime('%d/%m/%Y'),
-            'cliente_nome': cliente.nome,
-            'cliente_cognome': cliente.cognome,
-            'cliente_codice_fiscale': cliente.codice_fiscale,
-            'cliente_indirizzo': cliente.indirizzo,
-            'cliente_citta': getattr(cliente, 'citta', ''),
-            'cliente_cap': getattr(cliente, 'cap', ''),
-            'descrizione': descrizione_prestazione,
-            'numero_sedute': numero_sedute_formattato,
-            'subtotale_prestazioni': f"€ {calcoli['subtotale_base']:.2f}".replace('.', ','),
-            'contributo': f"€ {calcoli['contributo']:.2f}".replace('.', ','),
-            'totale_imponibile': f"€ {calcoli['totale_imponibile']:.2f}".replace('.', ','),
-            'bollo_descrizione_estesa': bollo_descrizione_estesa,
-            'bollo_descrizione_semplice': bollo_descrizione_semplice,
-            'bollo_importo_formattato': bollo_importo_formattato,
-            'totale': f"€ {calcoli['totale']:.2f}".replace('.', ','),
-            'pagamento_descrizione': _build_pagamento_descrizione(fattura),
-            # Dati intestatario (professionista) da env vars
-            'intestatario_titolo': os.getenv('INVOICE_INTESTATARIO_TITOLO', ''),
-            'intestatario_professione': os.getenv('INVOICE_INTESTATARIO_PROFESSIONE', ''),
-            'intestatario_indirizzo': os.getenv('INVOICE_INTESTATARIO_INDIRIZZO', ''),
-            'intestatario_cap_citta': os.getenv('INVOICE_INTESTATARIO_CAP_CITTA', ''),
-            'intestatario_cf': os.getenv('INVOICE_INTESTATARIO_CF', ''),
-            'intestatario_piva': os.getenv('INVOICE_INTESTATARIO_PIVA', ''),
-            'intestatario_email': os.getenv('INVOICE_INTESTATARIO_EMAIL', ''),
-            'intestatario_pec': os.getenv('INVOICE_INTESTATARIO_PEC', ''),
-            'intestatario_nome': os.getenv('INVOICE_INTESTATARIO_NOME', ''),
-        }
-
-        with tempfile.TemporaryDirectory() as tmpdir:
-            # Crea il DOCX
-            docx_path = os.path.join(tmpdir, f"fattura_{fattura.progressivo}_{fattura.anno}.docx")
-            doc = DocxTemplate(template_path)
-            doc.render(context)
-            doc.save(docx_path)
-            
-            gotenberg_url = os.getenv('GOTENBERG_URL', 'http://localhost:3000')
-            gotenberg_libreoffice_endpoint = f'{gotenberg_url}/forms/libreoffice/convert'
-
-            files = {
-                'files': open(docx_path, 'rb')
-            }
-            
-            try:
-                response = requests.post(gotenberg_libreoffice_endpoint, files=files, timeout=60)
-                response.raise_for_status()                
-                pdf_path = os.path.join(tmpdir, f"fattura_{fattura.progressivo}_{fattura.anno}.pdf")
-                with open(pdf_path, 'wb') as pdf_file:
-                    pdf_file.write(response.content)
-
-            except requests.exceptions.RequestException as e:
-                print(f"Errore nella comunicazione con Gotenberg: {e}")
-                return jsonify({"error": "Errore nella conversione a PDF (problema con il servizio Gotenberg)"}), 500
-
-            # Crea il file ZIP
-            zip_path = os.path.join(tmpdir, f"fattura_{fattura.progressivo}_{fattura.anno}.zip")
-            with zipfile.ZipFile(zip_path, 'w') as zipf:
-                zipf.write(docx_path, os.path.basename(docx_path))
-                zipf.write(pdf_path, os.path.basename(pdf_path))
-            
-            final_zip_path = os.path.join(SAVE_DIR, os.path.basename(zip_path))
-            shutil.copyfile(zip_path, final_zip_path)
-            
-            return send_file(zip_path, as_attachment=True)
+        context = build_invoice_context(fattura, cliente)
+        basename = invoice_basename(fattura)
+
+        # Il documento è in cache finché contesto e template non cambiano: ai click
+        # successivi niente render né conversione Gotenberg
+        try:
+            cached_path = cached_invoice_document(document_cache(SAVE_DIR), template_path, context, basename, fmt)
+        except ConversionError as e:
+            print(f"Errore nella comunicazione con Gotenberg: {e}")
+            return jsonify({"error": "Errore nella conversione a PDF (problema con il servizio Gotenberg)"}), 500
+
+        if fmt == 'zip':
+            # Copia d'archivio in invoices/ come hard link del file in cache: il bundle
+            # è scritto una volta sola e servito in streaming da disco
+            publish_bundle(cached_path, os.path.join(SAVE_DIR, f"{basename}.zip"))
+
+        return send_file(cached_path, mimetype=MIMETYPES[fmt], as_attachment=True,
+                         download_name=f"{basename}.{fmt}")
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
     
+@invoices_bp.route('/invoices/<int:invoice_id>/render', methods=['POST'])
+def render_invoice_job(invoice_id):
+    """Accoda la generazione del bundle della fattura; il risultato si legge da /api/jobs/<id>."""
+    if db.session.get(Fattura, invoice_id) is None:
+        return jsonify({"error": "Fattura non trovata"}), 404
+    return accepted_response(submit_render_job('invoice', invoice_id))
+
+
+ARCHIVE_DEFAULT_CONCURRENCY = 4
+
+
+def _archive_concurrency():
+    try:
+        return max(1, int(os.getenv('ARCHIVE_CONCURRENCY', ARCHIVE_DEFAULT_CONCURRENCY)))
+    except ValueError:
+        return ARCHIVE_DEFAULT_CONCURRENCY
+
+
+def _archive_entries(lavori, template_path, cache, concurrency):
+    """
+    Voci (nome, PDF) dell'archivio, nell'ordine delle fatture.
+
+    Render e conversione girano su `concurrency` thread, quindi fino a
+    `concurrency` conversioni Gotenberg sono in volo insieme. Ogni fattura passa
+    dalla cache dei bundle: le fatture già scaricate non vengono riconvertite e
+    quelle nuove restano in cache per i download singoli. Una fattura che non si
+    riesce a convertire non interrompe l'archivio (lo stream è già partito):
+    finisce in ERRORI.txt.
+    """
+    def pdf(lavoro):
+        basename, context = lavoro
+        return read_bundle_pdf(cached_invoice_bundle(cache, template_path, context, basename), basename)
+
+    errori = []
+    pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='archive')
+    try:
+        for (basename, _), future in ordered_results(pool, pdf, lavori, window=concurrency * 2):
+            try:
+                yield f"{basename}.pdf", future.result()
+            except ConversionError as e:
+                print(f"Errore nella conversione della fattura {basename}: {e}")
+                errori.append(f"{basename}: conversione PDF non riuscita ({e})")
+    finally:
+        # Client disconnesso a metà: le conversioni non ancora partite si annullano
+        pool.shutdown(wait=False, cancel_futures=True)
+    if errori:
+        yield 'ERRORI.txt', "\n".join(errori) + "\n"
+
+
+@invoices_bp.route('/invoices/archive', methods=['GET'])
+def download_invoice_archive():
+    """
+    Archivio ZIP con i PDF di tutte le fatture di un anno (?year=YYYY).
+
+    Lo ZIP è trasmesso in streaming man mano che i PDF sono pronti, senza
+    file temporanei: la prima fattura parte verso il client mentre le
+    successive sono ancora in conversione.
+    """
+    try:
+        year = int(request.args.get('year', ''))
+    except ValueError:
+        return jsonify({"error": "Il parametro 'year' è obbligatorio e deve essere un intero"}), 400
+
+    app_root = current_app.root_path
+    template_path = resolve_template(app_root, INVOICE_TEMPLATE)
+    if not template_path:
+        return jsonify({"error": "Template file not found"}), 404
+
+    righe = db.session.query(Fattura, Cliente) \
+        .join(Cliente, Cliente.id == Fattura.cliente_id) \
+        .filter(Fattura.anno == year) \
+        .order_by(Fattura.progressivo).all()
+    if not righe:
+        return jsonify({"error": f"Nessuna fattura per l'anno {year}"}), 404
+
+    # I contesti si costruiscono qui, con la sessione DB della richiesta: i
+    # thread di conversione lavorano solo su dict di stringhe
+    lavori = [(invoice_basename(f), build_invoice_context(f, c)) for f, c in righe]
+    cache = document_cache(os.path.join(app_root, 'invoices'))
+    entries = _archive_entries(lavori, template_path, cache, _archive_concurrency())
+
+    return Response(
+        stream_zip(entries),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename=fatture_{year}.zip'},
+    )
+
+
 @invoices_bp.route('/invoices/years', methods=['GET'])
 def get_available_years():
     try:
@@ -314,7 +497,7 @@ def get_available_years():
 
 @invoices_bp.route('/invoices/unpaid', methods=['GET'])
 def get_unpaid_invoices():
-    fatture = Fattura.query.filter(Fattura.data_pagamento.is_(None)) \
+    fatture = invoice_list_query().filter(Fattura.data_pagamento.is_(None)) \
         .order_by(Fattura.anno.desc(), Fattura.progressivo.desc()).all()
     result = []
     for f in fatture:
@@ -322,7 +505,7 @@ def get_unpaid_invoices():
             'id': f.id,
             'numero_fattura': f'{f.progressivo}/{f.anno}',
             'data_fattura': f.data_fattura.isoformat(),
-            'cliente': f'{f.cliente.nome} {f.cliente.cognome}' if f.cliente else None,
+            'cliente': cliente_display_name(f),
             'totale': float(f.totale),
         })
     return jsonify(result)
@@ -332,49 +515,10 @@ def get_invoice_stats():
     try:
         year_param = request.args.get('year')
         
-        if year_param:
-            selected_year = int(year_param)
-            year_filter = Fattura.anno == selected_year
-        else:
-            year_filter = True
-            selected_year = None
-
-        total_invoices = db.session.query(Fattura).filter(year_filter).count()
-        total_amount = db.session.query(func.sum(Fattura.totale)).filter(year_filter).scalar() or 0.0
-        unique_clients = db.session.query(Fattura.cliente_id).filter(year_filter).distinct().count()
-
-        if selected_year:
-            monthly_stats = db.session.query(
-                extract('month', Fattura.data_fattura).label('mese'),
-                func.count(Fattura.id).label('conteggio'),
-                func.sum(Fattura.totale).label('totale')
-            ).filter(year_filter).group_by('mese').order_by('mese').all()
-            monthly_data = [{'mese': int(s.mese), 'conteggio': s.conteggio, 'totale': float(s.totale)} for s in monthly_stats]
-        else:
-            yearly_stats = db.session.query(
-                Fattura.anno.label('anno'),
-                func.count(Fattura.id).label('conteggio'),
-                func.sum(Fattura.totale).label('totale')
-            ).group_by(Fattura.anno).order_by(Fattura.anno).all()
-            monthly_data = [{'mese': s.anno, 'conteggio': s.conteggio, 'totale': float(s.totale)} for s in yearly_stats]
-
-        client_stats = db.session.query(
-            Cliente.nome,
-            Cliente.cognome,
-            func.count(Fattura.id).label('conteggio'),
-            func.sum(Fattura.totale).label('totale')
-        ).join(Fattura, Cliente.id == Fattura.cliente_id).filter(year_filter).group_by(Cliente.id).order_by(func.count(Fattura.id).desc()).all()
-
-        client_data = [{'cliente': f'{s.nome} {s.cognome}', 'conteggio': s.conteggio, 'totale': float(s.totale)} for s in client_stats]
+        selected_year = int(year_param) if year_param else None
 
-        return jsonify({
-            'totale_fatture': total_invoices,
-            'totale_annuo': total_amount,
-            'clienti_con_fatture': unique_clients,
-            'per_mese': monthly_data,
-            'per_cliente': client_data,
-            'anno_selezionato': selected_year
-        })
+        # Una sola query sulle tabelle di riepilogo invece di cinque in sequenza
+        return jsonify(invoice_stats(selected_year))
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -384,49 +528,17 @@ def get_costs_stats():
     """Endpoint per ottenere le statistiche dei costi (con supporto per parametro year)."""
     try:
         year_param = request.args.get('year')
-        
-        if year_param:
-            selected_year = int(year_param)
-            # FIX: Filtra per anno di competenza (anno_riferimento) invece che data pagamento
-            year_filter = Costo.anno_riferimento == selected_year
-            total_costs_amount = db.session.query(func.sum(Costo.totale)).filter(year_filter).scalar() or 0.0
-
-            monthly_stats = db.session.query(
-                extract('month', Costo.data_pagamento).label('mese'),
-                func.count(Costo.id).label('conteggio'),
-                func.sum(Costo.totale).label('totale')
-            ).filter(year_filter).group_by('mese').order_by('mese').all()
-            monthly_data = [{'mese': int(s.mese), 'conteggio': s.conteggio, 'totale': float(s.totale)} for s in monthly_stats]
-
-            
-        else:
-            year_filter = True
-            selected_year = None
-            total_costs_amount = db.session.query(func.sum(Costo.totale)).scalar() or 0.0
-
-            # FIX: Raggruppa per anno di competenza (anno_riferimento)
-            yearly_stats = db.session.query(
-                Costo.anno_riferimento.label('anno'),
-                func.count(Costo.id).label('conteggio'),
-                func.sum(Costo.totale).label('totale')
-            ).group_by('anno').order_by('anno').all()
-            monthly_data = [{'mese': s.anno, 'conteggio': s.conteggio, 'totale': float(s.totale)} for s in yearly_stats]
-
-        total_costs_count = db.session.query(Costo).filter(year_filter).count()
-
-        category_stats = db.session.query(
-            Costo.descrizione,
-            func.count(Costo.id).label('conteggio'),
-            func.sum(Costo.totale).label('totale')
-        ).filter(year_filter).group_by(Costo.descrizione).order_by(func.count(Costo.id).desc()).all()
-
-        category_data = [{'descrizione': s.descrizione, 'conteggio': s.conteggio, 'totale': float(s.totale)} for s in category_stats]
+        # FIX: statistiche per anno di competenza (anno_riferimento), non per data pagamento
+        selected_year = int(year_param) if year_param else None
+        stats = cost_stats(selected_year)
+        monthly_data = [{'mese': s['periodo'], 'conteggio': s['conteggio'], 'totale': s['totale']}
+                        for s in stats['per_periodo']]
 
         return jsonify({
-            'totale_costi': total_costs_count,
-            'totale_annuo': total_costs_amount,
+            'totale_costi': stats['conteggio'],
+            'totale_annuo': stats['totale'],
             'per_mese': monthly_data,
-            'per_descrizione': category_data,
+            'per_descrizione': stats['per_descrizione'],
             'anno_selezionato': selected_year
         })
 
@@ -0,0 +1,42 @@
+from flask import Blueprint, jsonify, send_file
+from app.models import db, RenderJob
+from app.jobs import DONE, FAILED, expire_if_stale, job_to_dict
+from app.gotenberg import get_client
+import os
+
+jobs_bp = Blueprint('jobs_bp', __name__)
+
+
+@jobs_bp.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """
+    Stato di un job di generazione documenti, o l'artefatto se è pronto.
+
+    - 202 + JSON di stato finché il job è in coda o in esecuzione;
+    - 200 + file ZIP quando è completato;
+    - 500 + JSON con `error` se è fallito;
+    - 410 se il job è completato ma il file è stato rimosso (retention scaduta).
+    """
+    job = db.session.get(RenderJob, job_id)
+    if job is None:
+        return jsonify({"error": "Job non trovato"}), 404
+
+    expire_if_stale(job)
+
+    if job.status == DONE:
+        if not job.artifact_path or not os.path.exists(job.artifact_path):
+            return jsonify({**job_to_dict(job), "error": "Artefatto non più disponibile"}), 410
+        return send_file(job.artifact_path, as_attachment=True, download_name=job.filename)
+    if job.status == FAILED:
+        return jsonify(job_to_dict(job)), 500
+    return jsonify(job_to_dict(job)), 202
+
+
+@jobs_bp.route('/gotenberg/stats', methods=['GET'])
+def gotenberg_stats():
+    """
+    Statistiche delle conversioni PDF del worker che risponde: conversioni riuscite,
+    fallite e rifiutate (coda piena o circuit breaker aperto), in volo, stato del
+    circuito e latenze (media, p50, p95, max) delle ultime conversioni riuscite.
+    """
+    return jsonify(get_client().stats())
@@ -0,0 +1,23 @@
+from flask import Blueprint, request, jsonify
+
+from app.queries import profit_and_loss
+from app.timezone import today_local
+
+pnl_bp = Blueprint('pnl_bp', __name__)
+
+
+@pnl_bp.route('/pnl', methods=['GET'])
+def get_pnl():
+    """
+    Conto economico mensile dell'anno (default l'anno corrente) in una sola query.
+
+    Per ogni mese: ricavi, costi, margine, progressivi dall'inizio dell'anno e
+    differenze rispetto allo stesso mese dell'anno precedente; in testa i totali
+    dell'anno. Stessi criteri di /invoices/stats e /costs/stats, così la
+    dashboard non deve più combinarli lato client.
+    """
+    year = request.args.get('year', type=int) or today_local().year
+    try:
+        return jsonify(profit_and_loss(year)), 200
+    except Exception as e:
+        return jsonify({"message": f"Errore durante il calcolo del conto economico: {str(e)}"}), 500
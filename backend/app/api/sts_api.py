@@ -3,8 +3,11 @@ import os
 from datetime import datetime
 
 from flask import Blueprint, jsonify, request
+from sqlalchemy.exc import IntegrityError
 
-from app.models import db, Fattura, Cliente
+from app import sts_outbox
+from app.models import db, Fattura, Cliente, StsOutbox
+from app.queries import invoice_list_query, cliente_display_name
 
 logger = logging.getLogger(__name__)
 
@@ -12,16 +15,30 @@ sts_bp = Blueprint("sts_bp", __name__)
 
 
 def _sts_client():
-    """Istanzia STSClient solo quando STS_USERNAME è configurato."""
-    from app.sts.client import STSClient
-    return STSClient()
+    """Client STS del processo (riusato tra le richieste); va chiamato solo con STS_USERNAME configurato."""
+    from app.sts.client import get_client
+    return get_client()
 
 
 def _sts_configured() -> bool:
     return bool(os.getenv("STS_USERNAME"))
 
 
+def _non_configurato():
+    return jsonify({
+        "success": False,
+        "error": "STS non configurato: impostare STS_USERNAME nelle variabili d'ambiente.",
+    }), 503
+
+
+def _in_coda(fattura_id) -> bool:
+    """True se la fattura ha un'operazione STS in coda o in corso nel worker."""
+    return db.session.query(StsOutbox.query.filter(
+        StsOutbox.fattura_id == fattura_id, StsOutbox.stato.in_(sts_outbox.ATTIVI)).exists()).scalar()
+
+
 def _fattura_sts_dict(fattura) -> dict:
+    """Serializza una riga di invoice_list_query() per le liste STS."""
     return {
         "id": fattura.id,
         "numero_fattura": f"{fattura.progressivo}/{fattura.anno}",
@@ -31,9 +48,7 @@ def _fattura_sts_dict(fattura) -> dict:
         "inviata_sts": fattura.inviata_sts,
         "protocollo_sts": fattura.protocollo_sts,
         "data_invio_sts": fattura.data_invio_sts.isoformat() if fattura.data_invio_sts else None,
-        "cliente": (
-            f"{fattura.cliente.nome} {fattura.cliente.cognome}" if fattura.cliente else None
-        ),
+        "cliente": cliente_display_name(fattura),
     }
 
 
@@ -41,7 +56,7 @@ def _fattura_sts_dict(fattura) -> dict:
 def sts_unsent():
     """Lista fatture non ancora inviate a STS con data_pagamento valorizzata."""
     year = request.args.get("year", type=int)
-    query = Fattura.query.filter(
+    query = invoice_list_query().filter(
         Fattura.inviata_sts == False,
         Fattura.data_pagamento.isnot(None),
     )
@@ -55,10 +70,7 @@ def sts_unsent():
 def sts_send_single(invoice_id):
     """Invia una singola fattura a STS."""
     if not _sts_configured():
-        return jsonify({
-            "success": False,
-            "error": "STS non configurato: impostare STS_USERNAME nelle variabili d'ambiente.",
-        }), 503
+        return _non_configurato()
 
     fattura = Fattura.query.get_or_404(invoice_id)
     force = request.args.get("force", "false").lower() == "true"
@@ -76,6 +88,12 @@ def sts_send_single(invoice_id):
             "protocollo_sts": fattura.protocollo_sts,
         }), 409
 
+    if _in_coda(invoice_id):
+        return jsonify({
+            "success": False,
+            "error": "Fattura in coda per STS in un batch: attendere l'esito del batch.",
+        }), 409
+
     cliente = Cliente.query.get_or_404(fattura.cliente_id)
 
     client = _sts_client()
@@ -109,82 +127,102 @@ def sts_send_single(invoice_id):
 @sts_bp.route("/sts/invoices/send-batch", methods=["POST"])
 def sts_send_batch():
     """
-    Invia un batch di fatture a STS.
+    Accoda un batch di fatture per l'invio a STS e risponde subito (202).
     Body JSON: {"year": 2025} oppure {"ids": [1, 2, 3]}
+
+    Le fatture vengono inviate dal worker della coda (app/sts_outbox.py) nell'ordine
+    di accodamento: per anno/progressivo con "year", nell'ordine degli id con "ids".
+    Con "year" si accodano solo le fatture non ancora inviate; con "ids" quelle già
+    inviate finiscono in `failed`, a meno di ?force=true (reinvio). Le fatture già in
+    coda in un altro batch non vengono riaccodate. L'avanzamento si legge da
+    GET /api/sts/batches/<batch_id>.
     """
     if not _sts_configured():
-        return jsonify({
-            "success": False,
-            "error": "STS non configurato: impostare STS_USERNAME nelle variabili d'ambiente.",
-        }), 503
+        return _non_configurato()
 
     data = request.get_json(silent=True) or {}
     year = data.get("year")
     ids = data.get("ids")
+    force = request.args.get("force", "false").lower() == "true"
 
+    query = db.session.query(Fattura.id)
     if year:
-        fatture = Fattura.query.filter(
+        fattura_ids = [fattura_id for (fattura_id,) in query.filter(
             Fattura.anno == year,
             Fattura.inviata_sts == False,
             Fattura.data_pagamento.isnot(None),
-        ).all()
+        ).order_by(Fattura.anno, Fattura.progressivo)]
     elif ids:
-        fatture = Fattura.query.filter(
+        trovate = {fattura_id for (fattura_id,) in query.filter(
             Fattura.id.in_(ids),
             Fattura.data_pagamento.isnot(None),
-        ).all()
+        )}
+        fattura_ids = [fattura_id for fattura_id in ids if fattura_id in trovate]
     else:
         return jsonify({"success": False, "error": "Specificare 'year' o 'ids'."}), 400
 
-    client = _sts_client()
-    results = []
-
-    for fattura in fatture:
-        cliente = Cliente.query.get(fattura.cliente_id)
-        if not cliente:
-            results.append({"fattura_id": fattura.id, "success": False, "error": "Cliente non trovato"})
-            continue
-
-        result = client.send_inserimento(fattura, cliente)
-
-        is_debug = result.get("debug_mode", False)
-
-        if result["success"] and not is_debug:
-            fattura.inviata_sts = True
-            fattura.protocollo_sts = result.get("protocollo")
-            fattura.data_invio_sts = datetime.utcnow()
-            db.session.commit()
-
-        entry = {
-            "fattura_id": fattura.id,
-            "success": result["success"],
-            "protocollo": result.get("protocollo"),
-            "errors": result.get("errors", []),
-        }
-        if is_debug:
-            entry["debug_mode"] = True
-            entry["soap_payload"] = result.get("soap_payload", "")
-
-        results.append(entry)
-
-    total = len(results)
-    sent = sum(1 for r in results if r["success"])
-    return jsonify({
-        "total": total,
-        "sent": sent,
-        "failed": total - sent,
-        "results": results,
-    })
+    return _accoda(sts_outbox.INSERIMENTO, fattura_ids, forza=force and not year)
+
+
+@sts_bp.route("/sts/invoices/cancel-batch", methods=["POST"])
+def sts_cancel_batch():
+    """
+    Accoda la cancellazione da STS di più fatture e risponde subito (202).
+    Body JSON: {"ids": [1, 2, 3]}; si accodano solo le fatture inviate con protocollo.
+    """
+    if not _sts_configured():
+        return _non_configurato()
+
+    ids = (request.get_json(silent=True) or {}).get("ids")
+    if not ids:
+        return jsonify({"success": False, "error": "Specificare 'ids'."}), 400
+
+    trovate = {fattura_id for (fattura_id,) in db.session.query(Fattura.id).filter(
+        Fattura.id.in_(ids),
+        Fattura.inviata_sts == True,
+        Fattura.protocollo_sts.isnot(None),
+    )}
+    return _accoda(sts_outbox.CANCELLAZIONE, [fattura_id for fattura_id in ids if fattura_id in trovate])
+
+
+def _accoda(operazione, fattura_ids, forza=False):
+    try:
+        batch_id, total = sts_outbox.enqueue(operazione, fattura_ids, forza=forza)
+    except IntegrityError:
+        # Un batch concorrente ha accodato le stesse fatture tra la lettura e il commit
+        db.session.rollback()
+        return jsonify({"success": False, "error": "Alcune fatture sono già in coda per STS: riprovare."}), 409
+    if batch_id is None:
+        return jsonify({"batch_id": None, "total": 0})
+    status_url = f"/api/sts/batches/{batch_id}"
+    return jsonify({"batch_id": batch_id, "total": total, "status_url": status_url}), 202, {"Location": status_url}
+
+
+@sts_bp.route("/sts/stats", methods=["GET"])
+def sts_stats():
+    """
+    Statistiche del client STS del worker che risponde: richieste SOAP, errori di
+    rete, handshake TLS (quanti con sessione ripresa) e latenze (media, p50, p95, max).
+    """
+    if not _sts_configured():
+        return _non_configurato()
+    return jsonify(_sts_client().stats())
+
+
+@sts_bp.route("/sts/batches/<batch_id>", methods=["GET"])
+def sts_batch_status(batch_id):
+    """Avanzamento di un batch: righe pending/in_progress/sent/failed ed esito per fattura."""
+    progress = sts_outbox.batch_progress(batch_id)
+    if progress is None:
+        return jsonify({"error": "Batch non trovato"}), 404
+    return jsonify(progress)
 
 
 @sts_bp.route("/sts/invoices/<int:invoice_id>/cancel", methods=["POST"])
 def sts_cancel_single(invoice_id):
     """Annulla l'invio di una fattura su STS (cancellazione)."""
     if not _sts_configured():
-        return jsonify({
-            "success": False,
-            "error": "STS non configurato: impostare STS_USERNAME nelle variabili d'ambiente.",
-        }), 503
+        return _non_configurato()
 
     fattura = Fattura.query.get_or_404(invoice_id)
 
@@ -200,6 +238,12 @@ def sts_cancel_single(invoice_id):
             "error": "Fattura flaggata manualmente come inviata: impossibile annullare su STS senza protocollo.",
         }), 400
 
+    if _in_coda(invoice_id):
+        return jsonify({
+            "success": False,
+            "error": "Fattura in coda per STS in un batch: attendere l'esito del batch.",
+        }), 409
+
     cliente = Cliente.query.get_or_404(fattura.cliente_id)
 
     client = _sts_client()
@@ -0,0 +1,68 @@
+"""Archivi ZIP generati e trasmessi in streaming, senza file temporanei.
+
+`zipfile` sa scrivere su uno stream non posizionabile (senza `seek`/`tell`):
+in quel caso mette CRC e dimensioni in un data descriptor dopo ogni voce invece
+di tornare indietro a correggere l'header locale. Basta quindi un sink che
+accumula i byte scritti e li restituisce a blocchi: ogni voce può partire
+verso il client appena è pronta, e in memoria resta una voce alla volta.
+"""
+import zipfile
+from collections import deque
+
+_FINE = object()
+
+
+class _ChunkSink:
+    """File-like di sola scrittura e non posizionabile che accumula i chunk scritti."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+
+def stream_zip(entries, compression=zipfile.ZIP_STORED):
+    """
+    Genera i byte di un archivio ZIP a partire da coppie (nome, contenuto).
+
+    Default ZIP_STORED: le voci tipiche (PDF) sono già compresse e ricomprimerle
+    costerebbe CPU senza ridurre la dimensione.
+    """
+    sink = _ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=compression) as zipf:
+        for nome, contenuto in entries:
+            zipf.writestr(nome, contenuto)
+            yield from sink.drain()
+    yield from sink.drain()
+
+
+def ordered_results(pool, fn, items, window):
+    """
+    Applica `fn` agli elementi con `pool`, restituendo (item, future) nell'ordine di input.
+
+    Al più `window` elementi sono in lavorazione o in attesa di essere consumati:
+    i worker non corrono avanti senza limite rispetto a chi legge (memoria e
+    cache limitate anche su migliaia di elementi).
+    """
+    pending = deque()
+    items = iter(items)
+    for item in items:
+        pending.append((item, pool.submit(fn, item)))
+        if len(pending) >= window:
+            break
+    while pending:
+        item, future = pending.popleft()
+        future.exception()  # attende il completamento senza sollevare
+        prossimo = next(items, _FINE)
+        if prossimo is not _FINE:
+            pending.append((prossimo, pool.submit(fn, prossimo)))
+        yield item, future
@@ -0,0 +1,180 @@
+"""Cache su disco dei documenti generati (ZIP DOCX+PDF, PDF o DOCX delle fatture).
+
+Rigenerare una fattura costa un render docxtpl più una conversione Gotenberg
+(secondi di CPU LibreOffice). Se né i dati né il template sono cambiati il
+risultato è identico, quindi lo si conserva su disco indirizzato per contenuto:
+
+- la chiave è lo sha256 del contesto di render (JSON con chiavi ordinate),
+  del tipo di documento e dell'identità del template (percorso, mtime, size):
+  modificare la fattura, le variabili intestatario o il template custom
+  produce una chiave nuova, senza bisogno di invalidazioni esplicite;
+- le voci vivono in una sottocartella di `invoices/` e vengono scartate in
+  ordine LRU (mtime, aggiornato a ogni hit) oltre un limite di dimensione;
+- richieste concorrenti sulla stessa chiave sono single-flight: un lock
+  `flock` per chiave fa sì che la generazione parta una sola volta, anche
+  tra worker gunicorn diversi; gli altri attendono e leggono il risultato.
+  L'eviction rimuove solo i lock di voci assenti e non tenuti da nessuno, e
+  chi ottiene un lock controlla che il file sia ancora quello sul disco;
+- i file `.tmp` lasciati da un processo morto durante un build vengono
+  rimossi dall'eviction dopo `TMP_MAX_AGE_S` secondi.
+
+Modulo puro (niente Flask né DB), testabile con una directory temporanea.
+"""
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import time
+from collections import Counter
+
+DEFAULT_MAX_MB = 200
+TMP_MAX_AGE_S = 3600
+_ESTENSIONI = ('.zip', '.pdf', '.docx')
+
+
+def template_identity(template_path):
+    """Identità del file template: percorso assoluto, mtime e dimensione."""
+    st = os.stat(template_path)
+    return [os.path.abspath(template_path), st.st_mtime_ns, st.st_size]
+
+
+def cache_key(kind, context, template_path):
+    """Chiave di cache per un documento di tipo `kind` renderizzato con `context`."""
+    payload = json.dumps(
+        {'kind': kind, 'template': template_identity(template_path), 'context': context},
+        sort_keys=True, default=str, ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class DocumentCache:
+    """Cache LRU limitata in dimensione con generazione single-flight per chiave."""
+
+    def __init__(self, root, max_bytes=DEFAULT_MAX_MB * 1024 * 1024):
+        self.root = root
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    def path_for(self, key, ext='.zip'):
+        return os.path.join(self.root, key + ext)
+
+    def lookup(self, key, ext='.zip'):
+        """Percorso della voce se presente (segnandola come usata di recente), altrimenti None."""
+        path = self.path_for(key, ext)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def get_or_create(self, key, build, ext='.zip'):
+        """
+        Ritorna il percorso della voce `key`, generandola se manca.
+
+        `build(dest_path)` deve scrivere il documento in `dest_path`; viene
+        chiamata al più una volta per chiave anche con richieste concorrenti.
+        La voce compare atomicamente (os.replace), quindi un lettore non vede
+        mai un file scritto a metà. `ext` è l'estensione del file della voce,
+        una di `.zip`, `.pdf`, `.docx`. Ritorna (path, hit).
+        """
+        path = self.lookup(key, ext)
+        if path:
+            return path, True
+
+        with self._lock(key) as lock_file:
+            try:
+                # Un'altra richiesta potrebbe averla generata mentre aspettavamo il lock
+                path = self.lookup(key, ext)
+                if path:
+                    return path, True
+                fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix='.tmp')
+                os.close(fd)
+                try:
+                    build(tmp_path)
+                    path = self.path_for(key, ext)
+                    os.replace(tmp_path, path)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+        self.evict(keep=key)
+        return path, False
+
+    def _lock(self, key):
+        """Apre e blocca (LOCK_EX) il file di lock della chiave; ritorna il file aperto."""
+        lock_path = os.path.join(self.root, key + '.lock')
+        while True:
+            lock_file = open(lock_path, 'a')
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            # L'eviction può aver rimosso il file mentre aspettavamo: un lock su un
+            # file non più raggiungibile non esclude chi ne crea uno nuovo
+            try:
+                if os.stat(lock_path).st_ino == os.fstat(lock_file.fileno()).st_ino:
+                    return lock_file
+            except FileNotFoundError:
+                pass
+            lock_file.close()
+
+    def evict(self, keep=None):
+        """Rimuove le voci meno usate finché la cache non rientra in `max_bytes`, poi lock e .tmp orfani."""
+        voci = []
+        lock = []
+        totale = 0
+        scaduti = time.time() - TMP_MAX_AGE_S
+        with os.scandir(self.root) as it:
+            for entry in it:
+                base, ext = os.path.splitext(entry.name)
+                if ext not in _ESTENSIONI + ('.lock', '.tmp'):
+                    continue
+                try:
+                    st = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if ext == '.lock':
+                    lock.append(base)
+                elif ext == '.tmp':
+                    # Build di un processo morto: un build vivo riscrive il file ben prima
+                    if st.st_mtime < scaduti:
+                        self._rimuovi(entry.name)
+                else:
+                    voci.append((st.st_mtime_ns, st.st_size, entry.name, base))
+                    totale += st.st_size
+
+        voci.sort()
+        voci_rimaste = Counter(base for _, _, _, base in voci)
+        for _, size, nome, base in voci:
+            if totale <= self.max_bytes:
+                break
+            if keep and base == keep:
+                continue
+            self._rimuovi(nome)
+            voci_rimaste[base] -= 1
+            totale -= size
+
+        for base in lock:
+            if not voci_rimaste[base] and base != keep:
+                self._rimuovi_lock_libero(base)
+
+    def _rimuovi(self, nome):
+        try:
+            os.remove(os.path.join(self.root, nome))
+        except FileNotFoundError:
+            pass
+
+    def _rimuovi_lock_libero(self, base):
+        """Rimuove il lock di una voce assente solo se nessuno lo tiene (LOCK_NB)."""
+        lock_path = os.path.join(self.root, base + '.lock')
+        try:
+            lock_file = open(lock_path, 'r')
+        except FileNotFoundError:
+            return
+        with lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # build in corso
+            # Rimosso tenendo il lock: chi lo ottiene dopo vede un file diverso e riapre (_lock)
+            self._rimuovi(base + '.lock')
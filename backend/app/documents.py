@@ -0,0 +1,278 @@
+"""Generazione dei documenti DOCX/PDF (fatture, giustificativi) condivisa tra gli endpoint.
+
+Il contesto di render è un dict di sole stringhe, costruito una volta da
+fattura + cliente + variabili d'ambiente: serve sia per il render docxtpl sia
+come chiave della cache su disco (app/document_cache.py).
+"""
+import os
+import re
+import shutil
+import tempfile
+import threading
+import zipfile
+
+from app.document_cache import DocumentCache, DEFAULT_MAX_MB, cache_key
+from app.gotenberg import ConversionError, get_client
+from app.template_registry import get_template
+from app.utils import calculate_invoice_totals, format_numero_sedute, decode_codice_fiscale
+
+INVOICE_TEMPLATE = 'invoice_template.docx'
+GIUSTIFICATIVO_TEMPLATE = 'giustificativo_template.docx'
+
+PUNTINI = '…' * 8  # linea di puntini per i campi da compilare a mano
+
+# Formati scaricabili: bundle ZIP (DOCX+PDF, default), solo PDF, solo DOCX
+DOCUMENT_FORMATS = ('zip', 'pdf', 'docx')
+MIMETYPES = {
+    'zip': 'application/zip',
+    'pdf': 'application/pdf',
+    'docx': 'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+}
+
+
+def resolve_template(app_root, nome):
+    """Template custom (montato via volume) se presente, altrimenti quello built-in; None se manca."""
+    custom_template_path = os.path.join(app_root, 'templates', 'custom', nome)
+    builtin_template_path = os.path.join(app_root, 'templates', nome)
+    template_path = custom_template_path if os.path.exists(custom_template_path) else builtin_template_path
+    return template_path if os.path.exists(template_path) else None
+
+
+def intestatario_context():
+    """Dati intestatario (professionista) da env vars, comuni a tutti i template."""
+    return {
+        'intestatario_titolo': os.getenv('INVOICE_INTESTATARIO_TITOLO', ''),
+        'intestatario_professione': os.getenv('INVOICE_INTESTATARIO_PROFESSIONE', ''),
+        'intestatario_indirizzo': os.getenv('INVOICE_INTESTATARIO_INDIRIZZO', ''),
+        'intestatario_cap_citta': os.getenv('INVOICE_INTESTATARIO_CAP_CITTA', ''),
+        'intestatario_cf': os.getenv('INVOICE_INTESTATARIO_CF', ''),
+        'intestatario_piva': os.getenv('INVOICE_INTESTATARIO_PIVA', ''),
+        'intestatario_email': os.getenv('INVOICE_INTESTATARIO_EMAIL', ''),
+        'intestatario_pec': os.getenv('INVOICE_INTESTATARIO_PEC', ''),
+        'intestatario_nome': os.getenv('INVOICE_INTESTATARIO_NOME', ''),
+    }
+
+
+def build_pagamento_descrizione(fattura):
+    """Costruisce la descrizione del pagamento per il template della fattura."""
+    metodo = fattura.metodo_pagamento or ''
+    if fattura.data_pagamento:
+        return f"Pagato con {metodo} in data {fattura.data_pagamento.strftime('%d/%m/%Y')}"
+    elif metodo.lower() == 'bonifico':
+        iban = os.getenv('INVOICE_IBAN', '')
+        intestatario = os.getenv('INVOICE_INTESTATARIO', '')
+        if iban and intestatario:
+            return f"Il pagamento dovrà essere effettuato a mezzo bonifico bancario sull'IBAN {iban} intestato a {intestatario}"
+        elif iban:
+            return f"Il pagamento dovrà essere effettuato a mezzo bonifico bancario sull'IBAN {iban}"
+        else:
+            return "Il pagamento dovrà essere effettuato a mezzo bonifico bancario"
+    else:
+        return f"Pagato con {metodo} in data Non pagato"
+
+
+def build_invoice_context(fattura, cliente):
+    """Contesto docxtpl della fattura (solo stringhe, serializzabile in JSON)."""
+    # Usa importo_prestazione (prezzo base salvato nel database)
+    prezzo_base = fattura.importo_prestazione
+    calcoli = calculate_invoice_totals(fattura.numero_sedute, prezzo_base)
+    numero_sedute_formattato = format_numero_sedute(calcoli['numero_sedute'])
+    descrizione_prestazione = f"n. {numero_sedute_formattato} di Sedut{'e' if calcoli['numero_sedute'] > 1 else 'a'} di consulenza psicologica"
+
+    bollo_descrizione_estesa = ""
+    bollo_descrizione_semplice = ""
+    bollo_importo_formattato = ""
+    if calcoli['bollo_flag']:
+        bollo_descrizione_estesa = "Imposta di bollo da 2 euro assolta sull'originale per importi maggiori di 77,47 euro"
+        bollo_descrizione_semplice = "Imposta di Bollo - Esc. Art. 15"
+        bollo_importo_formattato = f"€{calcoli['bollo_importo']:.2f}".replace('.', ',')
+
+    return {
+        'numero_fattura': f"{fattura.progressivo}",
+        'data_fattura': fattura.data_fattura.strftime('%d/%m/%Y'),
+        'cliente_nome': cliente.nome,
+        'cliente_cognome': cliente.cognome,
+        'cliente_codice_fiscale': cliente.codice_fiscale,
+        'cliente_indirizzo': cliente.indirizzo,
+        'cliente_citta': getattr(cliente, 'citta', ''),
+        'cliente_cap': getattr(cliente, 'cap', ''),
+        'descrizione': descrizione_prestazione,
+        'numero_sedute': numero_sedute_formattato,
+        'subtotale_prestazioni': f"€ {calcoli['subtotale_base']:.2f}".replace('.', ','),
+        'contributo': f"€ {calcoli['contributo']:.2f}".replace('.', ','),
+        'totale_imponibile': f"€ {calcoli['totale_imponibile']:.2f}".replace('.', ','),
+        'bollo_descrizione_estesa': bollo_descrizione_estesa,
+        'bollo_descrizione_semplice': bollo_descrizione_semplice,
+        'bollo_importo_formattato': bollo_importo_formattato,
+        'totale': f"€ {calcoli['totale']:.2f}".replace('.', ','),
+        'pagamento_descrizione': build_pagamento_descrizione(fattura),
+        **intestatario_context(),
+    }
+
+
+def invoice_basename(fattura):
+    return f"fattura_{fattura.progressivo}_{fattura.anno}"
+
+
+def build_residenza(client):
+    """Compone la residenza (es. 'Firenze (50100), Via Roma 123') saltando i campi vuoti."""
+    luogo = client.citta or ''
+    if client.cap:
+        luogo = f"{luogo} ({client.cap})" if luogo else f"CAP {client.cap}"
+    parti = [p for p in (luogo, client.indirizzo) if p]
+    return ', '.join(parti) if parti else PUNTINI
+
+
+def build_giustificativo_context(client, data_prestazione, ora_inizio, ora_fine):
+    """Contesto docxtpl dell'attestazione di presenza per data e orari già validati."""
+    # Sesso ricavato dal codice fiscale; data di nascita dal campo
+    # anagrafico se presente, altrimenti decodificata dal CF
+    dati_cf = decode_codice_fiscale(client.codice_fiscale)
+    sesso = dati_cf['sesso'] if dati_cf else None
+    if client.data_nascita:
+        data_nascita = client.data_nascita.strftime('%d/%m/%Y')
+    elif dati_cf:
+        data_nascita = dati_cf['data_nascita'].strftime('%d/%m/%Y')
+    else:
+        data_nascita = PUNTINI
+
+    genere = {
+        'M': {'articolo_titolo': 'Il Sig.', 'nato_nata': 'nato', 'presentato_presentata': 'presentato', 'interessato_interessata': 'interessato'},
+        'F': {'articolo_titolo': 'La Sig.ra', 'nato_nata': 'nata', 'presentato_presentata': 'presentata', 'interessato_interessata': 'interessata'},
+    }.get(sesso, {'articolo_titolo': 'Il/La Sig./Sig.ra', 'nato_nata': 'nato/a', 'presentato_presentata': 'presentato/a', 'interessato_interessata': 'interessato/a'})
+
+    context = {
+        'cliente_nome': client.nome,
+        'cliente_cognome': client.cognome,
+        'cliente_codice_fiscale': client.codice_fiscale,
+        'cliente_data_nascita': data_nascita,
+        'cliente_luogo_nascita': client.luogo_nascita or PUNTINI,
+        'cliente_residenza': build_residenza(client),
+        'data_prestazione': data_prestazione.strftime('%d/%m/%Y'),
+        'ora_inizio': ora_inizio,
+        'ora_fine': ora_fine,
+        **genere,
+        # Dati intestatario (professionista) da env vars, come per la fattura
+        **intestatario_context(),
+    }
+
+    # Riga "luogo, data": città dell'intestatario senza CAP iniziale, se disponibile
+    luogo_rilascio = re.sub(r'^\d{5}\s*', '', os.getenv('INVOICE_INTESTATARIO_CAP_CITTA', '')).strip()
+    data_rilascio = data_prestazione.strftime('%d/%m/%Y')
+    context['luogo_data_rilascio'] = f"{luogo_rilascio}, {data_rilascio}" if luogo_rilascio else data_rilascio
+    return context
+
+
+def giustificativo_basename(client, data_prestazione):
+    return re.sub(r'[^A-Za-z0-9_-]+', '_', f"giustificativo_{client.cognome}_{client.nome}_{data_prestazione.strftime('%Y%m%d')}")
+
+
+def render_docx(template_path, context, dest_path):
+    # Template parsato una volta per worker (app/template_registry.py)
+    doc = get_template(template_path)
+    doc.render(context)
+    doc.save(dest_path)
+
+
+def convert_docx_to_pdf(docx_path, pdf_path):
+    """Converte un DOCX in PDF tramite Gotenberg (LibreOffice), con il client condiviso del worker."""
+    get_client().convert(docx_path, pdf_path)
+
+
+def build_bundle(template_path, context, basename, zip_path, workdir):
+    """Render DOCX + conversione PDF, entrambi impacchettati nello ZIP `zip_path`.
+
+    Solo il DOCX passa da `workdir` (serve come file da inviare a Gotenberg): il
+    PDF è scritto in streaming direttamente nella sua voce dello ZIP.
+    """
+    docx_path = os.path.join(workdir, f"{basename}.docx")
+    render_docx(template_path, context, docx_path)
+    with zipfile.ZipFile(zip_path, 'w') as zipf:
+        zipf.write(docx_path, os.path.basename(docx_path))
+        with zipf.open(f"{basename}.pdf", 'w') as pdf_entry:
+            get_client().convert_to(docx_path, pdf_entry)
+
+
+def parse_document_format(args):
+    """Formato richiesto con `?format=` (default zip): ritorna (formato, None) o (None, messaggio)."""
+    fmt = (args.get('format') or 'zip').strip().lower()
+    if fmt not in DOCUMENT_FORMATS:
+        return None, f"Formato non valido: usa uno tra {', '.join(DOCUMENT_FORMATS)}"
+    return fmt, None
+
+
+def build_document(template_path, context, basename, fmt, dest_path, workdir):
+    """Scrive in `dest_path` il documento nel formato `fmt`.
+
+    - zip: bundle DOCX+PDF (build_bundle);
+    - pdf: il PDF di Gotenberg scritto direttamente in `dest_path`, senza ZIP;
+    - docx: solo il render, senza passare da Gotenberg.
+    """
+    if fmt == 'zip':
+        build_bundle(template_path, context, basename, dest_path, workdir)
+    elif fmt == 'docx':
+        render_docx(template_path, context, dest_path)
+    else:
+        docx_path = os.path.join(workdir, f"{basename}.docx")
+        render_docx(template_path, context, docx_path)
+        convert_docx_to_pdf(docx_path, dest_path)
+
+
+def cached_invoice_bundle(cache, template_path, context, basename):
+    """Percorso del bundle ZIP della fattura, generato (una sola volta) se non è in cache."""
+    return cached_invoice_document(cache, template_path, context, basename, 'zip')
+
+
+def cached_invoice_document(cache, template_path, context, basename, fmt):
+    """Percorso della fattura nel formato `fmt`, generata (una sola volta) se non è in cache.
+
+    Se serve il solo PDF ma il bundle ZIP della stessa fattura è già in cache,
+    il PDF viene estratto da lì invece di riconvertire con Gotenberg.
+    """
+    def build(dest_path):
+        if fmt == 'pdf':
+            bundle_path = cache.lookup(cache_key('invoice', context, template_path))
+            if bundle_path:
+                with zipfile.ZipFile(bundle_path) as zipf, zipf.open(f"{basename}.pdf") as src, \
+                        open(dest_path, 'wb') as dest:
+                    shutil.copyfileobj(src, dest)
+                return
+        with tempfile.TemporaryDirectory() as tmpdir:
+            build_document(template_path, context, basename, fmt, dest_path, tmpdir)
+
+    # Il bundle mantiene la chiave 'invoice' delle voci già in cache
+    kind = 'invoice' if fmt == 'zip' else f'invoice_{fmt}'
+    path, _ = cache.get_or_create(cache_key(kind, context, template_path), build, ext=f'.{fmt}')
+    return path
+
+
+def read_bundle_pdf(zip_path, basename):
+    """Contenuto del PDF contenuto in un bundle generato da build_bundle()."""
+    with zipfile.ZipFile(zip_path) as zipf:
+        return zipf.read(f"{basename}.pdf")
+
+
+def publish_bundle(src_path, dest_path):
+    """Rende disponibile `src_path` anche come `dest_path` senza copiarne i byte.
+
+    Hard link (cache, archivio `invoices/` e job stanno sullo stesso volume),
+    creato con nome temporaneo e rinominato: chi legge `dest_path` vede il
+    vecchio file o quello nuovo, mai uno a metà. Copia solo se il link fallisce.
+    """
+    if os.path.exists(dest_path) and os.path.samefile(src_path, dest_path):
+        return
+    tmp_path = f"{dest_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        os.link(src_path, tmp_path)
+    except OSError:
+        shutil.copyfile(src_path, tmp_path)
+    os.replace(tmp_path, dest_path)
+
+
+def document_cache(save_dir):
+    """Cache dei bundle generati in `<save_dir>/cache`, limitata da DOCUMENT_CACHE_MAX_MB."""
+    try:
+        max_mb = float(os.getenv('DOCUMENT_CACHE_MAX_MB', DEFAULT_MAX_MB))
+    except ValueError:
+        max_mb = DEFAULT_MAX_MB
+    return DocumentCache(os.path.join(save_dir, 'cache'), max_bytes=int(max_mb * 1024 * 1024))
@@ -0,0 +1,274 @@
+"""Client Gotenberg condiviso: sessione keep-alive, concorrenza limitata, circuit breaker.
+
+Prima ogni conversione faceva `requests.post(...)` a livello di modulo: nuova
+connessione TCP a ogni documento, nessun limite alle conversioni in volo (un
+export annuale e qualche job potevano mettere in coda decine di documenti su
+un solo LibreOffice) e, con Gotenberg giù, ogni richiesta aspettava l'intero
+timeout di 60 s.
+
+Qui, una volta per processo (quindi per worker gunicorn):
+
+- una `requests.Session` con pool di connessioni keep-alive;
+- un semaforo che limita le conversioni in volo (`GOTENBERG_MAX_CONCURRENCY`);
+  chi non ottiene un posto entro `GOTENBERG_QUEUE_TIMEOUT` secondi fallisce;
+- un circuit breaker: dopo `GOTENBERG_CB_FAILURES` errori consecutivi di
+  rete/5xx il circuito si apre e le conversioni falliscono subito per
+  `GOTENBERG_CB_COOLDOWN` secondi, poi passa una sola richiesta di prova;
+- un thread che ogni `GOTENBERG_WARMUP_INTERVAL` secondi (0 = disattivato)
+  converte un DOCX vuoto, per tenere caldo LibreOffice e chiudere il circuito
+  appena Gotenberg torna su;
+- statistiche di latenza esposte da `GET /api/gotenberg/stats`.
+"""
+import io
+import os
+import threading
+import time
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_URL = 'http://localhost:3000'
+DEFAULT_TIMEOUT_S = 60
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_QUEUE_TIMEOUT_S = 30
+DEFAULT_CB_FAILURES = 5
+DEFAULT_CB_COOLDOWN_S = 30
+DEFAULT_WARMUP_INTERVAL_S = 300
+LATENCY_SAMPLES = 500
+CHUNK_SIZE = 64 * 1024
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+_client = None
+_client_lock = threading.Lock()
+_warmup_docx = None
+
+
+class ConversionError(Exception):
+    """Conversione DOCX -> PDF fallita (Gotenberg non raggiungibile o in errore)."""
+
+
+def _env_number(nome, default, minimo=1):
+    try:
+        return max(minimo, float(os.getenv(nome, default)))
+    except ValueError:
+        return default
+
+
+class CircuitBreaker:
+    """Circuit breaker a tre stati (chiuso, aperto, semiaperto) con una sola richiesta di prova."""
+
+    def __init__(self, soglia, cooldown, clock=time.monotonic):
+        self.soglia = soglia
+        self.cooldown = cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.stato = CLOSED
+        self.errori_consecutivi = 0
+        self._aperto_il = None
+
+    def allow(self):
+        with self._lock:
+            if self.stato == CLOSED:
+                return True
+            if self.stato == OPEN and self._clock() - self._aperto_il >= self.cooldown:
+                self.stato = HALF_OPEN  # la richiesta corrente fa da prova
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.stato = CLOSED
+            self.errori_consecutivi = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.errori_consecutivi += 1
+            if self.stato == HALF_OPEN or self.errori_consecutivi >= self.soglia:
+                self.stato = OPEN
+                self._aperto_il = self._clock()
+
+
+class GotenbergClient:
+    def __init__(self, base_url, timeout=DEFAULT_TIMEOUT_S, max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                 queue_timeout=DEFAULT_QUEUE_TIMEOUT_S, breaker=None, session=None):
+        self.endpoint = f"{base_url.rstrip('/')}/forms/libreoffice/convert"
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self.breaker = breaker or CircuitBreaker(DEFAULT_CB_FAILURES, DEFAULT_CB_COOLDOWN_S)
+        self._session = session or self._build_session(max_concurrency)
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._stats_lock = threading.Lock()
+        self._latenze = deque(maxlen=LATENCY_SAMPLES)
+        self._in_volo = 0
+        self._contatori = {'ok': 0, 'errori': 0, 'rifiutate': 0, 'warmup': 0}
+
+    @staticmethod
+    def _build_session(max_concurrency):
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def convert(self, docx_path, pdf_path):
+        """Converte `docx_path` in `pdf_path`; solleva ConversionError se non è possibile."""
+        with open(pdf_path, 'wb') as pdf_file:
+            self.convert_to(docx_path, pdf_file)
+
+    def convert_to(self, docx_path, out):
+        """Converte `docx_path` scrivendo il PDF a blocchi in `out` (file, voce di uno ZIP...)."""
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            self._conta('rifiutate')
+            raise ConversionError(f"Troppe conversioni in corso (attese {self.queue_timeout:g} s)")
+        try:
+            with open(docx_path, 'rb') as docx_file:
+                self._post(os.path.basename(docx_path), docx_file, out)
+        finally:
+            self._slots.release()
+
+    def warmup(self):
+        """Conversione di un DOCX vuoto; saltata se tutti i posti sono già occupati (LibreOffice è caldo)."""
+        if not self._slots.acquire(blocking=False):
+            return False
+        try:
+            self._post('warmup.docx', io.BytesIO(_get_warmup_docx()), None, warmup=True)
+            return True
+        except ConversionError as e:
+            print(f"Warm-up Gotenberg fallito: {e}")
+            return False
+        finally:
+            self._slots.release()
+
+    def _post(self, nome, stream, out, warmup=False):
+        # Risposta in streaming: il PDF passa a blocchi da Gotenberg a `out` senza
+        # mai stare tutto in memoria
+        if not self.breaker.allow():
+            self._conta('rifiutate')
+            raise ConversionError("Gotenberg non disponibile (circuit breaker aperto)")
+        with self._stats_lock:
+            self._in_volo += 1
+        inizio = time.perf_counter()
+        response = None
+        try:
+            response = self._session.post(self.endpoint, files={'files': (nome, stream)},
+                                          timeout=self.timeout, stream=True)
+            try:
+                response.raise_for_status()
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    if out is not None:
+                        out.write(chunk)
+            finally:
+                response.close()
+        except requests.exceptions.HTTPError as e:
+            # 4xx: documento rifiutato, ma Gotenberg risponde: per il circuito è un successo
+            if e.response is not None and e.response.status_code < 500:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+            self._conta('errori')
+            raise ConversionError(str(e)) from e
+        except requests.exceptions.RequestException as e:
+            self.breaker.record_failure()
+            self._conta('errori')
+            raise ConversionError(str(e)) from e
+        except BaseException:
+            # Errore locale (scrittura su `out`, ZIP, ...): il circuito va comunque aggiornato,
+            # altrimenti una richiesta di prova fallita così lo lascerebbe semiaperto per sempre.
+            # Se Gotenberg ha risposto è raggiungibile, quindi conta come successo
+            if response is not None:
+                self.breaker.record_success()
+            else:
+                self.breaker.record_failure()
+            self._conta('errori')
+            raise
+        finally:
+            with self._stats_lock:
+                self._in_volo -= 1
+        self.breaker.record_success()
+        with self._stats_lock:
+            if warmup:
+                self._contatori['warmup'] += 1
+            else:
+                self._contatori['ok'] += 1
+                self._latenze.append(time.perf_counter() - inizio)
+
+    def _conta(self, chiave):
+        with self._stats_lock:
+            self._contatori[chiave] += 1
+
+    def stats(self):
+        """Contatori e latenze (ms) delle ultime conversioni riuscite di questo worker."""
+        with self._stats_lock:
+            latenze = sorted(self._latenze)
+            result = {**self._contatori, 'in_volo': self._in_volo}
+        result.update({
+            'pid': os.getpid(),
+            'max_concurrency': self.max_concurrency,
+            'circuit_breaker': self.breaker.stato,
+            'campioni': len(latenze),
+        })
+        if latenze:
+            def percentile(p):
+                return round(latenze[min(len(latenze) - 1, int(p * len(latenze)))] * 1000, 1)
+
+            result.update({
+                'latenza_media_ms': round(sum(latenze) / len(latenze) * 1000, 1),
+                'latenza_p50_ms': percentile(0.50),
+                'latenza_p95_ms': percentile(0.95),
+                'latenza_max_ms': round(latenze[-1] * 1000, 1),
+            })
+        return result
+
+    def close(self):
+        self._session.close()
+
+
+def _get_warmup_docx():
+    global _warmup_docx
+    if _warmup_docx is None:
+        from docx import Document
+
+        out = io.BytesIO()
+        Document().save(out)
+        _warmup_docx = out.getvalue()
+    return _warmup_docx
+
+
+def _start_warmup(client, interval):
+    def loop():
+        while True:
+            time.sleep(interval)
+            # Qualunque errore inatteso (es. python-docx mancante) non deve
+            # fermare il thread per tutta la vita del worker
+            try:
+                client.warmup()
+            except Exception as e:
+                print(f"Warm-up Gotenberg fallito: {e}")
+
+    threading.Thread(target=loop, name='gotenberg-warmup', daemon=True).start()
+
+
+def get_client():
+    """Client del processo, creato al primo uso (dopo il fork dei worker gunicorn)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                breaker = CircuitBreaker(int(_env_number('GOTENBERG_CB_FAILURES', DEFAULT_CB_FAILURES)),
+                                         _env_number('GOTENBERG_CB_COOLDOWN', DEFAULT_CB_COOLDOWN_S))
+                _client = GotenbergClient(
+                    os.getenv('GOTENBERG_URL', DEFAULT_URL),
+                    timeout=_env_number('GOTENBERG_TIMEOUT', DEFAULT_TIMEOUT_S),
+                    max_concurrency=int(_env_number('GOTENBERG_MAX_CONCURRENCY', DEFAULT_MAX_CONCURRENCY)),
+                    queue_timeout=_env_number('GOTENBERG_QUEUE_TIMEOUT', DEFAULT_QUEUE_TIMEOUT_S),
+                    breaker=breaker,
+                )
+                interval = _env_number('GOTENBERG_WARMUP_INTERVAL', DEFAULT_WARMUP_INTERVAL_S, minimo=0)
+                if interval > 0:
+                    _start_warmup(_client, interval)
+    return _client
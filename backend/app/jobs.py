@@ -0,0 +1,258 @@
+"""Job di generazione documenti in background (render DOCX + conversione PDF).
+
+I download sincroni tengono occupato un worker gunicorn per tutta la
+conversione Gotenberg (fino al timeout di 60 s): poche conversioni lente
+bastano a saturare i worker e a bloccare tutta l'API, health check compreso.
+Con i job la richiesta registra il lavoro e risponde subito (202), un pool di
+thread del processo esegue render e conversione, e il client interroga
+`GET /api/jobs/<id>` finché non riceve l'artefatto.
+
+Lo stato vive nella tabella `render_job` e l'artefatto nel volume
+`invoices/jobs/`, quindi qualunque worker può servire il risultato. Il
+processo che ha in carico un job (in coda nel suo pool o in esecuzione) ne
+aggiorna `heartbeat_at` ogni `RENDER_JOB_HEARTBEAT` secondi: un job
+`pending`/`running` senza segni di vita da oltre `RENDER_JOB_TIMEOUT` secondi
+(worker riavviato a metà) viene segnato `failed` alla prima lettura. Uno stato
+concluso non viene mai sovrascritto. I job conclusi da più di
+`RENDER_JOB_RETENTION_HOURS` vengono rimossi, file compreso.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+
+from flask import current_app, jsonify
+from sqlalchemy import update
+
+from app.documents import (
+    INVOICE_TEMPLATE, GIUSTIFICATIVO_TEMPLATE, ConversionError, resolve_template,
+    build_invoice_context, invoice_basename, cached_invoice_bundle, document_cache,
+    build_giustificativo_context, giustificativo_basename, build_bundle, publish_bundle,
+)
+from app.models import db, RenderJob, Fattura, Cliente
+from app.timezone import now_local
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+DEFAULT_WORKERS = 2
+DEFAULT_TIMEOUT_S = 300
+DEFAULT_HEARTBEAT_S = 30
+DEFAULT_RETENTION_H = 24
+
+_executor = None
+_executor_lock = threading.Lock()
+# Job affidati al pool di questo processo e non ancora conclusi: il thread di
+# heartbeat ne tiene aggiornato heartbeat_at
+_in_carico = set()
+_in_carico_lock = threading.Lock()
+
+
+class JobError(Exception):
+    """Errore previsto durante un job, con messaggio da mostrare al client."""
+
+
+def _env_int(nome, default):
+    try:
+        return max(1, int(os.getenv(nome, default)))
+    except ValueError:
+        return default
+
+
+def _get_executor(app):
+    # Creato al primo uso, quindi dopo il fork dei worker gunicorn: ogni
+    # processo ha i propri thread, heartbeat compreso
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=_env_int('RENDER_JOB_WORKERS', DEFAULT_WORKERS),
+                                               thread_name_prefix='render-job')
+                threading.Thread(target=_run_heartbeat, args=(app,), name='render-job-heartbeat',
+                                 daemon=True).start()
+    return _executor
+
+
+def _run_heartbeat(app):
+    intervallo = _env_int('RENDER_JOB_HEARTBEAT', DEFAULT_HEARTBEAT_S)
+    while True:
+        time.sleep(intervallo)
+        with _in_carico_lock:
+            ids = list(_in_carico)
+        if not ids:
+            continue
+        try:
+            with app.app_context():
+                db.session.execute(
+                    update(RenderJob)
+                    .where(RenderJob.id.in_(ids), RenderJob.status.in_([PENDING, RUNNING]))
+                    .values(heartbeat_at=now_local())
+                )
+                db.session.commit()
+        except Exception as e:
+            print(f"Errore nell'heartbeat dei job: {e}")
+
+
+def jobs_dir(app_root):
+    return os.path.join(app_root, 'invoices', 'jobs')
+
+
+def job_to_dict(job):
+    return {
+        'job_id': job.id,
+        'kind': job.kind,
+        'target_id': job.target_id,
+        'status': job.status,
+        'filename': job.filename,
+        'error': job.error,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+    }
+
+
+def accepted_response(job):
+    """Risposta 202 con l'URL da interrogare per stato e artefatto."""
+    status_url = f"/api/jobs/{job.id}"
+    body = job_to_dict(job)
+    body['status_url'] = status_url
+    return jsonify(body), 202, {'Location': status_url}
+
+
+def submit_render_job(kind, target_id, params=None):
+    """Registra il job su DB (commit prima di accodarlo) e lo affida al pool del worker."""
+    app = current_app._get_current_object()
+    _purge_expired()
+    job = RenderJob(id=uuid.uuid4().hex, kind=kind, target_id=target_id,
+                    params=json.dumps(params) if params else None, status=PENDING)
+    db.session.add(job)
+    db.session.commit()
+    with _in_carico_lock:
+        _in_carico.add(job.id)
+    _get_executor(app).submit(_run_job, app, job.id)
+    return job
+
+
+def expire_if_stale(job):
+    """Segna `failed` un job senza segni di vita oltre il timeout: il worker che lo aveva in carico non c'è più.
+
+    L'ultimo segno di vita è l'heartbeat del processo proprietario, altrimenti
+    l'avvio (job `running`) o la creazione (job in coda).
+    """
+    if job.status not in (PENDING, RUNNING):
+        return
+    timeout = timedelta(seconds=_env_int('RENDER_JOB_TIMEOUT', DEFAULT_TIMEOUT_S))
+    ultimo_segnale = max(t for t in (job.created_at, job.started_at, job.heartbeat_at) if t)
+    if now_local() - ultimo_segnale <= timeout:
+        return
+    aggiornati = db.session.execute(
+        update(RenderJob)
+        .where(RenderJob.id == job.id, RenderJob.status == job.status)
+        .values(status=FAILED, finished_at=now_local(),
+                error="Job interrotto: il worker che lo eseguiva è stato riavviato")
+    ).rowcount
+    db.session.commit()
+    if aggiornati:
+        db.session.refresh(job)
+
+
+def _purge_expired():
+    limite = now_local() - timedelta(hours=_env_int('RENDER_JOB_RETENTION_HOURS', DEFAULT_RETENTION_H))
+    scaduti = RenderJob.query.filter(RenderJob.status.in_([DONE, FAILED]),
+                                     RenderJob.created_at < limite).all()
+    for job in scaduti:
+        if job.artifact_path:
+            try:
+                os.remove(job.artifact_path)
+            except FileNotFoundError:
+                pass
+        db.session.delete(job)
+
+
+def _run_job(app, job_id):
+    try:
+        with app.app_context():
+            _esegui(app, job_id)
+    finally:
+        with _in_carico_lock:
+            _in_carico.discard(job_id)
+
+
+def _esegui(app, job_id):
+    # Passaggi di stato condizionati allo stato atteso: un job già segnato
+    # `failed` (scaduto) non viene né avviato né sovrascritto
+    avviato = db.session.execute(
+        update(RenderJob)
+        .where(RenderJob.id == job_id, RenderJob.status == PENDING)
+        .values(status=RUNNING, started_at=now_local())
+    ).rowcount
+    db.session.commit()
+    if not avviato:
+        return
+    job = db.session.get(RenderJob, job_id)
+
+    artifact_path = os.path.join(jobs_dir(app.root_path), f"{job.id}.zip")
+    esito = {'status': DONE, 'artifact_path': artifact_path}
+    try:
+        os.makedirs(os.path.dirname(artifact_path), exist_ok=True)
+        esito['filename'] = _BUILDERS[job.kind](job, app.root_path, artifact_path)
+    except Exception as e:
+        if isinstance(e, ConversionError):
+            print(f"Errore nella comunicazione con Gotenberg (job {job_id}): {e}")
+            messaggio = "Errore nella conversione a PDF (problema con il servizio Gotenberg)"
+        else:
+            print(f"Errore durante il job {job_id}: {e}")
+            messaggio = str(e)
+        esito = {'status': FAILED, 'error': messaggio}
+    db.session.rollback()
+    concluso = db.session.execute(
+        update(RenderJob)
+        .where(RenderJob.id == job_id, RenderJob.status == RUNNING)
+        .values(finished_at=now_local(), **esito)
+    ).rowcount
+    db.session.commit()
+    if (not concluso or esito['status'] == FAILED) and os.path.exists(artifact_path):
+        os.remove(artifact_path)
+
+
+def _build_invoice(job, app_root, dest_path):
+    fattura = db.session.get(Fattura, job.target_id)
+    if fattura is None:
+        raise JobError("Fattura non trovata")
+    template_path = resolve_template(app_root, INVOICE_TEMPLATE)
+    if not template_path:
+        raise JobError("Template file not found")
+    context = build_invoice_context(fattura, db.session.get(Cliente, fattura.cliente_id))
+    basename = invoice_basename(fattura)
+    cached_path = cached_invoice_bundle(document_cache(os.path.join(app_root, 'invoices')),
+                                        template_path, context, basename)
+    publish_bundle(cached_path, dest_path)
+    return f"{basename}.zip"
+
+
+def _build_giustificativo(job, app_root, dest_path):
+    client = db.session.get(Cliente, job.target_id)
+    if client is None:
+        raise JobError("Cliente non trovato.")
+    template_path = resolve_template(app_root, GIUSTIFICATIVO_TEMPLATE)
+    if not template_path:
+        raise JobError("Template file not found")
+    params = json.loads(job.params)
+    data_prestazione = date.fromisoformat(params['data'])
+    context = build_giustificativo_context(client, data_prestazione, params['ora_inizio'], params['ora_fine'])
+    basename = giustificativo_basename(client, data_prestazione)
+    with tempfile.TemporaryDirectory() as tmpdir:
+        build_bundle(template_path, context, basename, dest_path, tmpdir)
+    return f"{basename}.zip"
+
+
+_BUILDERS = {
+    'invoice': _build_invoice,
+    'giustificativo': _build_giustificativo,
+}
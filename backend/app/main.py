@@ -1,15 +1,21 @@
 from flask import Flask, request, jsonify, send_file, Response
 from app.models import db
+from app import aggregates, recurring, sts_outbox
 from datetime import datetime
 import os
+import click
 from app.api.clienti_api import clients_bp
 from app.api.fatture_api import invoices_bp
 from app.api.costi_api import costi_bp
 from app.api.sts_api import sts_bp
+from app.api.jobs_api import jobs_bp
+from app.api.pnl_api import pnl_bp
 
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_SQLALCHEMY_URL') or 'sqlite:///test.db'
 db.init_app(app)
+# Listener che tengono allineate le tabelle di riepilogo delle statistiche
+aggregates.register(db.session)
 
 # Creazione delle directory se non esistono
 temp_dir = os.path.join(app.root_path, 'temp')
@@ -25,6 +31,17 @@ app.register_blueprint(clients_bp, url_prefix='/api')
 app.register_blueprint(invoices_bp, url_prefix='/api')
 app.register_blueprint(costi_bp, url_prefix='/api')
 app.register_blueprint(sts_bp, url_prefix='/api')
+app.register_blueprint(jobs_bp, url_prefix='/api')
+app.register_blueprint(pnl_bp, url_prefix='/api')
+
+
+# Worker della coda STS (app/sts_outbox.py) e generazione dei costi ricorrenti
+# (app/recurring.py): avviati alla prima richiesta, quindi dopo il fork di
+# gunicorn, e non dai comandi `flask` (migrazioni, stats)
+@app.before_request
+def _start_background_workers():
+    sts_outbox.start_worker(app)
+    recurring.start_scheduler(app)
 
 # Endpoint di health check
 @app.route('/health')
@@ -36,3 +53,44 @@ def health_check():
         return jsonify({"status": "healthy"})
     except Exception as e:
         return jsonify({"status": "unhealthy", "error": str(e)}), 500
+
+
+# Tabelle di riepilogo delle statistiche: `flask --app app.main stats rebuild|check`
+@app.cli.group('stats')
+def stats_cli():
+    """Tabelle di riepilogo delle statistiche (fattura_stats_*, costo_stats)."""
+
+
+@stats_cli.command('rebuild')
+def stats_rebuild():
+    """Ricalcola da zero le tabelle di riepilogo."""
+    righe = aggregates.rebuild()
+    db.session.commit()
+    for tabella, conteggio in righe.items():
+        print(f"{tabella}: {conteggio} righe")
+
+
+@stats_cli.command('check')
+def stats_check():
+    """Confronta le tabelle di riepilogo con le aggregazioni sulle tabelle vive."""
+    differenze = aggregates.check()
+    for tabella, chiave, atteso, trovato in differenze:
+        print(f"{tabella} {chiave}: atteso {atteso}, trovato {trovato}")
+    if differenze:
+        raise SystemExit(f"{len(differenze)} differenze: eseguire `flask stats rebuild`")
+    print("Tabelle di riepilogo allineate")
+
+
+# Costi ricorrenti: `flask --app app.main costs generate [--until YYYY-MM-DD]`
+@app.cli.group('costs')
+def costs_cli():
+    """Costi generati dalle regole ricorrenti (costo_ricorrente)."""
+
+
+@costs_cli.command('generate')
+@click.option('--until', 'until', default=None, help="Genera le scadenze fino a questa data (default oggi).")
+def costs_generate(until):
+    """Genera i costi ricorrenti scaduti e avanza i segnaposto delle regole."""
+    until_date = datetime.strptime(until, '%Y-%m-%d').date() if until else None
+    creati = recurring.generate_recurring_costs(until_date)
+    print(f"Costi ricorrenti generati: {creati}")
@@ -1,7 +1,8 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 from sqlalchemy.ext.declarative import declarative_base
 
-from app.timezone import today_local
+from app.timezone import today_local, now_local
 
 db = SQLAlchemy()
 
@@ -19,6 +20,15 @@ class Cliente(db.Model):
     citta = db.Column(db.String(255))
     cap = db.Column(db.String(5))
     flag_opposizione = db.Column(db.Boolean, default=False)
+    # CF cifrato per STS e impronta del certificato usato (app/sts/encryption.py)
+    codice_fiscale_cifrato = db.Column(db.Text, nullable=True)
+    codice_fiscale_cifrato_cert = db.Column(db.String(64), nullable=True)
+
+@event.listens_for(Cliente.codice_fiscale, 'set')
+def _invalida_cf_cifrato(target, value, oldvalue, initiator):
+    if value != oldvalue:
+        target.codice_fiscale_cifrato = None
+        target.codice_fiscale_cifrato_cert = None
 
 class Fattura(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -40,6 +50,19 @@ class Fattura(db.Model):
 
     cliente = db.relationship('Cliente', backref=db.backref('fatture', lazy=True))
 
+    __table_args__ = (
+        db.UniqueConstraint('anno', 'progressivo', name='uq_fattura_anno_progressivo'),
+        # Indici per le query calde (migration c5e7a9b1d3f5); i parziali coprono solo le
+        # righe delle liste "da inviare a STS" e "non pagate", ordinate per anno/progressivo
+        db.Index('ix_fattura_cliente_id', cliente_id),
+        db.Index('ix_fattura_sts_da_inviare', anno, progressivo,
+                 postgresql_where=db.and_(inviata_sts == False, data_pagamento.isnot(None)),
+                 sqlite_where=db.and_(inviata_sts == False, data_pagamento.isnot(None))),
+        db.Index('ix_fattura_non_pagate', anno, progressivo,
+                 postgresql_where=data_pagamento.is_(None),
+                 sqlite_where=data_pagamento.is_(None)),
+    )
+
 # Nuovo modello per gestire il progressivo annuale delle fatture
 class FatturaProgressivo(db.Model):
     __tablename__ = 'fattura_progressivo'
@@ -60,6 +83,10 @@ class Costo(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint('ricorrenza_id', 'periodo_riferimento', name='uq_costo_ricorrenza_periodo'),
+        db.Index('ix_costo_anno_riferimento_data_pagamento', anno_riferimento, data_pagamento),
+        db.Index('ix_costo_data_pagamento_id', data_pagamento, id),
+        db.Index('ix_costo_non_pagati', data_pagamento,
+                 postgresql_where=pagato == False, sqlite_where=pagato == False),
     )
 
 class CostoRicorrente(db.Model):
@@ -74,3 +101,78 @@ class CostoRicorrente(db.Model):
     data_fine = db.Column(db.Date, nullable=True)
     pagato_default = db.Column(db.Boolean, default=False)
     attivo = db.Column(db.Boolean, default=True)
+    # Ultimo periodo (YYYY-MM) già scaduto e generato: la generazione riparte da qui (app/recurring.py)
+    ultimo_periodo_generato = db.Column(db.String(7), nullable=True)
+
+# Job di generazione documenti (render DOCX + conversione PDF) eseguiti in background.
+# Lo stato è su DB e l'artefatto sul volume invoices/: qualunque worker può
+# rispondere a GET /api/jobs/<id>, non solo quello che ha eseguito il job.
+class RenderJob(db.Model):
+    __tablename__ = 'render_job'
+
+    id = db.Column(db.String(32), primary_key=True)
+    kind = db.Column(db.String(30), nullable=False)
+    target_id = db.Column(db.Integer, nullable=False)
+    params = db.Column(db.Text, nullable=True)
+    status = db.Column(db.String(20), nullable=False, default='pending')
+    filename = db.Column(db.String(255), nullable=True)
+    artifact_path = db.Column(db.String(500), nullable=True)
+    error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=now_local)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    # Ultimo segno di vita del processo che ha il job in carico (app/jobs.py)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+
+# Coda persistente delle operazioni STS (app/sts_outbox.py): una riga per fattura
+# e batch, svuotata dal worker di invio del processo.
+class StsOutbox(db.Model):
+    __tablename__ = 'sts_outbox'
+
+    id = db.Column(db.Integer, primary_key=True)
+    batch_id = db.Column(db.String(32), nullable=False, index=True)
+    fattura_id = db.Column(db.Integer, db.ForeignKey('fattura.id', ondelete='CASCADE'), nullable=False)
+    operazione = db.Column(db.String(20), nullable=False)
+    stato = db.Column(db.String(20), nullable=False, default='pending')
+    tentativi = db.Column(db.Integer, nullable=False, default=0)
+    ultimo_errore = db.Column(db.Text, nullable=True)
+    protocollo = db.Column(db.String(100), nullable=True)
+    # Reinvio richiesto esplicitamente (send-batch con ids e ?force=true): la riga
+    # parte anche se la fattura risulta già inviata
+    forza = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
+    created_at = db.Column(db.DateTime, nullable=False, default=now_local)
+    updated_at = db.Column(db.DateTime, nullable=False, default=now_local)
+
+    __table_args__ = (
+        # Al più un'operazione in coda o in corso per fattura: un secondo batch non la riaccoda
+        db.Index('uq_sts_outbox_fattura_attiva', fattura_id, unique=True,
+                 postgresql_where=stato.in_(['pending', 'in_progress']),
+                 sqlite_where=stato.in_(['pending', 'in_progress'])),
+    )
+
+# Tabelle di riepilogo delle statistiche (dashboard fatture e costi), tenute
+# allineate da app/aggregates.py nella stessa transazione di ogni scrittura.
+class FatturaStatsMese(db.Model):
+    __tablename__ = 'fattura_stats_mese'
+
+    anno = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    mese = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    conteggio = db.Column(db.Integer, nullable=False, default=0)
+    totale = db.Column(db.Float, nullable=False, default=0)
+
+class FatturaStatsCliente(db.Model):
+    __tablename__ = 'fattura_stats_cliente'
+
+    anno = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    cliente_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    conteggio = db.Column(db.Integer, nullable=False, default=0)
+    totale = db.Column(db.Float, nullable=False, default=0)
+
+class CostoStats(db.Model):
+    __tablename__ = 'costo_stats'
+
+    anno_riferimento = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    mese = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    descrizione = db.Column(db.String(255), primary_key=True)
+    conteggio = db.Column(db.Integer, nullable=False, default=0)
+    totale = db.Column(db.Float, nullable=False, default=0)
@@ -0,0 +1,75 @@
+"""Helper puri per la paginazione keyset (a cursore) delle liste.
+
+Con la paginazione keyset il client non passa un offset ma l'ultima chiave
+ricevuta (`after`): la query riparte con una seek sull'indice invece di
+scorrere e scartare le righe precedenti, quindi il costo di una pagina non
+dipende da quanti anni di storico ci sono nel DB.
+
+Nessuna dipendenza da Flask o dal DB: i cursori sono stringhe opache per il
+frontend ma leggibili (es. "2025:12" = fattura 12/2025, "2025-03-31:42" =
+costo 42 pagato il 31/03/2025), e gli errori di formato sollevano ValueError
+con un messaggio pronto per la risposta 400.
+"""
+from datetime import date
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def parse_limit(raw, default: int = DEFAULT_PAGE_SIZE, maximum: int = MAX_PAGE_SIZE) -> int:
+    """Valida il parametro `limit`: intero positivo, limitato a `maximum`."""
+    if raw is None or str(raw).strip() == '':
+        return default
+    try:
+        limit = int(raw)
+    except (TypeError, ValueError) as exc:
+        raise ValueError("Il parametro 'limit' deve essere un intero positivo") from exc
+    if limit <= 0:
+        raise ValueError("Il parametro 'limit' deve essere un intero positivo")
+    return min(limit, maximum)
+
+
+def parse_invoice_cursor(raw):
+    """
+    Decodifica il cursore fattura "<anno>:<progressivo>".
+
+    Ritorna (anno, progressivo) oppure None se il cursore è assente.
+    """
+    if raw is None or str(raw).strip() == '':
+        return None
+    parts = str(raw).strip().split(':')
+    if len(parts) != 2:
+        raise ValueError("Il parametro 'after' deve avere formato <anno>:<progressivo>")
+    try:
+        anno, progressivo = int(parts[0]), int(parts[1])
+    except ValueError as exc:
+        raise ValueError("Il parametro 'after' deve avere formato <anno>:<progressivo>") from exc
+    return anno, progressivo
+
+
+def format_invoice_cursor(anno: int, progressivo: int) -> str:
+    """Codifica la chiave (anno, progressivo) come cursore per `after`."""
+    return f"{anno}:{progressivo}"
+
+
+def parse_cost_cursor(raw):
+    """
+    Decodifica il cursore costo "<data_pagamento YYYY-MM-DD>:<id>".
+
+    Ritorna (data_pagamento, id) oppure None se il cursore è assente.
+    """
+    if raw is None or str(raw).strip() == '':
+        return None
+    parts = str(raw).strip().split(':')
+    if len(parts) != 2:
+        raise ValueError("Il parametro 'after' deve avere formato <YYYY-MM-DD>:<id>")
+    try:
+        data_pagamento, costo_id = date.fromisoformat(parts[0]), int(parts[1])
+    except ValueError as exc:
+        raise ValueError("Il parametro 'after' deve avere formato <YYYY-MM-DD>:<id>") from exc
+    return data_pagamento, costo_id
+
+
+def format_cost_cursor(data_pagamento: date, costo_id: int) -> str:
+    """Codifica la chiave (data_pagamento, id) come cursore per `after`."""
+    return f"{data_pagamento.isoformat()}:{costo_id}"
@@ -0,0 +1,40 @@
+"""Allocazione atomica del progressivo annuale delle fatture.
+
+Il contatore per anno vive in `fattura_progressivo`. Invece di leggere la riga,
+incrementare in Python e fare commit (due transazioni, e due worker gunicorn
+possono leggere lo stesso valore), il progressivo si riserva con un'unica
+istruzione upsert + RETURNING: crea la riga dell'anno se manca, altrimenti la
+incrementa, e restituisce il nuovo valore.
+
+L'upsert tiene il lock di riga fino al commit della transazione che inserisce
+la fattura: le creazioni concorrenti si serializzano solo su quella riga, un
+rollback restituisce il numero (nessun buco) e il vincolo
+UNIQUE(anno, progressivo) su `fattura` fa da rete di sicurezza contro i doppioni.
+Sintassi supportata da PostgreSQL e da SQLite >= 3.35 (usato nei test).
+"""
+from sqlalchemy import text
+
+from app.models import db
+
+_RESERVE_SQL = text(
+    """
+    INSERT INTO fattura_progressivo (anno, last_progressivo)
+    VALUES (:anno, :count)
+    ON CONFLICT (anno) DO UPDATE
+        SET last_progressivo = COALESCE(fattura_progressivo.last_progressivo, 0) + :count
+    RETURNING last_progressivo
+    """
+)
+
+
+def reserve_progressivi(anno: int, count: int = 1) -> int:
+    """
+    Riserva `count` progressivi consecutivi per `anno` nella transazione corrente.
+
+    Ritorna il primo numero del blocco (il blocco è primo..primo+count-1).
+    Il chiamante deve inserire le fatture e fare commit nella stessa transazione.
+    """
+    if count < 1:
+        raise ValueError("count deve essere >= 1")
+    last = db.session.execute(_RESERVE_SQL, {'anno': anno, 'count': count}).scalar_one()
+    return last - count + 1
@@ -0,0 +1,245 @@
+"""Query di lettura condivise tra i blueprint.
+
+Le liste di fatture (elenco, non pagate, da inviare a STS) mostrano anche il
+nome del cliente. Leggerlo tramite la relationship lazy `Fattura.cliente`
+costa una SELECT per fattura (N+1); qui invece fattura e cliente arrivano in
+un'unica SELECT con join, come tuple di colonne (niente idratazione ORM).
+
+Le statistiche della dashboard (`invoice_stats`, `cost_stats`) si leggono dalle
+tabelle di riepilogo mantenute da app/aggregates.py, con una sola query UNION
+ALL per endpoint: totale, dettaglio per mese (o per anno) e per cliente o
+descrizione. Il riferimento sulle tabelle vive è uno solo, le GROUP BY di
+`aggregates.check()`.
+
+`profit_and_loss` unisce le due tabelle di riepilogo mese per mese in una sola
+query con funzioni finestra: ricavi, costi, margine, progressivi dell'anno e
+confronto con lo stesso mese dell'anno precedente.
+"""
+from sqlalchemy import (
+    Float, Integer, String, cast, column, func, literal, null, select, union_all, values,
+)
+
+from app.models import db, Fattura, Cliente, FatturaStatsMese, FatturaStatsCliente, CostoStats
+
+# Livello di dettaglio di ogni riga della UNION ALL
+_LIVELLO_TOTALE = 3
+_LIVELLO_PERIODO = 1
+_LIVELLO_CLIENTE = 2
+# Per i costi il secondo dettaglio è per descrizione
+_LIVELLO_DESCRIZIONE = 2
+
+
+def invoice_list_query():
+    """Proiezione fattura + nome/cognome del cliente, filtrabile e ordinabile come Fattura.query."""
+    return db.session.query(
+        Fattura.id,
+        Fattura.anno,
+        Fattura.progressivo,
+        Fattura.data_fattura,
+        Fattura.data_pagamento,
+        Fattura.metodo_pagamento,
+        Fattura.descrizione,
+        Fattura.totale,
+        Fattura.inviata_sts,
+        Fattura.protocollo_sts,
+        Fattura.data_invio_sts,
+        Cliente.nome.label('cliente_nome'),
+        Cliente.cognome.label('cliente_cognome'),
+    ).outerjoin(Cliente, Cliente.id == Fattura.cliente_id)
+
+
+def cliente_display_name(row):
+    """'Nome Cognome' del cliente di una riga di invoice_list_query(), None se assente."""
+    if row.cliente_nome is None:
+        return None
+    return f"{row.cliente_nome} {row.cliente_cognome}"
+
+
+def invoice_stats_summary_query(year=None):
+    """UNION ALL su fattura_stats_mese/fattura_stats_cliente: totale, dettaglio per periodo e per cliente."""
+    periodo = FatturaStatsMese.mese if year else FatturaStatsMese.anno
+    totale = select(
+        literal(_LIVELLO_TOTALE).label('livello'), cast(null(), Integer).label('periodo'),
+        cast(null(), Integer).label('cliente_id'), cast(null(), String).label('nome'),
+        cast(null(), String).label('cognome'),
+        func.coalesce(func.sum(FatturaStatsMese.conteggio), 0).label('conteggio'),
+        func.sum(FatturaStatsMese.totale).label('totale'),
+    )
+    per_periodo = select(
+        literal(_LIVELLO_PERIODO), periodo, cast(null(), Integer), cast(null(), String), cast(null(), String),
+        func.sum(FatturaStatsMese.conteggio), func.sum(FatturaStatsMese.totale),
+    ).group_by(periodo)
+    per_cliente = select(
+        literal(_LIVELLO_CLIENTE), cast(null(), Integer), FatturaStatsCliente.cliente_id, Cliente.nome,
+        Cliente.cognome, func.sum(FatturaStatsCliente.conteggio), func.sum(FatturaStatsCliente.totale),
+    ).join_from(FatturaStatsCliente, Cliente, Cliente.id == FatturaStatsCliente.cliente_id).group_by(
+        FatturaStatsCliente.cliente_id, Cliente.nome, Cliente.cognome
+    )
+    if year:
+        totale = totale.where(FatturaStatsMese.anno == year)
+        per_periodo = per_periodo.where(FatturaStatsMese.anno == year)
+        per_cliente = per_cliente.where(FatturaStatsCliente.anno == year)
+    return union_all(totale, per_periodo, per_cliente)
+
+
+def _invoice_stats_json(righe, year):
+    totale = next((r for r in righe if r['livello'] == _LIVELLO_TOTALE), {'conteggio': 0, 'totale': None})
+    periodi = sorted((r for r in righe if r['livello'] == _LIVELLO_PERIODO), key=lambda r: r['periodo'])
+    clienti = sorted((r for r in righe if r['livello'] == _LIVELLO_CLIENTE),
+                     key=lambda r: (-r['conteggio'], r['cliente_id']))
+
+    # Arrotondati al centesimo: i totali delle tabelle di riepilogo accumulano delta float
+    # (+/-) e possono avere residui che una SUM diretta non avrebbe
+    return {
+        'totale_fatture': totale['conteggio'],
+        'totale_annuo': round(totale['totale'] or 0.0, 2),
+        'clienti_con_fatture': len(clienti),
+        'per_mese': [{'mese': int(r['periodo']), 'conteggio': r['conteggio'], 'totale': round(float(r['totale']), 2)}
+                     for r in periodi],
+        'per_cliente': [{'cliente': f"{r['nome']} {r['cognome']}", 'conteggio': r['conteggio'],
+                         'totale': round(float(r['totale']), 2)} for r in clienti],
+        'anno_selezionato': year,
+    }
+
+
+def invoice_stats(year=None):
+    """
+    Statistiche fatture per la dashboard, lette dalle tabelle di riepilogo con una query.
+
+    Stesso JSON di sempre: totale fatture e importo, clienti distinti, dettaglio
+    per mese (anno selezionato) o per anno (tutti gli anni) e per cliente.
+    """
+    righe = [row._asdict() for row in db.session.execute(invoice_stats_summary_query(year))]
+    return _invoice_stats_json(righe, year)
+
+
+def cost_stats(year=None):
+    """
+    Statistiche costi lette da costo_stats con una query.
+
+    Con un anno (di competenza) il dettaglio è per mese di pagamento, altrimenti
+    per anno di competenza. Ritorna {'conteggio', 'totale', 'per_periodo',
+    'per_descrizione'}; i dettagli sono liste di dict {periodo|descrizione,
+    conteggio, totale}, per periodo crescente e per conteggio decrescente.
+    """
+    periodo = CostoStats.mese if year else CostoStats.anno_riferimento
+    totale = select(
+        literal(_LIVELLO_TOTALE).label('livello'), cast(null(), Integer).label('periodo'),
+        cast(null(), String).label('descrizione'),
+        func.coalesce(func.sum(CostoStats.conteggio), 0).label('conteggio'),
+        func.sum(CostoStats.totale).label('totale'),
+    )
+    per_periodo = select(
+        literal(_LIVELLO_PERIODO), periodo, cast(null(), String),
+        func.sum(CostoStats.conteggio), func.sum(CostoStats.totale),
+    ).group_by(periodo)
+    per_descrizione = select(
+        literal(_LIVELLO_DESCRIZIONE), cast(null(), Integer), CostoStats.descrizione,
+        func.sum(CostoStats.conteggio), func.sum(CostoStats.totale),
+    ).group_by(CostoStats.descrizione)
+    if year:
+        totale = totale.where(CostoStats.anno_riferimento == year)
+        per_periodo = per_periodo.where(CostoStats.anno_riferimento == year)
+        per_descrizione = per_descrizione.where(CostoStats.anno_riferimento == year)
+
+    righe = db.session.execute(union_all(totale, per_periodo, per_descrizione)).all()
+    totali = next(r for r in righe if r.livello == _LIVELLO_TOTALE)
+    return {
+        'conteggio': totali.conteggio,
+        'totale': round(totali.totale or 0.0, 2),
+        'per_periodo': [{'periodo': int(r.periodo), 'conteggio': r.conteggio, 'totale': round(r.totale, 2)}
+                        for r in sorted((r for r in righe if r.livello == _LIVELLO_PERIODO), key=lambda r: r.periodo)],
+        'per_descrizione': [{'descrizione': r.descrizione, 'conteggio': r.conteggio, 'totale': round(r.totale, 2)}
+                            for r in sorted((r for r in righe if r.livello == _LIVELLO_DESCRIZIONE),
+                                            key=lambda r: (-r.conteggio, r.descrizione))],
+    }
+
+
+def _griglia_mesi(anni):
+    """I 12 mesi di ogni anno come tabella (anno, mese): VALUES su Postgres, UNION ALL su SQLite."""
+    coppie = [(anno, mese) for anno in anni for mese in range(1, 13)]
+    if db.session.get_bind().dialect.name == 'postgresql':
+        # SQLite non accetta alias di colonna su (VALUES ...) AS m (anno, mese)
+        return values(column('anno', Integer), column('mese', Integer), name='griglia').data(coppie)
+    return union_all(*(select(literal(anno, Integer).label('anno'), literal(mese, Integer).label('mese'))
+                       for anno, mese in coppie)).subquery('griglia')
+
+
+def profit_and_loss_query(year):
+    """
+    Conto economico mensile di `year` in una SELECT sulle tabelle di riepilogo.
+
+    Ricavi da fattura_stats_mese (anno della fattura, mese di data_fattura),
+    costi da costo_stats (anno di competenza, mese di data_pagamento): gli stessi
+    criteri di /invoices/stats e /costs/stats. La griglia copre anche l'anno
+    precedente, così LAG(...) OVER (PARTITION BY mese ORDER BY anno) dà il
+    confronto anno su anno e SUM(...) OVER (PARTITION BY anno ORDER BY mese) i
+    progressivi; i mesi senza movimenti valgono zero.
+    """
+    anni = (year - 1, year)
+    griglia = _griglia_mesi(anni)
+    ricavi = select(
+        FatturaStatsMese.anno, FatturaStatsMese.mese, func.sum(FatturaStatsMese.totale).label('totale'),
+    ).where(FatturaStatsMese.anno.in_(anni)).group_by(FatturaStatsMese.anno, FatturaStatsMese.mese).cte('ricavi')
+    costi = select(
+        CostoStats.anno_riferimento.label('anno'), CostoStats.mese, func.sum(CostoStats.totale).label('totale'),
+    ).where(CostoStats.anno_riferimento.in_(anni)).group_by(CostoStats.anno_riferimento, CostoStats.mese).cte('costi')
+    mesi = select(
+        griglia.c.anno,
+        griglia.c.mese,
+        func.coalesce(ricavi.c.totale, cast(0, Float)).label('ricavi'),
+        func.coalesce(costi.c.totale, cast(0, Float)).label('costi'),
+    ).select_from(
+        griglia.outerjoin(ricavi, (ricavi.c.anno == griglia.c.anno) & (ricavi.c.mese == griglia.c.mese))
+        .outerjoin(costi, (costi.c.anno == griglia.c.anno) & (costi.c.mese == griglia.c.mese))
+    ).cte('mesi')
+
+    progressivo = {'partition_by': mesi.c.anno, 'order_by': mesi.c.mese}
+    margine = mesi.c.ricavi - mesi.c.costi
+    progressivi = select(
+        mesi.c.anno,
+        mesi.c.mese,
+        mesi.c.ricavi,
+        mesi.c.costi,
+        margine.label('margine'),
+        func.sum(mesi.c.ricavi).over(**progressivo).label('ricavi_progressivi'),
+        func.sum(mesi.c.costi).over(**progressivo).label('costi_progressivi'),
+        func.sum(margine).over(**progressivo).label('margine_progressivo'),
+    ).cte('progressivi')
+
+    # Le funzioni finestra non si annidano: il LAG dei progressivi legge la CTE sopra
+    anno_prec = {'partition_by': progressivi.c.mese, 'order_by': progressivi.c.anno}
+    finestra = select(
+        progressivi,
+        *(func.lag(progressivi.c[nome]).over(**anno_prec).label(f'{nome}_anno_prec')
+          for nome in ('ricavi', 'costi', 'margine', 'margine_progressivo')),
+    ).subquery('finestra')
+    return select(finestra).where(finestra.c.anno == year).order_by(finestra.c.mese)
+
+
+def profit_and_loss(year):
+    """Ricavi, costi e margine per mese di `year`, con progressivi e differenze sull'anno precedente."""
+    per_mese = []
+    for r in db.session.execute(profit_and_loss_query(year)):
+        per_mese.append({
+            'mese': r.mese,
+            'ricavi': round(r.ricavi, 2),
+            'costi': round(r.costi, 2),
+            'margine': round(r.margine, 2),
+            'ricavi_progressivi': round(r.ricavi_progressivi, 2),
+            'costi_progressivi': round(r.costi_progressivi, 2),
+            'margine_progressivo': round(r.margine_progressivo, 2),
+            'delta_ricavi': round(r.ricavi - r.ricavi_anno_prec, 2),
+            'delta_costi': round(r.costi - r.costi_anno_prec, 2),
+            'delta_margine': round(r.margine - r.margine_anno_prec, 2),
+            'delta_margine_progressivo': round(r.margine_progressivo - r.margine_progressivo_anno_prec, 2),
+        })
+    ultimo = per_mese[-1]
+    return {
+        'anno': year,
+        'ricavi': ultimo['ricavi_progressivi'],
+        'costi': ultimo['costi_progressivi'],
+        'margine': ultimo['margine_progressivo'],
+        'delta_margine': ultimo['delta_margine_progressivo'],
+        'per_mese': per_mese,
+    }
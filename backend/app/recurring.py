@@ -0,0 +1,285 @@
+"""Generazione dei costi dalle regole ricorrenti (`costo_ricorrente`).
+
+Ogni regola produce un `Costo` per periodo (mese `YYYY-MM` di scadenza, ogni 1,
+3 o 12 mesi a partire dal mese di `data_inizio`), con il vincolo univoco
+(ricorrenza_id, periodo_riferimento) a fare da guardia contro i doppioni: le
+scadenze si calcolano in Python e si inseriscono con un solo INSERT ... ON
+CONFLICT DO NOTHING per esecuzione, non una riga (e un savepoint) alla volta.
+
+`ultimo_periodo_generato` è il segnaposto della regola: l'ultimo periodo già
+scaduto e generato. La generazione riparte dal periodo successivo, quindi costa
+quanto i periodi nuovi e non quanto la regola è vecchia; un costo generato e
+poi eliminato a mano non viene ricreato. Cambiando inizio o frequenza il
+segnaposto si azzera e la regola viene ripercorsa dall'inizio (i periodi già
+presenti restano come sono).
+
+Non si genera più nelle GET: lo fanno le scritture sulle regole (POST/PUT
+/recurring-costs), un thread per processo a intervalli regolari
+(RECURRING_COSTS_INTERVAL secondi, default 3600) e `flask costs generate`.
+
+`forecast_costs` proietta invece i periodi futuri in memoria, senza scrivere:
+serve alla previsione di cassa (GET /costs/forecast).
+"""
+import bisect
+import calendar
+import logging
+import os
+import threading
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import extract, func, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app import aggregates
+from app.models import db, Costo, CostoRicorrente
+from app.timezone import today_local
+
+logger = logging.getLogger(__name__)
+
+FREQUENZE_RICORRENZA = {
+    'mensile': 1,
+    'trimestrale': 3,
+    'annuale': 12,
+}
+
+DEFAULT_INTERVAL_S = 3600
+MESI_PREVISIONE_MAX = 36
+# Righe per INSERT: 7 parametri a riga restano sotto il limite di variabili di SQLite (32766)
+INSERT_BLOCCO = 1000
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def _env_int(nome, default):
+    try:
+        return max(1, int(os.getenv(nome, default)))
+    except ValueError:
+        return default
+
+
+def add_months(source_date, months):
+    month_index = source_date.month - 1 + months
+    year = source_date.year + month_index // 12
+    month = month_index % 12 + 1
+    day = min(source_date.day, calendar.monthrange(year, month)[1])
+    return date(year, month, day)
+
+
+def due_date_for_period(year, month, day):
+    last_day = calendar.monthrange(year, month)[1]
+    return date(year, month, min(day, last_day))
+
+
+def periodo(giorno):
+    return f"{giorno.year:04d}-{giorno.month:02d}"
+
+
+def periodi_da_generare(ricorrenza, until_date):
+    """
+    Periodi scaduti entro until_date dopo il segnaposto della regola.
+
+    Ritorna ([(periodo, scadenza, anno_riferimento)], nuovo segnaposto). Il
+    segnaposto avanza solo sui periodi già scaduti: quello del mese corrente con
+    scadenza successiva a until_date resta da generare.
+    """
+    step_months = FREQUENZE_RICORRENZA[ricorrenza.frequenza]
+    end_date = min(ricorrenza.data_fine or until_date, until_date)
+    ultimo = ricorrenza.ultimo_periodo_generato
+    if ultimo:
+        anno, mese = map(int, ultimo.split('-'))
+        current = add_months(date(anno, mese, 1), step_months)
+    else:
+        current = date(ricorrenza.data_inizio.year, ricorrenza.data_inizio.month, 1)
+
+    periodi = []
+    while current <= end_date:
+        due_date = due_date_for_period(current.year, current.month, ricorrenza.giorno_scadenza)
+        if due_date > end_date:
+            break
+        # Primo mese con scadenza prima di data_inizio: saltato, ma coperto dal segnaposto
+        if due_date >= ricorrenza.data_inizio:
+            periodi.append((periodo(current), due_date, current.year))
+        ultimo = periodo(current)
+        current = add_months(current, step_months)
+    return periodi, ultimo
+
+
+def _insert_sql():
+    """INSERT multi-riga che salta i periodi già presenti (vincolo uq_costo_ricorrenza_periodo)."""
+    insert = postgresql.insert if db.engine.dialect.name == 'postgresql' else sqlite.insert
+    return insert(Costo).on_conflict_do_nothing(index_elements=['ricorrenza_id', 'periodo_riferimento'])
+
+
+def _insert_costs(righe):
+    """Inserisce le righe a blocchi; ritorna quelle effettivamente inserite (dict delle colonne)."""
+    inserite = []
+    base = _insert_sql().returning(*(getattr(Costo, campo) for campo in aggregates.CAMPI_COSTO))
+    for inizio in range(0, len(righe), INSERT_BLOCCO):
+        risultato = db.session.execute(base.values(righe[inizio:inizio + INSERT_BLOCCO]))
+        inserite.extend(dict(riga._mapping) for riga in risultato)
+    return inserite
+
+
+def generate_recurring_costs(until_date=None, commit=True, ricorrenze=None):
+    """
+    Genera i costi scaduti entro until_date (default oggi) e avanza i segnaposto.
+
+    Senza `ricorrenze` considera le regole attive con periodi potenzialmente
+    scaduti dopo il segnaposto. Tutti i periodi di tutte le regole vanno in un
+    INSERT multi-riga (a blocchi di INSERT_BLOCCO) con ON CONFLICT DO NOTHING:
+    un periodo generato nel frattempo da un altro processo viene saltato senza
+    errori, e le righe in ordine di (regola, periodo) prendono i lock sempre
+    nello stesso ordine. Ritorna il numero di costi creati.
+    """
+    until_date = until_date or today_local()
+    if ricorrenze is None:
+        ricorrenze = CostoRicorrente.query.filter(
+            CostoRicorrente.attivo == True,
+            or_(CostoRicorrente.ultimo_periodo_generato.is_(None),
+                CostoRicorrente.ultimo_periodo_generato < periodo(until_date)),
+        ).all()
+    righe = []
+    avanzati = False
+
+    for ricorrenza in sorted(ricorrenze, key=lambda r: r.id):
+        if not ricorrenza.attivo:
+            continue
+        periods_to_generate, ultimo = periodi_da_generare(ricorrenza, until_date)
+        if ultimo != ricorrenza.ultimo_periodo_generato:
+            ricorrenza.ultimo_periodo_generato = ultimo
+            avanzati = True
+        righe.extend({
+            'descrizione': f"{ricorrenza.descrizione} - {periodo_riferimento}",
+            'anno_riferimento': anno_riferimento,
+            'data_pagamento': due_date,
+            'totale': ricorrenza.totale,
+            'pagato': ricorrenza.pagato_default,
+            'ricorrenza_id': ricorrenza.id,
+            'periodo_riferimento': periodo_riferimento,
+        } for periodo_riferimento, due_date, anno_riferimento in periods_to_generate)
+
+    inserite = _insert_costs(righe) if righe else []
+    # L'INSERT core non passa dal flush: le tabelle di riepilogo si aggiornano qui
+    aggregates.record_costs(inserite)
+    created = len(inserite)
+
+    if (created or avanzati) and commit:
+        db.session.commit()
+    return created
+
+
+def _indice_mese(anno, mese):
+    return anno * 12 + mese - 1
+
+
+def forecast_costs(mesi, oggi=None):
+    """
+    Uscite previste mese per mese da oggi (mese corrente incluso), senza scrivere nulla.
+
+    Per ogni mese somma i costi registrati non pagati e i periodi delle regole
+    attive non ancora generati (dopo il segnaposto, che copre tutti i costi già
+    in tabella). Le scadenze si calcolano una volta per giorno di scadenza su
+    tutta la griglia dei mesi: per regola restano una bisezione su data_fine e
+    un passo di 1, 3 o 12 posizioni, senza creare date. I costi non
+    pagati dei mesi passati e gli eventuali periodi passati non ancora generati
+    (scheduler in ritardo) vanno in 'arretrati'. Due query in tutto.
+    """
+    oggi = oggi or today_local()
+    primo = date(oggi.year, oggi.month, 1)
+    griglia = [add_months(primo, k) for k in range(mesi)]
+    fine = due_date_for_period(griglia[-1].year, griglia[-1].month, 31)
+    base = _indice_mese(primo.year, primo.month)
+    # Scadenze della griglia per giorno di scadenza, calcolate alla prima regola che lo usa
+    scadenze = {}
+    previsti = [0.0] * mesi
+    registrati = [0.0] * mesi
+    arretrati = 0.0
+
+    regole = db.session.execute(
+        select(CostoRicorrente.frequenza, CostoRicorrente.giorno_scadenza, CostoRicorrente.data_inizio,
+               CostoRicorrente.data_fine, CostoRicorrente.totale, CostoRicorrente.ultimo_periodo_generato)
+        .where(CostoRicorrente.attivo == True)
+    ).all()
+    for regola in regole:
+        frequenza, giorno, data_inizio, data_fine, totale, ultimo = regola
+        step_months = FREQUENZE_RICORRENZA[frequenza]
+        if ultimo:
+            anno, mese = map(int, ultimo.split('-'))
+            prossimo = _indice_mese(anno, mese) + step_months
+        else:
+            prossimo = _indice_mese(data_inizio.year, data_inizio.month)
+        if prossimo < base:
+            periodi_passati, _ = periodi_da_generare(regola, primo - timedelta(days=1))
+            arretrati += totale * len(periodi_passati)
+            prossimo += -(-(base - prossimo) // step_months) * step_months
+
+        colonna = scadenze.get(giorno)
+        if colonna is None:
+            colonna = scadenze[giorno] = [due_date_for_period(g.year, g.month, giorno) for g in griglia]
+        inizio = prossimo - base
+        # Scadenze crescenti: l'ultimo periodo entro data_fine si trova per bisezione
+        termine = bisect.bisect_right(colonna, data_fine) if data_fine else mesi
+        # Solo il primo periodo può scadere prima di data_inizio (mese di inizio)
+        if inizio < termine and colonna[inizio] < data_inizio:
+            inizio += step_months
+        for k in range(inizio, termine, step_months):
+            previsti[k] += totale
+
+    anno_pagamento = extract('year', Costo.data_pagamento)
+    mese_pagamento = extract('month', Costo.data_pagamento)
+    non_pagati = db.session.execute(
+        select(anno_pagamento, mese_pagamento, func.sum(Costo.totale))
+        .where(Costo.pagato == False, Costo.data_pagamento <= fine)
+        .group_by(anno_pagamento, mese_pagamento)
+    ).all()
+    for anno, mese, totale in non_pagati:
+        k = _indice_mese(int(anno), int(mese)) - base
+        if k < 0:
+            arretrati += totale
+        else:
+            registrati[k] += totale
+
+    per_mese = [{
+        'mese': periodo(griglia[k]),
+        'registrati': round(registrati[k], 2),
+        'previsti': round(previsti[k], 2),
+        'totale': round(registrati[k] + previsti[k], 2),
+    } for k in range(mesi)]
+    return {
+        'dal': per_mese[0]['mese'],
+        'al': per_mese[-1]['mese'],
+        'arretrati': round(arretrati, 2),
+        'per_mese': per_mese,
+        'totale': round(arretrati + sum(registrati) + sum(previsti), 2),
+    }
+
+
+def _run_worker(app):
+    intervallo = _env_int('RECURRING_COSTS_INTERVAL', DEFAULT_INTERVAL_S)
+    while True:
+        with app.app_context():
+            try:
+                creati = generate_recurring_costs()
+                if creati:
+                    logger.info("Generati %d costi ricorrenti", creati)
+            except Exception:
+                db.session.rollback()
+                logger.exception("Errore nella generazione dei costi ricorrenti")
+        time.sleep(intervallo)
+
+
+def start_scheduler(app):
+    """Avvia il thread che genera i costi ricorrenti, una volta per processo.
+
+    Come il worker della coda STS va chiamato dopo il fork dei worker gunicorn.
+    Più processi possono generare insieme: il vincolo univoco scarta i doppioni.
+    """
+    global _worker
+    if _worker is not None:
+        return
+    with _worker_lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_run_worker, args=(app,), name='recurring-costs', daemon=True)
+            _worker.start()
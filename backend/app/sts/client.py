@@ -1,14 +1,19 @@
 import logging
 import os
+import random
 import ssl
+import threading
 import time
 import xml.etree.ElementTree as ET
+from collections import deque
 
 import requests
 from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
-from urllib3.util.ssl_ import create_urllib3_context
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
 
+from app.sts.limiter import AdaptiveRateLimiter, LimiterTimeout, DEFAULT_RATE_MAX
+from app.sts.encryption import encrypt_cliente_cf
 from app.sts.mapper import build_inserimento_payload, build_cancellazione_payload
 
 logger = logging.getLogger(__name__)
@@ -21,17 +26,83 @@ STS_ENDPOINTS = {
 SOAP_ACTION_INSERIMENTO = "inserimento.documentospesap730.sanita.finanze.it"
 SOAP_ACTION_CANCELLAZIONE = "cancellazione.documentospesap730.sanita.finanze.it"
 
-# Codici errore STS che non devono essere ritentati
-NO_RETRY_CODES = {"WS002", "WS004"}
-
 MAX_RETRIES = 3
 RETRY_BACKOFF = 2  # secondi base per backoff esponenziale
+RETRY_BACKOFF_MAX = 30  # tetto dell'attesa tra due tentativi, Retry-After compreso
+
+# Risposte HTTP di sovraccarico: segnale di congestione per il limitatore. Solo 429 e 503
+# con Retry-After si ritentano: il servizio dichiara di non aver elaborato la richiesta
+CONGESTION_HTTP_STATUS = {429, 502, 503, 504}
+RETRY_HTTP_STATUS = {429, 503}
+# Gateway in errore o in timeout: STS potrebbe aver registrato la spesa, esito da verificare
+UNKNOWN_OUTCOME_HTTP_STATUS = {502, 504}
+
+# Attesa massima di un permesso del limitatore prima di rinunciare all'invio
+DEFAULT_QUEUE_TIMEOUT_S = 120
+
+# Invii in parallelo di un batch (send-batch); le connessioni del pool HTTP seguono
+DEFAULT_MAX_CONCURRENCY = 4
+LATENCY_SAMPLES = 500
+
+# Variabili lette da STSClient: se cambiano, get_client() ricrea il client del processo
+_ENV_VARS = (
+    "STS_ENVIRONMENT", "STS_DEBUG", "STS_USERNAME", "STS_PASSWORD", "STS_PARTITA_IVA",
+    "STS_PINCODE_ENCRYPTED", "STS_CF_PROPRIETARIO_ENCRYPTED", "STS_DISPOSITIVO",
+    "STS_CERTIFICATE_PATH", "STS_NATURA_IVA", "STS_MAX_CONCURRENCY", "STS_CA_BUNDLE", "STS_SSL_VERIFY",
+    "STS_MAX_RATE", "STS_THROTTLE_CODES", "STS_ENDPOINT_URL",
+)
+
+_client = None
+_client_lock = threading.Lock()
 
 # Cipher suite con SECLEVEL=1: necessario per i server governativi italiani
 # che usano cipher suite considerate "legacy" da OpenSSL >= 1.1.1
 _STS_CIPHERS = "DEFAULT@SECLEVEL=1"
 
 
+class _STSSSLSocket(ssl.SSLSocket):
+    """SSLSocket che alla chiusura consegna la propria sessione TLS al context."""
+
+    def close(self):
+        # Con TLS 1.3 il ticket arriva dopo l'handshake, insieme ai primi dati:
+        # la sessione riprendibile si legge quando la connessione ha finito
+        try:
+            self.context.ricorda_sessione(self.session)
+        except (AttributeError, OSError, ValueError):
+            pass
+        super().close()
+
+
+class _STSSSLContext(ssl.SSLContext):
+    """
+    SSLContext che riprende l'ultima sessione TLS quando apre una nuova connessione.
+
+    Le connessioni keep-alive del pool evitano già l'handshake tra un invio e
+    l'altro; quando il server chiude una connessione inattiva, la successiva
+    riprende la sessione (handshake abbreviato, senza catena di certificati né
+    scambio di chiavi completo). `on_handshake(secondi, ripresa)` riceve la
+    durata di ogni handshake.
+    """
+
+    sslsocket_class = _STSSSLSocket
+    on_handshake = None
+    _sessione = None
+
+    def ricorda_sessione(self, sessione):
+        if sessione is not None:
+            self._sessione = sessione
+
+    def wrap_socket(self, sock, *args, **kwargs):
+        if kwargs.get("session") is None:
+            kwargs["session"] = self._sessione
+        inizio = time.perf_counter()
+        ssock = super().wrap_socket(sock, *args, **kwargs)
+        if self.on_handshake is not None:
+            self.on_handshake(time.perf_counter() - inizio, ssock.session_reused)
+        self.ricorda_sessione(ssock.session)
+        return ssock
+
+
 class _STSSSLAdapter(HTTPAdapter):
     """
     HTTPAdapter con SSL context personalizzato per i server STS del MEF.
@@ -41,37 +112,44 @@ class _STSSSLAdapter(HTTPAdapter):
     - TLS 1.2 minimo
     - Verifica certificato opzionale (ssl_verify=False per ambiente test)
     - CA bundle personalizzato
+    - un solo SSL context per adapter, con ripresa delle sessioni TLS
     """
 
-    def __init__(self, ssl_verify: bool = True, ca_bundle: str | None = None, **kwargs):
+    def __init__(self, ssl_verify: bool = True, ca_bundle: str | None = None, on_handshake=None, **kwargs):
         self._ssl_verify = ssl_verify
         self._ca_bundle = ca_bundle
+        self._ctx = self._build_ctx()
+        self._ctx.on_handshake = on_handshake
         super().__init__(**kwargs)
 
     def _build_ctx(self) -> ssl.SSLContext:
+        # Stesse impostazioni di urllib3.util.ssl_.create_urllib3_context, tranne
+        # OP_NO_TICKET: i ticket servono proprio a riprendere le sessioni
+        ctx = _STSSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        ctx.set_ciphers(_STS_CIPHERS)
+        ctx.options |= ssl.OP_NO_COMPRESSION
+        ctx.minimum_version = ssl.TLSVersion.TLSv1_2
         if not self._ssl_verify:
             import urllib3
             urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
-            ctx = create_urllib3_context(ciphers=_STS_CIPHERS)
             ctx.check_hostname = False
             ctx.verify_mode = ssl.CERT_NONE
         else:
-            ctx = create_urllib3_context(ciphers=_STS_CIPHERS)
-            ctx.minimum_version = ssl.TLSVersion.TLSv1_2
             # Carica prima i certificati di sistema, poi eventualmente il CA bundle
             # aggiuntivo. Questo garantisce che la catena completa sia verificabile
             # anche se il bundle custom contiene solo certificati intermedi.
             ctx.set_default_verify_paths()
             if self._ca_bundle:
                 ctx.load_verify_locations(cafile=self._ca_bundle)
+        ctx.hostname_checks_common_name = False
         return ctx
 
     def init_poolmanager(self, *args, **kwargs):
-        kwargs["ssl_context"] = self._build_ctx()
+        kwargs["ssl_context"] = self._ctx
         super().init_poolmanager(*args, **kwargs)
 
     def proxy_manager_for(self, proxy, **proxy_kwargs):
-        proxy_kwargs["ssl_context"] = self._build_ctx()
+        proxy_kwargs["ssl_context"] = self._ctx
         return super().proxy_manager_for(proxy, **proxy_kwargs)
 
 
@@ -81,6 +159,8 @@ def _build_session(
     ca_bundle: str | None,
     ssl_verify: bool,
     environment: str,
+    pool_maxsize: int = DEFAULT_MAX_CONCURRENCY,
+    on_handshake=None,
 ) -> requests.Session:
     session = requests.Session()
     session.auth = HTTPBasicAuth(username, password)
@@ -97,7 +177,10 @@ def _build_session(
     if ca_bundle and not effective_ca:
         logger.warning("STS_CA_BUNDLE configurato (%s) ma file non trovato.", ca_bundle)
 
-    adapter = _STSSSLAdapter(ssl_verify=effective_verify, ca_bundle=effective_ca)
+    adapter = _STSSSLAdapter(
+        ssl_verify=effective_verify, ca_bundle=effective_ca, on_handshake=on_handshake,
+        pool_maxsize=pool_maxsize,
+    )
     session.mount("https://", adapter)
     # session.verify deve essere coerente col contesto dell'adapter:
     # requests lo passa a urllib3 che altrimenti sovrascrive il verify_mode del ctx
@@ -108,6 +191,43 @@ def _build_session(
     return session
 
 
+def _config_key() -> tuple:
+    """Valori delle variabili STS_* e data di modifica del CA bundle."""
+    ca_bundle = os.getenv("STS_CA_BUNDLE")
+    try:
+        ca_mtime = os.path.getmtime(ca_bundle) if ca_bundle else None
+    except OSError:
+        ca_mtime = None
+    return tuple(os.getenv(nome) for nome in _ENV_VARS) + (ca_mtime,)
+
+
+class EsitoSconosciuto(RuntimeError):
+    """La richiesta potrebbe essere arrivata a STS senza che la risposta sia arrivata a noi."""
+
+
+def _non_inviata(exc: requests.exceptions.RequestException) -> bool:
+    """True se la connessione non è mai stata stabilita, quindi la richiesta non è partita."""
+    if isinstance(exc, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(exc, requests.exceptions.ReadTimeout):
+        return False
+    causa = exc.args[0] if exc.args else None
+    causa = getattr(causa, "reason", causa)
+    return isinstance(causa, (NewConnectionError, ConnectTimeoutError))
+
+
+def _backoff(attempt: int, retry_after: str | None = None) -> float:
+    """Attesa prima del tentativo successivo: Retry-After se indicato, altrimenti backoff esponenziale con jitter."""
+    if retry_after and retry_after.strip().isdigit():
+        return min(float(retry_after), RETRY_BACKOFF_MAX)
+    # Full jitter: i thread respinti insieme non ritentano tutti nello stesso istante
+    return random.uniform(0, min(RETRY_BACKOFF ** attempt, RETRY_BACKOFF_MAX))
+
+
+def _percentile_ms(valori: list, p: float) -> float:
+    return round(valori[min(len(valori) - 1, int(p * len(valori)))] * 1000, 1)
+
+
 def _parse_response(xml_text: str) -> dict:
     """
     Analizza la risposta XML di STS ed estrae esito, protocollo e messaggi.
@@ -152,6 +272,7 @@ class STSClient:
 
     Le credenziali e la configurazione vengono lette dalle variabili d'ambiente:
       STS_ENVIRONMENT          test | production  (default: test)
+      STS_ENDPOINT_URL         endpoint alternativo (es. scripts/sts_stub_server.py); default da STS_ENVIRONMENT
       STS_USERNAME             username per HTTP Basic Auth
       STS_PASSWORD             password per HTTP Basic Auth
       STS_PINCODE_ENCRYPTED    pinCode già cifrato RSA (fornito da STS per test)
@@ -159,11 +280,20 @@ class STSClient:
       STS_PARTITA_IVA          P.IVA del professionista
       STS_DISPOSITIVO          numero dispositivo (default: 1)
       STS_CERTIFICATE_PATH     path PEM per cifrare il CF paziente (opzionale)
+      STS_MAX_CONCURRENCY      invii in parallelo nei batch (default: 4)
+      STS_MAX_RATE             richieste SOAP al secondo al massimo (default: 10)
+      STS_THROTTLE_CODES       codici errore STS da trattare come throttling (es. WS500,WS501)
+
+    I metodi send_* sono thread-safe: un batch li chiama da più thread sulla
+    stessa sessione HTTP, con un pool di connessioni grande quanto il parallelismo.
+    Di norma si usa il client del processo restituito da get_client(), che tiene
+    vive connessioni e sessioni TLS tra una richiesta e l'altra.
     """
 
     def __init__(self):
+        self.config_key = _config_key()
         env = os.getenv("STS_ENVIRONMENT", "test").lower()
-        self.endpoint = STS_ENDPOINTS.get(env, STS_ENDPOINTS["test"])
+        self.endpoint = os.getenv("STS_ENDPOINT_URL") or STS_ENDPOINTS.get(env, STS_ENDPOINTS["test"])
         self.debug = os.getenv("STS_DEBUG", "false").lower() in ("true", "1", "yes")
         self.username = os.getenv("STS_USERNAME", "")
         self.password = os.getenv("STS_PASSWORD", "")
@@ -175,13 +305,68 @@ class STSClient:
             "cert_path": os.getenv("STS_CERTIFICATE_PATH", None),
             "natura_iva": os.getenv("STS_NATURA_IVA", "N2.2"),
         }
+        try:
+            self.max_concurrency = max(1, int(os.getenv("STS_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)))
+        except ValueError:
+            self.max_concurrency = DEFAULT_MAX_CONCURRENCY
+        try:
+            max_rate = float(os.getenv("STS_MAX_RATE", DEFAULT_RATE_MAX))
+        except ValueError:
+            max_rate = DEFAULT_RATE_MAX
+        self.throttle_codes = {
+            codice.strip() for codice in os.getenv("STS_THROTTLE_CODES", "").split(",") if codice.strip()
+        }
+        self.limiter = AdaptiveRateLimiter(self.max_concurrency, rate_max=max_rate)
         self._ca_bundle = os.getenv("STS_CA_BUNDLE", None)
         ssl_verify_env = os.getenv("STS_SSL_VERIFY", "true").lower()
         ssl_verify = ssl_verify_env not in ("false", "0", "no")
+        self._stats_lock = threading.Lock()
+        self._latenze = deque(maxlen=LATENCY_SAMPLES)
+        self._handshake = deque(maxlen=LATENCY_SAMPLES)
+        self._contatori = {"richieste": 0, "errori_rete": 0, "handshake": 0, "handshake_ripresi": 0}
         self._session = _build_session(
-            self.username, self.password, self._ca_bundle, ssl_verify, env
+            self.username, self.password, self._ca_bundle, ssl_verify, env,
+            pool_maxsize=self.max_concurrency, on_handshake=self._registra_handshake,
         )
 
+    def _registra_handshake(self, durata: float, ripreso: bool) -> None:
+        with self._stats_lock:
+            self._contatori["handshake"] += 1
+            if ripreso:
+                self._contatori["handshake_ripresi"] += 1
+            self._handshake.append(durata)
+
+    def stats(self) -> dict:
+        """Contatori e latenze (ms) di richieste SOAP e handshake TLS di questo worker."""
+        with self._stats_lock:
+            latenze = sorted(self._latenze)
+            handshake = sorted(self._handshake)
+            result = dict(self._contatori)
+        result.update({
+            "pid": os.getpid(),
+            "endpoint": self.endpoint,
+            "max_concurrency": self.max_concurrency,
+            "campioni": len(latenze),
+            "limiter": self.limiter.stats(),
+        })
+        if latenze:
+            result.update({
+                "latenza_media_ms": round(sum(latenze) / len(latenze) * 1000, 1),
+                "latenza_p50_ms": _percentile_ms(latenze, 0.50),
+                "latenza_p95_ms": _percentile_ms(latenze, 0.95),
+                "latenza_max_ms": round(latenze[-1] * 1000, 1),
+            })
+        if handshake:
+            result.update({
+                "handshake_media_ms": round(sum(handshake) / len(handshake) * 1000, 1),
+                "handshake_p95_ms": _percentile_ms(handshake, 0.95),
+                "handshake_max_ms": round(handshake[-1] * 1000, 1),
+            })
+        return result
+
+    def close(self) -> None:
+        self._session.close()
+
     def _post_soap(self, payload: str, soap_action: str) -> requests.Response:
         headers = {
             "Content-Type": "text/xml; charset=utf-8",
@@ -190,41 +375,87 @@ class STSClient:
 
         last_exc = None
         for attempt in range(1, MAX_RETRIES + 1):
+            retry_after = None
             try:
-                resp = self._session.post(
-                    self.endpoint,
-                    data=payload.encode("utf-8"),
-                    headers=headers,
-                    timeout=30,
-                )
-                # Qualsiasi risposta HTTP (anche 5xx) = connessione riuscita, niente retry
-                return resp
-            except requests.exceptions.SSLError as exc:
-                # Errore SSL non transitorio: non ritentare
-                raise RuntimeError(f"STS SSL error: {exc}") from exc
-            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as exc:
-                last_exc = exc
-                logger.warning(
-                    "STS request error (attempt %d/%d): %s", attempt, MAX_RETRIES, exc
-                )
+                with self.limiter.permesso(timeout=DEFAULT_QUEUE_TIMEOUT_S) as esito:
+                    inizio = time.perf_counter()
+                    try:
+                        resp = self._session.post(
+                            self.endpoint,
+                            data=payload.encode("utf-8"),
+                            headers=headers,
+                            timeout=30,
+                        )
+                    except requests.exceptions.SSLError as exc:
+                        esito.congestione = True
+                        self._conta_errore()
+                        # Errore SSL non transitorio: non ritentare
+                        raise RuntimeError(f"STS SSL error: {exc}") from exc
+                    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as exc:
+                        esito.congestione = True
+                        self._conta_errore()
+                        if not _non_inviata(exc):
+                            # Timeout di lettura o connessione caduta dopo l'invio: niente reinvio
+                            raise EsitoSconosciuto(
+                                f"Esito sconosciuto: STS non ha risposto dopo l'invio ({exc}). "
+                                "Verificare su STS prima di reinviare."
+                            ) from exc
+                        last_exc = exc
+                        logger.warning(
+                            "STS request error (attempt %d/%d): %s", attempt, MAX_RETRIES, exc
+                        )
+                    else:
+                        with self._stats_lock:
+                            self._contatori["richieste"] += 1
+                            self._latenze.append(time.perf_counter() - inizio)
+                        throttled = self._throttled(resp)
+                        # Un SOAP Fault (500) è un rifiuto della richiesta, non un segnale di sovraccarico
+                        esito.congestione = resp.status_code in CONGESTION_HTTP_STATUS or throttled
+                        if resp.status_code in UNKNOWN_OUTCOME_HTTP_STATUS:
+                            raise EsitoSconosciuto(
+                                f"Esito sconosciuto: HTTP {resp.status_code} dal gateway di STS. "
+                                "Verificare su STS prima di reinviare."
+                            )
+                        retry_after = resp.headers.get("Retry-After")
+                        riprova = throttled or (resp.status_code in RETRY_HTTP_STATUS and bool(retry_after))
+                        if not riprova:
+                            return resp
+                        last_exc = f"HTTP {resp.status_code}"
+                        logger.warning(
+                            "STS sovraccarico (attempt %d/%d): %s", attempt, MAX_RETRIES, last_exc
+                        )
+            except LimiterTimeout as exc:
+                raise RuntimeError(f"STS non disponibile: {exc}") from exc
 
             if attempt < MAX_RETRIES:
-                time.sleep(min(RETRY_BACKOFF ** attempt, 3))
+                time.sleep(_backoff(attempt, retry_after))
 
         raise RuntimeError(
             f"STS non raggiungibile dopo {MAX_RETRIES} tentativi: {last_exc}"
         )
 
-    def _should_retry_errors(self, errors: list) -> bool:
-        for e in errors:
-            codice = e.get("codice", "")
-            if codice in NO_RETRY_CODES:
-                return False
-        return True
+    def _throttled(self, resp: requests.Response) -> bool:
+        """True se la risposta contiene un codice di throttling di STS (STS_THROTTLE_CODES)."""
+        if not self.throttle_codes or resp.status_code >= 500:
+            return False
+        errori = _parse_response(resp.text)["errors"]
+        return any(e.get("codice") in self.throttle_codes for e in errori if isinstance(e, dict))
+
+    def _conta_errore(self) -> None:
+        with self._stats_lock:
+            self._contatori["errori_rete"] += 1
+
+    def cifra_cf(self, cliente) -> str:
+        """CF del cliente cifrato per STS, riusando (o salvando) il cifrato sul cliente.
+
+        Scrive sull'istanza ORM: va chiamato dal thread che possiede la sessione,
+        non dai thread che inviano in parallelo.
+        """
+        return encrypt_cliente_cf(cliente, self.config.get("cert_path"))
 
-    def send_inserimento(self, fattura, cliente) -> dict:
-        """Invia una spesa sanitaria a STS."""
-        payload = build_inserimento_payload(fattura, cliente, self.config)
+    def send_inserimento(self, fattura, cliente, cf_cittadino: str | None = None) -> dict:
+        """Invia una spesa sanitaria a STS; `cf_cittadino` è il CF già cifrato (cifra_cf)."""
+        payload = build_inserimento_payload(fattura, cliente, self.config, cf_cittadino)
         logger.debug("STS inserimento payload:\n%s", payload)
 
         if self.debug:
@@ -240,6 +471,10 @@ class STSClient:
 
         try:
             resp = self._post_soap(payload, SOAP_ACTION_INSERIMENTO)
+        except EsitoSconosciuto as exc:
+            return {
+                "success": False, "protocollo": None, "errors": [str(exc)], "raw": "", "esito_sconosciuto": True,
+            }
         except RuntimeError as exc:
             return {"success": False, "protocollo": None, "errors": [str(exc)], "raw": ""}
 
@@ -247,6 +482,10 @@ class STSClient:
 
         if not result["success"]:
             for err in result["errors"]:
+                if isinstance(err, str):
+                    # Risposta non XML (es. pagina di errore di un proxy con 503 senza Retry-After)
+                    logger.warning("STS inserimento errore (HTTP %s): %s", resp.status_code, err)
+                    continue
                 logger.warning(
                     "STS inserimento errore [%s]: %s",
                     err.get("codice"), err.get("descrizione"),
@@ -280,6 +519,10 @@ class STSClient:
 
         try:
             resp = self._post_soap(payload, SOAP_ACTION_CANCELLAZIONE)
+        except EsitoSconosciuto as exc:
+            return {
+                "success": False, "protocollo": None, "errors": [str(exc)], "raw": "", "esito_sconosciuto": True,
+            }
         except RuntimeError as exc:
             return {"success": False, "protocollo": None, "errors": [str(exc)], "raw": ""}
 
@@ -287,9 +530,32 @@ class STSClient:
 
         if not result["success"]:
             for err in result["errors"]:
+                if isinstance(err, str):
+                    # Risposta non XML (es. pagina di errore di un proxy con 503 senza Retry-After)
+                    logger.warning("STS cancellazione errore (HTTP %s): %s", resp.status_code, err)
+                    continue
                 logger.warning(
                     "STS cancellazione errore [%s]: %s",
                     err.get("codice"), err.get("descrizione"),
                 )
 
         return result
+
+
+def get_client() -> STSClient:
+    """
+    Client del processo, creato al primo uso (dopo il fork dei worker gunicorn).
+
+    Viene ricreato solo se cambia la configurazione (variabili STS_* o CA bundle).
+    Il client precedente non viene chiuso: gli invii ancora in corso lo usano fino
+    alla fine, poi le sue connessioni si chiudono con la garbage collection.
+    """
+    global _client
+    chiave = _config_key()
+    client = _client
+    if client is None or client.config_key != chiave:
+        with _client_lock:
+            if _client is None or _client.config_key != chiave:
+                _client = STSClient()
+            client = _client
+    return client
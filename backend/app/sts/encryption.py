@@ -1,21 +1,29 @@
+import base64
+import hashlib
 import logging
 import os
+import threading
+
+try:
+    from cryptography import x509
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import padding
+except ImportError:  # pragma: no cover - dipendenza opzionale in sviluppo
+    x509 = None
 
 logger = logging.getLogger(__name__)
 
+# Chiave pubblica per path del certificato: (mtime, chiave, impronta SHA-256 del file)
+_chiavi = {}
+_chiavi_lock = threading.Lock()
 
-def encrypt_cf(plain_cf: str, cert_path: str | None) -> str:
-    """
-    Cifra il codice fiscale del cittadino con RSA PKCS#1 v1.5 usando il
-    certificato pubblico SanitelCF fornito da STS.
 
-    Fase iniziale (placeholder): se cert_path è None o il file non esiste,
-    restituisce il CF in chiaro con un warning. Il test STS accetta il CF
-    non cifrato.
+def _public_key(cert_path: str | None):
+    """
+    Chiave pubblica e impronta del certificato SanitelCF, lette una volta per
+    (path, mtime): il PEM viene riletto solo se il file cambia.
 
-    Fase futura: montare il certificato PEM in STS_CERTIFICATE_PATH e
-    aggiungere `cryptography>=42.0.0` a requirements.txt per abilitare
-    la cifratura reale.
+    Ritorna None (con un warning) se il certificato o `cryptography` mancano.
     """
     if not cert_path or not os.path.exists(cert_path):
         logger.warning(
@@ -24,36 +32,79 @@ def encrypt_cf(plain_cf: str, cert_path: str | None) -> str:
             "Accettabile solo in ambiente di test.",
             cert_path,
         )
-        return plain_cf
-
-    try:
-        from cryptography.hazmat.primitives import serialization, hashes
-        from cryptography.hazmat.primitives.asymmetric import padding
-        import base64
-
-        with open(cert_path, "rb") as f:
-            cert_data = f.read()
-
-        # Carica come certificato X.509 o chiave pubblica PEM
-        try:
-            from cryptography import x509
-            cert = x509.load_pem_x509_certificate(cert_data)
-            public_key = cert.public_key()
-        except Exception:
-            public_key = serialization.load_pem_public_key(cert_data)
-
-        encrypted = public_key.encrypt(
-            plain_cf.encode("utf-8"),
-            padding.PKCS1v15(),
-        )
-        return base64.b64encode(encrypted).decode("utf-8")
-
-    except ImportError:
+        return None
+    if x509 is None:
         logger.warning(
             "Libreria `cryptography` non installata. "
             "Il codice fiscale verrà inviato in chiaro."
         )
-        return plain_cf
+        return None
+
+    mtime = os.path.getmtime(cert_path)
+    voce = _chiavi.get(cert_path)
+    if voce is not None and voce[0] == mtime:
+        return voce[1], voce[2]
+
+    with _chiavi_lock:
+        voce = _chiavi.get(cert_path)
+        if voce is None or voce[0] != mtime:
+            with open(cert_path, "rb") as f:
+                cert_data = f.read()
+            # Carica come certificato X.509 o chiave pubblica PEM
+            try:
+                public_key = x509.load_pem_x509_certificate(cert_data).public_key()
+            except ValueError:
+                public_key = serialization.load_pem_public_key(cert_data)
+            voce = (mtime, public_key, hashlib.sha256(cert_data).hexdigest())
+            _chiavi[cert_path] = voce
+    return voce[1], voce[2]
+
+
+def _encrypt(public_key, plain_cf: str) -> str:
+    encrypted = public_key.encrypt(plain_cf.encode("utf-8"), padding.PKCS1v15())
+    return base64.b64encode(encrypted).decode("utf-8")
+
+
+def encrypt_cf(plain_cf: str, cert_path: str | None) -> str:
+    """
+    Cifra il codice fiscale del cittadino con RSA PKCS#1 v1.5 usando il
+    certificato pubblico SanitelCF fornito da STS.
+
+    Se cert_path è None o il file non esiste, restituisce il CF in chiaro con
+    un warning: il test STS accetta il CF non cifrato.
+    """
+    try:
+        chiave = _public_key(cert_path)
+        if chiave is None:
+            return plain_cf
+        return _encrypt(chiave[0], plain_cf)
     except Exception as exc:
         logger.error("Errore durante la cifratura del CF: %s", exc)
         return plain_cf
+
+
+def encrypt_cliente_cf(cliente, cert_path: str | None) -> str:
+    """
+    Come encrypt_cf, ma riusa il CF cifrato salvato sul cliente.
+
+    Il cifrato (`codice_fiscale_cifrato`) vale finché non cambiano il codice
+    fiscale (il modello lo azzera) o il certificato (`codice_fiscale_cifrato_cert`
+    ne conserva l'impronta); altrimenti viene ricalcolato e salvato sul cliente,
+    che il chiamante conferma col proprio commit. PKCS#1 v1.5 è randomizzato, ma
+    STS accetta qualunque cifrato valido dello stesso CF.
+    """
+    try:
+        chiave = _public_key(cert_path)
+        if chiave is None:
+            return cliente.codice_fiscale
+        public_key, impronta = chiave
+        cifrato = getattr(cliente, "codice_fiscale_cifrato", None)
+        if cifrato and getattr(cliente, "codice_fiscale_cifrato_cert", None) == impronta:
+            return cifrato
+        cifrato = _encrypt(public_key, cliente.codice_fiscale)
+    except Exception as exc:
+        logger.error("Errore durante la cifratura del CF: %s", exc)
+        return cliente.codice_fiscale
+    cliente.codice_fiscale_cifrato = cifrato
+    cliente.codice_fiscale_cifrato_cert = impronta
+    return cifrato
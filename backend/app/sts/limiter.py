@@ -0,0 +1,121 @@
+"""Limitatore adattivo degli invii STS: token bucket + finestra AIMD.
+
+Un'istanza per STSClient, quindi una per processo (get_client()): tutti gli
+invii del worker gunicorn, richieste singole e thread della coda, passano di
+qui. Ogni richiesta SOAP deve ottenere un token (al più `rate` richieste al
+secondo, con raffiche fino a `finestra_max`) e un posto nella finestra delle
+richieste in volo.
+
+Rate e finestra seguono l'AIMD: ogni risposta regolare li fa crescere di poco
+(additive increase) fino ai massimi configurati; un segnale di congestione
+(timeout, errore di connessione o SSL, 429/502/503/504 o codice di throttling
+di STS) li dimezza (multiplicative decrease). Le congestioni ravvicinate contano come una
+sola, così una raffica di timeout dello stesso gruppo di invii non azzera il
+rate. I grandi batch vanno veloci quanto STS regge e rallentano da soli appena
+il servizio soffre, invece di moltiplicare i tentativi.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_RATE_MAX = 10.0
+DEFAULT_RATE_MIN = 0.2
+RIDUZIONE_INTERVALLO_S = 1.0
+
+
+class LimiterTimeout(Exception):
+    """Nessun permesso di invio entro il tempo massimo di attesa."""
+
+
+class _Esito:
+    congestione = False
+
+
+class AdaptiveRateLimiter:
+    def __init__(self, finestra_max, rate_max=DEFAULT_RATE_MAX, rate_min=DEFAULT_RATE_MIN,
+                 clock=time.monotonic):
+        self.finestra_max = max(1, int(finestra_max))
+        self.rate_max = max(rate_min, float(rate_max))
+        self.rate_min = rate_min
+        self._clock = clock
+        self._cond = threading.Condition()
+        # Si parte dai massimi: la prima congestione li riporta a quello che STS regge
+        self.rate = self.rate_max
+        self.finestra = float(self.finestra_max)
+        self._token = float(self.finestra_max)
+        self._aggiornato = clock()
+        self._ultima_riduzione = None
+        self.in_volo = 0
+        self.in_attesa = 0
+        self._contatori = {'successi': 0, 'congestioni': 0, 'riduzioni': 0}
+
+    def _ricarica(self):
+        adesso = self._clock()
+        self._token = min(float(self.finestra_max), self._token + (adesso - self._aggiornato) * self.rate)
+        self._aggiornato = adesso
+
+    def acquire(self, timeout=None):
+        """Attende un token e un posto nella finestra; LimiterTimeout oltre `timeout` secondi."""
+        scadenza = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self.in_attesa += 1
+            try:
+                while True:
+                    self._ricarica()
+                    if self.in_volo < int(self.finestra) and self._token >= 1:
+                        self._token -= 1
+                        self.in_volo += 1
+                        return
+                    # Senza token si attende la ricarica; con la finestra piena un rilascio
+                    attesa = (1 - self._token) / self.rate if self._token < 1 else None
+                    if scadenza is not None:
+                        rimanente = scadenza - time.monotonic()
+                        if rimanente <= 0:
+                            raise LimiterTimeout("Troppi invii STS in attesa")
+                        attesa = rimanente if attesa is None else min(attesa, rimanente)
+                    self._cond.wait(attesa)
+            finally:
+                self.in_attesa -= 1
+
+    def release(self, congestione=False):
+        with self._cond:
+            self.in_volo -= 1
+            if congestione:
+                self._riduci()
+            else:
+                self._contatori['successi'] += 1
+                self.finestra = min(float(self.finestra_max), self.finestra + 1 / self.finestra)
+                self.rate = min(self.rate_max, self.rate + 1 / self.rate)
+            self._cond.notify_all()
+
+    def _riduci(self):
+        self._contatori['congestioni'] += 1
+        adesso = self._clock()
+        if self._ultima_riduzione is not None and adesso - self._ultima_riduzione < RIDUZIONE_INTERVALLO_S:
+            return
+        self._ultima_riduzione = adesso
+        self._contatori['riduzioni'] += 1
+        self.finestra = max(1.0, self.finestra / 2)
+        self.rate = max(self.rate_min, self.rate / 2)
+
+    @contextmanager
+    def permesso(self, timeout=None):
+        """Blocco `with` per una richiesta: chi lo usa imposta `congestione` sull'esito."""
+        self.acquire(timeout)
+        esito = _Esito()
+        try:
+            yield esito
+        finally:
+            self.release(esito.congestione)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'rate': round(self.rate, 2),
+                'rate_max': self.rate_max,
+                'finestra': round(self.finestra, 2),
+                'finestra_max': self.finestra_max,
+                'in_volo': self.in_volo,
+                'in_attesa': self.in_attesa,
+                **self._contatori,
+            }
@@ -1,5 +1,5 @@
 import xml.sax.saxutils as saxutils
-from app.sts.encryption import encrypt_cf
+from app.sts.encryption import encrypt_cliente_cf
 
 _NS = "http://documentospesap730.sanita.finanze.it"
 
@@ -8,10 +8,13 @@ def _esc(value: str) -> str:
     return saxutils.escape(str(value))
 
 
-def build_inserimento_payload(fattura, cliente, config: dict) -> str:
+def build_inserimento_payload(fattura, cliente, config: dict, cf_cittadino: str | None = None) -> str:
     """
     Costruisce l'envelope SOAP per l'operazione Inserimento.
 
+    `cf_cittadino` è il CF già cifrato (STSClient.cifra_cf); se manca viene
+    cifrato qui, salvando il cifrato sul cliente.
+
     Struttura conforme a DocumentoSpesa730pSchema.xsd:
       inserimentoDocumentoSpesaRequest
         pincode
@@ -46,7 +49,7 @@ def build_inserimento_payload(fattura, cliente, config: dict) -> str:
     # cfCittadino: non emettere il tag se flagOpposizione=1 (PDF pag.15)
     cf_cittadino_xml = ""
     if flag_opposizione != "1":
-        cf_cifrato = _esc(encrypt_cf(cliente.codice_fiscale, config.get("cert_path")))
+        cf_cifrato = _esc(cf_cittadino or encrypt_cliente_cf(cliente, config.get("cert_path")))
         cf_cittadino_xml = f"\n        <doc:cfCittadino>{cf_cifrato}</doc:cfCittadino>"
 
     return f"""<?xml version="1.0" encoding="UTF-8"?>
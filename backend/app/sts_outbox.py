@@ -0,0 +1,284 @@
+"""Coda persistente degli invii STS (tabella `sts_outbox`).
+
+`POST /sts/invoices/send-batch` non invia più nella richiesta: registra una
+riga per fattura nella stessa transazione che sceglie le fatture e risponde
+subito (202) con l'id del batch. Un thread per processo gunicorn svuota la
+coda: prende in carico al più STS_MAX_CONCURRENCY righe alla volta
+(`SELECT ... FOR UPDATE SKIP LOCKED` su Postgres, così più worker non si
+contendono le stesse righe), le invia in parallelo e salva esiti e stato delle
+fatture con un solo commit. `GET /api/sts/batches/<id>` riporta l'avanzamento.
+
+Stati di una riga: `pending` -> `in_progress` -> `sent` | `failed`. Gli errori
+di trasporto prima dell'invio (STS non raggiungibile) rimettono la riga in
+`pending` fino a STS_OUTBOX_MAX_ATTEMPTS tentativi; un rifiuto di STS (errore
+con codice) o un errore locale la chiudono subito in `failed`. Un esito
+sconosciuto (timeout dopo l'invio, 502/504 dal gateway: STS potrebbe aver
+registrato la spesa) chiude la riga in `failed` da verificare, senza reinvio.
+
+Ripresa dopo un riavvio: le righe `pending` vengono semplicemente riprese. Una
+riga rimasta `in_progress` oltre STS_OUTBOX_LEASE secondi apparteneva a un
+worker morto durante l'invio: STS potrebbe averla registrata senza che il
+protocollo sia stato salvato, quindi non viene reinviata alla cieca ma chiusa
+in `failed` con l'indicazione di verificarla su STS. Prendere in carico poche
+righe alla volta limita le righe che possono finire in questo stato.
+"""
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from app.models import db, StsOutbox, Fattura, Cliente
+from app.timezone import now_local
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+IN_PROGRESS = 'in_progress'
+SENT = 'sent'
+FAILED = 'failed'
+ATTIVI = (PENDING, IN_PROGRESS)
+
+INSERIMENTO = 'inserimento'
+CANCELLAZIONE = 'cancellazione'
+
+DEFAULT_MAX_ATTEMPTS = 3
+DEFAULT_LEASE_S = 600
+DEFAULT_POLL_S = 5
+
+ESITO_SCONOSCIUTO = ("Esito sconosciuto: il worker si è interrotto durante l'invio. "
+                     "Verificare su STS prima di reinviare.")
+
+_worker = None
+_worker_lock = threading.Lock()
+_wake = threading.Event()
+
+
+def _env_int(nome, default):
+    try:
+        return max(1, int(os.getenv(nome, default)))
+    except ValueError:
+        return default
+
+
+def enqueue(operazione, fattura_ids, forza=False):
+    """Accoda `operazione` per le fatture indicate, saltando quelle già in coda.
+
+    Le righe vanno nella transazione corrente, che viene poi confermata: il chiamante
+    può leggere le fatture nella stessa transazione. Con `forza` le fatture già
+    inviate vengono reinviate. Ritorna (batch_id, righe accodate); batch_id è None
+    se non c'era niente da accodare.
+    """
+    attive = {
+        fattura_id for (fattura_id,) in db.session.query(StsOutbox.fattura_id).filter(
+            StsOutbox.fattura_id.in_(fattura_ids), StsOutbox.stato.in_(ATTIVI))
+    }
+    da_accodare = [fattura_id for fattura_id in dict.fromkeys(fattura_ids) if fattura_id not in attive]
+    if not da_accodare:
+        db.session.commit()
+        return None, 0
+
+    batch_id = uuid.uuid4().hex
+    db.session.add_all([StsOutbox(batch_id=batch_id, fattura_id=fattura_id, operazione=operazione,
+                                  stato=PENDING, forza=forza)
+                        for fattura_id in da_accodare])
+    db.session.commit()
+    _wake.set()
+    return batch_id, len(da_accodare)
+
+
+def batch_progress(batch_id):
+    """Conteggi per stato e dettaglio delle righe di un batch, None se il batch non esiste."""
+    recover_stale()
+    righe = StsOutbox.query.filter_by(batch_id=batch_id).order_by(StsOutbox.id).all()
+    if not righe:
+        return None
+    conteggi = {stato: 0 for stato in (PENDING, IN_PROGRESS, SENT, FAILED)}
+    for riga in righe:
+        conteggi[riga.stato] += 1
+    return {
+        'batch_id': batch_id,
+        'operazione': righe[0].operazione,
+        'total': len(righe),
+        **conteggi,
+        'done': conteggi[PENDING] + conteggi[IN_PROGRESS] == 0,
+        'results': [{
+            'fattura_id': riga.fattura_id,
+            'stato': riga.stato,
+            'tentativi': riga.tentativi,
+            'protocollo': riga.protocollo,
+            'error': riga.ultimo_errore,
+        } for riga in righe],
+    }
+
+
+def recover_stale():
+    """Chiude in `failed` le righe `in_progress` di un worker che non c'è più, senza reinviarle."""
+    limite = now_local() - timedelta(seconds=_env_int('STS_OUTBOX_LEASE', DEFAULT_LEASE_S))
+    scadute = StsOutbox.query.filter(StsOutbox.stato == IN_PROGRESS, StsOutbox.updated_at < limite).update(
+        {'stato': FAILED, 'ultimo_errore': ESITO_SCONOSCIUTO, 'updated_at': now_local()},
+        synchronize_session=False,
+    )
+    db.session.commit()
+    if scadute:
+        logger.warning("%d invii STS rimasti in corso da un worker interrotto: da verificare su STS", scadute)
+    return scadute
+
+
+def _claim(limite):
+    """Prende in carico fino a `limite` righe `pending`, con commit prima di qualunque invio."""
+    ids = db.session.execute(
+        db.select(StsOutbox.id).where(StsOutbox.stato == PENDING).order_by(StsOutbox.id)
+        .limit(limite).with_for_update(skip_locked=True)
+    ).scalars().all()
+    if ids:
+        StsOutbox.query.filter(StsOutbox.id.in_(ids)).update(
+            {'stato': IN_PROGRESS, 'tentativi': StsOutbox.tentativi + 1, 'updated_at': now_local()},
+            synchronize_session=False,
+        )
+    db.session.commit()
+    return ids
+
+
+def _verifica(riga, fattura, cliente):
+    """Stesse condizioni degli endpoint singoli, rilette al momento dell'invio."""
+    if fattura is None:
+        return "Fattura non trovata"
+    if cliente is None:
+        return "Cliente non trovato"
+    if riga.operazione == INSERIMENTO:
+        if fattura.inviata_sts and not riga.forza:
+            return "Fattura già inviata a STS. Usa ?force=true per reinviare."
+        if not fattura.data_pagamento:
+            return "data_pagamento obbligatoria per l'invio a STS."
+    elif not (fattura.inviata_sts and fattura.protocollo_sts):
+        return "Fattura non risulta inviata a STS con un protocollo"
+    return None
+
+
+def _errore_di_trasporto(result):
+    # STSClient riporta come stringa gli errori di rete, come dict con codice quelli di STS
+    return bool(result['errors']) and all(isinstance(e, str) for e in result['errors'])
+
+
+def _messaggio(errors):
+    return '; '.join(e if isinstance(e, str) else f"[{e.get('codice')}] {e.get('descrizione')}" for e in errors)
+
+
+def process_pending(client):
+    """Invia un gruppo di righe in coda e ne salva gli esiti. Ritorna quante righe ha elaborato."""
+    recover_stale()
+    ids = _claim(client.max_concurrency)
+    if not ids:
+        return 0
+
+    righe = (db.session.query(StsOutbox, Fattura, Cliente)
+             .outerjoin(Fattura, Fattura.id == StsOutbox.fattura_id)
+             .outerjoin(Cliente, Cliente.id == Fattura.cliente_id)
+             .filter(StsOutbox.id.in_(ids)).order_by(StsOutbox.id).all())
+
+    # CF cifrati calcolati qui, una volta per cliente: encrypt_cliente_cf salva il
+    # cifrato sul Cliente, e la sessione non va toccata dai thread di invio
+    cf_cifrati = {}
+    for outbox, fattura, cliente in righe:
+        if (outbox.operazione == INSERIMENTO and cliente is not None and not cliente.flag_opposizione
+                and cliente.id not in cf_cifrati and _verifica(outbox, fattura, cliente) is None):
+            cf_cifrati[cliente.id] = client.cifra_cf(cliente)
+
+    def invia(riga):
+        outbox, fattura, cliente = riga
+        errore = _verifica(outbox, fattura, cliente)
+        if errore:
+            return {'success': False, 'protocollo': None, 'errors': [], 'locale': errore}, None
+        try:
+            if outbox.operazione == INSERIMENTO:
+                result = client.send_inserimento(fattura, cliente, cf_cittadino=cf_cifrati.get(cliente.id))
+            else:
+                result = client.send_cancellazione(fattura, cliente)
+        except Exception as exc:  # un errore locale (es. payload) non deve fermare gli altri invii
+            logger.exception("Errore durante l'invio STS della fattura %d", fattura.id)
+            return {'success': False, 'protocollo': None, 'errors': [], 'locale': str(exc)}, None
+        return result, datetime.utcnow()
+
+    with ThreadPoolExecutor(max_workers=min(client.max_concurrency, len(righe))) as pool:
+        esiti = list(pool.map(invia, righe))
+
+    max_tentativi = _env_int('STS_OUTBOX_MAX_ATTEMPTS', DEFAULT_MAX_ATTEMPTS)
+    protocolli = {}
+    for (outbox, fattura, _), (result, inviata_il) in zip(righe, esiti):
+        outbox.updated_at = now_local()
+        if result['success']:
+            outbox.stato = SENT
+            outbox.ultimo_errore = None
+            outbox.protocollo = result.get('protocollo')
+            if result.get('debug_mode'):
+                continue
+            if outbox.operazione == INSERIMENTO:
+                fattura.inviata_sts = True
+                fattura.protocollo_sts = outbox.protocollo
+                fattura.data_invio_sts = inviata_il
+            else:
+                fattura.inviata_sts = False
+                fattura.protocollo_sts = None
+                fattura.data_invio_sts = None
+            protocolli[fattura.id] = outbox.protocollo
+        elif 'locale' in result:
+            outbox.stato = FAILED
+            outbox.ultimo_errore = result['locale']
+        else:
+            riprova = (_errore_di_trasporto(result) and not result.get('esito_sconosciuto')
+                       and outbox.tentativi < max_tentativi)
+            outbox.stato = PENDING if riprova else FAILED
+            outbox.ultimo_errore = _messaggio(result['errors'])
+
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        # Gli invii sono già avvenuti: le righe restano in_progress e alla scadenza
+        # finiscono in failed da verificare; i protocolli vanno nel log per la riconciliazione
+        logger.exception("Salvataggio esiti STS fallito; protocolli ricevuti: %s", protocolli)
+        raise
+    return len(righe)
+
+
+def drain(client):
+    """Svuota la coda nel thread corrente. Ritorna il numero di righe elaborate."""
+    totale = 0
+    while True:
+        elaborate = process_pending(client)
+        if not elaborate:
+            return totale
+        totale += elaborate
+
+
+def _run_worker(app):
+    poll = _env_int('STS_OUTBOX_POLL', DEFAULT_POLL_S)
+    while True:
+        elaborate = 0
+        try:
+            with app.app_context():
+                if os.getenv('STS_USERNAME'):
+                    from app.sts.client import get_client
+                    elaborate = drain(get_client())
+        except Exception:
+            logger.exception("Errore nel worker della coda STS")
+        if not elaborate:
+            _wake.wait(poll)
+            _wake.clear()
+
+
+def start_worker(app):
+    """Avvia il thread che svuota la coda, una volta per processo.
+
+    Va chiamato dopo il fork dei worker gunicorn (alla prima richiesta): i thread
+    non sopravvivono al fork.
+    """
+    global _worker
+    if _worker is not None:
+        return
+    with _worker_lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_run_worker, args=(app,), name='sts-outbox', daemon=True)
+            _worker.start()
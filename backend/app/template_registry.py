@@ -0,0 +1,118 @@
+"""Registry dei template DOCX: parse una volta per worker, clone per ogni render.
+
+`DocxTemplate(path)` a ogni richiesta riapre lo ZIP, riparsa tutto l'XML del
+documento, riapplica le regex di preprocessing di docxtpl e ricompila il
+sorgente Jinja del corpo: lavoro identico per ogni fattura. Qui ogni template
+viene caricato una volta per processo e il render parte da:
+
+- una copia profonda del documento già parsato (più economica del parse, e
+  indipendente: render concorrenti nello stesso worker non si pestano i piedi);
+- l'XML del corpo già preprocessato;
+- un ambiente Jinja che memorizza i template compilati per sorgente.
+
+A ogni richiesta si confrontano mtime e dimensione del file (una `stat`):
+se il template custom montato in `custom_template/` viene sostituito, la voce
+è ricaricata al primo render successivo, senza riavviare il container.
+"""
+import copy
+import io
+import os
+import threading
+
+from docx import Document
+from docxtpl import DocxTemplate
+from jinja2 import Environment
+
+
+class _CachingEnvironment(Environment):
+    """Ambiente Jinja che compila ogni sorgente una sola volta."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._compilati = {}
+        self._compilati_lock = threading.Lock()
+
+    def from_string(self, source, globals=None, template_class=None):
+        if globals is not None or template_class is not None:
+            return super().from_string(source, globals, template_class)
+        template = self._compilati.get(source)
+        if template is None:
+            template = super().from_string(source)
+            with self._compilati_lock:
+                self._compilati.setdefault(source, template)
+        return template
+
+
+class _TemplateEntry:
+    """Template parsato una volta: documento base, corpo preprocessato, cache Jinja."""
+
+    def __init__(self, path, mtime_ns, size, data):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.size = size
+        self.docx = Document(io.BytesIO(data))
+        self.env = _CachingEnvironment()
+        self._patched = {}
+        parser = DocxTemplate(io.BytesIO(data))
+        parser.docx = self.docx
+        self._parser = parser
+        self.body_xml = self.patch(parser.get_xml())
+
+    def patch(self, src_xml):
+        """patch_xml di docxtpl (solo regex, deterministico) memorizzato per sorgente."""
+        patched = self._patched.get(src_xml)
+        if patched is None:
+            patched = self._parser.patch_xml(src_xml)
+            self._patched[src_xml] = patched
+        return patched
+
+
+class PreparedTemplate(DocxTemplate):
+    """DocxTemplate che renderizza su un clone del documento in cache nel registry."""
+
+    def __init__(self, entry):
+        super().__init__(entry.path)
+        self._entry = entry
+
+    def init_docx(self, reload=True):
+        if not self.docx or (self.is_rendered and reload):
+            self.docx = copy.deepcopy(self._entry.docx)
+            self.is_rendered = False
+
+    def patch_xml(self, src_xml):
+        return self._entry.patch(src_xml)
+
+    def build_xml(self, context, jinja_env=None):
+        return self.render_xml_part(self._entry.body_xml, self.docx._part, context, jinja_env)
+
+    def render(self, context, jinja_env=None, autoescape=False):
+        # L'ambiente condiviso non va toccato: con autoescape docxtpl lo modifica
+        if jinja_env is None and not autoescape:
+            jinja_env = self._entry.env
+        super().render(context, jinja_env, autoescape)
+
+
+_entries = {}
+_lock = threading.Lock()
+
+
+def get_template(template_path):
+    """DocxTemplate pronto per un render, ricaricato se il file è cambiato su disco."""
+    path = os.path.abspath(template_path)
+    st = os.stat(path)
+    entry = _entries.get(path)
+    if entry is None or (entry.mtime_ns, entry.size) != (st.st_mtime_ns, st.st_size):
+        with _lock:
+            entry = _entries.get(path)
+            if entry is None or (entry.mtime_ns, entry.size) != (st.st_mtime_ns, st.st_size):
+                with open(path, 'rb') as f:
+                    data = f.read()
+                entry = _TemplateEntry(path, st.st_mtime_ns, st.st_size, data)
+                _entries[path] = entry
+    return PreparedTemplate(entry)
+
+
+def clear():
+    """Svuota il registry (test)."""
+    with _lock:
+        _entries.clear()
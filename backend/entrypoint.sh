@@ -35,5 +35,17 @@ python -m alembic upgrade head
 echo "Alembic migrations completed."
 
 # Start the application
-echo "Starting application with Gunicorn..."
-exec gunicorn -b 0.0.0.0:8000 "app.main:app"
\ No newline at end of file
+# Worker gthread: ogni processo serve più richieste in parallelo con i suoi
+# thread, così una conversione Gotenberg lenta non blocca l'intera API (health
+# check compreso). I job di render (app/jobs.py) girano nei thread dello
+# stesso processo, separati da quelli delle richieste.
+GUNICORN_WORKERS="${GUNICORN_WORKERS:-2}"
+GUNICORN_THREADS="${GUNICORN_THREADS:-4}"
+GUNICORN_TIMEOUT="${GUNICORN_TIMEOUT:-120}"
+echo "Starting application with Gunicorn (gthread, workers=$GUNICORN_WORKERS, threads=$GUNICORN_THREADS)..."
+exec gunicorn -b 0.0.0.0:8000 \
+    --worker-class gthread \
+    --workers "$GUNICORN_WORKERS" \
+    --threads "$GUNICORN_THREADS" \
+    --timeout "$GUNICORN_TIMEOUT" \
+    "app.main:app"
\ No newline at end of file
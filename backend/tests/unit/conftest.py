@@ -0,0 +1,130 @@
+"""Fixture condivise per i test che usano il DB.
+
+La maggior parte degli unit test è pura e non tocca il DB. I pochi test che
+devono verificare query reali usano `db_app`: un'app Flask minimale su SQLite
+in memoria (niente container, niente rete), con i blueprint registrati come in
+app/main.py. Se le dipendenze del backend non sono installate il test viene
+saltato, così `make test-unit` resta eseguibile con il solo pytest.
+
+`any_db_app` gira anche su un Postgres reale quando TEST_DATABASE_URL punta a
+un database usa e getta (le tabelle vengono ricreate e poi eliminate): serve
+ai test che dipendono dal planner, come quelli sugli indici.
+"""
+import os
+
+import pytest
+
+
+def _test_app(database_uri):
+    pytest.importorskip("flask_sqlalchemy")
+    pytest.importorskip("docxtpl")
+    pytest.importorskip("codicefiscale")
+    from flask import Flask
+
+    from app import aggregates
+    from app.models import db
+    from app.api.clienti_api import clients_bp
+    from app.api.fatture_api import invoices_bp
+    from app.api.costi_api import costi_bp
+    from app.api.sts_api import sts_bp
+    from app.api.jobs_api import jobs_bp
+    from app.api.pnl_api import pnl_bp
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    db.init_app(app)
+    aggregates.register(db.session)
+    app.register_blueprint(clients_bp, url_prefix='/api')
+    app.register_blueprint(invoices_bp, url_prefix='/api')
+    app.register_blueprint(costi_bp, url_prefix='/api')
+    app.register_blueprint(sts_bp, url_prefix='/api')
+    app.register_blueprint(jobs_bp, url_prefix='/api')
+    app.register_blueprint(pnl_bp, url_prefix='/api')
+
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def db_app():
+    yield from _test_app('sqlite://')
+
+
+@pytest.fixture(params=['sqlite', 'postgresql'])
+def any_db_app(request):
+    """Come db_app, e in più su Postgres se TEST_DATABASE_URL punta a un DB usa e getta (make test-db)."""
+    if request.param == 'sqlite':
+        yield from _test_app('sqlite://')
+        return
+    url = os.getenv('TEST_DATABASE_URL')
+    if not url:
+        pytest.skip("TEST_DATABASE_URL non impostato")
+    pytest.importorskip("psycopg2")
+    yield from _test_app(url)
+
+
+@pytest.fixture
+def count_queries(request):
+    """Ritorna una funzione che esegue `fn` e conta le istruzioni SQL emesse (sull'app del test)."""
+    from sqlalchemy import event
+
+    # Con any_db_app conta sul suo engine, invece di aprire una seconda app SQLite
+    request.getfixturevalue('any_db_app' if 'any_db_app' in request.fixturenames else 'db_app')
+
+    from app.models import db
+
+    def _count(fn):
+        statements = []
+
+        def _before_execute(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        engine = db.engine
+        event.listen(engine, 'before_cursor_execute', _before_execute)
+        try:
+            result = fn()
+        finally:
+            event.remove(engine, 'before_cursor_execute', _before_execute)
+        return len(statements), result
+
+    return _count
+
+
+class _RispostaInStreaming:
+    """Adatta una risposta finta con `content` all'uso in streaming del client Gotenberg."""
+
+    def __init__(self, risposta):
+        self._risposta = risposta
+
+    def raise_for_status(self):
+        self._risposta.raise_for_status()
+
+    def iter_content(self, chunk_size):
+        yield self._risposta.content
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def fake_gotenberg(monkeypatch):
+    """Installa come client Gotenberg del processo uno la cui sessione HTTP è `post(url, files, timeout)`.
+
+    `post` restituisce un oggetto con `content` e `raise_for_status()`.
+    """
+    from types import SimpleNamespace
+
+    from app import gotenberg
+
+    def _install(post, **kwargs):
+        session = SimpleNamespace(
+            post=lambda url, files, timeout, stream: _RispostaInStreaming(post(url, files, timeout)))
+        client = gotenberg.GotenbergClient('http://gotenberg', session=session, **kwargs)
+        monkeypatch.setattr(gotenberg, '_client', client)
+        return client
+
+    return _install
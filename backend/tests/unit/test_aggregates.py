@@ -0,0 +1,178 @@
+"""Test per le tabelle di riepilogo delle statistiche (app/aggregates.py)."""
+import datetime
+
+
+def _clienti():
+    from app.models import db, Cliente
+
+    mario = Cliente(nome="Mario", cognome="Rossi", codice_fiscale="RSSMRA85M01H501Z")
+    anna = Cliente(nome="Anna", cognome="Bianchi", codice_fiscale="BNCNNA90A41H501X")
+    db.session.add_all([mario, anna])
+    db.session.commit()
+    return mario.id, anna.id
+
+
+def _fattura(progressivo, cliente_id, data, totale):
+    from app.models import Fattura
+
+    return Fattura(anno=data.year, progressivo=progressivo, data_fattura=data, cliente_id=cliente_id,
+                   numero_sedute=1, importo_prestazione=totale, totale=totale, metodo_pagamento='Contanti',
+                   descrizione='n. 1 di Seduta di consulenza psicologica')
+
+
+def _righe(modello):
+    from app.models import db
+
+    return sorted(tuple(getattr(r, c.name) for c in modello.__table__.columns) for r in db.session.query(modello))
+
+
+def test_insert_update_delete_aggiornano_le_tabelle(db_app):
+    from app import aggregates
+    from app.models import db, Fattura, FatturaStatsMese, FatturaStatsCliente
+
+    mario, anna = _clienti()
+    db.session.add_all([
+        _fattura(1, mario, datetime.date(2025, 1, 15), 60.0),
+        _fattura(2, mario, datetime.date(2025, 1, 31), 120.0),
+        _fattura(3, anna, datetime.date(2025, 3, 3), 80.5),
+    ])
+    db.session.commit()
+    assert _righe(FatturaStatsMese) == [(2025, 1, 2, 180.0), (2025, 3, 1, 80.5)]
+    assert _righe(FatturaStatsCliente) == [(2025, mario, 2, 180.0), (2025, anna, 1, 80.5)]
+
+    # Cambio di data, cliente e importo: la fattura si sposta da una chiave all'altra
+    fattura = db.session.query(Fattura).filter_by(progressivo=3).one()
+    fattura.data_fattura = datetime.date(2025, 1, 20)
+    fattura.cliente_id = mario
+    fattura.totale = 70.0
+    db.session.commit()
+    assert _righe(FatturaStatsMese) == [(2025, 1, 3, 250.0)]
+    assert _righe(FatturaStatsCliente) == [(2025, mario, 3, 250.0)]
+
+    # Campi che non entrano nelle statistiche: nessuna scrittura sulle tabelle di riepilogo
+    fattura.inviata_sts = True
+    db.session.commit()
+    assert _righe(FatturaStatsMese) == [(2025, 1, 3, 250.0)]
+
+    db.session.delete(fattura)
+    db.session.commit()
+    assert _righe(FatturaStatsMese) == [(2025, 1, 2, 180.0)]
+    assert aggregates.check() == []
+
+
+def test_rollback_annulla_anche_i_delta(db_app):
+    from app.models import db, FatturaStatsMese
+
+    mario, _ = _clienti()
+    db.session.add(_fattura(1, mario, datetime.date(2025, 1, 15), 60.0))
+    db.session.flush()
+    assert _righe(FatturaStatsMese) == [(2025, 1, 1, 60.0)]
+    db.session.rollback()
+    assert _righe(FatturaStatsMese) == []
+
+
+def test_bulk_aggiorna_le_tabelle(db_app):
+    from app import aggregates
+    from app.models import FatturaStatsCliente
+    from app.timezone import now_local
+
+    mario, _ = _clienti()
+    payload = {"data_fattura": "2025-02-10", "cliente_id": mario, "numero_sedute": 1}
+    resp = db_app.test_client().post('/api/invoices/bulk', json=[payload, payload])
+
+    assert resp.status_code == 201
+    anno = now_local().year
+    assert [(r[0], r[1], r[2]) for r in _righe(FatturaStatsCliente)] == [(anno, mario, 2)]
+    assert aggregates.check() == []
+
+
+def test_costi_ricorrenti_aggiornano_le_tabelle(db_app):
+    from app import aggregates
+    from app.models import db, CostoRicorrente
+    from app.recurring import generate_recurring_costs
+
+    db.session.add(CostoRicorrente(descrizione="Affitto", totale=500.0, frequenza='mensile', giorno_scadenza=5,
+                                   data_inizio=datetime.date(2024, 1, 1)))
+    db.session.commit()
+
+    assert generate_recurring_costs(datetime.date(2024, 12, 31)) == 12
+    assert aggregates.check() == []
+
+
+def test_insert_core_senza_record_blocca_il_commit(db_app):
+    import pytest
+    from sqlalchemy import insert
+
+    from app import aggregates
+    from app.models import db, Fattura
+
+    mario, _ = _clienti()
+    riga = {'anno': 2025, 'progressivo': 1, 'data_fattura': datetime.date(2025, 1, 15), 'cliente_id': mario,
+            'numero_sedute': 1, 'importo_prestazione': 60.0, 'totale': 60.0, 'metodo_pagamento': 'Contanti',
+            'descrizione': 'n. 1 di Seduta di consulenza psicologica'}
+    db.session.execute(insert(Fattura), [riga])
+    with pytest.raises(RuntimeError, match='record_invoices'):
+        db.session.commit()
+    db.session.rollback()
+    assert Fattura.query.count() == 0
+
+    # Con record_invoices nella stessa transazione il commit passa e le tabelle restano allineate
+    aggregates.register(db.session)  # idempotente: nessun listener doppio
+    db.session.execute(insert(Fattura), [riga])
+    aggregates.record_invoices([riga])
+    db.session.commit()
+    assert aggregates.check() == []
+
+
+def test_costi_e_statistiche_dalle_tabelle(db_app, count_queries):
+    from app import aggregates
+
+    client = db_app.test_client()
+    for descrizione, data, totale in (("Affitto", "2025-01-05", 500.0), ("Affitto", "2025-02-05", 500.0),
+                                      ("Luce", "2025-02-20", 80.25)):
+        client.post('/api/costs', json={"descrizione": descrizione, "anno_riferimento": 2025,
+                                        "data_pagamento": data, "totale": totale})
+    id_luce = client.post('/api/costs', json={"descrizione": "Luce", "anno_riferimento": 2024,
+                                              "data_pagamento": "2025-01-10", "totale": 40.0}).get_json()['id']
+    client.put(f'/api/costs/{id_luce}', json={"anno_riferimento": 2025})
+    assert aggregates.check() == []
+
+    n_query, resp = count_queries(lambda: client.get('/api/costs/stats?year=2025'))
+    assert n_query == 1  # solo le statistiche: le GET non generano più i costi ricorrenti
+    assert resp.get_json() == {
+        'totale_costi': 4,
+        'totale_annuo': 1120.25,
+        'per_mese': [{'mese': 1, 'conteggio': 2, 'totale': 540.0},
+                     {'mese': 2, 'conteggio': 2, 'totale': 580.25}],
+        'per_descrizione': [{'descrizione': 'Affitto', 'conteggio': 2, 'totale': 1000.0},
+                            {'descrizione': 'Luce', 'conteggio': 2, 'totale': 120.25}],
+        'anno_selezionato': 2025,
+    }
+
+    # Handler di costi_api (oscurato da quello di fatture_api, registrato prima): stesse tabelle
+    from app.api.costi_api import get_costs_stats
+    with db_app.test_request_context('/api/costs/stats?year=2025'):
+        resp, status = get_costs_stats()
+    assert resp.get_json()['per_mese'] == [{'mese': 1, 'totale': 540.0}, {'mese': 2, 'totale': 580.25}]
+
+    client.delete(f'/api/costs/{id_luce}')
+    dati = client.get('/api/costs/stats').get_json()
+    assert dati['per_mese'] == [{'mese': 2025, 'conteggio': 3, 'totale': 1080.25}]
+    assert aggregates.check() == []
+
+
+def test_check_segnala_e_rebuild_corregge(db_app):
+    from app import aggregates
+    from app.models import db, FatturaStatsMese
+
+    mario, _ = _clienti()
+    db.session.add(_fattura(1, mario, datetime.date(2025, 1, 15), 60.0))
+    db.session.commit()
+
+    db.session.query(FatturaStatsMese).update({'conteggio': 5})
+    db.session.commit()
+    assert aggregates.check() == [('fattura_stats_mese', (2025, 1), (1, 60.0), (5, 60.0))]
+
+    assert aggregates.rebuild() == {'fattura_stats_mese': 1, 'fattura_stats_cliente': 1, 'costo_stats': 0}
+    db.session.commit()
+    assert aggregates.check() == []
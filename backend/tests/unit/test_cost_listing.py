@@ -0,0 +1,74 @@
+"""Test per la lista costi filtrata e paginata (GET /api/costs, /api/costs/years)."""
+from datetime import date
+
+
+def _dati():
+    from app.models import db, Costo, CostoRicorrente
+
+    affitto = CostoRicorrente(descrizione="Affitto", totale=500.0, frequenza='mensile', giorno_scadenza=5,
+                              data_inizio=date(2024, 11, 1))
+    db.session.add(affitto)
+    db.session.flush()
+    costi = [
+        Costo(descrizione="Affitto - 2024-11", anno_riferimento=2024, data_pagamento=date(2024, 11, 5),
+              totale=500.0, pagato=True, ricorrenza_id=affitto.id, periodo_riferimento="2024-11"),
+        Costo(descrizione="Affitto - 2024-12", anno_riferimento=2024, data_pagamento=date(2024, 12, 5),
+              totale=500.0, pagato=False, ricorrenza_id=affitto.id, periodo_riferimento="2024-12"),
+        Costo(descrizione="Cancelleria", anno_riferimento=2024, data_pagamento=date(2024, 12, 5), totale=30.0,
+              pagato=True),
+        Costo(descrizione="Sconto 100% software", anno_riferimento=2025, data_pagamento=date(2025, 1, 10),
+              totale=0.5, pagato=True),
+        Costo(descrizione="Affitto - 2025-01", anno_riferimento=2025, data_pagamento=date(2025, 1, 5),
+              totale=500.0, pagato=False, ricorrenza_id=affitto.id, periodo_riferimento="2025-01"),
+    ]
+    db.session.add_all(costi)
+    db.session.commit()
+    return affitto.id
+
+
+def _descrizioni(risposta):
+    return [c['descrizione'] for c in risposta.get_json()]
+
+
+def test_filtri(db_app):
+    affitto_id = _dati()
+    client = db_app.test_client()
+
+    # Senza parametri: tutti, dal pagamento più recente (a parità di data, id decrescente)
+    assert _descrizioni(client.get('/api/costs')) == [
+        "Sconto 100% software", "Affitto - 2025-01", "Cancelleria", "Affitto - 2024-12", "Affitto - 2024-11"]
+    assert _descrizioni(client.get('/api/costs?year=2024&pagato=false')) == ["Affitto - 2024-12"]
+    assert len(client.get(f'/api/costs?ricorrenza_id={affitto_id}&pagato=true').get_json()) == 1
+    assert _descrizioni(client.get('/api/costs?q=CANCELL')) == ["Cancelleria"]
+    # % e _ sono caratteri letterali, non jolly
+    assert _descrizioni(client.get('/api/costs?q=100%25')) == ["Sconto 100% software"]
+    assert client.get('/api/costs?q=_').get_json() == []
+
+    raggruppati = client.get('/api/costs?group=year&pagato=false').get_json()
+    assert list(raggruppati) == ["2025", "2024"]
+    assert [c['descrizione'] for c in raggruppati["2024"]] == ["Affitto - 2024-12"]
+
+
+def test_paginazione_a_cursore(db_app):
+    _dati()
+    client = db_app.test_client()
+
+    pagina = client.get('/api/costs?limit=2').get_json()
+    viste = [c['descrizione'] for c in pagina['items']]
+    # Il cursore passa fra due costi con la stessa data di pagamento senza perderne né ripeterne
+    while pagina['next_cursor']:
+        pagina = client.get(f"/api/costs?limit=2&after={pagina['next_cursor']}").get_json()
+        viste += [c['descrizione'] for c in pagina['items']]
+    assert viste == _descrizioni(client.get('/api/costs'))
+
+    pagina = client.get('/api/costs?limit=1&year=2024&after=2024-12-05:999').get_json()
+    assert pagina['items'][0]['data_pagamento'] == "2024-12-05" and pagina['next_cursor']
+    assert client.get('/api/costs?after=ieri').status_code == 400
+
+
+def test_anni_dei_costi(db_app, count_queries):
+    _dati()
+    n_query, resp = count_queries(lambda: db_app.test_client().get('/api/costs/years'))
+    assert n_query == 1
+    assert resp.get_json() == [{"anno": 2025, "conteggio": 2, "totale": 500.5},
+                               {"anno": 2024, "conteggio": 3, "totale": 1030.0}]
@@ -0,0 +1,206 @@
+"""Unit test per la cache dei documenti generati (document_cache.py)."""
+import os
+import threading
+import time
+import zipfile
+
+from app.document_cache import DocumentCache, cache_key
+
+
+def _template(tmp_path, contenuto=b'template'):
+    path = tmp_path / 'invoice_template.docx'
+    path.write_bytes(contenuto)
+    return str(path)
+
+
+def test_chiave_indipendente_da_ordine_del_contesto(tmp_path):
+    template = _template(tmp_path)
+    a = cache_key('invoice', {'numero_fattura': '1', 'totale': '€ 60,00'}, template)
+    b = cache_key('invoice', {'totale': '€ 60,00', 'numero_fattura': '1'}, template)
+    assert a == b
+    assert a != cache_key('invoice', {'numero_fattura': '2', 'totale': '€ 60,00'}, template)
+    assert a != cache_key('giustificativo', {'numero_fattura': '1', 'totale': '€ 60,00'}, template)
+
+
+def test_chiave_cambia_se_cambia_il_template(tmp_path):
+    template = _template(tmp_path)
+    prima = cache_key('invoice', {'numero_fattura': '1'}, template)
+    st = os.stat(template)
+    os.utime(template, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    assert cache_key('invoice', {'numero_fattura': '1'}, template) != prima
+
+
+def test_hit_non_rigenera(tmp_path):
+    cache = DocumentCache(str(tmp_path / 'cache'))
+    chiamate = []
+
+    def build(dest):
+        chiamate.append(dest)
+        with open(dest, 'wb') as f:
+            f.write(b'zip')
+
+    path, hit = cache.get_or_create('k', build)
+    assert not hit
+    path2, hit2 = cache.get_or_create('k', build)
+    assert hit2 and path2 == path
+    assert len(chiamate) == 1
+    with open(path, 'rb') as f:
+        assert f.read() == b'zip'
+
+
+def test_errore_nel_build_non_lascia_voci(tmp_path):
+    cache = DocumentCache(str(tmp_path / 'cache'))
+
+    def build(dest):
+        raise RuntimeError('gotenberg giù')
+
+    try:
+        cache.get_or_create('k', build)
+    except RuntimeError:
+        pass
+    assert cache.lookup('k') is None
+    assert not [n for n in os.listdir(cache.root) if n.endswith(('.zip', '.tmp'))]
+
+
+def test_eviction_lru(tmp_path):
+    cache = DocumentCache(str(tmp_path / 'cache'), max_bytes=25)
+
+    def build(dest):
+        with open(dest, 'wb') as f:
+            f.write(b'x' * 10)
+
+    for i, key in enumerate(['a', 'b']):
+        cache.get_or_create(key, build)
+        os.utime(cache.path_for(key), ns=(i * 10**9, i * 10**9))
+    # 'a' torna la più recente grazie all'hit, quindi la vittima è 'b'
+    cache.get_or_create('a', build)
+    cache.get_or_create('c', build)
+
+    assert cache.lookup('a') is not None
+    assert cache.lookup('b') is None
+    assert cache.lookup('c') is not None
+
+
+def test_single_flight_su_richieste_concorrenti(tmp_path):
+    cache = DocumentCache(str(tmp_path / 'cache'))
+    chiamate = []
+
+    def build(dest):
+        chiamate.append(dest)
+        time.sleep(0.2)
+        with open(dest, 'wb') as f:
+            f.write(b'zip')
+
+    risultati = []
+    threads = [threading.Thread(target=lambda: risultati.append(cache.get_or_create('k', build)))
+               for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(chiamate) == 1
+    assert len({path for path, _ in risultati}) == 1
+    assert sum(1 for _, hit in risultati if not hit) == 1
+
+
+def test_download_fattura_usa_la_cache(db_app, tmp_path, fake_gotenberg):
+    """Il secondo download della stessa fattura non rifà render né conversione."""
+    import datetime
+    import shutil
+
+    import app.documents as documents
+    from app.models import db, Cliente, Fattura
+
+    builtin = os.path.join(os.path.dirname(documents.__file__), 'templates', 'invoice_template.docx')
+    os.makedirs(tmp_path / 'templates')
+    shutil.copy(builtin, tmp_path / 'templates' / 'invoice_template.docx')
+    db_app.root_path = str(tmp_path)
+
+    conversioni = []
+
+    class _Risposta:
+        content = b'%PDF-1.4 finto'
+
+        def raise_for_status(self):
+            pass
+
+    def fake_post(url, files, timeout):
+        conversioni.append(url)
+        return _Risposta()
+
+    fake_gotenberg(fake_post)
+
+    cliente = Cliente(nome="Mario", cognome="Rossi", codice_fiscale="RSSMRA85M01H501Z")
+    db.session.add(cliente)
+    db.session.flush()
+    fattura = Fattura(anno=2025, progressivo=1, data_fattura=datetime.date(2025, 1, 31),
+                      cliente_id=cliente.id, numero_sedute=1, importo_prestazione=58.82,
+                      totale=60.0, metodo_pagamento='contanti',
+                      descrizione='n. 1 di Seduta di consulenza psicologica')
+    db.session.add(fattura)
+    db.session.commit()
+
+    client = db_app.test_client()
+    primo = client.get(f'/api/invoices/{fattura.id}/download')
+    secondo = client.get(f'/api/invoices/{fattura.id}/download')
+
+    assert primo.status_code == 200 and secondo.status_code == 200
+    assert primo.data == secondo.data
+    assert len(conversioni) == 1
+
+    # La copia d'archivio in invoices/ è lo stesso file della cache (hard link), non una copia
+    archiviato = tmp_path / 'invoices' / 'fattura_1_2025.zip'
+    cache = tmp_path / 'invoices' / 'cache'
+    assert any(os.path.samefile(archiviato, cache / nome) for nome in os.listdir(cache) if nome.endswith('.zip'))
+    zipf = zipfile.ZipFile(archiviato)
+    assert zipf.namelist() == ['fattura_1_2025.docx', 'fattura_1_2025.pdf']
+    assert zipf.read('fattura_1_2025.pdf') == b'%PDF-1.4 finto'
+
+    # Una modifica alla fattura cambia il contesto, quindi la chiave
+    fattura.metodo_pagamento = 'bonifico'
+    db.session.commit()
+    assert client.get(f'/api/invoices/{fattura.id}/download').status_code == 200
+    assert len(conversioni) == 2
+
+
+def test_eviction_rimuove_solo_lock_liberi_e_tmp_orfani(tmp_path):
+    cache = DocumentCache(str(tmp_path / 'cache'), max_bytes=15)
+
+    def build(dest):
+        with open(dest, 'wb') as f:
+            f.write(b'x' * 10)
+
+    cache.get_or_create('a', build)
+    in_corso = cache._lock('b')  # build di 'b' in corso in un altro worker
+    vecchio, recente = os.path.join(cache.root, 'vecchio.tmp'), os.path.join(cache.root, 'recente.tmp')
+    for path in (vecchio, recente):
+        open(path, 'wb').close()
+    due_ore_fa = time.time() - 7200
+    os.utime(vecchio, (due_ore_fa, due_ore_fa))
+
+    cache.get_or_create('c', build)
+
+    assert cache.lookup('a') is None
+    assert sorted(os.listdir(cache.root)) == ['b.lock', 'c.lock', 'c.zip', 'recente.tmp']
+    in_corso.close()
+    assert cache.get_or_create('b', build) == (cache.path_for('b'), False)
+
+
+def test_lock_rimosso_durante_l_attesa_viene_riaperto(tmp_path):
+    cache = DocumentCache(str(tmp_path / 'cache'))
+    lock_path = os.path.join(cache.root, 'k.lock')
+    primo = cache._lock('k')
+    ottenuti = []
+    attesa = threading.Thread(target=lambda: ottenuti.append(cache._lock('k')))
+    attesa.start()
+    time.sleep(0.1)
+
+    # Come _rimuovi_lock_libero: file rimosso tenendo il lock, poi rilasciato
+    os.remove(lock_path)
+    primo.close()
+    attesa.join()
+
+    # Chi aspettava sul vecchio file ne ha aperto uno nuovo: un terzo processo lo troverebbe bloccato
+    assert os.fstat(ottenuti[0].fileno()).st_ino == os.stat(lock_path).st_ino
+    ottenuti[0].close()
@@ -0,0 +1,108 @@
+"""Test per i download in formato singolo (?format=pdf|docx|zip) di fatture e giustificativi."""
+import datetime
+import io
+import os
+import shutil
+import zipfile
+
+import pytest
+
+
+@pytest.fixture
+def conversioni(db_app, tmp_path, fake_gotenberg):
+    """Template built-in in tmp_path e Gotenberg finto; ritorna la lista dei file convertiti."""
+    import app.documents as documents
+
+    templates = os.path.join(os.path.dirname(documents.__file__), 'templates')
+    os.makedirs(tmp_path / 'templates')
+    for nome in ('invoice_template.docx', 'giustificativo_template.docx'):
+        shutil.copy(os.path.join(templates, nome), tmp_path / 'templates' / nome)
+    db_app.root_path = str(tmp_path)
+
+    convertiti = []
+
+    class _Risposta:
+        content = b'%PDF-1.4 finto'
+
+        def raise_for_status(self):
+            pass
+
+    def fake_post(url, files, timeout):
+        convertiti.append(files['files'][0])
+        return _Risposta()
+
+    fake_gotenberg(fake_post)
+    return convertiti
+
+
+def _dati():
+    from app.models import db, Cliente, Fattura
+
+    cliente = Cliente(nome="Mario", cognome="Rossi", codice_fiscale="RSSMRA85M01H501Z")
+    db.session.add(cliente)
+    db.session.flush()
+    fattura = Fattura(anno=2025, progressivo=4, data_fattura=datetime.date(2025, 1, 31),
+                      cliente_id=cliente.id, numero_sedute=1, importo_prestazione=58.82,
+                      totale=60.0, metodo_pagamento='Contanti',
+                      descrizione='n. 1 di Seduta di consulenza psicologica')
+    db.session.add(fattura)
+    db.session.commit()
+    return cliente.id, fattura.id
+
+
+def test_fattura_solo_pdf(db_app, conversioni):
+    _, fattura_id = _dati()
+    resp = db_app.test_client().get(f'/api/invoices/{fattura_id}/download?format=pdf')
+
+    assert resp.status_code == 200
+    assert resp.mimetype == 'application/pdf'
+    assert 'fattura_4_2025.pdf' in resp.headers['Content-Disposition']
+    assert resp.data == b'%PDF-1.4 finto'
+    assert len(conversioni) == 1
+
+
+def test_fattura_solo_docx_senza_gotenberg(db_app, conversioni):
+    _, fattura_id = _dati()
+    resp = db_app.test_client().get(f'/api/invoices/{fattura_id}/download?format=docx')
+
+    assert resp.status_code == 200
+    assert resp.mimetype.endswith('wordprocessingml.document')
+    assert 'fattura_4_2025.docx' in resp.headers['Content-Disposition']
+    assert 'word/document.xml' in zipfile.ZipFile(io.BytesIO(resp.data)).namelist()
+    assert conversioni == []
+
+
+def test_fattura_pdf_estratto_dal_bundle_in_cache(db_app, conversioni):
+    _, fattura_id = _dati()
+    client = db_app.test_client()
+
+    bundle = client.get(f'/api/invoices/{fattura_id}/download')
+    assert bundle.mimetype == 'application/zip'
+    assert len(conversioni) == 1
+
+    pdf = client.get(f'/api/invoices/{fattura_id}/download?format=pdf')
+    assert pdf.data == b'%PDF-1.4 finto'
+    assert len(conversioni) == 1
+
+
+def test_formato_non_valido(db_app, conversioni):
+    cliente_id, fattura_id = _dati()
+    client = db_app.test_client()
+    assert client.get(f'/api/invoices/{fattura_id}/download?format=odt').status_code == 400
+    assert client.get(f'/api/clients/{cliente_id}/giustificativo?format=odt').status_code == 400
+
+
+def test_giustificativo_pdf_e_docx(db_app, conversioni):
+    cliente_id, _ = _dati()
+    client = db_app.test_client()
+
+    pdf = client.get(f'/api/clients/{cliente_id}/giustificativo?data=2025-01-31&format=pdf')
+    assert pdf.status_code == 200
+    assert pdf.mimetype == 'application/pdf'
+    assert 'giustificativo_Rossi_Mario_20250131.pdf' in pdf.headers['Content-Disposition']
+    assert conversioni == ['giustificativo_Rossi_Mario_20250131.docx']
+
+    docx = client.get(f'/api/clients/{cliente_id}/giustificativo?data=2025-01-31&format=docx')
+    assert docx.status_code == 200
+    assert 'giustificativo_Rossi_Mario_20250131.docx' in docx.headers['Content-Disposition']
+    assert len(conversioni) == 1
@@ -0,0 +1,210 @@
+"""Unit test per il client Gotenberg condiviso (app/gotenberg.py), senza rete."""
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from app import gotenberg
+
+
+class _Risposta:
+    def __init__(self, status=200, content=b'%PDF finto'):
+        self.status_code = status
+        self.content = content
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f'{self.status_code} Error', response=self)
+
+    def iter_content(self, chunk_size):
+        for i in range(0, len(self.content), 4):  # più blocchi, come una risposta vera
+            yield self.content[i:i + 4]
+
+    def close(self):
+        pass
+
+
+class _Orologio:
+    def __init__(self):
+        self.t = 0.0
+
+    def __call__(self):
+        return self.t
+
+
+def _client(post, tmp_path, **kwargs):
+    docx = tmp_path / 'doc.docx'
+    docx.write_bytes(b'docx')
+    client = gotenberg.GotenbergClient('http://gotenberg/', session=SimpleNamespace(post=post), **kwargs)
+    return client, str(docx), str(tmp_path / 'doc.pdf')
+
+
+def test_conversione_riuscita_e_statistiche(tmp_path):
+    chiamate = []
+
+    def post(url, files, timeout, stream):
+        chiamate.append((url, files['files'][0]))
+        return _Risposta()
+
+    client, docx, pdf = _client(post, tmp_path)
+    client.convert(docx, pdf)
+
+    assert chiamate == [('http://gotenberg/forms/libreoffice/convert', 'doc.docx')]
+    assert open(pdf, 'rb').read() == b'%PDF finto'
+    stats = client.stats()
+    assert stats['ok'] == 1 and stats['campioni'] == 1 and stats['in_volo'] == 0
+    assert stats['circuit_breaker'] == gotenberg.CLOSED
+    assert 'latenza_p95_ms' in stats
+
+
+def test_circuit_breaker_apre_e_fallisce_subito(tmp_path):
+    orologio = _Orologio()
+    chiamate = []
+    stato = {'giu': True}
+
+    def post(url, files, timeout, stream):
+        chiamate.append(url)
+        if stato['giu']:
+            raise requests.exceptions.ConnectionError('connection refused')
+        return _Risposta()
+
+    breaker = gotenberg.CircuitBreaker(3, 30, clock=orologio)
+    client, docx, pdf = _client(post, tmp_path, breaker=breaker)
+
+    for _ in range(3):
+        with pytest.raises(gotenberg.ConversionError):
+            client.convert(docx, pdf)
+    assert breaker.stato == gotenberg.OPEN
+
+    # Circuito aperto: nessuna chiamata, errore immediato
+    with pytest.raises(gotenberg.ConversionError, match='circuit breaker'):
+        client.convert(docx, pdf)
+    assert len(chiamate) == 3
+
+    # Dopo il cooldown passa una prova: fallisce e il circuito si riapre
+    orologio.t = 31
+    with pytest.raises(gotenberg.ConversionError):
+        client.convert(docx, pdf)
+    assert len(chiamate) == 4 and breaker.stato == gotenberg.OPEN
+
+    # Gotenberg torna su: la prova successiva richiude il circuito
+    stato['giu'] = False
+    orologio.t = 62
+    client.convert(docx, pdf)
+    assert breaker.stato == gotenberg.CLOSED
+    assert client.stats()['rifiutate'] == 1
+
+
+def test_errore_4xx_non_apre_il_circuito(tmp_path):
+    client, docx, pdf = _client(lambda url, files, timeout, stream: _Risposta(400), tmp_path,
+                                breaker=gotenberg.CircuitBreaker(2, 30))
+    for _ in range(3):
+        with pytest.raises(gotenberg.ConversionError):
+            client.convert(docx, pdf)
+    assert client.breaker.stato == gotenberg.CLOSED
+
+
+def test_errore_di_scrittura_durante_la_prova_non_blocca_il_circuito(tmp_path):
+    orologio = _Orologio()
+    stato = {'giu': True}
+
+    def post(url, files, timeout, stream):
+        if stato['giu']:
+            raise requests.exceptions.ConnectionError('connection refused')
+        return _Risposta()
+
+    class _Disco:
+        def write(self, chunk):
+            raise OSError(28, 'No space left on device')
+
+    breaker = gotenberg.CircuitBreaker(1, 30, clock=orologio)
+    client, docx, pdf = _client(post, tmp_path, breaker=breaker)
+    with pytest.raises(gotenberg.ConversionError):
+        client.convert(docx, pdf)
+    assert breaker.stato == gotenberg.OPEN
+
+    # La prova dopo il cooldown fallisce in scrittura: Gotenberg ha risposto, il circuito si chiude
+    stato['giu'] = False
+    orologio.t = 31
+    with pytest.raises(OSError):
+        client.convert_to(docx, _Disco())
+    assert breaker.stato == gotenberg.CLOSED
+    client.convert(docx, pdf)
+    stats = client.stats()
+    assert (stats['ok'], stats['errori'], stats['in_volo']) == (1, 2, 0)
+
+
+def test_semaforo_limita_le_conversioni_in_volo(tmp_path):
+    lock = threading.Lock()
+    stato = {'in_volo': 0, 'max': 0}
+
+    def post(url, files, timeout, stream):
+        with lock:
+            stato['in_volo'] += 1
+            stato['max'] = max(stato['max'], stato['in_volo'])
+        time.sleep(0.03)
+        with lock:
+            stato['in_volo'] -= 1
+        return _Risposta()
+
+    client, docx, _ = _client(post, tmp_path, max_concurrency=2)
+    threads = [threading.Thread(target=client.convert, args=(docx, str(tmp_path / f'{i}.pdf')))
+               for i in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert stato['max'] == 2
+    assert client.stats()['ok'] == 6
+
+
+def test_coda_piena_fallisce_dopo_queue_timeout(tmp_path):
+    client, docx, pdf = _client(lambda url, files, timeout, stream: _Risposta(), tmp_path,
+                                max_concurrency=1, queue_timeout=0.01)
+    client._slots.acquire()  # l'unico posto è occupato
+    with pytest.raises(gotenberg.ConversionError, match='Troppe conversioni'):
+        client.convert(docx, pdf)
+    assert not client.warmup()
+    client._slots.release()
+
+
+def test_warmup_non_entra_nelle_latenze(tmp_path):
+    pytest.importorskip("docx")
+    nomi = []
+
+    def post(url, files, timeout, stream):
+        nomi.append(files['files'][0])
+        return _Risposta()
+
+    client, _, _ = _client(post, tmp_path)
+    assert client.warmup()
+    assert nomi == ['warmup.docx']
+    stats = client.stats()
+    assert stats['warmup'] == 1 and stats['ok'] == 0 and stats['campioni'] == 0
+
+
+def test_warmup_prosegue_dopo_un_errore_inatteso():
+    chiamate = []
+    ripartito = threading.Event()
+
+    class _ClientFinto:
+        def warmup(self):
+            chiamate.append(1)
+            if len(chiamate) == 1:
+                raise RuntimeError('docx non disponibile')
+            ripartito.set()
+            threading.Event().wait()  # parcheggia il thread daemon
+
+    gotenberg._start_warmup(_ClientFinto(), 0.001)
+    assert ripartito.wait(timeout=5)
+    assert len(chiamate) == 2
+
+
+def test_endpoint_statistiche(db_app, fake_gotenberg):
+    fake_gotenberg(lambda url, files, timeout: _Risposta())
+    resp = db_app.test_client().get('/api/gotenberg/stats')
+    assert resp.status_code == 200
+    assert resp.get_json()['circuit_breaker'] == 'closed'
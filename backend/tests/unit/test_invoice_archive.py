@@ -0,0 +1,97 @@
+"""Test per l'archivio annuale dei PDF (GET /api/invoices/archive) con Gotenberg finto."""
+import datetime
+import io
+import os
+import shutil
+import threading
+import time
+import zipfile
+
+import pytest
+import requests
+
+
+@pytest.fixture
+def archivio(db_app, tmp_path, monkeypatch, fake_gotenberg):
+    """App con template built-in in tmp_path e Gotenberg finto che misura la concorrenza."""
+    import app.documents as documents
+
+    builtin = os.path.join(os.path.dirname(documents.__file__), 'templates', 'invoice_template.docx')
+    os.makedirs(tmp_path / 'templates')
+    shutil.copy(builtin, tmp_path / 'templates' / 'invoice_template.docx')
+    db_app.root_path = str(tmp_path)
+
+    stato = {'in_volo': 0, 'max_in_volo': 0, 'chiamate': 0, 'fallisci': set()}
+    lock = threading.Lock()
+
+    class _Risposta:
+        def __init__(self, content, ok=True):
+            self.content = content
+            self._ok = ok
+
+        def raise_for_status(self):
+            if not self._ok:
+                raise requests.exceptions.HTTPError('503 Service Unavailable')
+
+    def fake_post(url, files, timeout):
+        nome = files['files'][0]
+        with lock:
+            stato['in_volo'] += 1
+            stato['chiamate'] += 1
+            stato['max_in_volo'] = max(stato['max_in_volo'], stato['in_volo'])
+        time.sleep(0.05)
+        with lock:
+            stato['in_volo'] -= 1
+        return _Risposta(f'%PDF {nome}'.encode(), ok=nome not in stato['fallisci'])
+
+    fake_gotenberg(fake_post)
+    monkeypatch.setenv('ARCHIVE_CONCURRENCY', '3')
+    return stato
+
+
+def _fatture(n, anno=2025):
+    from app.models import db, Cliente, Fattura
+
+    cliente = Cliente(nome="Mario", cognome="Rossi", codice_fiscale="RSSMRA85M01H501Z")
+    db.session.add(cliente)
+    db.session.flush()
+    for progressivo in range(1, n + 1):
+        db.session.add(Fattura(anno=anno, progressivo=progressivo, data_fattura=datetime.date(anno, 1, 31),
+                               cliente_id=cliente.id, numero_sedute=1, importo_prestazione=58.82,
+                               totale=60.0, metodo_pagamento='Contanti',
+                               descrizione='n. 1 di Seduta di consulenza psicologica'))
+    db.session.commit()
+
+
+def test_archivio_pdf_in_ordine_e_conversioni_parallele(db_app, archivio):
+    _fatture(7)
+    resp = db_app.test_client().get('/api/invoices/archive?year=2025')
+
+    assert resp.status_code == 200
+    assert resp.mimetype == 'application/zip'
+    zipf = zipfile.ZipFile(io.BytesIO(resp.data))
+    assert zipf.namelist() == [f'fattura_{i}_2025.pdf' for i in range(1, 8)]
+    assert zipf.read('fattura_3_2025.pdf') == b'%PDF fattura_3_2025.docx'
+    assert 1 < archivio['max_in_volo'] <= 3
+
+    # Le fatture ora sono in cache: un secondo export non riconverte nulla
+    chiamate = archivio['chiamate']
+    assert db_app.test_client().get('/api/invoices/archive?year=2025').status_code == 200
+    assert archivio['chiamate'] == chiamate
+
+
+def test_archivio_conversione_fallita_finisce_in_errori(db_app, archivio):
+    _fatture(3)
+    archivio['fallisci'].add('fattura_2_2025.docx')
+    resp = db_app.test_client().get('/api/invoices/archive?year=2025')
+
+    zipf = zipfile.ZipFile(io.BytesIO(resp.data))
+    assert zipf.namelist() == ['fattura_1_2025.pdf', 'fattura_3_2025.pdf', 'ERRORI.txt']
+    assert 'fattura_2_2025' in zipf.read('ERRORI.txt').decode()
+
+
+def test_archivio_parametri(db_app, archivio):
+    client = db_app.test_client()
+    assert client.get('/api/invoices/archive').status_code == 400
+    assert client.get('/api/invoices/archive?year=abc').status_code == 400
+    assert client.get('/api/invoices/archive?year=1999').status_code == 404
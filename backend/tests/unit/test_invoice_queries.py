@@ -0,0 +1,59 @@
+"""Regressione N+1: le liste fatture devono emettere un numero costante di query.
+
+Il nome del cliente arriva dalla proiezione con join di app/queries.py: il
+numero di SELECT per richiesta non deve dipendere dal numero di fatture.
+"""
+from datetime import date
+
+import pytest
+
+ENDPOINTS = [
+    '/api/invoices',
+    '/api/invoices?limit=50',
+    '/api/invoices/unpaid',
+    '/api/sts/invoices/unsent',
+]
+
+
+def _seed(db, n, offset=0):
+    from app.models import Cliente, Fattura
+
+    for k in range(offset, offset + n):
+        cliente = Cliente(nome=f"Nome{k}", cognome=f"Cognome{k}", codice_fiscale=f"CF{k:014d}")
+        db.session.add(cliente)
+        db.session.flush()
+        # Metà pagate (lista STS), metà no (lista non pagate)
+        db.session.add(Fattura(
+            anno=2025, progressivo=k + 1, cliente_id=cliente.id,
+            data_fattura=date(2025, 1, 1),
+            data_pagamento=date(2025, 1, 2) if k % 2 else None,
+            importo_prestazione=58.82, descrizione="n. 1 di Seduta", totale=60.0,
+            numero_sedute=1, inviata_sts=False,
+        ))
+    db.session.commit()
+    db.session.expunge_all()
+
+
+@pytest.mark.parametrize("url", ENDPOINTS)
+def test_numero_query_costante_al_crescere_delle_fatture(db_app, count_queries, url):
+    from app.models import db
+
+    client = db_app.test_client()
+
+    _seed(db, 2)
+    pochi, resp = count_queries(lambda: client.get(url))
+    assert resp.status_code == 200
+
+    _seed(db, 30, offset=2)
+    molti, resp = count_queries(lambda: client.get(url))
+    assert resp.status_code == 200
+
+    assert pochi == molti
+
+
+def test_lista_contiene_nome_cliente(db_app):
+    from app.models import db
+
+    _seed(db, 3)
+    items = db_app.test_client().get('/api/invoices?limit=2').get_json()['items']
+    assert [i['cliente'] for i in items] == ["Nome2 Cognome2", "Nome1 Cognome1"]
@@ -0,0 +1,60 @@
+"""Test per le statistiche fatture (GET /api/invoices/stats) calcolate con una sola query."""
+import datetime
+
+
+def _dati():
+    from app.models import db, Cliente, Fattura
+
+    mario = Cliente(nome="Mario", cognome="Rossi", codice_fiscale="RSSMRA85M01H501Z")
+    anna = Cliente(nome="Anna", cognome="Bianchi", codice_fiscale="BNCNNA90A41H501X")
+    db.session.add_all([mario, anna])
+    db.session.flush()
+    fatture = [
+        (mario, 2024, datetime.date(2024, 12, 10), 60.0),
+        (mario, 2025, datetime.date(2025, 1, 15), 60.0),
+        (mario, 2025, datetime.date(2025, 1, 31), 120.0),
+        (anna, 2025, datetime.date(2025, 3, 3), 80.5),
+    ]
+    for progressivo, (cliente, anno, data, totale) in enumerate(fatture, start=1):
+        db.session.add(Fattura(anno=anno, progressivo=progressivo, data_fattura=data, cliente_id=cliente.id,
+                               numero_sedute=1, importo_prestazione=totale, totale=totale,
+                               metodo_pagamento='Contanti', descrizione='n. 1 di Seduta di consulenza psicologica'))
+    db.session.commit()
+
+
+def test_statistiche_anno_in_una_query(db_app, count_queries):
+    _dati()
+    client = db_app.test_client()
+
+    n_query, resp = count_queries(lambda: client.get('/api/invoices/stats?year=2025'))
+
+    assert n_query == 1
+    assert resp.get_json() == {
+        'totale_fatture': 3,
+        'totale_annuo': 260.5,
+        'clienti_con_fatture': 2,
+        'per_mese': [{'mese': 1, 'conteggio': 2, 'totale': 180.0},
+                     {'mese': 3, 'conteggio': 1, 'totale': 80.5}],
+        'per_cliente': [{'cliente': 'Mario Rossi', 'conteggio': 2, 'totale': 180.0},
+                        {'cliente': 'Anna Bianchi', 'conteggio': 1, 'totale': 80.5}],
+        'anno_selezionato': 2025,
+    }
+
+
+def test_statistiche_tutti_gli_anni(db_app):
+    _dati()
+    dati = db_app.test_client().get('/api/invoices/stats').get_json()
+
+    assert dati['totale_fatture'] == 4
+    assert dati['totale_annuo'] == 320.5
+    assert dati['per_mese'] == [{'mese': 2024, 'conteggio': 1, 'totale': 60.0},
+                                {'mese': 2025, 'conteggio': 3, 'totale': 260.5}]
+    assert dati['per_cliente'][0] == {'cliente': 'Mario Rossi', 'conteggio': 3, 'totale': 240.0}
+    assert dati['anno_selezionato'] is None
+
+
+def test_statistiche_senza_fatture(db_app):
+    dati = db_app.test_client().get('/api/invoices/stats?year=2030').get_json()
+    assert dati == {'totale_fatture': 0, 'totale_annuo': 0.0, 'clienti_con_fatture': 0,
+                    'per_mese': [], 'per_cliente': [], 'anno_selezionato': 2030}
+
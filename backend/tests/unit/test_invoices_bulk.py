@@ -0,0 +1,77 @@
+"""Test per la creazione massiva di fatture (POST /api/invoices/bulk) su SQLite in memoria."""
+
+
+def _cliente(db):
+    from app.models import Cliente
+
+    cliente = Cliente(nome="Mario", cognome="Rossi", codice_fiscale="RSSMRA85M01H501Z")
+    db.session.add(cliente)
+    db.session.commit()
+    return cliente.id
+
+
+def _payload(cliente_id, **kw):
+    base = {"data_fattura": "2025-01-31", "cliente_id": cliente_id, "numero_sedute": 1}
+    base.update(kw)
+    return base
+
+
+def test_bulk_numeri_contigui_ed_errori_per_elemento(db_app, count_queries):
+    from app.models import db, Fattura
+
+    cliente_id = _cliente(db)
+    body = [
+        _payload(cliente_id),
+        _payload(cliente_id, numero_sedute=0),        # non valido
+        _payload(cliente_id, numero_sedute=2),
+        _payload(9999),                                # cliente inesistente
+        _payload(cliente_id, data_fattura="31/01/2025"),  # data non valida
+        _payload(cliente_id, numero_sedute=1.5),
+    ]
+    client = db_app.test_client()
+    n_query, resp = count_queries(lambda: client.post('/api/invoices/bulk', json=body))
+
+    assert resp.status_code == 201
+    data = resp.get_json()
+    assert data["created"] == 3
+    assert data["failed"] == 3
+    results = data["results"]
+    assert [r["index"] for r in results] == list(range(len(body)))
+    assert all("error" in results[i] for i in (1, 3, 4))
+
+    creati = [results[i] for i in (0, 2, 5)]
+    progressivi = [int(r["numero_fattura"].split("/")[0]) for r in creati]
+    assert progressivi == [1, 2, 3]
+    for r in creati:
+        assert db.session.get(Fattura, r["id"]).progressivo == int(r["numero_fattura"].split("/")[0])
+
+    # clienti + progressivo + INSERT multi-riga + un upsert per tabella di riepilogo:
+    # non dipende dal numero di fatture
+    assert n_query <= 6
+
+
+def test_bulk_successivo_continua_la_numerazione(db_app):
+    from app.models import db
+
+    cliente_id = _cliente(db)
+    client = db_app.test_client()
+    client.post('/api/invoices', json=_payload(cliente_id))
+    resp = client.post('/api/invoices/bulk', json=[_payload(cliente_id), _payload(cliente_id)])
+    numeri = [r["numero_fattura"].split("/")[0] for r in resp.get_json()["results"]]
+    assert numeri == ["2", "3"]
+
+
+def test_bulk_tutto_non_valido_non_consuma_numeri(db_app):
+    from app.models import db, FatturaProgressivo
+
+    cliente_id = _cliente(db)
+    client = db_app.test_client()
+    resp = client.post('/api/invoices/bulk', json=[_payload(cliente_id, numero_sedute=-1)])
+    assert resp.status_code == 400
+    assert resp.get_json()["created"] == 0
+    assert FatturaProgressivo.query.count() == 0
+
+
+def test_bulk_body_non_array(db_app):
+    resp = db_app.test_client().post('/api/invoices/bulk', json={"cliente_id": 1})
+    assert resp.status_code == 400
@@ -0,0 +1,60 @@
+"""Unit test per gli helper di paginazione keyset (pagination.py)."""
+from datetime import date
+
+import pytest
+
+from app.pagination import (
+    MAX_PAGE_SIZE,
+    DEFAULT_PAGE_SIZE,
+    parse_limit,
+    parse_invoice_cursor,
+    format_invoice_cursor,
+    parse_cost_cursor,
+    format_cost_cursor,
+)
+
+
+def test_limit_assente_usa_default():
+    assert parse_limit(None) == DEFAULT_PAGE_SIZE
+    assert parse_limit('') == DEFAULT_PAGE_SIZE
+
+
+def test_limit_oltre_massimo_viene_limitato():
+    assert parse_limit('10') == 10
+    assert parse_limit(str(MAX_PAGE_SIZE * 10)) == MAX_PAGE_SIZE
+
+
+@pytest.mark.parametrize("raw", ["0", "-5", "abc", "1.5"])
+def test_limit_non_valido(raw):
+    with pytest.raises(ValueError):
+        parse_limit(raw)
+
+
+def test_cursor_round_trip():
+    cursor = format_invoice_cursor(2025, 12)
+    assert cursor == "2025:12"
+    assert parse_invoice_cursor(cursor) == (2025, 12)
+
+
+def test_cursor_assente_ritorna_none():
+    assert parse_invoice_cursor(None) is None
+    assert parse_invoice_cursor('') is None
+
+
+@pytest.mark.parametrize("raw", ["2025", "2025:", "a:b", "2025:1:2"])
+def test_cursor_non_valido(raw):
+    with pytest.raises(ValueError):
+        parse_invoice_cursor(raw)
+
+
+def test_cursor_costo_round_trip():
+    cursor = format_cost_cursor(date(2025, 3, 31), 42)
+    assert cursor == "2025-03-31:42"
+    assert parse_cost_cursor(cursor) == (date(2025, 3, 31), 42)
+    assert parse_cost_cursor('') is None
+
+
+@pytest.mark.parametrize("raw", ["2025-03-31", "2025-13-01:4", "31/03/2025:4", "2025-03-31:x"])
+def test_cursor_costo_non_valido(raw):
+    with pytest.raises(ValueError):
+        parse_cost_cursor(raw)
@@ -0,0 +1,77 @@
+"""Test per il conto economico mensile (GET /api/pnl) calcolato con una sola query."""
+import datetime
+
+from sqlalchemy.dialects import postgresql
+
+
+def _dati():
+    from app.models import db, Cliente, Costo, Fattura
+
+    mario = Cliente(nome="Mario", cognome="Rossi", codice_fiscale="RSSMRA85M01H501Z")
+    db.session.add(mario)
+    db.session.flush()
+    fatture = [
+        (2024, datetime.date(2024, 1, 20), 100.0),
+        (2024, datetime.date(2024, 3, 5), 50.0),
+        (2025, datetime.date(2025, 1, 15), 60.0),
+        (2025, datetime.date(2025, 1, 31), 120.0),
+        (2025, datetime.date(2025, 3, 3), 80.5),
+    ]
+    for progressivo, (anno, data, totale) in enumerate(fatture, start=1):
+        db.session.add(Fattura(anno=anno, progressivo=progressivo, data_fattura=data, cliente_id=mario.id,
+                               numero_sedute=1, importo_prestazione=totale, totale=totale,
+                               metodo_pagamento='Contanti', descrizione='n. 1 di Seduta di consulenza psicologica'))
+    # Costo di competenza 2024 pagato a febbraio 2025: conta nel 2024, come in /costs/stats
+    costi = [
+        (2024, datetime.date(2024, 1, 10), 30.0),
+        (2024, datetime.date(2025, 2, 10), 40.0),
+        (2025, datetime.date(2025, 1, 10), 30.0),
+        (2025, datetime.date(2025, 2, 10), 25.0),
+    ]
+    for anno, data, totale in costi:
+        db.session.add(Costo(descrizione="Affitto", anno_riferimento=anno, data_pagamento=data, totale=totale))
+    db.session.commit()
+
+
+def test_conto_economico_in_una_query(any_db_app, count_queries):
+    _dati()
+    client = any_db_app.test_client()
+
+    n_query, resp = count_queries(lambda: client.get('/api/pnl?year=2025'))
+
+    assert n_query == 1
+    dati = resp.get_json()
+    assert len(dati['per_mese']) == 12
+    assert (dati['anno'], dati['ricavi'], dati['costi'], dati['margine']) == (2025, 260.5, 55.0, 205.5)
+    # 2024: ricavi 150, costi 70, margine 80
+    assert dati['delta_margine'] == 125.5
+    gennaio, febbraio, marzo, dicembre = (dati['per_mese'][m] for m in (0, 1, 2, 11))
+    assert gennaio == {
+        'mese': 1, 'ricavi': 180.0, 'costi': 30.0, 'margine': 150.0,
+        'ricavi_progressivi': 180.0, 'costi_progressivi': 30.0, 'margine_progressivo': 150.0,
+        'delta_ricavi': 80.0, 'delta_costi': 0.0, 'delta_margine': 80.0, 'delta_margine_progressivo': 80.0,
+    }
+    assert (febbraio['margine'], febbraio['margine_progressivo'], febbraio['delta_costi']) == (-25.0, 125.0, -15.0)
+    assert (marzo['ricavi'], marzo['delta_ricavi'], marzo['margine_progressivo']) == (80.5, 30.5, 205.5)
+    assert dicembre['margine'] == 0.0 and dicembre['margine_progressivo'] == 205.5
+    # Coerente con le due statistiche che la dashboard combinava
+    assert dati['ricavi'] == client.get('/api/invoices/stats?year=2025').get_json()['totale_annuo']
+    assert dati['costi'] == client.get('/api/costs/stats?year=2025').get_json()['totale_annuo']
+
+
+def test_conto_economico_anno_vuoto(db_app):
+    dati = db_app.test_client().get('/api/pnl?year=2030').get_json()
+    assert (dati['ricavi'], dati['costi'], dati['margine'], dati['delta_margine']) == (0.0, 0.0, 0.0, 0.0)
+    assert [m['mese'] for m in dati['per_mese']] == list(range(1, 13))
+
+
+def test_griglia_mesi_con_values_su_postgres():
+    from app.queries import profit_and_loss_query
+    from unittest import mock
+
+    with mock.patch('app.queries.db') as db:
+        db.session.get_bind.return_value.dialect.name = 'postgresql'
+        sql = str(profit_and_loss_query(2025).compile(dialect=postgresql.dialect()))
+
+    assert '(VALUES' in sql and 'AS griglia (anno, mese)' in sql
+    assert 'lag(progressivi.margine_progressivo) OVER (PARTITION BY progressivi.mese ORDER BY progressivi.anno)' in sql
@@ -0,0 +1,43 @@
+"""Test per l'allocazione atomica del progressivo (progressivo.py) su SQLite in memoria."""
+import pytest
+
+
+def test_primo_progressivo_dell_anno_crea_il_contatore(db_app):
+    from app.models import db, FatturaProgressivo
+    from app.progressivo import reserve_progressivi
+
+    assert reserve_progressivi(2030) == 1
+    db.session.commit()
+    assert db.session.get(FatturaProgressivo, 2030).last_progressivo == 1
+
+
+def test_progressivi_consecutivi_e_blocchi(db_app):
+    from app.models import db
+    from app.progressivo import reserve_progressivi
+
+    assert reserve_progressivi(2030) == 1
+    assert reserve_progressivi(2030) == 2
+    # blocco di 5: 3..7
+    assert reserve_progressivi(2030, count=5) == 3
+    assert reserve_progressivi(2030) == 8
+    # anni indipendenti
+    assert reserve_progressivi(2031) == 1
+    db.session.commit()
+
+
+def test_rollback_restituisce_il_numero(db_app):
+    from app.models import db
+    from app.progressivo import reserve_progressivi
+
+    assert reserve_progressivi(2030) == 1
+    db.session.commit()
+    assert reserve_progressivi(2030) == 2
+    db.session.rollback()
+    assert reserve_progressivi(2030) == 2
+
+
+def test_count_non_valido(db_app):
+    from app.progressivo import reserve_progressivi
+
+    with pytest.raises(ValueError):
+        reserve_progressivi(2030, count=0)
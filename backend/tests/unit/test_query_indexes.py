@@ -0,0 +1,107 @@
+"""Regressione sugli indici: le query calde degli endpoint devono usare l'indice previsto.
+
+Si popola il DB, si chiama l'endpoint catturando l'SQL che emette e si esegue
+EXPLAIN sulla stessa istruzione con gli stessi parametri. Gira su SQLite e, con
+TEST_DATABASE_URL (make test-db), su Postgres: lì, dopo ANALYZE, le scansioni
+sequenziali sono disattivate per la sola EXPLAIN, perché su pochi dati il
+planner può legittimamente preferirle; si verifica che l'indice sia
+utilizzabile per quel percorso di accesso, non il costo stimato.
+"""
+from datetime import date
+
+import pytest
+from sqlalchemy import event
+
+N_CLIENTI = 40
+N_FATTURE = 400
+N_COSTI = 200
+
+
+def _seed(db):
+    from app.models import Cliente, Fattura, Costo
+
+    clienti = [Cliente(nome=f"Nome{k}", cognome=f"Cognome{k}", codice_fiscale=f"CF{k:014d}")
+               for k in range(N_CLIENTI)]
+    db.session.add_all(clienti)
+    db.session.flush()
+    for k in range(N_FATTURE):
+        anno = 2023 + k % 3
+        # Poche non pagate e poche da inviare a STS, come in produzione
+        pagata = k % 20 != 0
+        db.session.add(Fattura(
+            anno=anno, progressivo=k + 1, cliente_id=clienti[k % N_CLIENTI].id,
+            data_fattura=date(anno, 1 + k % 12, 1), data_pagamento=date(anno, 1 + k % 12, 2) if pagata else None,
+            importo_prestazione=58.82, descrizione="n. 1 di Seduta", totale=60.0, numero_sedute=1,
+            inviata_sts=pagata and k % 25 != 1,
+        ))
+    for k in range(N_COSTI):
+        anno = 2021 + k % 5
+        db.session.add(Costo(descrizione=f"Costo {k % 7}", anno_riferimento=anno,
+                             data_pagamento=date(anno, 1 + k % 12, 10), totale=100.0, pagato=k % 15 != 0))
+    db.session.commit()
+    db.session.execute(db.text('ANALYZE'))
+    db.session.commit()
+    return clienti[0].id
+
+
+def _explain(db, statement, parameters):
+    connection = db.session.connection()
+    if connection.dialect.name == 'postgresql':
+        connection.exec_driver_sql('SET LOCAL enable_seqscan = off')
+        righe = connection.exec_driver_sql(f'EXPLAIN {statement}', parameters).all()
+    else:
+        righe = connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {statement}', parameters).all()
+    db.session.rollback()
+    return '\n'.join(str(riga[-1]) for riga in righe)
+
+
+def _capture(db, fn):
+    """Esegue `fn` e ritorna le istruzioni SQL emesse come (sql, parametri)."""
+    istruzioni = []
+
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        istruzioni.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', _before_execute)
+    try:
+        fn()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', _before_execute)
+    return istruzioni
+
+
+CASI = [
+    # (richiesta, riconosce la query calda nell'SQL emesso, indice atteso)
+    (('get', '/api/sts/invoices/unsent'), 'inviata_sts =', 'ix_fattura_sts_da_inviare'),
+    (('get', '/api/invoices/unpaid'), 'data_pagamento IS NULL', 'ix_fattura_non_pagate'),
+    (('get', '/api/costs/unpaid'), 'costo.pagato =', 'ix_costo_non_pagati'),
+    # Pagina successiva della lista costi senza filtro per anno: seek su (data_pagamento, id)
+    (('get', '/api/costs?limit=20&after=2024-06-10:150'), 'LIMIT', 'ix_costo_data_pagamento_id'),
+    # Il controllo "cliente con fatture" carica client.fatture prima di eliminare
+    (('delete', '/api/clients/{cliente_id}'), '= fattura.cliente_id', 'ix_fattura_cliente_id'),
+]
+
+
+@pytest.mark.parametrize("richiesta, marcatore, indice", CASI, ids=[c[2] for c in CASI])
+def test_endpoint_usa_indice(any_db_app, richiesta, marcatore, indice):
+    from app.models import db
+
+    cliente_id = _seed(db)
+    metodo, url = richiesta
+    client = any_db_app.test_client()
+    istruzioni = _capture(db, lambda: getattr(client, metodo)(url.format(cliente_id=cliente_id)))
+
+    calde = [(sql, parametri) for sql, parametri in istruzioni if marcatore in sql]
+    assert calde, f"nessuna query con {marcatore!r} tra quelle emesse"
+    piano = _explain(db, *calde[0])
+    assert indice in piano, piano
+
+
+def test_costi_per_anno_usano_indice(any_db_app):
+    from app.models import db, Costo
+
+    _seed(db)
+    query = Costo.query.filter(Costo.anno_riferimento == 2024).order_by(Costo.data_pagamento)
+    istruzioni = _capture(db, query.all)
+    piano = _explain(db, *istruzioni[0])
+    assert 'ix_costo_anno_riferimento_data_pagamento' in piano, piano
@@ -0,0 +1,149 @@
+"""Test per la generazione dei costi ricorrenti a partire dal segnaposto (app/recurring.py)."""
+from datetime import date
+from types import SimpleNamespace
+
+
+def _regola(**campi):
+    valori = dict(frequenza='mensile', giorno_scadenza=10, data_inizio=date(2024, 1, 15), data_fine=None,
+                  ultimo_periodo_generato=None)
+    valori.update(campi)
+    return SimpleNamespace(**valori)
+
+
+def test_periodi_dal_segnaposto():
+    from app.recurring import periodi_da_generare
+
+    regola = _regola()
+    # Gennaio scade il 10, prima dell'inizio: saltato ma coperto dal segnaposto.
+    # Aprile scade il 10, dopo la data limite: resta da generare.
+    periodi, ultimo = periodi_da_generare(regola, date(2024, 4, 5))
+    assert periodi == [("2024-02", date(2024, 2, 10), 2024), ("2024-03", date(2024, 3, 10), 2024)]
+    assert ultimo == "2024-03"
+
+    regola.ultimo_periodo_generato = ultimo
+    assert periodi_da_generare(regola, date(2024, 4, 5)) == ([], "2024-03")
+    assert periodi_da_generare(regola, date(2024, 4, 10)) == ([("2024-04", date(2024, 4, 10), 2024)], "2024-04")
+
+    trimestrale = _regola(frequenza='trimestrale', giorno_scadenza=31, ultimo_periodo_generato="2024-10",
+                          data_fine=date(2025, 6, 30))
+    assert periodi_da_generare(trimestrale, date(2026, 1, 1)) == (
+        [("2025-01", date(2025, 1, 31), 2025), ("2025-04", date(2025, 4, 30), 2025)], "2025-04")
+
+
+def test_generazione_incrementale_e_letture_pure(db_app, count_queries):
+    from app.models import db, Costo, CostoRicorrente
+    from app.recurring import generate_recurring_costs
+
+    affitto = CostoRicorrente(descrizione="Affitto", totale=500.0, frequenza='mensile', giorno_scadenza=5,
+                              data_inizio=date(2015, 1, 1))
+    db.session.add(affitto)
+    db.session.commit()
+
+    assert generate_recurring_costs(date(2024, 12, 31)) == 120
+    assert affitto.ultimo_periodo_generato == "2024-12"
+
+    # Un costo generato ed eliminato a mano non viene ricreato
+    db.session.delete(Costo.query.filter_by(periodo_riferimento="2024-06").one())
+    db.session.commit()
+
+    # Il mese nuovo costa le stesse query qualunque sia l'età della regola
+    n_query, creati = count_queries(lambda: generate_recurring_costs(date(2025, 1, 31)))
+    assert creati == 1 and n_query <= 6
+    assert affitto.ultimo_periodo_generato == "2025-01"
+    assert Costo.query.filter_by(ricorrenza_id=affitto.id).count() == 120
+    # Segnaposto già al mese corrente: la regola non viene nemmeno riletta
+    assert generate_recurring_costs(date(2025, 1, 31)) == 0
+
+    client = db_app.test_client()
+    for url in ('/api/costs', '/api/costs/unpaid', '/api/costs/stats?year=2025'):
+        n_query, resp = count_queries(lambda: client.get(url))
+        assert resp.status_code == 200 and n_query == 1
+
+
+def test_modifica_della_regola_riparte_dall_inizio(db_app):
+    from app.models import db, Costo, CostoRicorrente
+
+    client = db_app.test_client()
+    resp = client.post('/api/recurring-costs', json={"descrizione": "Assicurazione", "totale": 120.0,
+                                                     "frequenza": "annuale", "giorno_scadenza": 1,
+                                                     "data_inizio": "2020-03-01", "data_fine": "2023-12-31"})
+    ricorrenza_id = resp.get_json()['id']
+    regola = db.session.get(CostoRicorrente, ricorrenza_id)
+    assert regola.ultimo_periodo_generato == "2023-03"
+    assert client.get(f'/api/recurring-costs/{ricorrenza_id}').get_json()['ultimo_periodo_generato'] == "2023-03"
+
+    # Stessa data di inizio: il segnaposto resta; nuova data: periodi ricalcolati da capo
+    client.put(f'/api/recurring-costs/{ricorrenza_id}', json={"data_inizio": "2020-03-01", "totale": 130.0})
+    assert Costo.query.filter_by(ricorrenza_id=ricorrenza_id).count() == 4
+    client.put(f'/api/recurring-costs/{ricorrenza_id}', json={"data_inizio": "2020-01-01"})
+    periodi = sorted(c.periodo_riferimento for c in Costo.query.filter_by(ricorrenza_id=ricorrenza_id))
+    assert periodi == ["2020-01", "2020-03", "2021-01", "2021-03", "2022-01", "2022-03", "2023-01", "2023-03"]
+    db.session.refresh(regola)
+    assert regola.ultimo_periodo_generato == "2023-01"
+
+
+def test_backfill_in_un_solo_insert_senza_doppioni(any_db_app, count_queries):
+    from app import aggregates
+    from app.models import db, Costo, CostoRicorrente
+    from app.recurring import generate_recurring_costs
+
+    regole = [CostoRicorrente(descrizione=f"Regola {k}", totale=10.0 + k, frequenza='mensile', giorno_scadenza=28,
+                              data_inizio=date(2015, 1, 1)) for k in range(3)]
+    db.session.add_all(regole)
+    db.session.flush()
+    # Periodo già generato da un altro processo: saltato dall'ON CONFLICT, non contato
+    db.session.add(Costo(descrizione="Regola 0 - 2020-05", anno_riferimento=2020, data_pagamento=date(2020, 5, 28),
+                         totale=10.0, ricorrenza_id=regole[0].id, periodo_riferimento="2020-05"))
+    db.session.commit()
+
+    n_query, creati = count_queries(lambda: generate_recurring_costs(date(2024, 12, 31)))
+    assert creati == 3 * 120 - 1
+    # regole + INSERT ... RETURNING + segnaposto + riepilogo (+ savepoint/commit), non una query per periodo
+    assert n_query <= 6
+    assert Costo.query.count() == 3 * 120
+    assert {r.ultimo_periodo_generato for r in regole} == {"2024-12"}
+    assert aggregates.check() == []
+
+
+def test_previsione_in_memoria_senza_scritture(db_app, count_queries):
+    from app.models import db, Costo, CostoRicorrente
+    from app.recurring import forecast_costs, generate_recurring_costs
+
+    affitto = CostoRicorrente(descrizione="Affitto", totale=500.0, frequenza='mensile', giorno_scadenza=5,
+                              data_inizio=date(2024, 1, 1))
+    # Trimestrale che termina a fine anno; annuale mai generata con scadenza a fine febbraio
+    contabile = CostoRicorrente(descrizione="Commercialista", totale=300.0, frequenza='trimestrale',
+                                giorno_scadenza=31, data_inizio=date(2025, 1, 1), data_fine=date(2025, 12, 31))
+    assicurazione = CostoRicorrente(descrizione="Assicurazione", totale=120.0, frequenza='annuale',
+                                    giorno_scadenza=31, data_inizio=date(2025, 2, 1))
+    sospesa = CostoRicorrente(descrizione="Sospesa", totale=1000.0, frequenza='mensile', giorno_scadenza=1,
+                              data_inizio=date(2024, 1, 1), attivo=False)
+    db.session.add_all([affitto, contabile, sospesa])
+    db.session.commit()
+    generate_recurring_costs(date(2025, 5, 10))
+    db.session.add(assicurazione)
+    db.session.add(Costo(descrizione="Fattura luce", anno_riferimento=2025, data_pagamento=date(2025, 6, 20),
+                         totale=80.0, pagato=False))
+    db.session.commit()
+    costi_prima = Costo.query.count()
+
+    n_query, previsione = count_queries(lambda: forecast_costs(8, oggi=date(2025, 5, 10)))
+    assert n_query == 2
+    assert Costo.query.count() == costi_prima
+    assert (previsione['dal'], previsione['al']) == ("2025-05", "2025-12")
+    mesi = {m['mese']: m for m in previsione['per_mese']}
+    # Affitto di maggio già generato: conta fra i registrati, non fra i previsti
+    assert mesi["2025-05"] == {"mese": "2025-05", "registrati": 500.0, "previsti": 0.0, "totale": 500.0}
+    assert mesi["2025-06"] == {"mese": "2025-06", "registrati": 80.0, "previsti": 500.0, "totale": 580.0}
+    assert mesi["2025-07"]['previsti'] == 800.0
+    assert mesi["2025-10"]['previsti'] == 800.0
+    assert mesi["2025-11"]['previsti'] == 500.0
+    # L'assicurazione (febbraio, mai generata) è arretrata insieme agli affitti non pagati
+    assert previsione['arretrati'] == 500.0 * 16 + 300.0 * 2 + 120.0
+    assert previsione['totale'] == previsione['arretrati'] + sum(m['totale'] for m in previsione['per_mese'])
+
+    client = db_app.test_client()
+    assert client.get('/api/costs/forecast?months=0').status_code == 400
+    resp = client.get('/api/costs/forecast?months=36')
+    assert resp.status_code == 200 and len(resp.get_json()['per_mese']) == 36
+    assert Costo.query.count() == costi_prima
@@ -0,0 +1,186 @@
+"""Test per i job di generazione documenti (POST .../render + GET /api/jobs/<id>)."""
+import datetime
+import io
+import os
+import shutil
+import zipfile
+
+import pytest
+import requests
+
+
+class _ExecutorSincrono:
+    """Esegue il job subito, nel thread della richiesta: test deterministici su SQLite in memoria."""
+
+    def submit(self, fn, *args):
+        fn(*args)
+
+
+@pytest.fixture
+def jobs_app(db_app, tmp_path, monkeypatch, fake_gotenberg):
+    import app.documents as documents
+    import app.jobs as jobs
+
+    templates = os.path.join(os.path.dirname(documents.__file__), 'templates')
+    os.makedirs(tmp_path / 'templates')
+    for nome in ('invoice_template.docx', 'giustificativo_template.docx'):
+        shutil.copy(os.path.join(templates, nome), tmp_path / 'templates' / nome)
+    db_app.root_path = str(tmp_path)
+
+    stato = {'gotenberg_giu': False}
+
+    class _Risposta:
+        content = b'%PDF-1.4 finto'
+
+        def raise_for_status(self):
+            if stato['gotenberg_giu']:
+                raise requests.exceptions.ConnectionError('connection refused')
+
+    fake_gotenberg(lambda url, files, timeout: _Risposta())
+    monkeypatch.setattr(jobs, '_get_executor', lambda app: _ExecutorSincrono())
+    return stato
+
+
+def _dati():
+    from app.models import db, Cliente, Fattura
+
+    cliente = Cliente(nome="Mario", cognome="Rossi", codice_fiscale="RSSMRA85M01H501Z")
+    db.session.add(cliente)
+    db.session.flush()
+    fattura = Fattura(anno=2025, progressivo=4, data_fattura=datetime.date(2025, 1, 31),
+                      cliente_id=cliente.id, numero_sedute=1, importo_prestazione=58.82,
+                      totale=60.0, metodo_pagamento='Contanti',
+                      descrizione='n. 1 di Seduta di consulenza psicologica')
+    db.session.add(fattura)
+    db.session.commit()
+    return cliente.id, fattura.id
+
+
+def test_job_fattura_completato_restituisce_lo_zip(db_app, jobs_app):
+    _, fattura_id = _dati()
+    client = db_app.test_client()
+
+    resp = client.post(f'/api/invoices/{fattura_id}/render')
+    assert resp.status_code == 202
+    job_url = resp.headers['Location']
+    assert resp.get_json()['status_url'] == job_url
+
+    artefatto = client.get(job_url)
+    assert artefatto.status_code == 200
+    assert 'fattura_4_2025.zip' in artefatto.headers['Content-Disposition']
+    nomi = zipfile.ZipFile(io.BytesIO(artefatto.data)).namelist()
+    assert sorted(nomi) == ['fattura_4_2025.docx', 'fattura_4_2025.pdf']
+
+
+def test_job_giustificativo_con_parametri(db_app, jobs_app):
+    cliente_id, _ = _dati()
+    client = db_app.test_client()
+
+    assert client.post(f'/api/clients/{cliente_id}/giustificativo/render?data=31-01-2025').status_code == 400
+    resp = client.post(f'/api/clients/{cliente_id}/giustificativo/render',
+                       json={'data': '2025-01-31', 'ora_inizio': '16:00', 'ora_fine': '17:00'})
+    assert resp.status_code == 202
+
+    artefatto = client.get(resp.headers['Location'])
+    assert artefatto.status_code == 200
+    assert 'giustificativo_Rossi_Mario_20250131.zip' in artefatto.headers['Content-Disposition']
+
+
+def test_job_fallito_riporta_errore(db_app, jobs_app):
+    _, fattura_id = _dati()
+    jobs_app['gotenberg_giu'] = True
+    client = db_app.test_client()
+
+    job_url = client.post(f'/api/invoices/{fattura_id}/render').headers['Location']
+    resp = client.get(job_url)
+    assert resp.status_code == 500
+    assert resp.get_json()['status'] == 'failed'
+    assert 'Gotenberg' in resp.get_json()['error']
+
+
+def test_job_in_corso_e_job_orfano(db_app, jobs_app):
+    from app.models import db, RenderJob
+    from app.timezone import now_local
+
+    un_ora_fa = now_local() - datetime.timedelta(hours=1)
+    db.session.add(RenderJob(id='recente', kind='invoice', target_id=1, status='running',
+                             created_at=now_local()))
+    # Rimasto in coda a lungo ma avviato da poco: il tempo si misura dall'avvio
+    db.session.add(RenderJob(id='lungo', kind='invoice', target_id=1, status='running',
+                             created_at=un_ora_fa, started_at=un_ora_fa, heartbeat_at=now_local()))
+    db.session.add(RenderJob(id='in_coda', kind='invoice', target_id=1, status='pending',
+                             created_at=un_ora_fa, heartbeat_at=now_local()))
+    db.session.add(RenderJob(id='orfano', kind='invoice', target_id=1, status='running',
+                             created_at=un_ora_fa, started_at=un_ora_fa,
+                             heartbeat_at=un_ora_fa + datetime.timedelta(minutes=1)))
+    db.session.commit()
+    client = db_app.test_client()
+
+    for job_id in ('recente', 'lungo', 'in_coda'):
+        assert client.get(f'/api/jobs/{job_id}').status_code == 202
+    orfano = client.get('/api/jobs/orfano')
+    assert orfano.status_code == 500
+    assert orfano.get_json()['status'] == 'failed'
+    assert client.get('/api/jobs/inesistente').status_code == 404
+    assert client.post('/api/invoices/9999/render').status_code == 404
+
+
+def test_heartbeat_aggiorna_i_job_in_carico(db_app, monkeypatch):
+    import app.jobs as jobs
+    from app.models import db, RenderJob
+    from app.timezone import now_local
+
+    un_ora_fa = now_local() - datetime.timedelta(hours=1)
+    for job_id in ('mio', 'altrui'):
+        db.session.add(RenderJob(id=job_id, kind='invoice', target_id=1, status='running',
+                                 created_at=un_ora_fa, started_at=un_ora_fa))
+    db.session.commit()
+
+    class _Fine(Exception):
+        pass
+
+    def sleep(secondi):
+        if sleep.giri:
+            raise _Fine
+        sleep.giri += 1
+    sleep.giri = 0
+    monkeypatch.setattr(jobs.time, 'sleep', sleep)
+    monkeypatch.setattr(jobs, '_in_carico', {'mio'})
+    with pytest.raises(_Fine):
+        jobs._run_heartbeat(db_app)
+
+    db.session.expire_all()
+    assert db.session.get(RenderJob, 'mio').heartbeat_at > un_ora_fa
+    assert db.session.get(RenderJob, 'altrui').heartbeat_at is None
+
+
+def test_job_scaduto_non_viene_sovrascritto(db_app, jobs_app, monkeypatch):
+    from sqlalchemy import update
+
+    import app.jobs as jobs
+    from app.models import db, RenderJob
+
+    _, fattura_id = _dati()
+    costruisci = jobs._BUILDERS['invoice']
+
+    def scaduto_durante_il_render(job, app_root, dest_path):
+        # Un'altra richiesta lo segna `failed` mentre il render è in corso
+        nome = costruisci(job, app_root, dest_path)
+        db.session.execute(update(RenderJob).where(RenderJob.id == job.id)
+                           .values(status='failed', error='Job interrotto'))
+        db.session.commit()
+        return nome
+    monkeypatch.setitem(jobs._BUILDERS, 'invoice', scaduto_durante_il_render)
+    client = db_app.test_client()
+
+    job_id = client.post(f'/api/invoices/{fattura_id}/render').get_json()['job_id']
+    resp = client.get(f'/api/jobs/{job_id}')
+    assert resp.status_code == 500
+    assert resp.get_json()['error'] == 'Job interrotto'
+    assert not os.path.exists(os.path.join(jobs.jobs_dir(db_app.root_path), f'{job_id}.zip'))
+
+    # Un job già concluso non viene riavviato
+    jobs._run_job(db_app, job_id)
+    assert db.session.get(RenderJob, job_id).started_at is not None
+    assert client.get(f'/api/jobs/{job_id}').get_json()['status'] == 'failed'
+    assert not jobs._in_carico
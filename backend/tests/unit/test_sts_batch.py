@@ -0,0 +1,223 @@
+"""Test per l'invio STS a batch tramite la coda persistente (app/sts_outbox.py) con un client STS finto."""
+import threading
+import time
+from datetime import date, timedelta
+
+import pytest
+
+
+class _ClientFinto:
+    """Registra il parallelismo e risponde con un protocollo per fattura; alcune falliscono."""
+
+    def __init__(self, max_concurrency, fallite=(), eccezioni=(), irraggiungibili=(), sconosciute=()):
+        self.max_concurrency = max_concurrency
+        self.fallite = set(fallite)
+        self.eccezioni = set(eccezioni)
+        self.irraggiungibili = set(irraggiungibili)
+        self.sconosciute = set(sconosciute)
+        self._lock = threading.Lock()
+        self.in_volo = 0
+        self.max_in_volo = 0
+        self.inviate = []
+
+    def cifra_cf(self, cliente):
+        return f"CIFRATO-{cliente.codice_fiscale}"
+
+    def send_inserimento(self, fattura, cliente, cf_cittadino=None):
+        with self._lock:
+            self.in_volo += 1
+            self.max_in_volo = max(self.max_in_volo, self.in_volo)
+            self.inviate.append(fattura.progressivo)
+        time.sleep(0.02)
+        with self._lock:
+            self.in_volo -= 1
+        if fattura.progressivo in self.eccezioni:
+            raise ValueError("payload non valido")
+        if fattura.progressivo in self.irraggiungibili:
+            return {"success": False, "protocollo": None, "errors": ["STS non raggiungibile dopo 3 tentativi"]}
+        if fattura.progressivo in self.sconosciute:
+            return {"success": False, "protocollo": None, "esito_sconosciuto": True,
+                    "errors": ["Esito sconosciuto: HTTP 504 dal gateway di STS."]}
+        if fattura.progressivo in self.fallite:
+            return {"success": False, "protocollo": None,
+                    "errors": [{"codice": "WS004", "descrizione": "Documento già presente"}]}
+        return {"success": True, "protocollo": f"PROT-{fattura.progressivo}", "errors": []}
+
+
+@pytest.fixture
+def client_http(db_app, monkeypatch):
+    monkeypatch.setenv("STS_USERNAME", "utente")
+    return db_app.test_client()
+
+
+def _fatture(n):
+    from app.models import db, Cliente, Fattura
+
+    cliente = Cliente(nome="Mario", cognome="Rossi", codice_fiscale="RSSMRA85M01H501Z")
+    db.session.add(cliente)
+    db.session.flush()
+    fatture = [Fattura(anno=2025, progressivo=k, data_fattura=date(2025, 1, k), data_pagamento=date(2025, 1, k),
+                       cliente_id=cliente.id, numero_sedute=1, importo_prestazione=58.82, totale=60.0,
+                       metodo_pagamento='Bonifico', descrizione='n. 1 di Seduta di consulenza psicologica',
+                       inviata_sts=False)
+               for k in range(1, n + 1)]
+    db.session.add_all(fatture)
+    db.session.commit()
+    return [f.id for f in fatture]
+
+
+def test_batch_accodato_e_inviato_in_parallelo(client_http):
+    from app import sts_outbox
+    from app.models import Fattura
+
+    _fatture(10)
+    resp = client_http.post('/api/sts/invoices/send-batch', json={"year": 2025})
+
+    assert resp.status_code == 202
+    dati = resp.get_json()
+    assert dati["total"] == 10
+    assert resp.headers["Location"] == dati["status_url"] == f"/api/sts/batches/{dati['batch_id']}"
+    stato = client_http.get(dati["status_url"]).get_json()
+    assert (stato["pending"], stato["sent"], stato["done"]) == (10, 0, False)
+
+    client = _ClientFinto(max_concurrency=3, fallite={4}, eccezioni={7})
+    assert sts_outbox.drain(client) == 10
+
+    stato = client_http.get(dati["status_url"]).get_json()
+    assert (stato["total"], stato["sent"], stato["failed"], stato["pending"], stato["done"]) == (10, 8, 2, 0, True)
+    assert [r["protocollo"] for r in stato["results"]] == [
+        f"PROT-{k}" if k not in (4, 7) else None for k in range(1, 11)]
+    assert stato["results"][3]["error"] == "[WS004] Documento già presente"
+    assert stato["results"][6]["error"] == "payload non valido"
+    assert 1 < client.max_in_volo <= 3
+
+    inviate = {f.progressivo: f.protocollo_sts for f in Fattura.query.filter_by(inviata_sts=True)}
+    assert inviate == {k: f"PROT-{k}" for k in range(1, 11) if k not in (4, 7)}
+
+
+def test_batch_per_ids_segue_l_ordine_richiesto(client_http):
+    from app import sts_outbox
+
+    ids = _fatture(4)
+    richiesti = [ids[2], ids[0], ids[3]]
+    batch_url = client_http.post('/api/sts/invoices/send-batch', json={"ids": richiesti}).get_json()["status_url"]
+
+    client = _ClientFinto(max_concurrency=1)
+    sts_outbox.drain(client)
+
+    assert client.inviate == [3, 1, 4]
+    assert [r["fattura_id"] for r in client_http.get(batch_url).get_json()["results"]] == richiesti
+
+
+def test_cf_cifrato_una_volta_per_cliente_fuori_dai_thread(client_http, monkeypatch):
+    from app import sts_outbox
+    from app.models import db, Cliente
+    from app.sts import client as sts_client, encryption
+
+    monkeypatch.setenv("STS_DEBUG", "true")  # payload costruito, nessuna chiamata di rete
+    monkeypatch.setenv("STS_MAX_CONCURRENCY", "4")
+    monkeypatch.setattr(sts_client, "_client", None)
+    monkeypatch.setattr(encryption, "_public_key", lambda cert_path: (object(), "impronta"))
+    cifrature = []
+
+    def cifra(public_key, cf):
+        cifrature.append(threading.current_thread())
+        return f"CIFRATO-{len(cifrature)}"
+    monkeypatch.setattr(encryption, "_encrypt", cifra)
+
+    ids = _fatture(3)  # tre fatture dello stesso paziente
+    client_http.post('/api/sts/invoices/send-batch', json={"ids": ids})
+    client = sts_client.get_client()
+    payload = []
+    invia = client.send_inserimento
+    monkeypatch.setattr(client, "send_inserimento",
+                        lambda *a, **kw: payload.append(r := invia(*a, **kw)) or r)
+    assert sts_outbox.drain(client) == 3
+
+    # Una sola cifratura, nel thread che possiede la sessione, usata da tutti gli invii e salvata
+    assert cifrature == [threading.current_thread()]
+    assert all("<doc:cfCittadino>CIFRATO-1</doc:cfCittadino>" in r["soap_payload"] for r in payload)
+    db.session.expire_all()
+    cliente = Cliente.query.one()
+    assert (cliente.codice_fiscale_cifrato, cliente.codice_fiscale_cifrato_cert) == ("CIFRATO-1", "impronta")
+
+
+def test_reinvio_per_ids_solo_con_force(client_http):
+    from app import sts_outbox
+    from app.models import db, Fattura
+
+    ids = _fatture(2)
+    Fattura.query.filter(Fattura.id == ids[0]).update({"inviata_sts": True, "protocollo_sts": "PROT-VECCHIO"})
+    db.session.commit()
+    client = _ClientFinto(max_concurrency=1)
+
+    batch_url = client_http.post('/api/sts/invoices/send-batch', json={"ids": ids}).get_json()["status_url"]
+    sts_outbox.drain(client)
+    risultati = client_http.get(batch_url).get_json()["results"]
+    assert [r["stato"] for r in risultati] == ["failed", "sent"]
+    assert "force=true" in risultati[0]["error"]
+    assert client.inviate == [2]
+
+    resp = client_http.post('/api/sts/invoices/send-batch?force=true', json={"ids": ids[:1]})
+    assert resp.status_code == 202
+    sts_outbox.drain(client)
+    assert client_http.get(resp.get_json()["status_url"]).get_json()["sent"] == 1
+    assert client.inviate == [2, 1]
+    assert db.session.get(Fattura, ids[0]).protocollo_sts == "PROT-1"
+
+
+def test_fatture_in_coda_non_vengono_riaccodate(client_http):
+    ids = _fatture(3)
+    client_http.post('/api/sts/invoices/send-batch', json={"ids": ids[:2]})
+
+    dati = client_http.post('/api/sts/invoices/send-batch', json={"year": 2025}).get_json()
+    assert dati["total"] == 1
+    assert client_http.post('/api/sts/invoices/send-batch', json={"ids": ids[:2]}).get_json() == {
+        "batch_id": None, "total": 0}
+    assert client_http.post(f'/api/sts/invoices/{ids[0]}/send').status_code == 409
+    assert client_http.get('/api/sts/batches/sconosciuto').status_code == 404
+
+
+def test_errori_di_rete_ritentati_fino_al_limite(client_http, monkeypatch):
+    from app import sts_outbox
+
+    _fatture(2)
+    monkeypatch.setenv("STS_OUTBOX_MAX_ATTEMPTS", "2")
+    batch_url = client_http.post('/api/sts/invoices/send-batch', json={"year": 2025}).get_json()["status_url"]
+
+    client = _ClientFinto(max_concurrency=2, irraggiungibili={1}, sconosciute={2})
+    assert sts_outbox.process_pending(client) == 2
+    risultati = client_http.get(batch_url).get_json()["results"]
+    # Esito sconosciuto (STS potrebbe aver registrato la spesa): chiusa subito, mai reinviata
+    assert [(r["stato"], r["tentativi"]) for r in risultati] == [("pending", 1), ("failed", 1)]
+    assert risultati[1]["error"].startswith("Esito sconosciuto")
+
+    # Al secondo tentativo fallito (il limite) la riga resta fallita con l'ultimo errore
+    sts_outbox.drain(client)
+    risultati = client_http.get(batch_url).get_json()["results"]
+    assert [(r["stato"], r["tentativi"]) for r in risultati] == [("failed", 2), ("failed", 1)]
+    assert risultati[0]["error"] == "STS non raggiungibile dopo 3 tentativi"
+    assert client.inviate == [1, 2, 1]
+
+
+def test_ripresa_dopo_riavvio_senza_doppi_invii(client_http):
+    from app import sts_outbox
+    from app.models import db, StsOutbox
+    from app.timezone import now_local
+
+    _fatture(3)
+    batch_url = client_http.post('/api/sts/invoices/send-batch', json={"year": 2025}).get_json()["status_url"]
+
+    # Un worker prende in carico la prima riga e muore durante l'invio
+    (preso,) = sts_outbox._claim(1)
+    db.session.get(StsOutbox, preso).updated_at = now_local() - timedelta(hours=1)
+    db.session.commit()
+
+    # Il worker del processo riavviato riprende le righe pending, non quella interrotta
+    client = _ClientFinto(max_concurrency=4)
+    assert sts_outbox.drain(client) == 2
+    assert client.inviate == [2, 3]
+
+    stato = client_http.get(batch_url).get_json()
+    assert (stato["sent"], stato["failed"], stato["done"]) == (2, 1, True)
+    assert stato["results"][0]["error"] == sts_outbox.ESITO_SCONOSCIUTO
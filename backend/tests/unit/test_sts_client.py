@@ -0,0 +1,218 @@
+"""Test per il client STS del processo: riuso, ricreazione al cambio di configurazione, sessioni TLS."""
+import datetime
+import ssl
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+RISPOSTA = (b'<Envelope><Body><esitoChiamata>0</esitoChiamata>'
+            b'<protocollo>PROT-1</protocollo></Body></Envelope>')
+
+
+@pytest.fixture
+def env_sts(monkeypatch):
+    pytest.importorskip("requests")
+    monkeypatch.setenv("STS_USERNAME", "utente")
+    monkeypatch.setenv("STS_SSL_VERIFY", "false")
+    monkeypatch.setattr("app.sts.client._client", None)
+    monkeypatch.delenv("STS_ENDPOINT_URL", raising=False)
+    # requests darebbe la precedenza a questi bundle su session.verify = False
+    monkeypatch.delenv("REQUESTS_CA_BUNDLE", raising=False)
+    monkeypatch.delenv("CURL_CA_BUNDLE", raising=False)
+
+
+def _certificato(tmp_path):
+    """Certificato autofirmato per 127.0.0.1: ritorna (cert, chiave)."""
+    x509 = pytest.importorskip("cryptography.x509")
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    chiave = ec.generate_private_key(ec.SECP256R1())
+    nome = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "127.0.0.1")])
+    adesso = datetime.datetime.now(datetime.timezone.utc)
+    cert = (x509.CertificateBuilder().subject_name(nome).issuer_name(nome).public_key(chiave.public_key())
+            .serial_number(x509.random_serial_number())
+            .not_valid_before(adesso - datetime.timedelta(days=1))
+            .not_valid_after(adesso + datetime.timedelta(days=1))
+            .sign(chiave, hashes.SHA256()))
+    cert_path, key_path = tmp_path / "cert.pem", tmp_path / "key.pem"
+    cert_path.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+    key_path.write_bytes(chiave.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                              serialization.NoEncryption()))
+    return str(cert_path), str(key_path)
+
+
+@pytest.fixture
+def server_tls(tmp_path):
+    """Server HTTPS locale che risponde come STS; `chiudi=True` chiude la connessione a ogni risposta."""
+    cert, chiave = _certificato(tmp_path)
+    opzioni = {"chiudi": False}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.send_response(200)
+            self.send_header("Content-Type", "text/xml")
+            self.send_header("Content-Length", str(len(RISPOSTA)))
+            if opzioni["chiudi"]:
+                self.send_header("Connection", "close")
+                self.close_connection = True
+            self.end_headers()
+            self.wfile.write(RISPOSTA)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    ctx.load_cert_chain(cert, chiave)
+    server.socket = ctx.wrap_socket(server.socket, server_side=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    def _avvia(chiudi):
+        opzioni["chiudi"] = chiudi
+        return f"https://127.0.0.1:{server.server_address[1]}/DocumentoSpesa730pPort"
+
+    yield _avvia
+    server.shutdown()
+    server.server_close()
+
+
+def test_client_riusato_e_ricreato_se_cambia_la_configurazione(env_sts, monkeypatch):
+    from app.sts.client import get_client
+
+    client = get_client()
+    assert get_client() is client
+
+    monkeypatch.setenv("STS_MAX_CONCURRENCY", "8")
+    nuovo = get_client()
+    assert nuovo is not client
+    assert nuovo.max_concurrency == 8
+    assert get_client() is nuovo
+
+
+@pytest.mark.parametrize("chiudi, handshake_attesi", [(False, 1), (True, 3)], ids=["keep-alive", "connection-close"])
+def test_connessioni_e_sessioni_tls_riusate(env_sts, server_tls, chiudi, handshake_attesi):
+    from app.sts.client import get_client
+
+    client = get_client()
+    client.endpoint = server_tls(chiudi)
+    for _ in range(3):
+        assert client._post_soap("<Envelope/>", "inserimento").status_code == 200
+
+    stats = client.stats()
+    assert (stats["richieste"], stats["errori_rete"], stats["campioni"]) == (3, 0, 3)
+    assert stats["handshake"] == handshake_attesi
+    # Ogni connessione dopo la prima riprende la sessione TLS invece di rifare l'handshake completo
+    assert stats["handshake_ripresi"] == handshake_attesi - 1
+    assert stats["latenza_max_ms"] >= stats["latenza_p50_ms"] > 0
+
+
+def test_retry_con_backoff_e_segnali_di_congestione(env_sts, monkeypatch):
+    from types import SimpleNamespace
+
+    from app.sts import client as sts_client
+
+    monkeypatch.setenv("STS_THROTTLE_CODES", "WS900")
+    throttling = ('<Envelope><Body><esitoChiamata>1</esitoChiamata><listaMessaggi><messaggio>'
+                  '<codice>WS900</codice><descrizione>Troppe richieste</descrizione>'
+                  '</messaggio></listaMessaggi></Body></Envelope>')
+    risposte = [
+        SimpleNamespace(status_code=503, headers={"Retry-After": "7"}, text=""),
+        SimpleNamespace(status_code=200, headers={}, text=throttling),
+        SimpleNamespace(status_code=200, headers={}, text=RISPOSTA.decode()),
+    ]
+    attese = []
+    monkeypatch.setattr(sts_client.time, "sleep", attese.append)
+
+    client = sts_client.get_client()
+    monkeypatch.setattr(client._session, "post", lambda *a, **kw: risposte.pop(0))
+    assert client._post_soap("<Envelope/>", "inserimento").text == RISPOSTA.decode()
+
+    # Retry-After rispettato, poi backoff con jitter entro il tetto esponenziale
+    assert attese[0] == 7 and 0 <= attese[1] <= sts_client.RETRY_BACKOFF ** 2
+    limiter = client.stats()["limiter"]
+    assert (limiter["congestioni"], limiter["successi"], limiter["in_volo"]) == (2, 1, 0)
+    assert limiter["finestra"] < limiter["finestra_max"]
+
+
+def test_nessun_reinvio_se_la_richiesta_puo_essere_arrivata(env_sts, monkeypatch):
+    from types import SimpleNamespace
+
+    import requests
+    from urllib3.exceptions import NewConnectionError
+
+    from app.sts import client as sts_client
+
+    monkeypatch.setattr(sts_client.time, "sleep", lambda s: None)
+    client = sts_client.get_client()
+    fattura, cliente = object(), object()
+    monkeypatch.setattr(sts_client, "build_inserimento_payload", lambda *a: "<Envelope/>")
+
+    def invia(*esiti):
+        """Esegue un inserimento con le risposte (o eccezioni) indicate; ritorna (result, post eseguiti)."""
+        coda = list(esiti)
+
+        def post(*a, **kw):
+            esito = coda.pop(0)
+            if isinstance(esito, Exception):
+                raise esito
+            return esito
+        monkeypatch.setattr(client._session, "post", post)
+        result = client.send_inserimento(fattura, cliente)
+        return result, len(esiti) - len(coda)
+
+    ok = SimpleNamespace(status_code=200, headers={}, text=RISPOSTA.decode())
+    # Connessione mai stabilita: la richiesta non è partita, si ritenta
+    rifiutata = requests.exceptions.ConnectionError(NewConnectionError(None, "Connection refused"))
+    result, post = invia(rifiutata, requests.exceptions.ConnectTimeout("connect"), ok)
+    assert result["success"] and post == 3
+
+    # Timeout di lettura e 502/504: STS potrebbe aver registrato la spesa, nessun reinvio
+    for esito in (requests.exceptions.ReadTimeout("read"),
+                  requests.exceptions.ConnectionError("Connection aborted"),
+                  SimpleNamespace(status_code=502, headers={}, text=""),
+                  SimpleNamespace(status_code=504, headers={"Retry-After": "1"}, text="")):
+        result, post = invia(esito, ok)
+        assert (result["success"], result.get("esito_sconosciuto"), post) == (False, True, 1)
+
+    # 503 senza Retry-After torna al chiamante come risposta, senza reinvio
+    result, post = invia(SimpleNamespace(status_code=503, headers={}, text="Service Unavailable"), ok)
+    assert not result["success"] and not result.get("esito_sconosciuto") and post == 1
+
+
+def test_segnali_al_limitatore(env_sts, monkeypatch):
+    from types import SimpleNamespace
+
+    import requests
+
+    from app.sts import client as sts_client
+
+    client = sts_client.get_client()
+    fault = ('<Envelope><Body><Fault><faultcode>Client</faultcode>'
+             '<faultstring>Codice fiscale non valido</faultstring></Fault></Body></Envelope>')
+    monkeypatch.setattr(client._session, "post",
+                        lambda *a, **kw: SimpleNamespace(status_code=500, headers={}, text=fault))
+    client._post_soap("<Envelope/>", "inserimento")
+    # Un SOAP Fault di validazione non è sovraccarico: il rate non si dimezza
+    assert client.stats()["limiter"]["congestioni"] == 0
+
+    def errore_ssl(*a, **kw):
+        raise requests.exceptions.SSLError("handshake failure")
+    monkeypatch.setattr(client._session, "post", errore_ssl)
+    with pytest.raises(RuntimeError, match="SSL"):
+        client._post_soap("<Envelope/>", "inserimento")
+    limiter = client.stats()["limiter"]
+    assert (limiter["congestioni"], limiter["successi"], limiter["in_volo"]) == (1, 1, 0)
+
+
+def test_endpoint_configurabile(env_sts, monkeypatch):
+    from app.sts.client import STS_ENDPOINTS, get_client
+
+    assert get_client().endpoint == STS_ENDPOINTS["test"]
+    monkeypatch.setenv("STS_ENDPOINT_URL", "http://127.0.0.1:8730/DocumentoSpesa730pWeb/DocumentoSpesa730pPort")
+    assert get_client().endpoint == "http://127.0.0.1:8730/DocumentoSpesa730pWeb/DocumentoSpesa730pPort"
@@ -0,0 +1,95 @@
+"""Test per la cifratura del CF (app/sts/encryption.py): cache della chiave pubblica e CF cifrato per cliente."""
+import datetime
+import os
+
+import pytest
+
+
+@pytest.fixture
+def certificato(tmp_path, monkeypatch):
+    """Scrive un certificato RSA autofirmato; ritorna (path, funzione che decifra)."""
+    x509 = pytest.importorskip("cryptography.x509")
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import padding, rsa
+    from cryptography.x509.oid import NameOID
+
+    from app.sts import encryption
+
+    monkeypatch.setattr(encryption, "_chiavi", {})
+    path = tmp_path / "sts_cert.pem"
+    scritture = []
+
+    def _scrivi():
+        chiave = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        nome = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "SanitelCF")])
+        adesso = datetime.datetime.now(datetime.timezone.utc)
+        cert = (x509.CertificateBuilder().subject_name(nome).issuer_name(nome).public_key(chiave.public_key())
+                .serial_number(x509.random_serial_number())
+                .not_valid_before(adesso).not_valid_after(adesso + datetime.timedelta(days=1))
+                .sign(chiave, hashes.SHA256()))
+        path.write_bytes(cert.public_bytes(serialization.Encoding.PEM))
+        # mtime diverso a ogni scrittura anche su filesystem a bassa risoluzione
+        scritture.append(1)
+        os.utime(path, (1_700_000_000 + len(scritture),) * 2)
+
+        def decifra(valore):
+            import base64
+            return chiave.decrypt(base64.b64decode(valore), padding.PKCS1v15()).decode()
+
+        return decifra
+
+    return str(path), _scrivi
+
+
+def test_chiave_pubblica_letta_una_volta_per_mtime(certificato, monkeypatch):
+    from app.sts import encryption
+
+    path, scrivi = certificato
+    decifra = scrivi()
+    letture = []
+    carica = encryption.x509.load_pem_x509_certificate
+    monkeypatch.setattr(encryption.x509, "load_pem_x509_certificate",
+                        lambda data: letture.append(1) or carica(data))
+
+    assert [decifra(encryption.encrypt_cf("RSSMRA85M01H501Z", path)) for _ in range(3)] == ["RSSMRA85M01H501Z"] * 3
+    assert len(letture) == 1
+
+    # Certificato rinnovato: nuovo mtime, la chiave viene riletta
+    decifra = scrivi()
+    assert decifra(encryption.encrypt_cf("RSSMRA85M01H501Z", path)) == "RSSMRA85M01H501Z"
+    assert len(letture) == 2
+
+
+def test_cf_cifrato_salvato_sul_cliente_e_invalidato(db_app, certificato):
+    from app.models import db, Cliente
+    from app.sts.encryption import encrypt_cliente_cf
+
+    path, scrivi = certificato
+    decifra = scrivi()
+    cliente = Cliente(nome="Mario", cognome="Rossi", codice_fiscale="RSSMRA85M01H501Z")
+    db.session.add(cliente)
+    db.session.commit()
+
+    cifrato = encrypt_cliente_cf(cliente, path)
+    db.session.commit()
+    assert decifra(cifrato) == "RSSMRA85M01H501Z"
+    assert encrypt_cliente_cf(cliente, path) == cifrato == db.session.get(Cliente, cliente.id).codice_fiscale_cifrato
+
+    # Stesso CF riassegnato (es. PUT senza modifiche): il cifrato resta valido
+    cliente.codice_fiscale = "RSSMRA85M01H501Z"
+    assert cliente.codice_fiscale_cifrato == cifrato
+
+    # Cambio di CF: il cifrato viene azzerato e ricalcolato al primo invio
+    cliente.codice_fiscale = "BNCNNA90A41H501X"
+    db.session.commit()
+    assert cliente.codice_fiscale_cifrato is None
+    assert decifra(encrypt_cliente_cf(cliente, path)) == "BNCNNA90A41H501X"
+
+    # Cambio di certificato: l'impronta non corrisponde più, si ricifra con la nuova chiave
+    decifra = scrivi()
+    assert decifra(encrypt_cliente_cf(cliente, path)) == "BNCNNA90A41H501X"
+
+    # Senza certificato il CF va in chiaro e non viene salvato come cifrato
+    cliente.codice_fiscale = "RSSMRA85M01H501Z"
+    assert encrypt_cliente_cf(cliente, None) == "RSSMRA85M01H501Z"
+    assert cliente.codice_fiscale_cifrato is None
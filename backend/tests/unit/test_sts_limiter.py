@@ -0,0 +1,84 @@
+"""Test per il limitatore adattivo degli invii STS (app/sts/limiter.py)."""
+import threading
+import time
+
+import pytest
+
+from app.sts.limiter import AdaptiveRateLimiter, LimiterTimeout, RIDUZIONE_INTERVALLO_S
+
+
+class _Orologio:
+    def __init__(self):
+        self.adesso = 1000.0
+
+    def __call__(self):
+        return self.adesso
+
+
+def _richiesta(limiter, orologio, congestione=False):
+    orologio.adesso += 1  # abbastanza per ricaricare un token
+    with limiter.permesso() as esito:
+        esito.congestione = congestione
+
+
+def test_aimd_dimezza_sulle_congestioni_e_risale_coi_successi():
+    orologio = _Orologio()
+    limiter = AdaptiveRateLimiter(8, rate_max=40, clock=orologio)
+    assert (limiter.finestra, limiter.rate) == (8, 40)
+
+    _richiesta(limiter, orologio, congestione=True)
+    assert (limiter.finestra, limiter.rate) == (4, 20)
+
+    # Congestione ravvicinata (stessa raffica di errori): conta, ma non dimezza di nuovo
+    orologio.adesso -= 1 - RIDUZIONE_INTERVALLO_S / 2
+    _richiesta(limiter, orologio, congestione=True)
+    assert (limiter.finestra, limiter.rate) == (4, 20)
+
+    _richiesta(limiter, orologio, congestione=True)
+    assert (limiter.finestra, limiter.rate) == (2, 10)
+
+    for _ in range(20):
+        _richiesta(limiter, orologio)
+    assert 2 < limiter.finestra < 8 and 10 < limiter.rate < 40  # crescita additiva, graduale
+
+    for _ in range(800):
+        _richiesta(limiter, orologio)
+    stats = limiter.stats()
+    assert stats["finestra"] == 8 and stats["rate"] == 40  # risalite fino ai massimi, non oltre
+    assert (stats["successi"], stats["congestioni"], stats["riduzioni"]) == (820, 3, 2)
+
+    for _ in range(10):
+        _richiesta(limiter, orologio, congestione=True)
+        orologio.adesso += RIDUZIONE_INTERVALLO_S
+    assert (limiter.finestra, limiter.rate) == (1, limiter.rate_min)
+
+
+def test_token_bucket_limita_il_rate_e_riporta_la_coda():
+    limiter = AdaptiveRateLimiter(2, rate_max=20)
+    campioni = []
+
+    def invio():
+        with limiter.permesso():
+            campioni.append(limiter.stats()["in_attesa"])
+            time.sleep(0.01)
+
+    inizio = time.monotonic()
+    threads = [threading.Thread(target=invio) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    # 2 token iniziali, poi uno ogni 1/20 s (il rate cresce di poco a ogni successo)
+    assert time.monotonic() - inizio >= 5 / limiter.rate_max
+    assert max(campioni) > 0
+    stats = limiter.stats()
+    assert (stats["in_volo"], stats["in_attesa"], stats["successi"]) == (0, 0, 8)
+
+
+def test_attesa_oltre_il_timeout():
+    limiter = AdaptiveRateLimiter(1, rate_max=1)
+    limiter.acquire()
+    with pytest.raises(LimiterTimeout):
+        limiter.acquire(timeout=0.05)
+    assert limiter.stats()["in_attesa"] == 0
@@ -0,0 +1,113 @@
+"""Unit test per il registry dei template DOCX (template_registry.py)."""
+import io
+import os
+import shutil
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("docxtpl")
+
+from docxtpl import DocxTemplate  # noqa: E402
+
+from app import template_registry  # noqa: E402
+
+BUILTIN = os.path.join(os.path.dirname(template_registry.__file__), 'templates', 'invoice_template.docx')
+
+
+@pytest.fixture
+def template(tmp_path):
+    template_registry.clear()
+    path = tmp_path / 'invoice_template.docx'
+    shutil.copy(BUILTIN, path)
+    yield str(path)
+    template_registry.clear()
+
+
+def _render(doc, context):
+    doc.render(context)
+    out = io.BytesIO()
+    doc.save(out)
+    return out.getvalue()
+
+
+def _document_xml(docx_bytes):
+    return zipfile.ZipFile(io.BytesIO(docx_bytes)).read('word/document.xml').decode('utf-8')
+
+
+def _parti(docx_bytes):
+    """Contenuto delle parti del DOCX (i byte dello ZIP includono l'orario di salvataggio)."""
+    zipf = zipfile.ZipFile(io.BytesIO(docx_bytes))
+    return {nome: zipf.read(nome) for nome in zipf.namelist()}
+
+
+def test_output_identico_a_docxtemplate(template):
+    context = {'numero_fattura': '7', 'cliente_nome': 'Mario', 'cliente_cognome': 'Rossi'}
+    atteso = _parti(_render(DocxTemplate(template), context))
+    for _ in range(2):  # il secondo render parte da un clone, non dal documento già renderizzato
+        assert _parti(_render(template_registry.get_template(template), context)) == atteso
+
+
+def test_template_caricato_una_volta(template):
+    a = template_registry.get_template(template)
+    b = template_registry.get_template(template)
+    assert a is not b
+    assert a._entry is b._entry
+
+
+def test_ricarica_se_il_file_cambia(template):
+    prima = template_registry.get_template(template)._entry
+    st = os.stat(template)
+    os.utime(template, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+    assert template_registry.get_template(template)._entry is not prima
+
+
+def test_render_concorrenti_indipendenti(template):
+    def render(i):
+        return i, _document_xml(_render(template_registry.get_template(template), {'cliente_nome': f'Cliente{i:03d}'}))
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        risultati = list(pool.map(render, range(16)))
+
+    for i, xml in risultati:
+        assert f'Cliente{i:03d}' in xml
+        assert sum(f'Cliente{j:03d}' in xml for j in range(16)) == 1
+
+
+def test_interni_di_docxtpl_sovrascritti_invariati():
+    """PreparedTemplate sovrascrive metodi interni di docxtpl (versione fissata in requirements.txt).
+
+    Se un aggiornamento ne cambia firme o flusso, il test fallisce prima che il render si rompa.
+    """
+    import inspect
+
+    firme = {
+        'init_docx': ['self', 'reload'],
+        'patch_xml': ['self', 'src_xml'],
+        'build_xml': ['self', 'context', 'jinja_env'],
+        'render': ['self', 'context', 'jinja_env', 'autoescape'],
+        'render_xml_part': ['self', 'src_xml', 'part', 'context', 'jinja_env'],
+        'get_xml': ['self'],
+    }
+    for nome, parametri in firme.items():
+        assert list(inspect.signature(getattr(DocxTemplate, nome)).parameters) == parametri, nome
+        if nome in vars(template_registry.PreparedTemplate):
+            sovrascritto = inspect.signature(getattr(template_registry.PreparedTemplate, nome))
+            assert list(sovrascritto.parameters) == parametri, nome
+
+    # render passa da render_init/init_docx, build_xml e patch_xml: le sostituzioni restano in uso
+    render = inspect.getsource(DocxTemplate.render)
+    assert 'self.render_init()' in render and 'self.build_xml(' in render
+    assert 'self.init_docx()' in inspect.getsource(DocxTemplate.render_init)
+    assert 'self.patch_xml(' in inspect.getsource(DocxTemplate.build_xml)
+
+
+
+def test_autoescape_non_modifica_l_ambiente_condiviso(template):
+    context = {'cliente_nome': 'Mario', 'cliente_cognome': 'Rossi'}
+    doc = template_registry.get_template(template)
+    doc.render(context, autoescape=True)
+    assert doc._entry.env.autoescape is False
+    atteso = _parti(_render(DocxTemplate(template), context))
+    assert _parti(_render(template_registry.get_template(template), context)) == atteso
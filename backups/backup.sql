@@ -47,7 +47,9 @@ CREATE TABLE public.cliente (
     cap character varying(5),
     flag_opposizione boolean DEFAULT false,
     luogo_nascita character varying(255),
-    data_nascita date
+    data_nascita date,
+    codice_fiscale_cifrato text,
+    codice_fiscale_cifrato_cert character varying(64)
 );
 
 
@@ -128,7 +130,8 @@ CREATE TABLE public.costo_ricorrente (
     data_inizio date NOT NULL,
     data_fine date,
     pagato_default boolean,
-    attivo boolean
+    attivo boolean,
+    ultimo_periodo_generato character varying(7)
 );
 
 
@@ -156,6 +159,21 @@ ALTER TABLE public.costo_ricorrente_id_seq OWNER TO "user";
 ALTER SEQUENCE public.costo_ricorrente_id_seq OWNED BY public.costo_ricorrente.id;
 
 
+--
+-- Name: costo_stats; Type: TABLE; Schema: public; Owner: user
+--
+
+CREATE TABLE public.costo_stats (
+    anno_riferimento integer NOT NULL,
+    mese integer NOT NULL,
+    descrizione character varying(255) NOT NULL,
+    conteggio integer NOT NULL,
+    totale double precision NOT NULL
+);
+
+
+ALTER TABLE public.costo_stats OWNER TO "user";
+
 --
 -- Name: fattura; Type: TABLE; Schema: public; Owner: user
 --
@@ -237,6 +255,99 @@ ALTER TABLE public.fattura_progressivo_anno_seq OWNER TO "user";
 ALTER SEQUENCE public.fattura_progressivo_anno_seq OWNED BY public.fattura_progressivo.anno;
 
 
+--
+-- Name: fattura_stats_cliente; Type: TABLE; Schema: public; Owner: user
+--
+
+CREATE TABLE public.fattura_stats_cliente (
+    anno integer NOT NULL,
+    cliente_id integer NOT NULL,
+    conteggio integer NOT NULL,
+    totale double precision NOT NULL
+);
+
+
+ALTER TABLE public.fattura_stats_cliente OWNER TO "user";
+
+--
+-- Name: fattura_stats_mese; Type: TABLE; Schema: public; Owner: user
+--
+
+CREATE TABLE public.fattura_stats_mese (
+    anno integer NOT NULL,
+    mese integer NOT NULL,
+    conteggio integer NOT NULL,
+    totale double precision NOT NULL
+);
+
+
+ALTER TABLE public.fattura_stats_mese OWNER TO "user";
+
+--
+-- Name: render_job; Type: TABLE; Schema: public; Owner: user
+--
+
+CREATE TABLE public.render_job (
+    id character varying(32) NOT NULL,
+    kind character varying(30) NOT NULL,
+    target_id integer NOT NULL,
+    params text,
+    status character varying(20) NOT NULL,
+    filename character varying(255),
+    artifact_path character varying(500),
+    error text,
+    created_at timestamp without time zone NOT NULL,
+    started_at timestamp without time zone,
+    finished_at timestamp without time zone,
+    heartbeat_at timestamp without time zone
+);
+
+
+ALTER TABLE public.render_job OWNER TO "user";
+
+--
+-- Name: sts_outbox; Type: TABLE; Schema: public; Owner: user
+--
+
+CREATE TABLE public.sts_outbox (
+    id integer NOT NULL,
+    batch_id character varying(32) NOT NULL,
+    fattura_id integer NOT NULL,
+    operazione character varying(20) NOT NULL,
+    stato character varying(20) NOT NULL,
+    tentativi integer NOT NULL,
+    ultimo_errore text,
+    protocollo character varying(100),
+    created_at timestamp without time zone NOT NULL,
+    updated_at timestamp without time zone NOT NULL,
+    forza boolean DEFAULT false NOT NULL
+);
+
+
+ALTER TABLE public.sts_outbox OWNER TO "user";
+
+--
+-- Name: sts_outbox_id_seq; Type: SEQUENCE; Schema: public; Owner: user
+--
+
+CREATE SEQUENCE public.sts_outbox_id_seq
+    AS integer
+    START WITH 1
+    INCREMENT BY 1
+    NO MINVALUE
+    NO MAXVALUE
+    CACHE 1;
+
+
+ALTER TABLE public.sts_outbox_id_seq OWNER TO "user";
+
+--
+-- Name: sts_outbox_id_seq; Type: SEQUENCE OWNED BY; Schema: public; Owner: user
+--
+
+ALTER SEQUENCE public.sts_outbox_id_seq OWNED BY public.sts_outbox.id;
+
+
 --
 -- Name: cliente id; Type: DEFAULT; Schema: public; Owner: user
 --
@@ -272,12 +383,19 @@ ALTER TABLE ONLY public.fattura ALTER COLUMN id SET DEFAULT nextval('public.fatt
 ALTER TABLE ONLY public.fattura_progressivo ALTER COLUMN anno SET DEFAULT nextval('public.fattura_progressivo_anno_seq'::regclass);
 
 
+--
+-- Name: sts_outbox id; Type: DEFAULT; Schema: public; Owner: user
+--
+
+ALTER TABLE ONLY public.sts_outbox ALTER COLUMN id SET DEFAULT nextval('public.sts_outbox_id_seq'::regclass);
+
+
 --
 -- Data for Name: alembic_version; Type: TABLE DATA; Schema: public; Owner: user
 --
 
 COPY public.alembic_version (version_num) FROM stdin;
-d9e1f3a5b7c9
+c2e4a6b8d0f2
 \.
 
 
@@ -285,18 +403,18 @@ d9e1f3a5b7c9
 -- Data for Name: cliente; Type: TABLE DATA; Schema: public; Owner: user
 --
 
-COPY public.cliente (id, nome, cognome, codice_fiscale, indirizzo, citta, cap, flag_opposizione, luogo_nascita, data_nascita) FROM stdin;
-1	Lapo	Schmid	SCHLPA14L24B036G	Via Campomigliaio, 20	Scarperia e San Piero (FI)	50038	f	\N	\N
-2	Stefania	Galeotti	GLTSFN89R42B036T	Via Pietro Nenni, 19	Borgo San Lorenzo (FI)	50032	f	\N	\N
-3	Isabel Maya	Lasagni	LSGSLM12C45B036L	Via Casanuova, 107	Firenzuola (FI)	50033	f	\N	\N
-4	Daniela	Paladini	PLDDNL94M45B036F	Via Molezzano, 61	Vicchio (FI)	50039	f	\N	\N
-5	Giorgia	D’Orilia	DRLGRG03A60B036C	Via Alessandro Pieri Stella, 66/A	Ronta - Borgo San Lorenzo (FI)	50032	f	\N	\N
-6	Paolo	Borselli	BRSPLA97A17B036L	Via Faentina, 144	Ronta - Borgo San Lorenzo (FI)	50032	f	\N	\N
-7	Rita	Piccini	PCCRTI54E44I085O	Via Rabatta, 27	Borgo San Lorenzo (FI)	50032	f	\N	\N
-8	Laura	Paladini	PLDLRA77E67B036M	Via dell’Azzurro, 5	Scarperia e San Piero (FI)	50038	f	\N	\N
-9	Adele	Salimbeni	SLMDLA82S62D612M	Via Solferino, 4	Scarperia e San Piero (FI)	50038	f	\N	\N
-11	Raimondo 	Della Rocca	DLLRND48M05E971M	Via Piave, 41/26	Borgo San Lorenzo (FI)	50032	f	\N	\N
-10	Dario	Bulletti	BLLDRA83L25D575Z	Via Stefaneschi, 39A	Ronta - Borgo San Lorenzo (FI)	50032	f	\N	\N
+COPY public.cliente (id, nome, cognome, codice_fiscale, indirizzo, citta, cap, flag_opposizione, luogo_nascita, data_nascita, codice_fiscale_cifrato, codice_fiscale_cifrato_cert) FROM stdin;
+1	Lapo	Schmid	SCHLPA14L24B036G	Via Campomigliaio, 20	Scarperia e San Piero (FI)	50038	f	\N	\N	\N	\N
+2	Stefania	Galeotti	GLTSFN89R42B036T	Via Pietro Nenni, 19	Borgo San Lorenzo (FI)	50032	f	\N	\N	\N	\N
+3	Isabel Maya	Lasagni	LSGSLM12C45B036L	Via Casanuova, 107	Firenzuola (FI)	50033	f	\N	\N	\N	\N
+4	Daniela	Paladini	PLDDNL94M45B036F	Via Molezzano, 61	Vicchio (FI)	50039	f	\N	\N	\N	\N
+5	Giorgia	D’Orilia	DRLGRG03A60B036C	Via Alessandro Pieri Stella, 66/A	Ronta - Borgo San Lorenzo (FI)	50032	f	\N	\N	\N	\N
+6	Paolo	Borselli	BRSPLA97A17B036L	Via Faentina, 144	Ronta - Borgo San Lorenzo (FI)	50032	f	\N	\N	\N	\N
+7	Rita	Piccini	PCCRTI54E44I085O	Via Rabatta, 27	Borgo San Lorenzo (FI)	50032	f	\N	\N	\N	\N
+8	Laura	Paladini	PLDLRA77E67B036M	Via dell’Azzurro, 5	Scarperia e San Piero (FI)	50038	f	\N	\N	\N	\N
+9	Adele	Salimbeni	SLMDLA82S62D612M	Via Solferino, 4	Scarperia e San Piero (FI)	50038	f	\N	\N	\N	\N
+11	Raimondo 	Della Rocca	DLLRND48M05E971M	Via Piave, 41/26	Borgo San Lorenzo (FI)	50032	f	\N	\N	\N	\N
+10	Dario	Bulletti	BLLDRA83L25D575Z	Via Stefaneschi, 39A	Ronta - Borgo San Lorenzo (FI)	50032	f	\N	\N	\N	\N
 \.
 
 
@@ -312,7 +430,15 @@ COPY public.costo (id, descrizione, anno_riferimento, data_pagamento, totale, pa
 -- Data for Name: costo_ricorrente; Type: TABLE DATA; Schema: public; Owner: user
 --
 
-COPY public.costo_ricorrente (id, descrizione, totale, frequenza, giorno_scadenza, data_inizio, data_fine, pagato_default, attivo) FROM stdin;
+COPY public.costo_ricorrente (id, descrizione, totale, frequenza, giorno_scadenza, data_inizio, data_fine, pagato_default, attivo, ultimo_periodo_generato) FROM stdin;
+\.
+
+
+--
+-- Data for Name: costo_stats; Type: TABLE DATA; Schema: public; Owner: user
+--
+
+COPY public.costo_stats (anno_riferimento, mese, descrizione, conteggio, totale) FROM stdin;
 \.
 
 
@@ -358,6 +484,54 @@ COPY public.fattura_progressivo (anno, last_progressivo) FROM stdin;
 \.
 
 
+--
+-- Data for Name: fattura_stats_cliente; Type: TABLE DATA; Schema: public; Owner: user
+--
+
+COPY public.fattura_stats_cliente (anno, cliente_id, conteggio, totale) FROM stdin;
+2025	1	4	488
+2025	2	4	240
+2025	3	3	180
+2025	4	1	242
+2025	5	4	240
+2025	6	3	180
+2025	7	2	120
+2025	8	1	302
+2025	9	1	60
+2025	10	1	242
+2025	11	1	242
+\.
+
+
+--
+-- Data for Name: fattura_stats_mese; Type: TABLE DATA; Schema: public; Owner: user
+--
+
+COPY public.fattura_stats_mese (anno, mese, conteggio, totale) FROM stdin;
+2025	3	2	364
+2025	4	2	244
+2025	6	1	122
+2025	7	12	1144
+2025	8	8	662
+\.
+
+
+--
+-- Data for Name: render_job; Type: TABLE DATA; Schema: public; Owner: user
+--
+
+COPY public.render_job (id, kind, target_id, params, status, filename, artifact_path, error, created_at, started_at, finished_at, heartbeat_at) FROM stdin;
+\.
+
+
+--
+-- Data for Name: sts_outbox; Type: TABLE DATA; Schema: public; Owner: user
+--
+
+COPY public.sts_outbox (id, batch_id, fattura_id, operazione, stato, tentativi, ultimo_errore, protocollo, created_at, updated_at, forza) FROM stdin;
+\.
+
+
 --
 -- Name: cliente_id_seq; Type: SEQUENCE SET; Schema: public; Owner: user
 --
@@ -393,6 +567,13 @@ SELECT pg_catalog.setval('public.fattura_id_seq', 25, true);
 SELECT pg_catalog.setval('public.fattura_progressivo_anno_seq', 1, false);
 
 
+--
+-- Name: sts_outbox_id_seq; Type: SEQUENCE SET; Schema: public; Owner: user
+--
+
+SELECT pg_catalog.setval('public.sts_outbox_id_seq', 1, false);
+
+
 --
 -- Name: alembic_version alembic_version_pkc; Type: CONSTRAINT; Schema: public; Owner: user
 --
@@ -433,6 +614,14 @@ ALTER TABLE ONLY public.costo_ricorrente
     ADD CONSTRAINT costo_ricorrente_pkey PRIMARY KEY (id);
 
 
+--
+-- Name: costo_stats costo_stats_pkey; Type: CONSTRAINT; Schema: public; Owner: user
+--
+
+ALTER TABLE ONLY public.costo_stats
+    ADD CONSTRAINT costo_stats_pkey PRIMARY KEY (anno_riferimento, mese, descrizione);
+
+
 --
 -- Name: fattura fattura_pkey; Type: CONSTRAINT; Schema: public; Owner: user
 --
@@ -449,6 +638,38 @@ ALTER TABLE ONLY public.fattura_progressivo
     ADD CONSTRAINT fattura_progressivo_pkey PRIMARY KEY (anno);
 
 
+--
+-- Name: fattura_stats_cliente fattura_stats_cliente_pkey; Type: CONSTRAINT; Schema: public; Owner: user
+--
+
+ALTER TABLE ONLY public.fattura_stats_cliente
+    ADD CONSTRAINT fattura_stats_cliente_pkey PRIMARY KEY (anno, cliente_id);
+
+
+--
+-- Name: fattura_stats_mese fattura_stats_mese_pkey; Type: CONSTRAINT; Schema: public; Owner: user
+--
+
+ALTER TABLE ONLY public.fattura_stats_mese
+    ADD CONSTRAINT fattura_stats_mese_pkey PRIMARY KEY (anno, mese);
+
+
+--
+-- Name: render_job render_job_pkey; Type: CONSTRAINT; Schema: public; Owner: user
+--
+
+ALTER TABLE ONLY public.render_job
+    ADD CONSTRAINT render_job_pkey PRIMARY KEY (id);
+
+
+--
+-- Name: sts_outbox sts_outbox_pkey; Type: CONSTRAINT; Schema: public; Owner: user
+--
+
+ALTER TABLE ONLY public.sts_outbox
+    ADD CONSTRAINT sts_outbox_pkey PRIMARY KEY (id);
+
+
 --
 -- Name: costo uq_costo_ricorrenza_periodo; Type: CONSTRAINT; Schema: public; Owner: user
 --
@@ -457,6 +678,70 @@ ALTER TABLE ONLY public.costo
     ADD CONSTRAINT uq_costo_ricorrenza_periodo UNIQUE (ricorrenza_id, periodo_riferimento);
 
 
+--
+-- Name: fattura uq_fattura_anno_progressivo; Type: CONSTRAINT; Schema: public; Owner: user
+--
+
+ALTER TABLE ONLY public.fattura
+    ADD CONSTRAINT uq_fattura_anno_progressivo UNIQUE (anno, progressivo);
+
+
+--
+-- Name: ix_costo_anno_riferimento_data_pagamento; Type: INDEX; Schema: public; Owner: user
+--
+
+CREATE INDEX ix_costo_anno_riferimento_data_pagamento ON public.costo USING btree (anno_riferimento, data_pagamento);
+
+
+--
+-- Name: ix_costo_data_pagamento_id; Type: INDEX; Schema: public; Owner: user
+--
+
+CREATE INDEX ix_costo_data_pagamento_id ON public.costo USING btree (data_pagamento, id);
+
+
+--
+-- Name: ix_costo_non_pagati; Type: INDEX; Schema: public; Owner: user
+--
+
+CREATE INDEX ix_costo_non_pagati ON public.costo USING btree (data_pagamento) WHERE (pagato = false);
+
+
+--
+-- Name: ix_fattura_cliente_id; Type: INDEX; Schema: public; Owner: user
+--
+
+CREATE INDEX ix_fattura_cliente_id ON public.fattura USING btree (cliente_id);
+
+
+--
+-- Name: ix_fattura_non_pagate; Type: INDEX; Schema: public; Owner: user
+--
+
+CREATE INDEX ix_fattura_non_pagate ON public.fattura USING btree (anno, progressivo) WHERE (data_pagamento IS NULL);
+
+
+--
+-- Name: ix_fattura_sts_da_inviare; Type: INDEX; Schema: public; Owner: user
+--
+
+CREATE INDEX ix_fattura_sts_da_inviare ON public.fattura USING btree (anno, progressivo) WHERE ((inviata_sts = false) AND (data_pagamento IS NOT NULL));
+
+
+--
+-- Name: ix_sts_outbox_batch_id; Type: INDEX; Schema: public; Owner: user
+--
+
+CREATE INDEX ix_sts_outbox_batch_id ON public.sts_outbox USING btree (batch_id);
+
+
+--
+-- Name: uq_sts_outbox_fattura_attiva; Type: INDEX; Schema: public; Owner: user
+--
+
+CREATE UNIQUE INDEX uq_sts_outbox_fattura_attiva ON public.sts_outbox USING btree (fattura_id) WHERE ((stato)::text = ANY ((ARRAY['pending'::character varying, 'in_progress'::character varying])::text[]));
+
+
 --
 -- Name: fattura fattura_cliente_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: user
 --
@@ -473,6 +758,14 @@ ALTER TABLE ONLY public.costo
     ADD CONSTRAINT fk_costo_ricorrenza_id_costo_ricorrente FOREIGN KEY (ricorrenza_id) REFERENCES public.costo_ricorrente(id);
 
 
+--
+-- Name: sts_outbox sts_outbox_fattura_id_fkey; Type: FK CONSTRAINT; Schema: public; Owner: user
+--
+
+ALTER TABLE ONLY public.sts_outbox
+    ADD CONSTRAINT sts_outbox_fattura_id_fkey FOREIGN KEY (fattura_id) REFERENCES public.fattura(id) ON DELETE CASCADE;
+
+
 --
 -- PostgreSQL database dump complete
 --
@@ -1,5 +1,4 @@
-from flask import Blueprint, render_template, request, jsonify, flash, send_file, redirect
-from io import BytesIO
+from flask import Blueprint, render_template, request, jsonify, flash, redirect, Response, stream_with_context
 import requests
 import os
 import re
@@ -127,32 +126,35 @@ def edit_client_proxy(client_id):
 
 @cliente_bp.route('/download_giustificativo/<int:client_id>')
 def download_giustificativo_proxy(client_id):
-    """Scarica lo ZIP (DOCX+PDF) del giustificativo di presenza, proxato dal backend."""
+    """Scarica il giustificativo di presenza (ZIP DOCX+PDF, o `?format=pdf|docx`), inoltrato in streaming dal backend."""
     try:
         response = requests.get(
             f"{BACKEND_URL}/api/clients/{client_id}/giustificativo",
             params=request.args,
-            timeout=70,
+            stream=True,
+            timeout=(10, 70),
         )
         response.raise_for_status()
-
-        # Riusa il nome file deciso dal backend, se presente
-        disposition = response.headers.get('Content-Disposition', '')
-        download_name = f"giustificativo_{client_id}.zip"
-        match = re.search(r'filename="?([^";]+)"?', disposition)
-        if match:
-            download_name = match.group(1)
-
-        return send_file(
-            BytesIO(response.content),
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=download_name,
-        )
     except requests.exceptions.RequestException as e:
         flash(f"Errore durante la generazione del giustificativo: {e}", 'danger')
         return redirect(request.referrer or '/')
 
+    # Riusa il nome file deciso dal backend, se presente
+    disposition = response.headers.get('Content-Disposition', '')
+    download_name = f"giustificativo_{client_id}.{request.args.get('format', 'zip')}"
+    match = re.search(r'filename="?([^";]+)"?', disposition)
+    if match:
+        download_name = match.group(1)
+
+    headers = {'Content-Disposition': f'attachment; filename={download_name}'}
+    if 'Content-Length' in response.headers:
+        headers['Content-Length'] = response.headers['Content-Length']
+    return Response(
+        stream_with_context(response.iter_content(chunk_size=64 * 1024)),
+        content_type=response.headers.get('Content-Type', 'application/zip'),
+        headers=headers,
+    )
+
 
 @cliente_bp.route('/api/clients/<int:client_id>', methods=['DELETE'])
 def delete_client_proxy(client_id):
@@ -1,4 +1,4 @@
-from flask import Blueprint, request, jsonify, flash, render_template
+from flask import Blueprint, request, jsonify, flash, render_template, Response
 import requests
 import os
 from collections import defaultdict
@@ -25,11 +25,11 @@ def add_costo_proxy():
 
 @costi_bp.route('/api/costs', methods=['GET'])
 def get_costs_proxy():
-    """Proxy per ottenere la lista dei costi."""
+    """Proxy per la lista dei costi (filtri, cursore e group=year passati al backend)."""
     try:
-        response = requests.get(f"{BACKEND_URL}/api/costs")
-        response.raise_for_status()
-        return jsonify(response.json()), response.status_code
+        response = requests.get(f"{BACKEND_URL}/api/costs", params=request.args)
+        # Corpo inoltrato così com'è: jsonify riordinerebbe gli anni di group=year, e un 400 resta un 400
+        return Response(response.content, status=response.status_code, mimetype='application/json')
     except requests.exceptions.RequestException as e:
         flash(f"Errore durante il recupero dei costi: {e}", 'danger')
         return jsonify({'message': f"Errore: {e}"}), 500
@@ -154,3 +154,15 @@ def get_costs_stats_proxy():
     except requests.exceptions.RequestException as e:
         flash(f"Errore durante il recupero delle statistiche dei costi: {e}", 'danger')
         return jsonify({'message': f"Errore: {e}"}), 500
+
+@costi_bp.route('/api/pnl', methods=['GET'])
+def get_pnl_proxy():
+    """Proxy per il conto economico mensile (ricavi, costi, margine)."""
+    try:
+        year = request.args.get('year')
+        params = {'year': year} if year else {}
+        response = requests.get(f"{BACKEND_URL}/api/pnl", params=params)
+        response.raise_for_status()
+        return jsonify(response.json()), response.status_code
+    except requests.exceptions.RequestException as e:
+        return jsonify({'message': f"Errore: {e}"}), 500
@@ -1,9 +1,7 @@
-from flask import Blueprint, render_template, request, jsonify, flash, send_file, redirect, url_for
+from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for, Response, stream_with_context
 import requests
 import os
 from datetime import datetime
-from io import BytesIO
-from collections import defaultdict
 
 from ..timezone import now_local
 
@@ -30,29 +28,31 @@ def fatture():
         invoices_response.raise_for_status()
         invoices = invoices_response.json()
         
-        # Recupera i costi
-        costs_response = requests.get(f"{BACKEND_URL}/api/costs")
-        costs_response.raise_for_status()
-        costs_data = costs_response.json()
+        # Anni con costi (dal più recente): la pagina carica solo quelli dell'anno scelto
+        cost_years_response = requests.get(f"{BACKEND_URL}/api/costs/years")
+        cost_years_response.raise_for_status()
+        cost_years = [y['anno'] for y in cost_years_response.json()]
+        selected_cost_year = request.args.get('costs_year', type=int) or (cost_years[0] if cost_years else None)
+
+        # Recupera i costi dell'anno, già raggruppati per anno dal backend
+        costs = {}
+        if selected_cost_year:
+            costs_response = requests.get(f"{BACKEND_URL}/api/costs",
+                                          params={'year': selected_cost_year, 'group': 'year'})
+            costs_response.raise_for_status()
+            costs = {int(year): costi for year, costi in costs_response.json().items()}
 
         recurring_costs_response = requests.get(f"{BACKEND_URL}/api/recurring-costs")
         recurring_costs_response.raise_for_status()
         recurring_costs = recurring_costs_response.json()
         
-        # Raggruppa i costi per anno
-        costs_grouped = defaultdict(list)
-        for cost in costs_data:
-            costs_grouped[cost['anno_riferimento']].append(cost)
-        
-        # Ordina gli anni in ordine decrescente
-        sorted_years = sorted(costs_grouped.keys(), reverse=True)
-        costs = {year: costs_grouped[year] for year in sorted_years}
-        
     except requests.exceptions.RequestException as e:
         flash(f"Errore di connessione al backend: {e}", 'danger')
         clients = []
         invoices = []
         costs = {}
+        cost_years = []
+        selected_cost_year = None
         recurring_costs = []
 
     return render_template(
@@ -60,6 +60,8 @@ def fatture():
         clients=clients,
         invoices=invoices,
         costs=costs,
+        cost_years=cost_years,
+        selected_cost_year=selected_cost_year,
         recurring_costs=recurring_costs,
         now=now_local()
     )
@@ -78,6 +80,20 @@ def add_invoice_proxy():
         flash(f"Errore durante l'aggiunta: {e}", 'danger')
         return jsonify({'message': f"Errore: {e}"}), 500
 
+@fattura_bp.route('/api/invoices/bulk', methods=['POST'])
+def add_invoices_bulk_proxy():
+    """Proxy per la creazione massiva di fatture (esiti per singolo elemento)."""
+    data = request.get_json()
+    try:
+        response = requests.post(f"{BACKEND_URL}/api/invoices/bulk", json=data, timeout=60)
+        result = response.json()
+        if result.get('created'):
+            flash(f"{result['created']} fatture aggiunte con successo!", 'success')
+        return jsonify(result), response.status_code
+    except (requests.exceptions.RequestException, ValueError) as e:
+        flash(f"Errore durante l'aggiunta: {e}", 'danger')
+        return jsonify({'message': f"Errore: {e}"}), 500
+
 @fattura_bp.route('/api/invoices/<int:invoice_id>', methods=['GET'])
 def get_invoice_proxy(invoice_id):
     """Proxy per ottenere i dati di una singola fattura."""
@@ -104,25 +120,45 @@ def edit_invoice_proxy(invoice_id):
 
 @fattura_bp.route('/download_invoice_zip/<int:invoice_id>')
 def download_invoice_zip(invoice_id):
-    """Rotta per scaricare un file ZIP di fattura, proxato dal backend."""
+    """Rotta per scaricare la fattura (ZIP, o `?format=pdf|docx`), inoltrata in streaming dal backend."""
+    fmt = request.args.get('format', 'zip')
     try:
-        response = requests.get(f"{BACKEND_URL}/api/invoices/{invoice_id}/download")
+        response = requests.get(f"{BACKEND_URL}/api/invoices/{invoice_id}/download",
+                                params={'format': fmt}, stream=True, timeout=(10, 70))
         response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        flash(f"Errore durante il download: {e}", 'danger')
+        return redirect(url_for('fattura_bp.fatture'))
 
-        # Leggi il contenuto come un oggetto BytesIO
-        file_object = BytesIO(response.content)
+    # Il file passa a blocchi dal backend al browser, senza mai stare tutto in memoria
+    headers = {'Content-Disposition': response.headers.get(
+        'Content-Disposition', f'attachment; filename=fattura_{invoice_id}.{fmt}')}
+    if 'Content-Length' in response.headers:
+        headers['Content-Length'] = response.headers['Content-Length']
+    return Response(
+        stream_with_context(response.iter_content(chunk_size=64 * 1024)),
+        content_type=response.headers.get('Content-Type', 'application/zip'),
+        headers=headers,
+    )
 
-        # Restituisci il file ZIP con il mimetype corretto
-        return send_file(
-            file_object,
-            mimetype='application/zip',
-            as_attachment=True,
-            download_name=f"fattura_{invoice_id}.zip"
-        )
+@fattura_bp.route('/download_invoice_archive/<int:year>')
+def download_invoice_archive(year):
+    """Archivio ZIP con i PDF delle fatture dell'anno, inoltrato in streaming dal backend."""
+    try:
+        # Timeout (connessione, lettura tra due chunk): l'archivio intero può richiedere minuti
+        response = requests.get(f"{BACKEND_URL}/api/invoices/archive", params={'year': year},
+                                stream=True, timeout=(10, 120))
+        response.raise_for_status()
     except requests.exceptions.RequestException as e:
-        flash(f"Errore durante il download: {e}", 'danger')
+        flash(f"Errore durante il download dell'archivio {year}: {e}", 'danger')
         return redirect(url_for('fattura_bp.fatture'))
-    
+
+    return Response(
+        stream_with_context(response.iter_content(chunk_size=64 * 1024)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename=fatture_{year}.zip'},
+    )
+
 @fattura_bp.route('/api/sts/invoices/<int:invoice_id>/send', methods=['POST'])
 def sts_send_proxy(invoice_id):
     """Proxy per l'invio di una fattura a STS."""
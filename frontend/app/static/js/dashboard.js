@@ -72,23 +72,20 @@ export async function fetchDashboardStats(year = null, showLoadingNotification =
         const controller = new AbortController();
         currentRequest = controller;
 
-        const urlInvoices = year ? `/api/invoices/stats?year=${year}` : '/api/invoices/stats';
-        const urlCosts = year ? `/api/costs/stats?year=${year}` : '/api/costs/stats';
-
+        // Fatturato, costi, margine e differenze sull'anno precedente arrivano
+        // già calcolati da /api/pnl; /api/invoices/stats serve solo per i
+        // conteggi (fatture, clienti) e per il grafico per cliente
         const fetches = [
-            fetch(urlInvoices, { signal: controller.signal }),
-            fetch(urlCosts, { signal: controller.signal })
+            fetch(`/api/invoices/stats?year=${year}`, { signal: controller.signal }),
+            fetch(`/api/pnl?year=${year}`, { signal: controller.signal })
         ];
 
-        // Con il confronto attivo, chiede anche le statistiche dell'anno precedente
+        // Con il confronto attivo, chiede anche i conteggi dell'anno precedente
         if (compare) {
-            fetches.push(
-                fetch(`/api/invoices/stats?year=${prevYear}`, { signal: controller.signal }),
-                fetch(`/api/costs/stats?year=${prevYear}`, { signal: controller.signal })
-            );
+            fetches.push(fetch(`/api/invoices/stats?year=${prevYear}`, { signal: controller.signal }));
         }
 
-        const [invoicesResponse, costsResponse, prevInvoicesResponse, prevCostsResponse] = await Promise.all(fetches);
+        const [invoicesResponse, pnlResponse, prevInvoicesResponse] = await Promise.all(fetches);
 
         // Controlla se la richiesta è stata cancellata
         if (controller.signal.aborted) {
@@ -100,54 +97,56 @@ export async function fetchDashboardStats(year = null, showLoadingNotification =
             throw new Error(err.message || 'Errore nel recupero dei dati delle fatture.');
         }
 
-        if (!costsResponse.ok) {
-            const err = await costsResponse.json();
-            throw new Error(err.message || 'Errore nel recupero dei dati dei costi.');
+        if (!pnlResponse.ok) {
+            const err = await pnlResponse.json();
+            throw new Error(err.message || 'Errore nel recupero del conto economico.');
         }
 
         const invoicesData = await invoicesResponse.json();
-        const costsData = await costsResponse.json();
+        const pnlData = await pnlResponse.json();
 
-        // I dati dell'anno precedente sono opzionali: se falliscono, il resto
-        // della dashboard funziona comunque (badge "n/d", nessun layer nel grafico)
+        // I conteggi dell'anno precedente sono opzionali: se falliscono, il resto
+        // della dashboard funziona comunque (badge "n/d" su fatture e clienti)
         let prevInvoicesData = null;
-        let prevCostsData = null;
         if (compare && prevInvoicesResponse && prevInvoicesResponse.ok) {
             prevInvoicesData = await prevInvoicesResponse.json();
         }
-        if (compare && prevCostsResponse && prevCostsResponse.ok) {
-            prevCostsData = await prevCostsResponse.json();
-        }
+
+        // L'anno precedente si ricava dalle differenze di /api/pnl:
+        // valore precedente = valore corrente - delta
+        const perMese = Array.isArray(pnlData.per_mese) ? pnlData.per_mese : [];
+        const deltaRicavi = perMese.reduce((acc, m) => acc + (parseFloat(m.delta_ricavi) || 0), 0);
+        const deltaCosti = perMese.reduce((acc, m) => acc + (parseFloat(m.delta_costi) || 0), 0);
+
+        const totaleAnnualeFatturato = parseFloat(pnlData.ricavi) || 0;
+        const totaleCostiAnnuali = parseFloat(pnlData.costi) || 0;
+        const profitto = parseFloat(pnlData.margine) || 0;
+        const prevFatturato = totaleAnnualeFatturato - deltaRicavi;
+        const prevCosti = totaleCostiAnnuali - deltaCosti;
 
         const prevHasData = compare && (
             (prevInvoicesData && (parseInt(prevInvoicesData.totale_fatture) || 0) > 0) ||
-            (prevCostsData && (parseFloat(prevCostsData.totale_annuo) || 0) > 0)
+            Math.abs(prevFatturato) >= 0.005 || Math.abs(prevCosti) >= 0.005
         );
-        const comparison = prevHasData ? { prevYear, prevInvoicesData, prevCostsData } : null;
+        const comparison = prevHasData ? { prevYear } : null;
 
         if (compare && !prevHasData && !controller.signal.aborted) {
             notifications.info(`Nessun dato disponibile per il ${prevYear}: confronto non applicato.`, 4000);
         }
 
         if (statsContainer && !controller.signal.aborted) {
-            // Estrae i dati corretti dalle rispettive API
-            const totaleAnnualeFatturato = parseFloat(invoicesData.totale_annuo) || 0;
-            const totaleCostiAnnuali = parseFloat(costsData.totale_annuo) || 0;
             const totaleFatture = parseInt(invoicesData.totale_fatture) || 0;
             const clientiFatturati = parseInt(invoicesData.clienti_con_fatture) || 0;
-            const profitto = totaleAnnualeFatturato - totaleCostiAnnuali;
 
             // Riga delta sotto il valore della card (solo con confronto attivo)
             let deltaLine = () => '';
             if (compare) {
-                const prevFatturato = parseFloat(prevInvoicesData?.totale_annuo) || 0;
-                const prevCosti = parseFloat(prevCostsData?.totale_annuo) || 0;
                 const prevValues = {
                     fatture: parseInt(prevInvoicesData?.totale_fatture) || 0,
                     clienti: parseInt(prevInvoicesData?.clienti_con_fatture) || 0,
                     fatturato: prevFatturato,
                     costi: prevCosti,
-                    profitto: prevFatturato - prevCosti
+                    profitto: profitto - (parseFloat(pnlData.delta_margine) || 0)
                 };
                 deltaLine = (key, current, opts) => `
                     <div class="mb-1">${buildDeltaBadge(current, prevValues[key], opts)} <small class="text-muted">vs ${prevYear}</small></div>`;
@@ -215,7 +214,7 @@ export async function fetchDashboardStats(year = null, showLoadingNotification =
         // Renderizza i grafici solo se la richiesta non è stata cancellata
         if (!controller.signal.aborted) {
             setTimeout(() => {
-                renderCharts(invoicesData, costsData, comparison);
+                renderCharts(invoicesData, pnlData, comparison);
             }, 100);
         }
 
@@ -253,17 +252,14 @@ export async function fetchDashboardStats(year = null, showLoadingNotification =
     }
 }
 
-function renderCharts(invoicesData, costsData, comparison = null) {
+function renderCharts(invoicesData, pnlData, comparison = null) {
     if (typeof Chart === 'undefined') {
         console.error('Chart.js non è caricato!');
         notifications.error('Errore: libreria grafici non disponibile.');
         return;
     }
 
-    // Controlla se l'anno è stato selezionato
-    const isSpecificYear = invoicesData.anno_selezionato !== null && invoicesData.anno_selezionato !== undefined;
-
-    // Grafico combinato Fatturato e Costi per Mese/Anno
+    // Grafico combinato Fatturato e Costi per Mese (dal conto economico)
     const chartPerMese = document.getElementById('chartPerMese');
     if (chartPerMese) {
         try {
@@ -271,79 +267,28 @@ function renderCharts(invoicesData, costsData, comparison = null) {
                 chartPerMeseInstance.destroy();
             }
 
-            let labels = [];
-            let fatturatoValues = [];
-            let costiValues = [];
-
-            // Gestione dati per mese (quando è selezionato un anno specifico)
-            if (isSpecificYear && invoicesData.per_mese && Array.isArray(invoicesData.per_mese)) {
-                // Crea un array per tutti i 12 mesi
-                const monthlyData = new Array(12).fill(0);
-                const monthlyCosts = new Array(12).fill(0);
-
-                // Popola i dati delle fatture
-                invoicesData.per_mese.forEach(item => {
-                    const monthIndex = parseInt(item.mese) - 1; // Converti a indice array (0-11)
-                    if (monthIndex >= 0 && monthIndex < 12) {
-                        monthlyData[monthIndex] = parseFloat(item.totale) || 0;
-                    }
-                });
-
-                // Popola i dati dei costi
-                if (costsData.per_mese && Array.isArray(costsData.per_mese)) {
-                    costsData.per_mese.forEach(item => {
-                        const monthIndex = parseInt(item.mese) - 1;
-                        if (monthIndex >= 0 && monthIndex < 12) {
-                            monthlyCosts[monthIndex] = parseFloat(item.totale) || 0;
-                        }
-                    });
+            const labels = Object.values(MESE_MAPPINGS);
+            const fatturatoValues = new Array(12).fill(0);
+            const costiValues = new Array(12).fill(0);
+            const prevMonthlyFatturato = new Array(12).fill(0);
+            const prevMonthlyCosti = new Array(12).fill(0);
+
+            (pnlData.per_mese || []).forEach(item => {
+                const monthIndex = parseInt(item.mese) - 1; // Converti a indice array (0-11)
+                if (monthIndex >= 0 && monthIndex < 12) {
+                    const ricavi = parseFloat(item.ricavi) || 0;
+                    const costi = parseFloat(item.costi) || 0;
+                    fatturatoValues[monthIndex] = ricavi;
+                    costiValues[monthIndex] = costi;
+                    prevMonthlyFatturato[monthIndex] = ricavi - (parseFloat(item.delta_ricavi) || 0);
+                    prevMonthlyCosti[monthIndex] = costi - (parseFloat(item.delta_costi) || 0);
                 }
-
-                labels = Object.values(MESE_MAPPINGS);
-                fatturatoValues = monthlyData;
-                costiValues = monthlyCosts;
-
-            } else if (invoicesData.per_anno && Array.isArray(invoicesData.per_anno)) {
-                // Gestione dati per anno
-                const yearlyInvoices = new Map(invoicesData.per_anno.map(item => [parseInt(item.anno), parseFloat(item.totale) || 0]));
-                const yearlyCosts = new Map();
-
-                if (costsData.per_anno && Array.isArray(costsData.per_anno)) {
-                    costsData.per_anno.forEach(item => {
-                        yearlyCosts.set(parseInt(item.anno), parseFloat(item.totale) || 0);
-                    });
-                }
-
-                // Ottieni tutti gli anni dalle fatture e dai costi
-                const allYears = new Set([...yearlyInvoices.keys(), ...yearlyCosts.keys()]);
-                const sortedYears = Array.from(allYears).sort();
-
-                labels = sortedYears.map(year => year.toString());
-                fatturatoValues = sortedYears.map(year => yearlyInvoices.get(year) || 0);
-                costiValues = sortedYears.map(year => yearlyCosts.get(year) || 0);
-            }
+            });
 
             // Layer di confronto: anno precedente come linee tratteggiate
-            // sovrapposte alle barre (solo in vista mensile)
+            // sovrapposte alle barre
             let prevYearDatasets = [];
-            if (isSpecificYear && comparison) {
-                const prevMonthlyFatturato = new Array(12).fill(0);
-                const prevMonthlyCosti = new Array(12).fill(0);
-
-                (comparison.prevInvoicesData?.per_mese || []).forEach(item => {
-                    const monthIndex = parseInt(item.mese) - 1;
-                    if (monthIndex >= 0 && monthIndex < 12) {
-                        prevMonthlyFatturato[monthIndex] = parseFloat(item.totale) || 0;
-                    }
-                });
-
-                (comparison.prevCostsData?.per_mese || []).forEach(item => {
-                    const monthIndex = parseInt(item.mese) - 1;
-                    if (monthIndex >= 0 && monthIndex < 12) {
-                        prevMonthlyCosti[monthIndex] = parseFloat(item.totale) || 0;
-                    }
-                });
-
+            if (comparison) {
                 prevYearDatasets = [{
                     type: 'line',
                     label: `Fatturato ${comparison.prevYear} (€)`,
@@ -372,11 +317,9 @@ function renderCharts(invoicesData, costsData, comparison = null) {
                 }];
             }
 
-            const dynamicChartTitle = isSpecificYear
-                ? (comparison
-                    ? `Fatturato e Costi per Mese - ${invoicesData.anno_selezionato} vs ${comparison.prevYear}`
-                    : `Fatturato e Costi per Mese - ${invoicesData.anno_selezionato}`)
-                : 'Fatturato e Costi per Anno';
+            const dynamicChartTitle = comparison
+                ? `Fatturato e Costi per Mese - ${pnlData.anno} vs ${comparison.prevYear}`
+                : `Fatturato e Costi per Mese - ${pnlData.anno}`;
 
             chartPerMeseInstance = new Chart(chartPerMese, {
                 type: 'bar',
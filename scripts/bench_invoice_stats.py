@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""Benchmark delle statistiche fatture: cinque query sulle tabelle vive contro le tabelle di riepilogo.
+
+Su un dataset sintetico (clienti e fatture generati) confronta:
+  - l'implementazione originale di GET /api/invoices/stats: count, somma,
+    clienti distinti, dettaglio per mese/anno e per cliente, cinque SELECT;
+  - `app.queries.invoice_stats`: una sola SELECT sulle tabelle di riepilogo
+    (app/aggregates.py), ricalcolate dopo il popolamento.
+Conta le istruzioni SQL emesse, misura la latenza, verifica che i due JSON
+coincidano e che `aggregates.check()` non trovi differenze.
+
+Il database di default è SQLite in memoria. Con --database-url si usa un
+Postgres reale: i dati sintetici sono inseriti in
+una transazione che viene annullata alla fine, quindi il DB resta com'era.
+--rtt-ms aggiunge un ritardo artificiale a ogni istruzione, per simulare la
+latenza di rete verso un DB remoto (su SQLite in memoria è zero).
+
+Esempio:
+    python3 scripts/bench_invoice_stats.py --invoices 20000 --clients 300 --rtt-ms 1
+    python3 scripts/bench_invoice_stats.py --database-url postgresql+psycopg2://user:pw@localhost/fatture
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / "backend"))
+
+from flask import Flask  # noqa: E402
+from sqlalchemy import event, extract, func  # noqa: E402
+
+from app.models import db, Cliente, Fattura  # noqa: E402
+from app import aggregates  # noqa: E402
+from app.queries import invoice_stats  # noqa: E402
+
+
+def legacy_stats(selected_year):
+    """Copia dell'implementazione precedente di get_invoice_stats (cinque query)."""
+    year_filter = Fattura.anno == selected_year if selected_year else True
+    total_invoices = db.session.query(Fattura).filter(year_filter).count()
+    total_amount = db.session.query(func.sum(Fattura.totale)).filter(year_filter).scalar() or 0.0
+    unique_clients = db.session.query(Fattura.cliente_id).filter(year_filter).distinct().count()
+    if selected_year:
+        rows = db.session.query(
+            extract('month', Fattura.data_fattura).label('mese'),
+            func.count(Fattura.id).label('conteggio'),
+            func.sum(Fattura.totale).label('totale'),
+        ).filter(year_filter).group_by('mese').order_by('mese').all()
+        monthly = [{'mese': int(r.mese), 'conteggio': r.conteggio, 'totale': float(r.totale)} for r in rows]
+    else:
+        rows = db.session.query(
+            Fattura.anno.label('anno'),
+            func.count(Fattura.id).label('conteggio'),
+            func.sum(Fattura.totale).label('totale'),
+        ).group_by(Fattura.anno).order_by(Fattura.anno).all()
+        monthly = [{'mese': r.anno, 'conteggio': r.conteggio, 'totale': float(r.totale)} for r in rows]
+    rows = db.session.query(
+        Cliente.nome, Cliente.cognome,
+        func.count(Fattura.id).label('conteggio'),
+        func.sum(Fattura.totale).label('totale'),
+    ).join(Fattura, Cliente.id == Fattura.cliente_id).filter(year_filter).group_by(Cliente.id) \
+        .order_by(func.count(Fattura.id).desc()).all()
+    clients = [{'cliente': f'{r.nome} {r.cognome}', 'conteggio': r.conteggio, 'totale': float(r.totale)}
+               for r in rows]
+    return {
+        'totale_fatture': total_invoices,
+        'totale_annuo': total_amount,
+        'clienti_con_fatture': unique_clients,
+        'per_mese': monthly,
+        'per_cliente': clients,
+        'anno_selezionato': selected_year,
+    }
+
+
+def populate(n_clients, n_invoices, years, seed):
+    rng = random.Random(seed)
+    clienti = [Cliente(nome=f"Nome{i}", cognome=f"Cognome{i}", codice_fiscale=f"BENCH{i:011d}")
+               for i in range(n_clients)]
+    db.session.add_all(clienti)
+    db.session.flush()
+    progressivi = dict.fromkeys(years, 0)
+    righe = []
+    for _ in range(n_invoices):
+        anno = rng.choice(years)
+        progressivi[anno] += 1
+        totale = rng.choice([60.0, 70.0, 80.0, 120.0, 142.0])
+        righe.append({
+            'anno': anno, 'progressivo': 900000 + progressivi[anno],
+            'data_fattura': date(anno, 1, 1) + timedelta(days=rng.randrange(365)),
+            'cliente_id': rng.choice(clienti).id, 'importo_prestazione': totale, 'totale': totale,
+            'numero_sedute': 1, 'metodo_pagamento': 'Bonifico', 'descrizione': 'bench',
+        })
+    db.session.execute(db.insert(Fattura), righe)
+    aggregates.rebuild()
+    db.session.flush()
+
+
+def normalize(stats):
+    """Confronto a meno dell'arrotondamento ai centesimi e dell'ordine dei clienti a parità di conteggio."""
+    def voce(v):
+        return {**v, 'totale': round(v['totale'], 2)}
+    return {
+        **stats,
+        'totale_annuo': round(stats['totale_annuo'], 2),
+        'per_mese': [voce(v) for v in stats['per_mese']],
+        'per_cliente': sorted((voce(v) for v in stats['per_cliente']), key=lambda v: (-v['conteggio'], v['cliente'])),
+    }
+
+
+def measure(fn, year, runs, statements):
+    latencies = []
+    for _ in range(runs):
+        statements.clear()
+        start = time.perf_counter()
+        result = fn(year)
+        latencies.append(time.perf_counter() - start)
+    return result, len(statements), latencies
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default="sqlite://")
+    parser.add_argument("--invoices", type=int, default=10000)
+    parser.add_argument("--clients", type=int, default=200)
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--rtt-ms", type=float, default=0.0, help="latenza simulata per istruzione SQL")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = args.database_url
+    db.init_app(app)
+    aggregates.register(db.session)
+
+    years = [2023, 2024, 2025]
+    ok = True
+    with app.app_context():
+        if args.database_url.startswith("sqlite"):
+            db.create_all()
+        print(f"Dialetto: {db.engine.dialect.name}, {args.invoices} fatture, {args.clients} clienti, "
+              f"rtt simulato {args.rtt_ms} ms")
+        populate(args.clients, args.invoices, years, args.seed)
+
+        statements = []
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def _count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+            if args.rtt_ms:
+                time.sleep(args.rtt_ms / 1000)
+
+        try:
+            if aggregates.check():
+                ok = False
+                print("❌ tabelle di riepilogo disallineate")
+            for year in (years[-1], None):
+                etichetta = f"anno {year}" if year else "tutti gli anni"
+                print(f"\n{etichetta}:")
+                riferimento = None
+                for nome, fn in (("5 query", legacy_stats), ("riepilogo", invoice_stats)):
+                    risultato, n_istruzioni, latenze = measure(fn, year, args.runs, statements)
+                    print(f"  {nome:<12} : {n_istruzioni} istruzioni, mediana {statistics.median(latenze) * 1000:.2f} ms")
+                    if riferimento is None:
+                        riferimento = normalize(risultato)
+                    elif normalize(risultato) != riferimento:
+                        ok = False
+                        print(f"  ❌ JSON diverso ({nome})")
+                if ok:
+                    print("  ✅ JSON identico")
+        finally:
+            db.session.rollback()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""Benchmark di concorrenza sull'allocazione del progressivo fattura.
+
+Lancia N creazioni di fattura in parallelo contro un backend in esecuzione
+(POST /api/invoices), misura il throughput e verifica che i progressivi
+assegnati siano tutti distinti e consecutivi (nessun buco, nessun doppione).
+
+ATTENZIONE: crea fatture reali. Va eseguito solo sullo stack di test
+(`make restoredb` per ripulire dopo).
+
+Esempio:
+    python3 scripts/bench_progressivo.py --requests 200 --concurrency 20 --cliente-id 1
+
+Exit 0 se la numerazione è corretta, 1 altrimenti.
+"""
+import argparse
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+
+import requests
+
+
+def create_invoice(session, base_url, cliente_id):
+    payload = {
+        "data_fattura": date.today().isoformat(),
+        "data_pagamento": None,
+        "metodo_pagamento": "Bonifico",
+        "cliente_id": cliente_id,
+        "numero_sedute": 1,
+        "inviata_sts": False,
+    }
+    start = time.perf_counter()
+    resp = session.post(f"{base_url}/invoices", json=payload, timeout=60)
+    elapsed = time.perf_counter() - start
+    resp.raise_for_status()
+    return resp.json()["id"], elapsed
+
+
+def fetch_numbers(base_url, ids):
+    """Legge i numeri assegnati alle fatture create scorrendo la lista a cursore."""
+    wanted = set(ids)
+    numbers = {}
+    after = None
+    while wanted - numbers.keys():
+        params = {"limit": 200}
+        if after:
+            params["after"] = after
+        page = requests.get(f"{base_url}/invoices", params=params, timeout=30).json()
+        for item in page["items"]:
+            if item["id"] in wanted:
+                progressivo, anno = item["numero_fattura"].split("/")
+                numbers[item["id"]] = (int(anno), int(progressivo))
+        after = page["next_cursor"]
+        if not after:
+            break
+    return numbers
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000/api")
+    parser.add_argument("--requests", type=int, default=100, help="numero di fatture da creare")
+    parser.add_argument("--concurrency", type=int, default=10, help="richieste in parallelo")
+    parser.add_argument("--cliente-id", type=int, default=1)
+    args = parser.parse_args()
+
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(
+            lambda _: create_invoice(session, args.base_url, args.cliente_id),
+            range(args.requests),
+        ))
+    total = time.perf_counter() - start
+
+    ids = [invoice_id for invoice_id, _ in results]
+    latencies = sorted(elapsed for _, elapsed in results)
+    print(f"Fatture create : {len(ids)} in {total:.2f}s "
+          f"({len(ids) / total:.1f} req/s, concorrenza {args.concurrency})")
+    print(f"Latenza        : media {statistics.mean(latencies) * 1000:.1f} ms, "
+          f"p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:.1f} ms")
+
+    numbers = fetch_numbers(args.base_url, ids)
+    if len(numbers) != len(ids):
+        print(f"❌ Fatture non ritrovate nella lista: {sorted(set(ids) - numbers.keys())}")
+        return 1
+
+    ok = True
+    by_year = {}
+    for anno, progressivo in numbers.values():
+        by_year.setdefault(anno, []).append(progressivo)
+    for anno, progressivi in sorted(by_year.items()):
+        progressivi.sort()
+        duplicati = len(progressivi) - len(set(progressivi))
+        attesi = set(range(progressivi[0], progressivi[-1] + 1))
+        buchi = sorted(attesi - set(progressivi))
+        if duplicati or buchi:
+            ok = False
+            print(f"❌ {anno}: {duplicati} doppioni, buchi {buchi}")
+        else:
+            print(f"✅ {anno}: progressivi {progressivi[0]}..{progressivi[-1]} consecutivi, nessun doppione")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
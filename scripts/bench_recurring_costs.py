@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""Benchmark del backfill dei costi ricorrenti: un savepoint per riga contro un INSERT ON CONFLICT.
+
+Crea --rules regole mensili, trimestrali e annuali iniziate --years anni fa e
+genera tutti i periodi scaduti con:
+  - l'implementazione precedente di generate_recurring_costs: SELECT dei
+    periodi esistenti per regola, poi un savepoint + flush (e l'aggiornamento
+    delle tabelle di riepilogo) per ogni costo;
+  - `app.recurring.generate_recurring_costs`: scadenze calcolate in Python e
+    un INSERT multi-riga ... ON CONFLICT DO NOTHING RETURNING per esecuzione.
+Conta le istruzioni SQL emesse, misura il tempo e verifica che i costi generati
+coincidano e che le tabelle di riepilogo restino allineate.
+
+Il database di default è SQLite in memoria. Con --database-url si usa un
+Postgres reale: tutto avviene in una transazione annullata alla fine, quindi il
+DB resta com'era. --rtt-ms aggiunge un ritardo a ogni istruzione per simulare
+la latenza di rete verso un DB remoto.
+
+Esempio:
+    python3 scripts/bench_recurring_costs.py --rules 50 --years 10 --rtt-ms 1
+    python3 scripts/bench_recurring_costs.py --database-url postgresql+psycopg2://user:pw@localhost/fatture
+"""
+import argparse
+import sys
+import time
+from datetime import date
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / "backend"))
+
+from flask import Flask  # noqa: E402
+from sqlalchemy import delete, event, update  # noqa: E402
+from sqlalchemy.exc import IntegrityError  # noqa: E402
+
+from app import aggregates  # noqa: E402
+from app.models import db, Costo, CostoRicorrente, CostoStats  # noqa: E402
+from app.recurring import (  # noqa: E402
+    FREQUENZE_RICORRENZA, add_months, due_date_for_period, generate_recurring_costs,
+)
+
+
+def legacy_generate(until_date):
+    """Copia dell'implementazione precedente (un savepoint e un flush per costo)."""
+    created = 0
+    for ricorrenza in CostoRicorrente.query.filter_by(attivo=True).all():
+        step_months = FREQUENZE_RICORRENZA[ricorrenza.frequenza]
+        current = date(ricorrenza.data_inizio.year, ricorrenza.data_inizio.month, 1)
+        end_date = min(ricorrenza.data_fine or until_date, until_date)
+        periods_to_generate = []
+        while current <= end_date:
+            due_date = due_date_for_period(current.year, current.month, ricorrenza.giorno_scadenza)
+            if ricorrenza.data_inizio <= due_date <= end_date:
+                periods_to_generate.append((f"{current.year:04d}-{current.month:02d}", due_date, current.year))
+            current = add_months(current, step_months)
+        if not periods_to_generate:
+            continue
+        existing_periods = {
+            row[0] for row in db.session.query(Costo.periodo_riferimento).filter(
+                Costo.ricorrenza_id == ricorrenza.id,
+                Costo.periodo_riferimento.in_([p for p, _, _ in periods_to_generate]),
+            )
+        }
+        for periodo, due_date, anno_riferimento in periods_to_generate:
+            if periodo in existing_periods:
+                continue
+            try:
+                with db.session.begin_nested():
+                    db.session.add(Costo(
+                        descrizione=f"{ricorrenza.descrizione} - {periodo}", anno_riferimento=anno_riferimento,
+                        data_pagamento=due_date, totale=ricorrenza.totale, pagato=ricorrenza.pagato_default,
+                        ricorrenza_id=ricorrenza.id, periodo_riferimento=periodo,
+                    ))
+                    db.session.flush()
+                created += 1
+            except IntegrityError:
+                pass
+            existing_periods.add(periodo)
+    return created
+
+
+def populate(n_rules, years, until_date):
+    frequenze = list(FREQUENZE_RICORRENZA)
+    inizio = date(until_date.year - years, until_date.month, 1)
+    db.session.add_all([
+        CostoRicorrente(descrizione=f"Regola {k}", totale=50.0 + k, frequenza=frequenze[k % len(frequenze)],
+                        giorno_scadenza=1 + k % 31, data_inizio=inizio, pagato_default=bool(k % 2))
+        for k in range(n_rules)
+    ])
+    db.session.flush()
+
+
+def reset():
+    """Riporta i costi generati e i segnaposto allo stato iniziale, nella transazione corrente."""
+    db.session.execute(delete(Costo).where(Costo.ricorrenza_id.isnot(None)))
+    db.session.execute(update(CostoRicorrente).values(ultimo_periodo_generato=None))
+    db.session.execute(delete(CostoStats))
+    db.session.expire_all()
+
+
+def snapshot():
+    return sorted(db.session.query(Costo.ricorrenza_id, Costo.periodo_riferimento, Costo.data_pagamento,
+                                   Costo.anno_riferimento, Costo.totale, Costo.pagato).all())
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default="sqlite://")
+    parser.add_argument("--rules", type=int, default=50)
+    parser.add_argument("--years", type=int, default=10)
+    parser.add_argument("--rtt-ms", type=float, default=0.0, help="latenza simulata per istruzione SQL")
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = args.database_url
+    db.init_app(app)
+    aggregates.register(db.session)
+    until_date = date.today()
+
+    ok = True
+    with app.app_context():
+        if args.database_url.startswith("sqlite"):
+            db.create_all()
+        print(f"Dialetto: {db.engine.dialect.name}, {args.rules} regole da {args.years} anni, "
+              f"rtt simulato {args.rtt_ms} ms")
+        populate(args.rules, args.years, until_date)
+
+        statements = []
+
+        @event.listens_for(db.engine, 'before_cursor_execute')
+        def _count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+            if args.rtt_ms:
+                time.sleep(args.rtt_ms / 1000)
+
+        try:
+            riferimento = None
+            for nome, fn in (("savepoint per riga", legacy_generate),
+                             ("INSERT ON CONFLICT", lambda d: generate_recurring_costs(d, commit=False))):
+                reset()
+                statements.clear()
+                inizio = time.perf_counter()
+                creati = fn(until_date)
+                db.session.flush()
+                durata = time.perf_counter() - inizio
+                n_istruzioni = len(statements)
+                print(f"  {nome:<20}: {creati} costi, {n_istruzioni} istruzioni, {durata * 1000:.1f} ms")
+                righe = snapshot()
+                if riferimento is None:
+                    riferimento = righe
+                elif righe != riferimento:
+                    ok = False
+                    print(f"  ❌ costi generati diversi ({nome})")
+                differenze = aggregates.check()
+                if differenze:
+                    ok = False
+                    print(f"  ❌ tabelle di riepilogo disallineate ({nome}): {len(differenze)} differenze")
+
+            # Seconda esecuzione: segnaposto aggiornati, nessun periodo nuovo
+            statements.clear()
+            inizio = time.perf_counter()
+            creati = generate_recurring_costs(until_date, commit=False)
+            print(f"  {'ripetuta':<20}: {creati} costi, {len(statements)} istruzioni, "
+                  f"{(time.perf_counter() - inizio) * 1000:.1f} ms")
+            if ok:
+                print("  ✅ costi identici, tabelle di riepilogo allineate")
+        finally:
+            db.session.rollback()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
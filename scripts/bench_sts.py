@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""Benchmark degli invii STS contro lo stub locale (scripts/sts_stub_server.py).
+
+Due scenari, entrambi senza toccare l'ambiente di test governativo:
+  - client: N chiamate `STSClient.send_inserimento` da --threads thread sul
+    client del processo (get_client), come gli invii singoli concorrenti;
+  - batch: POST /api/sts/invoices/send-batch su un'app Flask con SQLite in
+    memoria e N fatture sintetiche, poi svuotamento della coda
+    (`sts_outbox.drain`) come fa il worker del processo.
+Riporta throughput, percentili di latenza (per chiamata nello scenario client,
+delle richieste SOAP dalle statistiche del client nello scenario batch), lo
+stato del limitatore adattivo e i contatori dello stub, e verifica che ogni
+invio riuscito corrisponda a un documento registrato dallo stub.
+
+Lo stub parte nello stesso processo con le opzioni di sts_stub_server.py
+(--latency-ms, --error-rate, --max-inflight, ...); con --endpoint si usa invece
+uno stub già avviato. Con --base-url lo scenario batch gira contro un backend
+in esecuzione (avviato con STS_ENDPOINT_URL verso lo stub): invia le fatture
+pagate e non ancora inviate di --year e segue `status_url` fino alla fine.
+ATTENZIONE: in quel caso le fatture risultano inviate (`make restoredb` per ripulire).
+
+Esempio:
+    python3 scripts/bench_sts.py --requests 500 --latency-ms 80 --concurrency 8 --max-rate 50
+    python3 scripts/bench_sts.py --scenario batch --max-inflight 4 --throttle-code WS500
+    python3 scripts/bench_sts.py --scenario batch --base-url http://localhost:8000/api --year 2025
+
+Exit 0 se gli esiti del client coincidono con quanto registrato dallo stub, 1 altrimenti.
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from pathlib import Path
+
+import requests
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / "backend"))
+sys.path.insert(0, str(REPO_ROOT / "scripts"))
+
+import sts_stub_server  # noqa: E402
+
+
+def _percentile(valori, p):
+    ordinati = sorted(valori)
+    return ordinati[min(len(ordinati) - 1, int(p * len(ordinati)))]
+
+
+def _fattura(k, cliente):
+    from app.models import Fattura
+
+    giorno = date(2025, 1, 1) + timedelta(days=k % 365)
+    return Fattura(anno=2025, progressivo=k, data_fattura=giorno, data_pagamento=giorno, cliente=cliente,
+                   numero_sedute=1, importo_prestazione=58.82, totale=60.0, metodo_pagamento='Bonifico',
+                   descrizione='n. 1 di Seduta di consulenza psicologica', inviata_sts=False)
+
+
+def _cliente():
+    from app.models import Cliente
+
+    return Cliente(nome="Mario", cognome="Rossi", codice_fiscale="RSSMRA85M01H501Z", flag_opposizione=False)
+
+
+def scenario_client(args):
+    from app.sts.client import get_client
+
+    client = get_client()
+    cliente = _cliente()
+    fatture = [_fattura(k, cliente) for k in range(1, args.requests + 1)]
+    latenze, esiti, lock = [], {"ok": 0, "rifiutate": 0, "errori_rete": 0}, threading.Lock()
+
+    def invia(fattura):
+        inizio = time.perf_counter()
+        result = client.send_inserimento(fattura, cliente)
+        durata = time.perf_counter() - inizio
+        chiave = "ok" if result["success"] else (
+            "errori_rete" if any(isinstance(e, str) for e in result["errors"]) else "rifiutate")
+        with lock:
+            latenze.append(durata)
+            esiti[chiave] += 1
+
+    inizio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as pool:
+        list(pool.map(invia, fatture))
+    totale = time.perf_counter() - inizio
+
+    print(f"Invii          : {args.requests} in {totale:.2f}s ({args.requests / totale:.1f} req/s, "
+          f"{args.threads} thread)")
+    print(f"Latenza        : p50 {_percentile(latenze, 0.50) * 1000:.1f} ms, "
+          f"p95 {_percentile(latenze, 0.95) * 1000:.1f} ms, p99 {_percentile(latenze, 0.99) * 1000:.1f} ms, "
+          f"max {max(latenze) * 1000:.1f} ms")
+    print(f"Esiti          : {esiti}")
+    return esiti["ok"], client.stats()
+
+
+def scenario_batch_locale(args):
+    from flask import Flask
+
+    from app import aggregates, sts_outbox
+    from app.api.sts_api import sts_bp
+    from app.models import db
+    from app.sts.client import get_client
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite://'
+    db.init_app(app)
+    aggregates.register(db.session)
+    app.register_blueprint(sts_bp, url_prefix='/api')
+
+    with app.app_context():
+        db.create_all()
+        cliente = _cliente()
+        db.session.add_all([_fattura(k, cliente) for k in range(1, args.requests + 1)])
+        db.session.commit()
+
+        http = app.test_client()
+        inizio = time.perf_counter()
+        resp = http.post('/api/sts/invoices/send-batch', json={"year": 2025})
+        if resp.status_code != 202:
+            raise SystemExit(f"send-batch: HTTP {resp.status_code} {resp.get_data(as_text=True)}")
+        accodamento = time.perf_counter() - inizio
+        status_url = resp.get_json()["status_url"]
+
+        client = get_client()
+        elaborate = sts_outbox.drain(client)
+        totale = time.perf_counter() - inizio
+        stato = http.get(status_url).get_json()
+
+    print(f"Batch          : {stato['total']} fatture accodate in {accodamento * 1000:.0f} ms, "
+          f"{elaborate} elaborazioni in {totale:.2f}s ({stato['total'] / totale:.1f} fatture/s)")
+    print(f"Esiti          : sent {stato['sent']}, failed {stato['failed']}, pending {stato['pending']}")
+    return stato["sent"], client.stats()
+
+
+def scenario_batch_remoto(args):
+    base_url = args.base_url.rstrip("/")
+    inizio = time.perf_counter()
+    resp = requests.post(f"{base_url}/sts/invoices/send-batch", json={"year": args.year}, timeout=60)
+    resp.raise_for_status()
+    dati = resp.json()
+    if not dati.get("batch_id"):
+        raise SystemExit(f"Nessuna fattura da inviare per il {args.year}")
+    status_url = f"{base_url}{dati['status_url'].removeprefix('/api')}"
+    while True:
+        stato = requests.get(status_url, timeout=30).json()
+        if stato["done"]:
+            break
+        time.sleep(0.5)
+    totale = time.perf_counter() - inizio
+
+    print(f"Batch          : {stato['total']} fatture in {totale:.2f}s ({stato['total'] / totale:.1f} fatture/s)")
+    print(f"Esiti          : sent {stato['sent']}, failed {stato['failed']}")
+    # Statistiche del worker che risponde: con più worker gunicorn sono parziali
+    return stato["sent"], requests.get(f"{base_url}/sts/stats", timeout=30).json()
+
+
+def stampa_stats_client(stats):
+    if stats.get("campioni"):
+        print(f"SOAP           : {stats['richieste']} richieste, {stats['errori_rete']} errori di rete, "
+              f"p50 {stats['latenza_p50_ms']} ms, p95 {stats['latenza_p95_ms']} ms, "
+              f"max {stats['latenza_max_ms']} ms")
+    limiter = stats.get("limiter")
+    if limiter:
+        print(f"Limitatore     : rate {limiter['rate']}/{limiter['rate_max']} req/s, "
+              f"finestra {limiter['finestra']}/{limiter['finestra_max']}, "
+              f"{limiter['congestioni']} congestioni, {limiter['riduzioni']} riduzioni")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", choices=("client", "batch", "tutti"), default="tutti")
+    parser.add_argument("--requests", type=int, default=200, help="invii (client) o fatture (batch)")
+    parser.add_argument("--threads", type=int, default=16, help="thread chiamanti nello scenario client")
+    parser.add_argument("--concurrency", type=int, default=4, help="STS_MAX_CONCURRENCY")
+    parser.add_argument("--max-rate", type=float, default=50.0, help="STS_MAX_RATE")
+    parser.add_argument("--endpoint", default=None, help="endpoint di uno stub già avviato")
+    parser.add_argument("--base-url", default=None, help="backend in esecuzione per lo scenario batch")
+    parser.add_argument("--year", type=int, default=date.today().year, help="anno del batch con --base-url")
+    parser.add_argument("--verbose", action="store_true", help="mostra i log del backend (tentativi, errori STS)")
+    sts_stub_server.aggiungi_opzioni(parser)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING if args.verbose else logging.CRITICAL)
+
+    server = None
+    endpoint = args.endpoint
+    if endpoint is None:
+        server = sts_stub_server.crea_server(sts_stub_server.stub_da_opzioni(args))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        endpoint = sts_stub_server.endpoint_url(server)
+    stub_base = endpoint.split(sts_stub_server.PATH)[0]
+
+    os.environ.update({
+        "STS_ENDPOINT_URL": endpoint,
+        "STS_ENVIRONMENT": "test",
+        "STS_USERNAME": os.getenv("STS_USERNAME") or "bench",
+        "STS_SSL_VERIFY": "false",
+        "STS_MAX_CONCURRENCY": str(args.concurrency),
+        "STS_MAX_RATE": str(args.max_rate),
+    })
+    os.environ.pop("STS_DEBUG", None)
+    if args.throttle_code:
+        os.environ["STS_THROTTLE_CODES"] = args.throttle_code
+
+    print(f"Stub {endpoint}: latenza {args.latency_ms}±{args.jitter_ms} ms, errori WS {args.error_rate:.0%}, "
+          f"503 {args.http_error_rate:.0%}, fault {args.fault_rate:.0%}, max in corso {args.max_inflight or '∞'}")
+    scenari = ("client", "batch") if args.scenario == "tutti" else (args.scenario,)
+    ok = True
+    try:
+        for scenario in scenari:
+            requests.post(f"{stub_base}/reset", timeout=10)
+            # Client nuovo per scenario: il limitatore riparte dai massimi
+            from app.sts import client as sts_client
+            sts_client._client = None
+            print(f"\nScenario {scenario}:")
+            if scenario == "client":
+                riusciti, stats = scenario_client(args)
+            elif args.base_url:
+                riusciti, stats = scenario_batch_remoto(args)
+            else:
+                riusciti, stats = scenario_batch_locale(args)
+            stampa_stats_client(stats)
+            stub = requests.get(f"{stub_base}/stats", timeout=10).json()
+            print(f"Stub           : {stub}")
+            if args.base_url and scenario == "batch":
+                continue
+            if stub["documenti"] != riusciti:
+                ok = False
+                print(f"❌ {riusciti} invii riusciti ma {stub['documenti']} documenti registrati dallo stub")
+            else:
+                print(f"✅ {riusciti} invii riusciti, tutti registrati dallo stub")
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
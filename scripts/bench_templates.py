@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Benchmark del render DOCX: DocxTemplate a ogni richiesta vs registry dei template.
+
+Confronta, sullo stesso contesto, il costo per render di:
+  - `DocxTemplate(path)` + render + save (comportamento precedente);
+  - `template_registry.get_template(path)` + render + save (parse una volta,
+    clone per render).
+Verifica inoltre che i due DOCX prodotti siano identici parte per parte.
+
+Nessun DB né Gotenberg: misura solo docxtpl. Richiede le dipendenze del backend.
+
+Esempio:
+    python3 scripts/bench_templates.py --renders 200
+    python3 scripts/bench_templates.py --template custom_template/invoice_template.docx
+"""
+import argparse
+import io
+import statistics
+import sys
+import time
+import zipfile
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT / "backend"))
+
+from docxtpl import DocxTemplate  # noqa: E402
+
+from app.template_registry import get_template  # noqa: E402
+
+DEFAULT_TEMPLATES = [
+    REPO_ROOT / "backend" / "app" / "templates" / "invoice_template.docx",
+    REPO_ROOT / "backend" / "app" / "templates" / "giustificativo_template.docx",
+]
+
+
+def render_bytes(doc, context):
+    doc.render(context)
+    out = io.BytesIO()
+    doc.save(out)
+    return out.getvalue()
+
+
+def measure(fn, renders):
+    tempi = []
+    for _ in range(renders):
+        start = time.perf_counter()
+        fn()
+        tempi.append((time.perf_counter() - start) * 1000)
+    return tempi
+
+
+def same_docx(a, b):
+    za, zb = zipfile.ZipFile(io.BytesIO(a)), zipfile.ZipFile(io.BytesIO(b))
+    return za.namelist() == zb.namelist() and all(za.read(n) == zb.read(n) for n in za.namelist())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--template", action="append", help="template DOCX (ripetibile; default: quelli built-in)")
+    parser.add_argument("--renders", type=int, default=100, help="render per variante (default 100)")
+    args = parser.parse_args()
+
+    templates = [Path(t) for t in args.template] if args.template else DEFAULT_TEMPLATES
+    ok = True
+    for path in templates:
+        variabili = DocxTemplate(str(path)).get_undeclared_template_variables()
+        context = {v: f"valore {v}" for v in variabili}
+
+        # Primo render fuori misura: carica il registry (costo una tantum per worker)
+        start = time.perf_counter()
+        registry_out = render_bytes(get_template(str(path)), context)
+        primo = (time.perf_counter() - start) * 1000
+
+        prima = measure(lambda: render_bytes(DocxTemplate(str(path)), context), args.renders)
+        dopo = measure(lambda: render_bytes(get_template(str(path)), context), args.renders)
+        identici = same_docx(render_bytes(DocxTemplate(str(path)), context), registry_out)
+        ok = ok and identici
+
+        med_prima, med_dopo = statistics.median(prima), statistics.median(dopo)
+        print(f"{path.name} ({len(variabili)} variabili, {args.renders} render)")
+        print(f"  DocxTemplate per richiesta: mediana {med_prima:6.1f} ms  p95 {sorted(prima)[int(len(prima) * 0.95) - 1]:6.1f} ms")
+        print(f"  registry (clone):           mediana {med_dopo:6.1f} ms  p95 {sorted(dopo)[int(len(dopo) * 0.95) - 1]:6.1f} ms")
+        print(f"  caricamento registry:       {primo:6.1f} ms (una volta per worker)")
+        print(f"  risparmio per render:       {med_prima - med_dopo:6.1f} ms ({(1 - med_dopo / med_prima) * 100:.0f}%)")
+        print(f"  output identico:            {'sì' if identici else 'NO'}")
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
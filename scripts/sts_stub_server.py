@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+"""Server SOAP locale che simula il web service DocumentoSpesa730p di STS.
+
+Implementa le operazioni Inserimento e Cancellazione (DocumentoSpesa730pSchema.xsd
+nel kit docs/sts-kit-riferimento): risponde con `esitoChiamata`, `protocollo` e
+`listaMessaggi` come il servizio reale, e tiene in memoria i documenti inseriti
+(un secondo inserimento dello stesso documento viene rifiutato con WS004, una
+cancellazione di un documento mai inserito con --codice-non-trovato).
+
+Serve per i test di carico e di regressione senza toccare l'ambiente di test
+governativo. Latenza, errori e sovraccarico sono configurabili:
+  --latency-ms / --jitter-ms   tempo di risposta (gaussiano, mai negativo)
+  --error-rate                 quota di risposte esitoChiamata=1 con un codice da --error-codes
+  --warning-rate               quota di risposte esitoChiamata=2 (accettato con segnalazione)
+  --http-error-rate            quota di risposte 503 con Retry-After
+  --fault-rate                 quota di SOAP Fault (HTTP 500)
+  --max-inflight               oltre questo numero di richieste contemporanee risponde 503
+                               (o esitoChiamata=1 con --throttle-code, per provare STS_THROTTLE_CODES)
+GET /stats riporta i contatori in JSON, POST /reset li azzera insieme ai documenti.
+
+Il backend lo usa con STS_ENDPOINT_URL (es. http://localhost:8730/DocumentoSpesa730pWeb/DocumentoSpesa730pPort).
+
+Esempio:
+    python3 scripts/sts_stub_server.py --port 8730 --latency-ms 150 --jitter-ms 50 --error-rate 0.02
+    python3 scripts/sts_stub_server.py --max-inflight 4 --retry-after 1
+"""
+import argparse
+import json
+import random
+import ssl
+import sys
+import threading
+import time
+import xml.etree.ElementTree as ET
+from datetime import date
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from xml.sax.saxutils import escape
+
+PATH = "/DocumentoSpesa730pWeb/DocumentoSpesa730pPort"
+OPERAZIONI = {
+    "inserimentoDocumentoSpesaRequest": "inserimento",
+    "cancellazioneDocumentoSpesaRequest": "cancellazione",
+}
+CODICE_DUPLICATO = ("WS004", "Documento già presente")
+
+_RISPOSTA = """<?xml version="1.0" encoding="UTF-8"?>
+<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">
+  <soap:Body>
+    <ns2:{operazione}DocumentoSpesaResponse xmlns:ns2="http://documentospesap730.sanita.finanze.it">
+      <esitoChiamata>{esito}</esitoChiamata>{protocollo}
+      <listaMessaggi>{messaggi}
+      </listaMessaggi>
+    </ns2:{operazione}DocumentoSpesaResponse>
+  </soap:Body>
+</soap:Envelope>"""
+
+_MESSAGGIO = """
+        <messaggio>
+          <codice>{codice}</codice>
+          <descrizione>{descrizione}</descrizione>
+          <tipo>{tipo}</tipo>
+        </messaggio>"""
+
+_FAULT = """<?xml version="1.0" encoding="UTF-8"?>
+<soap:Envelope xmlns:soap="http://schemas.xmlsoap.org/soap/envelope/">
+  <soap:Body>
+    <soap:Fault>
+      <faultcode>soap:{codice}</faultcode>
+      <faultstring>{messaggio}</faultstring>
+    </soap:Fault>
+  </soap:Body>
+</soap:Envelope>"""
+
+
+def _risposta(operazione, esito, protocollo=None, messaggi=()):
+    return _RISPOSTA.format(
+        operazione=operazione,
+        esito=esito,
+        protocollo=f"\n      <protocollo>{protocollo}</protocollo>" if protocollo else "",
+        messaggi="".join(_MESSAGGIO.format(codice=escape(c), descrizione=escape(d), tipo=t)
+                         for c, d, t in messaggi),
+    )
+
+
+def _testo(elemento, tag):
+    nodo = elemento.find(".//{*}" + tag)
+    return nodo.text.strip() if nodo is not None and nodo.text else ""
+
+
+class StubSTS:
+    """Stato del servizio simulato: documenti inseriti, contatori, richieste in corso."""
+
+    def __init__(self, latency_ms=100.0, jitter_ms=30.0, error_rate=0.0, warning_rate=0.0,
+                 http_error_rate=0.0, fault_rate=0.0, error_codes=("WS002",), max_inflight=0,
+                 retry_after=1, throttle_code=None, codice_non_trovato="WS002", seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.warning_rate = warning_rate
+        self.http_error_rate = http_error_rate
+        self.fault_rate = fault_rate
+        self.error_codes = list(error_codes) or ["WS002"]
+        self.max_inflight = max_inflight
+        self.retry_after = retry_after
+        self.throttle_code = throttle_code
+        self.codice_non_trovato = codice_non_trovato
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.documenti = {}
+            self.in_corso = 0
+            self.contatori = {"richieste": 0, "ok": 0, "warning": 0, "errori_ws": 0, "http_503": 0,
+                              "fault": 0, "rifiutate_sovraccarico": 0, "max_in_corso": 0}
+            self._progressivo = 0
+
+    def _conta(self, chiave):
+        with self._lock:
+            self.contatori[chiave] += 1
+
+    def _caso(self):
+        with self._lock:
+            return self._random.random()
+
+    def _protocollo(self):
+        # Stesso formato dei protocolli reali: 17 cifre (es. 99161117000731505)
+        with self._lock:
+            self._progressivo += 1
+            return f"{date.today():%y%m%d}{self._progressivo:011d}"
+
+    def gestisci(self, corpo: bytes):
+        """Ritorna (status HTTP, header aggiuntivi, corpo della risposta)."""
+        with self._lock:
+            self.contatori["richieste"] += 1
+            self.in_corso += 1
+            self.contatori["max_in_corso"] = max(self.contatori["max_in_corso"], self.in_corso)
+            sovraccarico = self.max_inflight and self.in_corso > self.max_inflight
+        try:
+            return self._rispondi(corpo, sovraccarico)
+        finally:
+            with self._lock:
+                self.in_corso -= 1
+
+    def _rispondi(self, corpo, sovraccarico):
+        if sovraccarico and not self.throttle_code:
+            self._conta("rifiutate_sovraccarico")
+            return 503, {"Retry-After": str(self.retry_after)}, b"Service Unavailable"
+
+        attesa = max(0.0, self._random.gauss(self.latency_ms, self.jitter_ms)) if self.jitter_ms else self.latency_ms
+        time.sleep(attesa / 1000)
+
+        try:
+            root = ET.fromstring(corpo)
+        except ET.ParseError as exc:
+            self._conta("fault")
+            return 500, {}, _FAULT.format(codice="Client", messaggio=escape(str(exc))).encode()
+        richiesta = next((el for el in root.iter() if el.tag.rsplit("}", 1)[-1] in OPERAZIONI), None)
+        if richiesta is None:
+            self._conta("fault")
+            return 500, {}, _FAULT.format(codice="Client", messaggio="Operazione non supportata").encode()
+        operazione = OPERAZIONI[richiesta.tag.rsplit("}", 1)[-1]]
+
+        if sovraccarico:
+            self._conta("rifiutate_sovraccarico")
+            messaggi = [(self.throttle_code, "Servizio momentaneamente sovraccarico", "E")]
+            return 200, {}, _risposta(operazione, 1, messaggi=messaggi).encode()
+        caso = self._caso()
+        if caso < self.http_error_rate:
+            self._conta("http_503")
+            return 503, {"Retry-After": str(self.retry_after)}, b"Service Unavailable"
+        caso -= self.http_error_rate
+        if caso < self.fault_rate:
+            self._conta("fault")
+            return 500, {}, _FAULT.format(codice="Server", messaggio="Errore interno simulato").encode()
+        caso -= self.fault_rate
+        if caso < self.error_rate:
+            self._conta("errori_ws")
+            codice = self._random.choice(self.error_codes)
+            return 200, {}, _risposta(operazione, 1, messaggi=[(codice, "Errore simulato", "E")]).encode()
+        caso -= self.error_rate
+
+        chiave = (_testo(richiesta, "pIva"), _testo(richiesta, "dataEmissione"),
+                  _testo(richiesta, "dispositivo"), _testo(richiesta, "numDocumento"))
+        with self._lock:
+            presente = chiave in self.documenti
+            if operazione == "inserimento" and not presente:
+                self.documenti[chiave] = True
+            elif operazione == "cancellazione" and presente:
+                del self.documenti[chiave]
+        if operazione == "inserimento" and presente:
+            self._conta("errori_ws")
+            return 200, {}, _risposta(operazione, 1, messaggi=[(*CODICE_DUPLICATO, "E")]).encode()
+        if operazione == "cancellazione" and not presente:
+            self._conta("errori_ws")
+            messaggi = [(self.codice_non_trovato, "Documento non presente", "E")]
+            return 200, {}, _risposta(operazione, 1, messaggi=messaggi).encode()
+
+        if caso < self.warning_rate:
+            self._conta("warning")
+            messaggi = [("WS900", "Documento accettato con segnalazione simulata", "W")]
+            return 200, {}, _risposta(operazione, 2, self._protocollo(), messaggi).encode()
+        self._conta("ok")
+        return 200, {}, _risposta(operazione, 0, self._protocollo()).encode()
+
+    def stats(self):
+        with self._lock:
+            return {**self.contatori, "in_corso": self.in_corso, "documenti": len(self.documenti)}
+
+
+def crea_server(stub: StubSTS, host="127.0.0.1", port=0, certfile=None, keyfile=None):
+    """ThreadingHTTPServer (HTTPS con certfile/keyfile) per lo stub; va avviato con serve_forever()."""
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _invia(self, status, headers, corpo, content_type="text/xml; charset=utf-8"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(corpo)))
+            for nome, valore in headers.items():
+                self.send_header(nome, valore)
+            self.end_headers()
+            self.wfile.write(corpo)
+
+        def do_POST(self):
+            corpo = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            if self.path == "/reset":
+                stub.reset()
+                self._invia(204, {}, b"")
+                return
+            self._invia(*stub.gestisci(corpo))
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._invia(200, {}, json.dumps(stub.stats()).encode(), "application/json")
+            else:
+                self._invia(404, {}, b"Not Found", "text/plain")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    if certfile:
+        ctx = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        ctx.load_cert_chain(certfile, keyfile)
+        server.socket = ctx.wrap_socket(server.socket, server_side=True)
+    return server
+
+
+def endpoint_url(server) -> str:
+    schema = "https" if isinstance(server.socket, ssl.SSLSocket) else "http"
+    host, port = server.server_address[:2]
+    return f"{schema}://{host}:{port}{PATH}"
+
+
+def aggiungi_opzioni(parser):
+    """Opzioni dello stub, condivise con scripts/bench_sts.py."""
+    parser.add_argument("--latency-ms", type=float, default=100.0, help="tempo medio di risposta")
+    parser.add_argument("--jitter-ms", type=float, default=30.0, help="deviazione standard del tempo di risposta")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="quota di esitoChiamata=1")
+    parser.add_argument("--warning-rate", type=float, default=0.0, help="quota di esitoChiamata=2")
+    parser.add_argument("--http-error-rate", type=float, default=0.0, help="quota di HTTP 503")
+    parser.add_argument("--fault-rate", type=float, default=0.0, help="quota di SOAP Fault (HTTP 500)")
+    parser.add_argument("--error-codes", default="WS002", help="codici WS per --error-rate, separati da virgola")
+    parser.add_argument("--max-inflight", type=int, default=0, help="richieste contemporanee oltre cui rifiutare (0 = nessun limite)")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After (secondi) delle risposte 503")
+    parser.add_argument("--throttle-code", default=None, help="rifiuta il sovraccarico con questo codice WS invece del 503")
+    parser.add_argument("--codice-non-trovato", default="WS002", help="codice della cancellazione di un documento assente")
+    parser.add_argument("--seed", type=int, default=None)
+
+
+def stub_da_opzioni(args) -> StubSTS:
+    return StubSTS(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+        warning_rate=args.warning_rate, http_error_rate=args.http_error_rate, fault_rate=args.fault_rate,
+        error_codes=[c.strip() for c in args.error_codes.split(",") if c.strip()],
+        max_inflight=args.max_inflight, retry_after=args.retry_after, throttle_code=args.throttle_code,
+        codice_non_trovato=args.codice_non_trovato, seed=args.seed,
+    )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8730)
+    parser.add_argument("--certfile", default=None, help="certificato PEM per servire in HTTPS")
+    parser.add_argument("--keyfile", default=None)
+    aggiungi_opzioni(parser)
+    args = parser.parse_args()
+
+    server = crea_server(stub_da_opzioni(args), args.host, args.port, args.certfile, args.keyfile)
+    print(f"Stub STS in ascolto: STS_ENDPOINT_URL={endpoint_url(server)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -138,7 +138,27 @@ function check_giustificativo() {
   rm -f "$tmpfile"
 }
 
+function check_pdf() {
+  local url=$1
+  local description=$2
+  echo -e "\n${BLUE}🔧 $description${NC}"
+  echo -e "${YELLOW}   [GET] $url${NC}"
+  local tmpfile
+  tmpfile=$(mktemp /tmp/documento_XXXXXX.pdf)
+  local http_code
+  http_code=$(curl -s -w "%{http_code}" -o "$tmpfile" "$url")
+  if [[ "$http_code" =~ ^2[0-9][0-9]$ ]] && [[ "$(head -c 4 "$tmpfile")" == "%PDF" ]]; then
+    echo -e "${GREEN}   ✓ Status: $http_code (PDF valido, $(du -h "$tmpfile" | cut -f1))${NC}"
+    ((success_count++))
+  else
+    echo -e "${RED}   ✗ Status: $http_code (PDF non valido)${NC}"
+    ((fail_count++))
+  fi
+  rm -f "$tmpfile"
+}
+
 check_giustificativo "$BASE_URL/clients/1/giustificativo" "Download giustificativo (data/ora correnti)"
+check_pdf "$BASE_URL/clients/1/giustificativo?format=pdf" "Download giustificativo solo PDF"
 check_giustificativo "$BASE_URL/clients/1/giustificativo?data=2026-01-10&ora_inizio=16:00&ora_fine=17:00" "Download giustificativo con data e orari espliciti"
 
 echo -e "\n${CYAN}━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━${NC}"
@@ -150,8 +170,14 @@ curl_check DELETE "$BASE_URL/clients/1" "" "Elimina cliente con fatture (deve fa
 curl_check POST "$BASE_URL/clients" '{"nome":"Luigi","cognome":"Verdi","codice_fiscale":"VRDLGU80A01H501Y"}' "Crea cliente Luigi"
 curl_check DELETE "$BASE_URL/clients/2" "" "Elimina cliente senza fatture"
 curl_check GET "$BASE_URL/invoices" "" "Lista fatture"
+curl_check POST "$BASE_URL/invoices/bulk" '[{"data_fattura":"2025-01-31","metodo_pagamento":"Bonifico","cliente_id":1,"numero_sedute":1},{"data_fattura":"2025-01-31","metodo_pagamento":"Contanti","cliente_id":1,"numero_sedute":2}]' "Crea fatture in blocco"
+curl_check GET "$BASE_URL/invoices?limit=10" "" "Lista fatture paginata (cursore)"
 curl_check GET "$BASE_URL/invoices/1" "" "Dettaglio fattura"
 curl_check PUT "$BASE_URL/invoices/1" '{"data_fattura":"2025-02-01","data_pagamento":"2025-02-05","metodo_pagamento":"Contanti","cliente_id":1,"numero_sedute":2,"inviata_sts":true}' "Aggiorna fattura"
+check_pdf "$BASE_URL/invoices/1/download?format=pdf" "Download fattura solo PDF"
+check_giustificativo "$BASE_URL/invoices/archive?year=2025" "Archivio ZIP dei PDF fatture 2025"
+curl_check POST "$BASE_URL/invoices/1/render" '{}' "Accoda job di generazione fattura"
+curl_check GET "$BASE_URL/gotenberg/stats" "" "Statistiche conversioni Gotenberg"
 
 echo -e "\n${CYAN}━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━${NC}"
 echo -e "${CYAN}  SEZIONE: Gestione Costi${NC}"
@@ -54,7 +54,7 @@ function curl_check() {
   fi
   echo -e "${YELLOW}   [$method] $url${NC}"
 
-  if [[ "$url" == *"/download_invoice_zip/"* || "$url" == *"/download_giustificativo/"* ]]; then
+  if [[ "$url" == *"/download_invoice_zip/"* || "$url" == *"/download_invoice_archive/"* || "$url" == *"/download_giustificativo/"* ]]; then
     local tmpfile=$(mktemp /tmp/zip_XXXXXX.zip)
     local http_code=$(curl -s -w "%{http_code}" -o "$tmpfile" "$url" 2>&1 | tail -n1)
     
@@ -126,6 +126,8 @@ curl_check POST "$BASE_URL/api/invoices" '{"data_fattura":"2025-01-15","data_pag
 curl_check GET "$BASE_URL/api/invoices/1" "" "Dettaglio fattura"
 curl_check PUT "$BASE_URL/api/invoices/1" '{"data_fattura":"2025-02-01","data_pagamento":"2025-02-05","metodo_pagamento":"Contanti","cliente_id":1,"numero_sedute":2,"inviata_sts":true}' "Aggiorna fattura"
 curl_check GET "$BASE_URL/download_invoice_zip/1" "" "Download ZIP fattura"
+curl_check GET "$BASE_URL/download_invoice_zip/1?format=pdf" "" "Download PDF fattura"
+curl_check GET "$BASE_URL/download_invoice_archive/2025" "" "Download archivio PDF fatture 2025"
 
 echo -e "\n${CYAN}━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━${NC}"
 echo -e "${CYAN}  SEZIONE: Gestione Costi (Proxy)${NC}"
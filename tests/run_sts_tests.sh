@@ -177,15 +177,21 @@ BATCH_RESP=$(curl -s -w "\n%{http_code}" -X POST \
 BATCH_HTTP=$(echo "$BATCH_RESP" | tail -1)
 BATCH_BODY=$(echo "$BATCH_RESP" | head -n -1)
 
-if [ "$BATCH_HTTP" = "200" ] || [ "$BATCH_HTTP" = "503" ]; then
+if [ "$BATCH_HTTP" = "202" ] || [ "$BATCH_HTTP" = "200" ] || [ "$BATCH_HTTP" = "503" ]; then
     pass "POST /api/sts/invoices/send-batch → HTTP $BATCH_HTTP"
-    if [ "$BATCH_HTTP" = "200" ]; then
-        TOTAL=$(echo "$BATCH_BODY" | python3 -c "import sys,json; print(json.load(sys.stdin).get('total','?'))" 2>/dev/null || echo "?")
-        SENT_B=$(echo "$BATCH_BODY" | python3 -c "import sys,json; print(json.load(sys.stdin).get('sent','?'))" 2>/dev/null || echo "?")
-        info "Batch: total=$TOTAL sent=$SENT_B"
+    if [ "$BATCH_HTTP" = "202" ]; then
+        # Il batch è accodato: si attende che il worker lo completi (max ~60 s)
+        STATUS_URL=$(echo "$BATCH_BODY" | python3 -c "import sys,json; print(json.load(sys.stdin).get('status_url',''))" 2>/dev/null || echo "")
+        for _ in $(seq 1 30); do
+            STATUS_BODY=$(curl -s "$BACKEND_URL$STATUS_URL")
+            DONE=$(echo "$STATUS_BODY" | python3 -c "import sys,json; print(json.load(sys.stdin).get('done',''))" 2>/dev/null || echo "")
+            [ "$DONE" = "True" ] && break
+            sleep 2
+        done
+        info "Batch: $(echo "$STATUS_BODY" | python3 -c "import sys,json; d=json.load(sys.stdin); print(f\"total={d['total']} sent={d['sent']} failed={d['failed']} pending={d['pending']}\")" 2>/dev/null || echo "$STATUS_BODY")"
     fi
 else
-    fail "POST /api/sts/invoices/send-batch → HTTP $BATCH_HTTP (atteso 200/503)"
+    fail "POST /api/sts/invoices/send-batch → HTTP $BATCH_HTTP (atteso 202/200/503)"
     info "Body: $BATCH_BODY"
 fi
 